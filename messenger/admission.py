@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from crypto_utils import SESSION_PREFIX
+from clock import REAL_CLOCK
+from enums import MsgType
+from scheduler import TokenBucket
+
+# Admission control for received frames, ahead of decryption. Any node on
+# the channel can send frames with our BSSID, and each one would otherwise
+# cost a base64 decode and an AES decryption (and a HANDSHAKE_REQ an ECDH),
+# so a flood could starve real traffic of CPU.
+#
+# Every frame takes its tokens before anything else is done with it, so
+# a flood of forged session frames uses up its source's and the global
+# budget like any other. Then session frames have their truncated tag
+# checked (Session.authentic), which only tries the epochs next to the
+# newest one verified from the sender and derives no key for others.
+#
+# Every source MAC gets a token bucket. A MAC we have a session with gets a
+# large one; any other MAC only gets enough frames to finish a handshake,
+# then a trickle, and all of those share one small bucket between them, so
+# a flood from random MACs can't crowd out our peers either. A global
+# bucket caps everything we decrypt, with the last UNKNOWN_RESERVE of it
+# kept for our peers.
+#
+# Handshakes and rosters are under the shared key, so anyone can send them
+# with a peer's MAC, and each costs an ECDH. They first take tokens from
+# buckets of their own, per MAC and for all MACs together, whether or not
+# we have a session with the MAC, so spoofing a peer doesn't buy its large
+# bucket; then from the buckets any other frame would.
+
+PEER_RATE = 2000  # frames/s from one MAC we have a session with
+PEER_BURST = 500
+UNKNOWN_RATE = 0.5  # frames/s from one MAC we have no session with, after its first UNKNOWN_BURST
+UNKNOWN_BURST = 8  # enough for handshakes and a heartbeat or two
+UNKNOWN_TOTAL_RATE = 20  # frames/s from all MACs without a session together
+UNKNOWN_TOTAL_BURST = 40
+GLOBAL_RATE = 5000  # frames/s decrypted from all sources
+GLOBAL_BURST = 1000
+UNKNOWN_RESERVE = 0.5  # share of the global bucket that frames from unknown MACs can't use
+HANDSHAKE_RATE = 1  # handshake frames/s from one MAC, after its first HANDSHAKE_BURST
+HANDSHAKE_BURST = 32  # a REQ, its retries and the rosters a node answers a power cycle with
+HANDSHAKE_TOTAL_RATE = 40  # handshake frames/s from all MACs together, about a tenth of a core in ECDHs
+HANDSHAKE_TOTAL_BURST = 300  # the handshakes and rosters of a power cycle of a few hundred nodes
+HANDSHAKE_TYPES = {MsgType.HANDSHAKE_REQ, MsgType.HANDSHAKE_ACK, MsgType.ROSTER}  # each costs ECDHs
+MAX_SOURCES = 4096  # source buckets kept; the least recently heard are forgotten
+
+class AdmissionControl:
+    '''
+    Decides which received frames are worth decrypting. A frame first
+    takes a token from its source's bucket and the global one; then a
+    session frame's truncated tag is checked, which rejects forged ones
+    without decrypting them. Drops are counted by reason in drops.
+    '''
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST, clock=REAL_CLOCK):
+        self.clock = clock
+        self.sources = OrderedDict()  # source MAC -> TokenBucket, least recently heard first
+        self.unknown_total = TokenBucket(UNKNOWN_TOTAL_RATE, UNKNOWN_TOTAL_BURST, clock.monotonic())
+        self.handshakes = OrderedDict()  # source MAC -> TokenBucket for its handshake frames
+        self.handshake_total = TokenBucket(HANDSHAKE_TOTAL_RATE, HANDSHAKE_TOTAL_BURST, clock.monotonic())
+        self.global_bucket = TokenBucket(global_rate, global_burst, clock.monotonic())
+        self.admitted = 0
+        self.drops = {'forged': 0, 'no_session': 0, 'peer_rate': 0, 'unknown_rate': 0,
+                      'unknown_total': 0, 'handshake_rate': 0, 'handshake_total': 0, 'global': 0}
+
+    def admit_frame(self, sender_mac: str, encrypted_data: str, session, verified: bool = False,
+                    header: bytes = b'', msg_type: MsgType = None) -> bool:
+        '''
+        Returns True if a frame from sender_mac should be decrypted and
+        handled. session: our Session with sender_mac, if any. verified: the
+        tag was already checked (by a receive worker that decrypted it).
+        header: the frame's frame_header, which the tag covers.
+        '''
+        check_tag = encrypted_data.startswith(SESSION_PREFIX) and not verified
+        if check_tag and session is None:
+            self.drops['no_session'] += 1
+            return False
+        if not self.admit(sender_mac, session is not None, msg_type):
+            return False
+        if check_tag and not session.authentic(encrypted_data, sender_mac, header):
+            self.admitted -= 1  # it took its tokens, but isn't decrypted
+            self.drops['forged'] += 1  # or sent under a key we no longer have
+            return False
+        return True
+
+    def admit(self, sender_mac: str, known: bool, msg_type: MsgType = None) -> bool:
+        '''
+        Takes a token for a frame from sender_mac, if its buckets have one.
+        known: we have a session with sender_mac.
+        '''
+        now = self.clock.monotonic()
+        if msg_type in HANDSHAKE_TYPES and not self.admit_handshake(sender_mac, now):
+            return False
+        bucket = self.sources.get(sender_mac)
+        if bucket is None:
+            bucket = self.sources[sender_mac] = TokenBucket(UNKNOWN_RATE, UNKNOWN_BURST, now)
+            if len(self.sources) > MAX_SOURCES:
+                self.sources.popitem(last=False)
+        else:
+            self.sources.move_to_end(sender_mac)
+        if known and bucket.rate != PEER_RATE:
+            bucket.rate, bucket.burst = PEER_RATE, PEER_BURST
+        elif not known and bucket.rate == PEER_RATE:
+            bucket.rate, bucket.burst = UNKNOWN_RATE, UNKNOWN_BURST
+            bucket.tokens = min(bucket.tokens, UNKNOWN_BURST)
+
+        if not bucket.take(now):
+            self.drops['peer_rate' if known else 'unknown_rate'] += 1
+            return False
+        if not known and not self.unknown_total.take(now):
+            self.drops['unknown_total'] += 1
+            return False
+        floor = 0 if known else self.global_bucket.burst * UNKNOWN_RESERVE
+        if not self.global_bucket.take(now, floor):
+            self.drops['global'] += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def admit_handshake(self, sender_mac: str, now: float) -> bool:
+        '''
+        Takes a handshake token for a frame claiming to be from sender_mac,
+        ahead of its other buckets.
+        '''
+        bucket = self.handshakes.get(sender_mac)
+        if bucket is None:
+            bucket = self.handshakes[sender_mac] = TokenBucket(HANDSHAKE_RATE, HANDSHAKE_BURST, now)
+            if len(self.handshakes) > MAX_SOURCES:
+                self.handshakes.popitem(last=False)
+        else:
+            self.handshakes.move_to_end(sender_mac)
+        if not bucket.take(now):
+            self.drops['handshake_rate'] += 1
+            return False
+        if not self.handshake_total.take(now):
+            self.drops['handshake_total'] += 1
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {'admitted': self.admitted, 'sources': len(self.sources), **self.drops}
@@ -0,0 +1,378 @@
+import argparse
+import array
+import mmap
+import struct
+import sys
+import time
+import numpy as np
+from enums import MsgType
+from frame_trace import PCAP_GLOBAL_HEADER, PCAP_MAGIC, LINKTYPE_IEEE802_11_RADIOTAP
+from frames import BSSID_BYTES, LLC_SNAP
+
+# One row per GhostFrames frame in a capture. Addresses are 48-bit MACs as integers.
+FRAME_DTYPE = np.dtype([('ts', 'f8'), ('length', 'u4'), ('src', 'u8'), ('dst', 'u8'),
+                        ('type', 'u1'), ('msg_id', 'u4'), ('seq', 'u4')])
+BROADCAST = 0xffffffffffff
+BSSID_INT = int.from_bytes(BSSID_BYTES, 'big')
+SNAP_INT = int.from_bytes(LLC_SNAP[:3], 'big')  # DSAP, SSAP and control of an LLC/SNAP header
+
+BATCH = 1 << 20  # records decoded at a time, bounding the size of temporary arrays
+HEADER_WINDOW = 24  # payload bytes searched for "GF|type|msg_id|seq|"
+DUPLICATE_WINDOW = 0.05  # a repeat of a frame within this many seconds is a duplicate copy, later a retransmit
+RESTART_GAP = 1000  # msg_id jumps bigger than this are a restarted peer rather than lost messages
+RTT_LIMIT = 5.0  # replies later than this aren't matched to a request
+# Unicast requests and the reply type that answers them, for RTT
+REPLY_TYPES = {MsgType.MSG: MsgType.MSG_ACK, MsgType.FILE_END: MsgType.FILE_ACK, MsgType.PING: MsgType.PONG}
+PERCENTILES = (50, 95, 99)
+
+def walk_records(mm, start: int, record: struct.Struct) -> np.ndarray:
+    '''
+    Offsets of the records from start to the end of the capture.
+    '''
+    offsets = []
+    append = offsets.append
+    unpack = record.unpack_from
+    end = len(mm)
+    while start + record.size <= end:
+        incl_len = unpack(mm, start)[2]
+        if start + record.size + incl_len > end:
+            break  # truncated last record, e.g. the recorder was killed mid-write
+        append(start)
+        start += record.size + incl_len
+    return np.array(offsets, dtype=np.int64)
+
+def record_offsets(mm) -> np.ndarray:
+    '''
+    walk_records() for a little-endian capture on a little-endian host.
+    Record lengths form a chain that can only be followed one record at a
+    time, so this keeps the loop to one add per record: incl_len is read
+    through a uint32 view of the file at each of the four byte alignments
+    instead of being unpacked.
+    '''
+    if sys.byteorder != 'little':
+        return walk_records(mm, PCAP_GLOBAL_HEADER.size, struct.Struct('<IIII'))
+    size = len(mm)
+    view = memoryview(mm)
+    words = [view[k:k + (size - k) // 4 * 4].cast('I') for k in range(4)]
+    offsets = array.array('q')
+    append = offsets.append
+    start = PCAP_GLOBAL_HEADER.size
+    try:
+        while start + 16 <= size:
+            next_start = start + 16 + words[start & 3][(start >> 2) + 2]
+            if next_start > size:
+                break  # truncated last record
+            append(start)
+            start = next_start
+    finally:
+        for w in words:
+            w.release()
+        view.release()
+    return np.frombuffer(offsets, dtype=np.int64)
+
+def take(buf: np.ndarray, pos: np.ndarray, width: int) -> np.ndarray:
+    '''
+    The width bytes at each of pos, as a (len(pos), width) array.
+    '''
+    rows = np.lib.stride_tricks.sliding_window_view(buf, width)
+    return rows[np.minimum(pos, len(rows) - 1)]
+
+def mac_column(block: np.ndarray, end: int) -> np.ndarray:
+    '''
+    The 48-bit big-endian numbers ending at column end of block.
+    '''
+    return np.ascontiguousarray(block[:, end - 8:end]).view('>u8')[:, 0] & BROADCAST
+
+def select(mask: np.ndarray, count: int):
+    '''
+    Index for the rows where mask is set: a plain slice when that's every
+    row, so the common case of a capture with one frame layout takes views
+    rather than copies.
+    '''
+    return slice(None) if count == len(mask) else np.flatnonzero(mask)
+
+def decode_batch(buf: np.ndarray, offsets: np.ndarray, big_endian: bool = False) -> np.ndarray:
+    '''
+    Extracts the GhostFrames header of every record at offsets into a
+    FRAME_DTYPE array, dropping records that aren't GhostFrames frames.
+    '''
+    record = take(buf, offsets, 20)  # pcap record header and the start of radiotap
+    ts_sec, ts_usec, incl_len, _ = np.ascontiguousarray(record[:, :16]).view('>u4' if big_endian else '<u4').T
+    end = offsets + 16 + incl_len
+    # Radiotap length is little-endian whatever the pcap byte order
+    dot11 = offsets + 16 + (record[:, 18] | record[:, 19].astype(np.int64) << 8)
+    # MAC header (up to 32 bytes with addr4 and QoS), LLC/SNAP and the GhostFrames header, in one gather
+    block = take(buf, dot11, 32 + len(LLC_SNAP) + HEADER_WINDOW)
+    frame_control, flags = block[:, 0], block[:, 1]
+    ok = (dot11 + 24 <= end) & (frame_control & 0x0c == 0x08) & (flags & 0x40 == 0)
+    ok &= mac_column(block, 22) == BSSID_INT
+    body = 24 + np.where(flags & 0x03 == 0x03, 6, 0) + np.where(frame_control & 0x80, 2, 0)
+    counts = np.bincount(body, minlength=33)
+    for column in np.flatnonzero(counts):
+        rows = select(body == column, counts[column])
+        snap = np.ascontiguousarray(block[rows, column - 1:column + 3]).view('>u4')[:, 0] & 0xffffff == SNAP_INT
+        body[rows] += np.where(snap, len(LLC_SNAP), 0)
+
+    # Frames whose headers start at the same column and whose msg_id and seq have the
+    # same widths ("GF|tt|" + msg_id + "|" + seq + "|") are decoded together
+    layout = np.zeros(len(offsets), dtype=np.int64)
+    counts = np.bincount(body, minlength=41)
+    for column in np.flatnonzero(counts):
+        rows = select(body == column, counts[column])
+        window = block[rows, column:column + HEADER_WINDOW]
+        bar = window == ord('|')
+        valid = (window[:, 0] == ord('G')) & (window[:, 1] == ord('F')) & bar[:, 2] & bar[:, 5]
+        id_end = np.argmax(bar[:, 6:], axis=1) + 6
+        bar[np.arange(len(window)), id_end] = False
+        seq_end = np.argmax(bar[:, 7:], axis=1) + 7
+        valid &= (id_end > 6) & (seq_end > id_end + 1) & (dot11[rows] + column + seq_end < end[rows])
+        ok[rows] &= valid
+        layout[rows] = (column * HEADER_WINDOW + id_end) * HEADER_WINDOW + seq_end
+
+    msg_type, msg_id, seq = (np.zeros(len(offsets), dtype=np.uint32) for _ in range(3))
+    counts = np.bincount(layout[ok])
+    for code in np.flatnonzero(counts):
+        rows = select(ok & (layout == code), counts[code])
+        column, id_end = divmod(int(code) // HEADER_WINDOW, HEADER_WINDOW)
+        seq_end = int(code) % HEADER_WINDOW
+        digits = block[rows, column:column + seq_end] - ord('0')  # wraps to over 9 for anything but a digit
+        valid = np.ones(len(digits), dtype=bool)
+        for values, first, last in ((msg_type, 3, 5), (msg_id, 6, id_end), (seq, id_end + 1, seq_end)):
+            value = np.zeros(len(digits), dtype=np.uint32)
+            for i in range(first, last):
+                valid &= digits[:, i] <= 9
+                value = value * 10 + digits[:, i]
+            values[rows] = value
+        ok[rows] &= valid
+
+    frames = np.empty(int(ok.sum()), dtype=FRAME_DTYPE)
+    frames['ts'] = ts_sec[ok] + ts_usec[ok] / 1_000_000
+    frames['length'] = incl_len[ok]
+    frames['dst'] = mac_column(block, 10)[ok]
+    frames['src'] = mac_column(block, 16)[ok]
+    frames['type'], frames['msg_id'], frames['seq'] = msg_type[ok], msg_id[ok], seq[ok]
+    return frames
+
+def load_capture(path: str):
+    '''
+    Memory-maps a capture written by TraceRecorder (or any radiotap pcap)
+    and returns (FRAME_DTYPE array of its GhostFrames frames, records in
+    the capture).
+    '''
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mm) < PCAP_GLOBAL_HEADER.size:
+        return np.empty(0, dtype=FRAME_DTYPE), 0
+    magic = struct.unpack_from('<I', mm)[0]
+    if magic == PCAP_MAGIC:
+        big_endian = False
+        linktype = PCAP_GLOBAL_HEADER.unpack_from(mm)[-1]
+    elif magic == 0xd4c3b2a1:
+        big_endian = True
+        linktype = struct.unpack_from('>IHHiIII', mm)[-1]
+    else:
+        raise ValueError(f"Not a pcap file: {path}")
+    if linktype != LINKTYPE_IEEE802_11_RADIOTAP:
+        raise ValueError(f"{path} isn't a radiotap capture (linktype {linktype})")
+
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    if big_endian:
+        offsets = walk_records(mm, PCAP_GLOBAL_HEADER.size, struct.Struct('>IIII'))
+    else:
+        offsets = record_offsets(mm)
+    frames = np.concatenate([decode_batch(buf, offsets[i:i + BATCH], big_endian)
+                             for i in range(0, len(offsets), BATCH)] or [np.empty(0, dtype=FRAME_DTYPE)])
+    return frames, len(offsets)
+
+def peer_order(groups: np.ndarray, count: int) -> np.ndarray:
+    '''
+    Stable argsort of small peer indexes, which numpy does as a radix sort
+    when they fit in 16 bits.
+    '''
+    return np.argsort(groups.astype(np.uint16) if count < 1 << 16 else groups, kind='stable')
+
+def group_percentiles(groups: np.ndarray, values: np.ndarray, count: int) -> np.ndarray:
+    '''
+    PERCENTILES of values within each group 0..count-1, as a (count,
+    len(PERCENTILES)) array (NaN for empty groups).
+    '''
+    result = np.full((count, len(PERCENTILES)), np.nan)
+    if not len(values):
+        return result
+    order = np.argsort(values)
+    order = order[peer_order(groups[order], count)]
+    values = values[order]
+    sizes = np.bincount(groups, minlength=count)
+    starts = np.cumsum(sizes) - sizes
+    present = sizes > 0
+    for i, q in enumerate(PERCENTILES):
+        picks = starts + ((sizes - 1) * q / 100).astype(np.int64)
+        result[present, i] = values[picks[present]]
+    return result
+
+def frame_order(src: np.ndarray, msg_id: np.ndarray, seq: np.ndarray, count: int) -> np.ndarray:
+    '''
+    Order of frames by (sender, msg_id, seq), keeping time order among
+    repeats of a frame. The three are packed into one 64-bit key when they
+    fit, which is much faster to sort than sorting on each in turn.
+    '''
+    if count > 1 << 8 or (len(seq) and seq.max() >= 1 << 24):
+        return np.lexsort((seq, msg_id, src))
+    key = src.astype(np.uint64) << 56 | msg_id.astype(np.uint64) << 24 | seq
+    # Grouping by sender first leaves each sender's (mostly increasing) keys in runs
+    order = peer_order(src, count)
+    return order[np.argsort(key[order], kind='stable')]
+
+def analyze(frames: np.ndarray, window: float = 1.0) -> dict:
+    '''
+    Per-sender statistics for a FRAME_DTYPE array, all computed on whole
+    arrays. Returns a dict of arrays indexed like its 'peers' entry.
+
+    A frame is identified by its sender, msg_id and seq. Copies of one
+    within DUPLICATE_WINDOW are duplicates (heard on two interfaces or
+    relayed back), later ones retransmits. Loss comes from gaps in what
+    each sender numbered: the seqs of a multi-frame message, and msg_ids
+    (every peer numbers its messages consecutively). It assumes the
+    capture hears everything the sender sends, as a monitor-mode capture
+    does; a peer's own recording only sees frames addressed to it, and
+    resumed transfers skip seqs on purpose, so both overstate it. RELAY
+    frames carry someone else's msg_id and are left out of both.
+    '''
+    if np.any(np.diff(frames['ts']) < 0):
+        frames = frames[np.argsort(frames['ts'], kind='stable')]
+    peers = np.unique(np.concatenate((frames['src'], frames['dst'])))
+    peers = peers[peers != BROADCAST]
+    count = len(peers)
+    src = np.searchsorted(peers, frames['src'])
+    dst = np.where(frames['dst'] == BROADCAST, count, np.searchsorted(peers, frames['dst']))
+    ts = frames['ts']
+    stats = {'peers': peers}
+    stats['frames'] = np.bincount(src, minlength=count)
+    stats['bytes'] = np.bincount(src, weights=frames['length'], minlength=count)
+
+    # Throughput per window
+    start = ts[0] if len(ts) else 0.0
+    windows = int((ts[-1] - start) // window) + 1 if len(ts) else 1
+    slot = ((ts - start) // window).astype(np.int64)
+    series = np.bincount(src * windows + slot, weights=frames['length'],
+                         minlength=count * windows).reshape(count, windows) / window
+    stats['series'] = series
+    stats['window_start'] = start + np.arange(windows) * window
+    stats['peak_rate'] = series.max(axis=1)
+
+    # Each sender's frames in time order: average rate and inter-arrival times
+    order = peer_order(src, count)
+    sender, arrival = src[order], ts[order]
+    sizes = stats['frames']
+    firsts = np.cumsum(sizes) - sizes
+    present = sizes > 0
+    duration = np.zeros(count)
+    duration[present] = arrival[firsts[present] + sizes[present] - 1] - arrival[firsts[present]]
+    stats['rate'] = stats['bytes'] / np.maximum(duration, window)
+    following = sender[1:] == sender[:-1]
+    stats['inter_arrival'] = group_percentiles(sender[1:][following], np.diff(arrival)[following], count)
+
+    # Repeats of the same frame: duplicates or retransmits
+    numbered = np.flatnonzero(frames['type'] != MsgType.RELAY)
+    key_src, key_id, key_seq = src[numbered], frames['msg_id'][numbered], frames['seq'][numbered]
+    order = frame_order(key_src, key_id, key_seq, count)
+    key_src, key_id, key_seq = key_src[order], key_id[order], key_seq[order]
+    same = np.zeros(len(order), dtype=bool)
+    same[1:] = (key_src[1:] == key_src[:-1]) & (key_id[1:] == key_id[:-1]) & (key_seq[1:] == key_seq[:-1])
+    gap = np.diff(ts[numbered][order], prepend=0.0)
+    duplicate = same & (gap < DUPLICATE_WINDOW)
+    retransmit = same & ~duplicate
+    stats['duplicates'] = np.bincount(key_src[duplicate], minlength=count)
+    stats['retransmits'] = np.bincount(key_src[retransmit], minlength=count)
+    repeated = np.zeros(len(frames), dtype=bool)  # frames sent more than once, for Karn's rule below
+    repeated[numbered[order[1:][retransmit[1:]]]] = True
+    repeated[numbered[order[:-1][retransmit[1:]]]] = True
+
+    # Loss from seq gaps within messages and msg_id gaps between them
+    key_src, key_id, key_seq = key_src[~same], key_id[~same].astype(np.int64), key_seq[~same].astype(np.int64)
+    received = np.bincount(key_src, minlength=count)
+    message = np.ones(len(key_src), dtype=bool)
+    message[1:] = (key_src[1:] != key_src[:-1]) | (key_id[1:] != key_id[:-1])
+    starts = np.flatnonzero(message)
+    ends = np.append(starts[1:], len(key_src)) - 1
+    seq_lost = (key_seq[ends] - key_seq[starts] + 1) - (ends - starts + 1)
+    lost = np.bincount(key_src[starts], weights=seq_lost, minlength=count)
+    id_gap = np.diff(key_id[starts]) - 1
+    same_sender = key_src[starts][1:] == key_src[starts][:-1]
+    missing = same_sender & (id_gap > 0) & (id_gap < RESTART_GAP)
+    lost += np.bincount(key_src[starts][1:][missing], weights=id_gap[missing], minlength=count)
+    stats['loss'] = lost / np.maximum(lost + received, 1)
+
+    # RTT: a unicast request to the first reply of the matching type that comes back before
+    # the next such request between the two peers. Retransmitted requests are skipped (Karn's rule).
+    reply_type = np.zeros(256, dtype=np.int64)
+    for request, reply in REPLY_TYPES.items():
+        reply_type[request] = reply
+    span = (ts.max() - start + 1) if len(ts) else 1.0
+    is_reply = np.isin(frames['type'], list(REPLY_TYPES.values())) & (dst < count)
+    is_request = (reply_type[frames['type']] > 0) & (dst < count)
+    # Both keyed by (requester, responder, reply type), and put in one timeline per key
+    reply_key = (dst[is_reply] * (count + 1) + src[is_reply]) * 256 + frames['type'][is_reply]
+    reply_clock = reply_key * span + (ts[is_reply] - start)
+    order = np.argsort(reply_clock)
+    reply_key, reply_clock, reply_ts = reply_key[order], reply_clock[order], ts[is_reply][order]
+    request_key = (src[is_request] * (count + 1) + dst[is_request]) * 256 + reply_type[frames['type'][is_request]]
+    request_ts = ts[is_request]
+    order = np.lexsort((request_ts, request_key))
+    next_request = np.full(len(order), np.inf)
+    later = request_key[order][1:] == request_key[order][:-1]
+    next_request[order[:-1][later]] = request_ts[order][1:][later]
+
+    match = np.searchsorted(reply_clock, request_key * span + (request_ts - start), side='right')
+    found = (match < len(reply_key)) & ~repeated[is_request]
+    match = np.minimum(match, max(len(reply_key) - 1, 0))
+    if len(reply_key):
+        rtt = reply_ts[match] - request_ts
+        found &= (reply_key[match] == request_key) & (reply_ts[match] < next_request) & (rtt < RTT_LIMIT)
+    else:
+        rtt = np.zeros(len(match))
+    requester = src[is_request][found]
+    stats['rtt_samples'] = np.bincount(requester, minlength=count)
+    stats['rtt'] = group_percentiles(requester, rtt[found], count)
+    return stats
+
+def format_mac(value) -> str:
+    return int(value).to_bytes(6, 'big').hex(':')
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-peer statistics for a GhostFrames capture.')
+    parser.add_argument('capture', help='pcap file written by TraceRecorder or a monitor-mode capture')
+    parser.add_argument('--window', type=float, default=1.0, help='seconds per throughput window')
+    parser.add_argument('--timeseries', help='write per-peer throughput per window to this CSV file')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    frames, records = load_capture(args.capture)
+    loaded = time.perf_counter() - start_time
+    stats = analyze(frames, args.window)
+    elapsed = time.perf_counter() - start_time
+    print(f'[*] {records} records, {len(frames)} GhostFrames frames: loaded in {loaded:.2f} s, '
+          f'analyzed in {elapsed - loaded:.2f} s ({records / max(elapsed, 1e-9) / 1e6:.1f}M records/s)')
+    if not len(frames):
+        return
+
+    print(f'\n{"sender":<18} {"frames":>9} {"kB":>9} {"kB/s":>7} {"peak":>7} {"loss":>6} {"dup":>6} '
+          f'{"retx":>6}  {"gap p50/p95/p99 ms":>20}  {"rtt p50/p95/p99 ms":>20} {"n":>6}')
+    for i, mac in enumerate(stats['peers']):
+        if not stats['frames'][i]:
+            continue
+        gaps = '/'.join(f'{v * 1000:.1f}' for v in stats['inter_arrival'][i])
+        rtt = '/'.join(f'{v * 1000:.1f}' for v in stats['rtt'][i]) if stats['rtt_samples'][i] else '-'
+        print(f'{format_mac(mac):<18} {stats["frames"][i]:>9} {stats["bytes"][i] / 1000:>9.0f} '
+              f'{stats["rate"][i] / 1000:>7.1f} {stats["peak_rate"][i] / 1000:>7.1f} '
+              f'{stats["loss"][i] * 100:>5.1f}% {stats["duplicates"][i] / stats["frames"][i] * 100:>5.1f}% '
+              f'{stats["retransmits"][i]:>6}  {gaps:>20}  {rtt:>20} {stats["rtt_samples"][i]:>6}')
+
+    if args.timeseries:
+        header = 'window_start,' + ','.join(format_mac(mac) for mac in stats['peers'])
+        table = np.column_stack((stats['window_start'], stats['series'].T))
+        np.savetxt(args.timeseries, table, delimiter=',', header=header, comments='', fmt='%.6f')
+        print(f'\n[*] Throughput per {args.window} s window written to {args.timeseries}')
+
+if __name__ == '__main__':
+    main()
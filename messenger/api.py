@@ -3,7 +3,7 @@ from flask_cors import CORS
 from flask_sock import Sock
 import json
 import os
-from peer import Me
+from radio_ipc import RadioClient, IpcError, RADIO_SOCKET
 
 app = Flask(__name__)
 CORS(app)  # allow calls from React (localhost:3000 in dev)
@@ -34,16 +34,26 @@ conversations = {
 }
 
 username = "Anonymous"
-peer = Me(username)
-peer.start()
+peer = None  # RadioClient connected to the radio daemon, created by create_app()
+
+def create_app(socket_path: str = RADIO_SOCKET):
+    '''
+    Connects to the radio daemon (radio_daemon.py) and returns the app.
+    Each API worker process connects on its own; the radio, its peers and
+    the message history live in the daemon.
+    '''
+    global username, peer
+    peer = RadioClient(socket_path)
+    username = peer.name()
+    return app
 
 # --- API Endpoints ---
 @app.route("/users", methods=["GET"])
 def get_users():
-    print(peer.known_peers)
+    known_peers = peer.known_peers()
     # use these peers with random avatars
     users = {}
-    for i, (id, data) in enumerate(peer.known_peers.items()):
+    for i, (id, data) in enumerate(known_peers.items()):
         users[id] = {
             "id": id,
             "name": data['name'],
@@ -59,9 +69,79 @@ def get_messages(user_id):
 
 @app.route("/messages/<user_id>", methods=["POST"])
 def send_message(user_id):
+    '''
+    Sends a message, or queues it until the peer is back in range. Returns
+    the message's id and status; follow it with GET /delivery/<id>.
+    '''
     message = request.get_data().decode('utf-8')
-    peer.send_message(user_id, message)
-    return '', 204
+    try:
+        status = peer.send_message(user_id, message)
+    except IpcError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(status), 202
+
+@app.route("/delivery/<message_id>", methods=["GET"])
+def get_delivery(message_id):
+    '''
+    Delivery status of a sent message: queued, sent, delivered, expired
+    or dropped.
+    '''
+    try:
+        return jsonify(peer.delivery(message_id))
+    except IpcError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.route("/outbox", methods=["GET"])
+def get_outbox():
+    '''
+    Messages not delivered yet, oldest first. peer: only those to that peer.
+    '''
+    return jsonify({"messages": peer.undelivered(request.args.get("peer"))})
+
+@app.route("/search", methods=["GET"])
+def search_messages():
+    '''
+    Full-text search over the message history, best match first.
+    q: words that must all appear (end with * to match the last as a prefix);
+    peer: only that conversation; before: only messages older than this
+    timestamp; limit and offset page through the results.
+    '''
+    query = request.args.get("q", "")
+    before = request.args.get("before", type=float)
+    limit = request.args.get("limit", 20, type=int)
+    offset = max(0, request.args.get("offset", 0, type=int))
+    results = peer.search(query, peer=request.args.get("peer"), before=before, limit=limit, offset=offset)
+    return jsonify({"results": results, "offset": offset, "limit": limit})
+
+@app.route("/ping/<user_id>", methods=["GET"])
+def ping_peer(user_id):
+    '''
+    Runs a PING probe train to a peer and returns RTT min/avg/p99, loss and
+    jitter per padding size. count: PINGs per size; sizes: comma separated
+    padding sizes in bytes.
+    '''
+    count = max(1, min(request.args.get("count", 20, type=int), 1000))
+    try:
+        sizes = [int(size) for size in request.args.get("sizes", "64,512,1000").split(",")]
+    except ValueError:
+        return jsonify({"error": "sizes must be comma separated integers"}), 400
+    try:
+        results = peer.ping(user_id, count, sizes)
+    except IpcError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"peer": user_id, "results": results})
+
+@app.route("/admission", methods=["GET"])
+def get_admission():
+    '''
+    Frames the radio admitted, and dropped before decrypting them, by
+    reason: forged, no_session, peer_rate, unknown_rate, unknown_total
+    and global.
+    '''
+    try:
+        return jsonify(peer.admission())
+    except IpcError as e:
+        return jsonify({"error": str(e)}), 404
 
 @sock.route('/ws/chat')
 def chat(ws):
@@ -82,6 +162,7 @@ def chat(ws):
     except Exception as e:
         print("WebSocket error:", e)
     finally:
+        peer.remove_message_listener(handle_message)
         print("WebSocket connection ended")
 
 @app.route("/users/login/<string:new_username>", methods=["POST"])
@@ -145,4 +226,4 @@ def request_file(user_id, filename):
 
 
 if __name__ == "__main__":
-    app.run(port=5000, debug=True, use_reloader=False)
+    create_app().run(port=5000, debug=True, use_reloader=False)
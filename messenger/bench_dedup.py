@@ -0,0 +1,89 @@
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from dedup import ChunkStore, build_manifest, encode_manifest
+from checkpoint import encode_ranges, index_ranges
+
+FRAME_OVERHEAD = 24 + 8 + 16  # 802.11 + LLC/SNAP + "GF|tt|iiii|ssss|" header bytes
+FILE_CHUNK_SIZE = 1000  # same as peer.CHUNK_SIZE
+
+def change(data: bytearray, fraction: float, edit_size: int, rng):
+    '''
+    Rewrites about fraction of data in edits of edit_size bytes, a third of
+    them overwrites, a third insertions and a third deletions.
+    '''
+    for i in range(int(len(data) * fraction / edit_size)):
+        position = rng.randrange(len(data) - edit_size)
+        kind = i % 3
+        if kind == 0:
+            data[position:position + edit_size] = rng.randbytes(edit_size)
+        elif kind == 1:
+            data[position:position] = rng.randbytes(edit_size)
+        else:
+            del data[position:position + edit_size]
+    return data
+
+def airtime_bytes(payload_bytes: int) -> int:
+    '''
+    Bytes on the air for a file transfer of payload_bytes (base64 chunks).
+    '''
+    frames = -(-payload_bytes // FILE_CHUNK_SIZE) + 2  # chunks + FILE_INIT + FILE_END
+    return payload_bytes * 4 // 3 + frames * FRAME_OVERHEAD
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark delta file transfers with content-defined chunking.')
+    parser.add_argument('--size', type=int, default=50 * 1024 * 1024)
+    parser.add_argument('--change', type=float, default=0.01, help='fraction of the file edited')
+    parser.add_argument('--edit-size', type=int, default=4096)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    old = rng.randbytes(args.size)
+    new = bytes(change(bytearray(old), args.change, args.edit_size, rng))
+
+    start_time = time.perf_counter()
+    old_manifest = build_manifest(old)
+    elapsed = time.perf_counter() - start_time
+    print(f'chunked {len(old)} bytes into {len(old_manifest)} chunks '
+          f'(avg {len(old) // len(old_manifest)} B) at {len(old) / elapsed / 1e6:.0f} MB/s')
+
+    store_dir = tempfile.mkdtemp()
+    try:
+        store = ChunkStore(store_dir)
+        start_time = time.perf_counter()
+        for h, offset, length in old_manifest:
+            store.put(h, old[offset:offset + length])
+        print(f'stored the old version in {time.perf_counter() - start_time:.2f} s')
+
+        new_manifest = build_manifest(new)
+        needed = set()
+        seen = set()
+        for i, (h, _, _) in enumerate(new_manifest):
+            if h not in seen and not store.has(h):
+                needed.add(i)
+            seen.add(h)
+        delta = sum(new_manifest[i][2] for i in needed)
+        manifest_frames = encode_manifest(new_manifest)
+        manifest_bytes = sum(len(body) + FRAME_OVERHEAD for body in manifest_frames)
+        have_bytes = len(encode_ranges(index_ranges(needed))) + FRAME_OVERHEAD
+    finally:
+        shutil.rmtree(store_dir)
+
+    # Fixed-size chunks for comparison: every insertion or deletion shifts everything after it
+    old_fixed = {old[i:i + 8192] for i in range(0, len(old), 8192)}
+    fixed_delta = sum(len(new[i:i + 8192]) for i in range(0, len(new), 8192) if new[i:i + 8192] not in old_fixed)
+
+    full = airtime_bytes(len(new))
+    dedup = airtime_bytes(delta) + manifest_bytes + have_bytes
+    print(f'\nnew version: {len(new)} bytes, {len(needed)} of {len(new_manifest)} chunks changed')
+    print(f'{"full send":<28} {full:>12} bytes on air')
+    print(f'{"fixed 8 KiB chunk delta":<28} {airtime_bytes(fixed_delta):>12} bytes on air')
+    print(f'{"content-defined delta":<28} {dedup:>12} bytes on air '
+          f'(delta {delta}, manifest {manifest_bytes} in {len(manifest_frames)} frames, reply {have_bytes})')
+    print(f'saved {full - dedup} bytes ({(1 - dedup / full) * 100:.1f}%)')
+
+if __name__ == '__main__':
+    main()
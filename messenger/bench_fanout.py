@@ -0,0 +1,95 @@
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from crypto_utils import Session
+from enums import MsgType
+from fanout import ReceivePool, decode_frame
+from frames import build_frame
+from transport import PacketTransport
+
+RECEIVER_MAC = '02:00:00:00:00:ff'
+
+def sender_mac(i: int) -> str:
+    return f'02:00:00:00:{i >> 8:02x}:{i & 0xff:02x}'
+
+def flood(iface: str, frames: list, stop):
+    '''
+    Sender process: replays the prebuilt frames in bursts until stopped.
+    '''
+    transport = PacketTransport(iface)
+    while not stop.is_set():
+        for i in range(0, len(frames), 64):
+            transport.send_batch(frames[i:i + 64])
+
+def measure(iface: str, workers: int, keys: dict, frames: list, seconds: float, results):
+    '''
+    Runs in its own process, so nothing is left listening for the next run.
+    Puts frames decoded per second with workers receive processes on
+    results (0: decoded by the receiving thread itself, as without fanout).
+    '''
+    decoded = [0]
+    if workers:
+        pool = ReceivePool(iface, workers, RECEIVER_MAC)
+        pool.start()
+        for mac, key in keys.items():
+            pool.set_session(mac, key)
+
+        def count(item):
+            decoded[0] += 1
+        threading.Thread(target=pool.listen, args=(count,), daemon=True).start()
+    else:
+        transport = PacketTransport(iface)
+        sessions = {mac: Session(key) for mac, key in keys.items()}
+
+        def decode(pkt):
+            if decode_frame(pkt, RECEIVER_MAC, sessions, False):
+                decoded[0] += 1
+        threading.Thread(target=transport.listen, args=(decode,), daemon=True).start()
+
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    sender = context.Process(target=flood, args=(iface, frames, stop), daemon=True)
+    sender.start()
+    time.sleep(1)  # warm up
+    start_count, start_time = decoded[0], time.perf_counter()
+    time.sleep(seconds)
+    results.put((decoded[0] - start_count) / (time.perf_counter() - start_time))
+    stop.set()
+    sender.join()
+    if workers:
+        pool.close()
+
+def run(iface: str, workers: int, keys: dict, frames: list, seconds: float) -> float:
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(iface, workers, keys, frames, seconds, results))
+    process.start()
+    rate = results.get()
+    process.join()
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark receive throughput with fanout worker processes.')
+    parser.add_argument('--iface', default='lo')
+    parser.add_argument('--peers', type=int, default=32, help='sender MACs the traffic comes from')
+    parser.add_argument('--workers', default='0,1,2,4', help='worker counts to compare (0 = no fanout)')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    # Session-encrypted 1 kB chunks from each peer, like a busy file exchange
+    keys = {sender_mac(i): os.urandom(32) for i in range(args.peers)}
+    sessions = {mac: Session(key) for mac, key in keys.items()}
+    data = os.urandom(350).hex()
+    frames = [build_frame(MsgType.FILE_CHUNK, 1, seq, data, RECEIVER_MAC, mac, session)
+              for seq in range(64) for mac, session in sessions.items()]
+
+    print(f'{os.cpu_count()} CPUs, {args.peers} peers')
+    for workers in map(int, args.workers.split(',')):
+        rate = run(args.iface, workers, keys, frames, args.seconds)
+        label = f'{workers} workers' if workers else 'no fanout'
+        print(f'  {label:<10} {rate:8.0f} frames/s decoded')
+
+if __name__ == '__main__':
+    main()
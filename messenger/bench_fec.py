@@ -0,0 +1,90 @@
+import argparse
+import os
+import random
+import time
+import fec
+
+CHUNK_SIZE = 1000  # same as peer.CHUNK_SIZE
+FRAME_TIME = 0.004  # seconds of airtime per ~1.3 kB frame
+
+def retransmit_only(num_chunks, loss, rng, rtt):
+    '''
+    Sends every chunk, then resends whatever the FILE_ACK reports missing
+    until nothing is. Returns (frames sent, seconds).
+    '''
+    missing = num_chunks
+    frames = 0
+    rounds = 0
+    while missing:
+        frames += missing
+        missing = sum(rng.random() < loss for _ in range(missing))
+        rounds += 1
+    return frames, frames * FRAME_TIME + rounds * rtt
+
+def with_fec(chunks, loss, rng, rtt):
+    '''
+    Sends every block with parity sized by fec.parity_count(), rebuilds what
+    it can with fec.decode(), and retransmits the rest like retransmit_only().
+    Returns (frames sent, seconds).
+    '''
+    m = fec.parity_count(loss)
+    frames = 0
+    unrecovered = 0
+    for start in range(0, len(chunks), fec.FEC_BLOCK_SIZE):
+        block = chunks[start:start + fec.FEC_BLOCK_SIZE]
+        parity = fec.encode(block, m)
+        frames += len(block) + m
+        data = {i: c for i, c in enumerate(block) if rng.random() >= loss}
+        heard = {j: p for j, p in enumerate(parity) if rng.random() >= loss}
+        rebuilt = fec.decode(data, heard, len(block), m, CHUNK_SIZE)
+        if rebuilt is None:
+            unrecovered += len(block) - len(data)
+        else:
+            assert all(rebuilt[i][:len(block[i])] == block[i] for i in rebuilt)
+    extra_frames, extra_time = retransmit_only(unrecovered, loss, rng, rtt) if unrecovered else (0, 0)
+    return frames + extra_frames, frames * FRAME_TIME + rtt + extra_time
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark file goodput with and without FEC parity frames.')
+    parser.add_argument('--size', type=int, default=1_000_000, help='file size in bytes')
+    parser.add_argument('--losses', default='0,0.01,0.02,0.05,0.1,0.2,0.3')
+    parser.add_argument('--rtt', type=float, default=0.05,
+                        help='seconds from FILE_END to the start of a retransmission round')
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size)
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, args.size, CHUNK_SIZE)]
+
+    block = chunks[:fec.FEC_BLOCK_SIZE]
+    for m in (1, 4, 8):
+        parity = fec.encode(block, m)
+        start_time = time.perf_counter()
+        for _ in range(50):
+            fec.encode(block, m)
+        encode_rate = 50 * len(block) * CHUNK_SIZE / (time.perf_counter() - start_time) / 1e6
+        data_heard = {i: c for i, c in enumerate(block) if i >= m}
+        start_time = time.perf_counter()
+        for _ in range(50):
+            fec.decode(data_heard, dict(enumerate(parity)), len(block), m, CHUNK_SIZE)
+        decode_rate = 50 * len(block) * CHUNK_SIZE / (time.perf_counter() - start_time) / 1e6
+        print(f'm={m}: encode {encode_rate:6.1f} MB/s, decode {m} lost chunks {decode_rate:6.1f} MB/s')
+
+    print(f"\n{'loss':>5} {'parity':>6} {'retx frames':>11} {'retx kB/s':>9} {'fec frames':>10} {'fec kB/s':>9}")
+    rng = random.Random(args.seed)
+    for loss in [float(x) for x in args.losses.split(',')]:
+        retx_frames = retx_time = fec_frames = fec_time = 0
+        for _ in range(args.trials):
+            frames, seconds = retransmit_only(len(chunks), loss, rng, args.rtt)
+            retx_frames += frames
+            retx_time += seconds
+            frames, seconds = with_fec(chunks, loss, rng, args.rtt)
+            fec_frames += frames
+            fec_time += seconds
+        print(f"{loss:>5.2f} {fec.parity_count(loss):>6} {retx_frames // args.trials:>11} "
+              f"{args.size * args.trials / retx_time / 1000:>9.1f} {fec_frames // args.trials:>10} "
+              f"{args.size * args.trials / fec_time / 1000:>9.1f}")
+
+if __name__ == '__main__':
+    main()
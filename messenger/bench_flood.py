@@ -0,0 +1,125 @@
+import argparse
+import base64
+import os
+import statistics
+import tempfile
+import threading
+import time
+from transport import SimulatedMedium, SimulatedTransport
+from crypto_utils import TicketCache, generate_keypair, export_public_key
+from dedup import ChunkStore
+from enums import MsgType
+from frames import build_frame, build_encrypted_frame
+from outbox import MessageOutbox
+from peer import Me, BROADCAST_MAC
+
+ALICE_MAC = '02:00:00:00:00:01'
+BOB_MAC = '02:00:00:00:00:02'
+
+def attack_frames(kind: str, count: int) -> list:
+    '''
+    Frames a flooding node sends, built up front so the attack costs the
+    benchmark as little CPU as possible. handshake: HANDSHAKE_REQs from a
+    new MAC each, every one an ECDH for the receiver. spoofed:
+    HANDSHAKE_REQs claiming to be from alice, with fresh keys, each of
+    which would replace bob's session with her. forged: session frames
+    claiming to be from alice, with made-up ciphertext.
+    '''
+    if kind == 'handshake':
+        public_key = export_public_key(generate_keypair())
+        return [build_frame(MsgType.HANDSHAKE_REQ, i, 0, f"0|flood{i}|{public_key}|{os.urandom(16).hex()}|",
+                            BROADCAST_MAC, f'02:ff:00:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}')
+                for i in range(count)]
+    if kind == 'spoofed':
+        public_keys = [export_public_key(generate_keypair()) for _ in range(min(count, 64))]
+        return [build_frame(MsgType.HANDSHAKE_REQ, i, 0,
+                            f"0|alice|{public_keys[i % len(public_keys)]}|{os.urandom(16).hex()}|",
+                            BROADCAST_MAC, ALICE_MAC)
+                for i in range(count)]
+    return [build_encrypted_frame(MsgType.MSG, i, 1, f"$0.{os.urandom(4).hex()}.{base64.b64encode(os.urandom(200)).decode()}",
+                                  BOB_MAC, ALICE_MAC)
+            for i in range(count)]
+
+def flood(medium, transport, frames, rate, stop):
+    '''
+    Puts frames on the air at rate frames per second until stop is set.
+    '''
+    batch = max(1, int(rate / 100))
+    i = 0
+    next_time = time.perf_counter()
+    while not stop.is_set():
+        for _ in range(batch):
+            medium.broadcast(transport, frames[i % len(frames)])
+            i += 1
+        next_time += batch / rate
+        time.sleep(max(0, next_time - time.perf_counter()))
+
+def run(kind: str, admission: bool, args):
+    '''
+    Sends chat messages from alice to bob while a third node floods the
+    channel. Returns (latencies in ms of the messages delivered, messages
+    sent, bob's admission stats).
+    '''
+    os.chdir(tempfile.mkdtemp())
+    medium = SimulatedMedium(args.seed)
+    nodes = []
+    for name, mac in (('alice', ALICE_MAC), ('bob', BOB_MAC)):
+        nodes.append(Me(name, tickets=TicketCache(os.devnull), mac=mac,
+                        transports=[SimulatedTransport(medium, name[0] + '0', inbox_limit=args.capture_buffer)],
+                        chunk_store=ChunkStore(f'store_{name}'), mtu_probing=False,
+                        outbox=MessageOutbox(f'outbox_{name}.json'), admission=admission))
+    alice, bob = nodes
+    latencies = []
+    bob.register_message_listener(lambda sender, text: latencies.append((time.time() - float(text)) * 1000))
+    bob.start()
+    alice.start()
+    deadline = time.time() + 5
+    while 'bob' not in alice.known_peers and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(1.5)
+
+    stop = threading.Event()
+    if kind != 'none':
+        attacker = SimulatedTransport(medium, 'x0', inbox_limit=1)
+        frames = attack_frames(kind, args.attack_frames)
+        threading.Thread(target=flood, args=(medium, attacker, frames, args.rate, stop), daemon=True).start()
+        time.sleep(0.5)
+
+    sent = 0
+    end = time.time() + args.seconds
+    while time.time() < end:
+        alice.send_message('bob', f'{time.time():.6f}')
+        sent += 1
+        time.sleep(args.interval)
+    time.sleep(2)
+    stop.set()
+    return latencies[:], sent, bob.admission.stats() if bob.admission else None
+
+def summary(latencies, sent):
+    if not latencies:
+        return f'  0/{sent} delivered'
+    latencies = sorted(latencies)
+    return (f'{len(latencies):>3}/{sent} delivered  p50 {statistics.median(latencies):7.1f} ms  '
+            f'p99 {latencies[int(len(latencies) * 0.99)]:7.1f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chat latency while a node floods the channel.')
+    parser.add_argument('--rate', type=float, default=2000, help='flood frames per second')
+    parser.add_argument('--seconds', type=float, default=5, help='chat duration per run')
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between chat messages')
+    parser.add_argument('--attack-frames', type=int, default=5000, help='distinct flood frames (and MACs)')
+    parser.add_argument('--capture-buffer', type=int, default=1000, help='frames each receiver buffers')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} CPUs, flood at {args.rate:.0f} frames/s')
+    for kind in ('none', 'forged', 'handshake', 'spoofed'):
+        for admission in ((True,) if kind == 'none' else (False, True)):
+            latencies, sent, stats = run(kind, admission, args)
+            label = f'{kind} flood, admission {"on" if admission else "off"}'
+            print(f'{label:<30} {summary(latencies, sent)}')
+            if stats and kind != 'none':
+                print(f'{"":<30} ' + ', '.join(f'{key} {value}' for key, value in stats.items() if value))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import contextlib
+import os
+import random
+import socket
+import threading
+import time
+from crypto_utils import TicketCache
+from identities import SharedRadio
+from outbox import MessageOutbox
+from peer import Me
+from transport import SimulatedMedium, SimulatedTransport
+from udp_gateway import UdpGateway, encode_msg, decode_msgs, UDP_READ_SIZE
+
+class LanPeer:
+    '''
+    A UDP peer on loopback, speaking the apinew.py protocol (with batches
+    when batch is set). Counts the datagrams and messages it receives.
+    '''
+    def __init__(self, name: str, gateway_port: int, batch: bool):
+        self.name = name
+        self.gateway_port = gateway_port
+        self.batch = batch
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.datagrams = 0
+        self.received = []
+        threading.Thread(target=self.announcer, daemon=True).start()
+        threading.Thread(target=self.receiver, daemon=True).start()
+
+    def announcer(self):
+        msg = encode_msg({'id': self.name, 'type': 'announce', 'name': self.name,
+                          'port': self.sock.getsockname()[1], 'batch': self.batch})
+        while True:
+            self.sock.sendto(msg, ('127.0.0.1', self.gateway_port))
+            time.sleep(1)
+
+    def receiver(self):
+        while True:
+            data, _ = self.sock.recvfrom(UDP_READ_SIZE)
+            self.datagrams += 1
+            self.received.extend(msg['text'] for msg in decode_msgs(data) if msg.get('type') == 'msg')
+
+    def send(self, port: int, text: str):
+        self.sock.sendto(encode_msg({'type': 'msg', 'from': self.name, 'text': text}), ('127.0.0.1', port))
+
+def wait_for(condition, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def run(args, batch: bool, port: int):
+    '''
+    Radio peers on a simulated medium and UDP peers on loopback exchange
+    messages through a gateway. Returns (messages to the LAN delivered,
+    datagrams they took, seconds, messages to the radio delivered, gateway metrics).
+    '''
+    medium = SimulatedMedium(args.seed)
+    radio = SharedRadio([SimulatedTransport(medium, 'gw')])
+    def identity(name):
+        return Me(name, tickets=TicketCache(os.devnull), radio=radio, mtu_probing=False, outbox=MessageOutbox(None))
+    gateway = UdpGateway(radio, host='127.0.0.1', broadcast='127.0.0.1', announce_port=port,
+                         identity_factory=identity, rate=args.rate, burst=args.rate)
+    radio_peers = [Me(f'radio{i}', tickets=TicketCache(os.devnull), mac=f'02:00:00:00:01:{i:02x}',
+                      transports=[SimulatedTransport(medium, f'r{i}')], mtu_probing=False,
+                      outbox=MessageOutbox(None))
+                   for i in range(args.radio_peers)]
+    delivered = []
+    for me in radio_peers:
+        me.register_message_listener(lambda sender_id, text: delivered.append(text))
+        me.start()
+    gateway.start()
+    lan_peers = [LanPeer(f'lan{i}', port, batch) for i in range(args.lan_peers)]
+    names = {peer.name for peer in lan_peers}
+    wait_for(lambda: all(names <= set(me.known_peers) for me in radio_peers), 20)
+    wait_for(lambda: {me.name for me in radio_peers} <= set(gateway.radio_ports), 10)
+    time.sleep(1)
+
+    rng = random.Random(args.seed)
+    start = time.time()
+    for i in range(args.messages):
+        rng.choice(radio_peers).send_message(rng.choice(lan_peers).name, f'down{i}')
+    wait_for(lambda: sum(len(peer.received) for peer in lan_peers) >= args.messages, 30)
+    elapsed = time.time() - start
+    received = sum(len(set(peer.received)) for peer in lan_peers)
+    datagrams = sum(peer.datagrams for peer in lan_peers)
+
+    ports = {name: sock.getsockname()[1] for name, sock in list(gateway.radio_ports.items())}
+    for i in range(args.messages):
+        rng.choice(lan_peers).send(ports[rng.choice(radio_peers).name], f'up{i}')
+    wait_for(lambda: len(set(delivered)) >= args.messages, 30)
+    return received, datagrams, elapsed, len(set(delivered)), gateway.stats()
+
+def main():
+    parser = argparse.ArgumentParser(description='Bridge messages between a simulated radio and UDP peers on loopback.')
+    parser.add_argument('--radio-peers', type=int, default=4)
+    parser.add_argument('--lan-peers', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=400, help='messages each way')
+    parser.add_argument('--rate', type=float, default=1000, help='bridged messages/s per UDP peer')
+    parser.add_argument('--port', type=int, default=47000, help='announcement port on loopback')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for i, batch in enumerate((False, True)):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            received, datagrams, elapsed, up, stats = run(args, batch, args.port + i)
+        print(f'batching {"on " if batch else "off"}: to LAN {received}/{args.messages} in {datagrams} datagrams '
+              f'({received / max(datagrams, 1):.1f} per datagram, {elapsed:.2f} s), to radio {up}/{args.messages}')
+        print('  ' + ', '.join(f'{key} {value}' for key, value in stats.items()), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+from history import MessageHistory
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark message history indexing and search.')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--peers', type=int, default=50)
+    parser.add_argument('--vocabulary', type=int, default=50_000)
+    parser.add_argument('--queries', type=int, default=200, help='runs of each query kind')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = make_vocabulary(args.vocabulary, rng)
+    # Zipf-like word frequencies, like real chat
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    peers = [f'peer{i}' for i in range(args.peers)]
+    texts = [' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(4, 16)))
+             for _ in range(args.messages)]
+    senders = rng.choices(peers, k=args.messages)
+    history = MessageHistory(os.path.join(tempfile.mkdtemp(), 'history.db'))
+
+    start_ts = time.time() - args.messages
+    start_time = time.perf_counter()
+    for i, (text, peer) in enumerate(zip(texts, senders)):
+        history.add(peer, peer, text, start_ts + i)
+    add_time = time.perf_counter() - start_time
+    history.flush()
+    elapsed = time.perf_counter() - start_time
+    print(f'{args.messages} messages indexed at {args.messages / elapsed:.0f}/s; '
+          f'add() cost the caller {add_time / args.messages * 1e6:.1f} µs per message')
+
+    common, middling, rare = words[0], words[300], words[20_000]
+    kinds = {
+        'common word': lambda: history.search(common),
+        'middling word': lambda: history.search(middling),
+        'rare word': lambda: history.search(rare),
+        'two words': lambda: history.search(f'{common} {middling}'),
+        'prefix': lambda: history.search(middling[:3] + '*'),
+        'common + peer': lambda: history.search(common, peer=rng.choice(peers)),
+        'common + before': lambda: history.search(common, before=start_ts + rng.randrange(args.messages)),
+        'page 5': lambda: history.search(common, offset=80),
+    }
+    print(f'\n{"query":<16} {"p50 ms":>7} {"p99 ms":>7} {"results":>8}')
+    for name, run in kinds.items():
+        times = []
+        for _ in range(args.queries):
+            query_start = time.perf_counter()
+            results = run()
+            times.append((time.perf_counter() - query_start) * 1000)
+        times.sort()
+        print(f'{name:<16} {statistics.median(times):7.2f} {times[int(len(times) * 0.99) - 1]:7.2f} {len(results):>8}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import contextlib
+import os
+import random
+import time
+from clock import VirtualClock
+from crypto_utils import TicketCache
+from enums import MsgType
+from frames import parse_frame
+from identities import SharedRadio
+from outbox import MessageOutbox
+from peer import Me
+from simulation import VirtualMedium, VirtualTransport
+
+HEARTBEAT_TYPES = {MsgType.HEARTBEAT, MsgType.HOST_HEARTBEAT}
+
+class CountingMedium(VirtualMedium):
+    '''
+    A single cell that counts heartbeat frames put on the air.
+    '''
+    def __init__(self, clock, rng):
+        super().__init__(clock, rng)
+        self.heartbeats = 0
+
+    def broadcast(self, sender, frame):
+        if MsgType(int(parse_frame(frame)[3][3:5])) in HEARTBEAT_TYPES:
+            self.heartbeats += 1
+        super().broadcast(sender, frame)
+
+def node(name, i, clock, **kwargs):
+    return Me(name, tickets=TicketCache(os.devnull), mac=f'02:00:00:00:{i >> 8:02x}:{i & 0xff:02x}',
+              mtu_probing=False, outbox=MessageOutbox(None, clock), clock=clock, **kwargs)
+
+def run(identities: int, remotes: int, shared: bool, seconds: float, rate: float, seed: int):
+    '''
+    remotes peers chat with a gateway's identities, each hosted on one
+    SharedRadio or on a capture of its own. Returns (CPU seconds over the
+    measured window, heartbeat frames sent in it, messages sent,
+    messages delivered).
+    '''
+    random.seed(seed)
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    medium = CountingMedium(clock, rng)
+    radio = SharedRadio([VirtualTransport(medium, 'gateway')], clock) if shared else None
+    gateway = [node(f'bot{i}', i, clock, radio=radio) if shared else
+               node(f'bot{i}', i, clock, transports=[VirtualTransport(medium, f'bot{i}')])
+               for i in range(identities)]
+    peers = [node(f'peer{i}', 1000 + i, clock, transports=[VirtualTransport(medium, f'peer{i}')])
+             for i in range(remotes)]
+    delivered = []
+    for me in gateway:
+        me.register_message_listener(lambda sender_id, text: delivered.append(text))
+    if radio:
+        radio.start()
+    for me in gateway + peers:
+        clock.call_later(rng.uniform(0, 5), me.start)
+    clock.run(clock.time() + 30)  # handshakes settle
+
+    sent = []
+    def chat():
+        peer = rng.choice(peers)
+        bot = rng.choice(gateway)
+        if bot.name in peer.known_peers:
+            sent.append(f'{peer.name}#{len(sent)}')
+            peer.send_message(bot.name, sent[-1])
+        clock.call_later(rng.expovariate(rate), chat)
+    clock.call_later(0, chat)
+    medium.heartbeats = 0
+    delivered.clear()
+    cpu_start = time.process_time()
+    clock.run(clock.time() + seconds)
+    return time.process_time() - cpu_start, medium.heartbeats, len(sent), len(set(delivered))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare identities sharing one radio with one capture each.')
+    parser.add_argument('--identities', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--remotes', type=int, default=5, help='peers chatting with the gateway')
+    parser.add_argument('--seconds', type=float, default=60, help='virtual seconds measured')
+    parser.add_argument('--rate', type=float, default=50, help='messages per second to the gateway')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{"identities":>10} {"capture":<8} {"CPU":>8} {"heartbeats":>10}  delivered')
+    for identities in args.identities:
+        for shared in (False, True):
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                cpu, heartbeats, sent, delivered = run(identities, args.remotes, shared,
+                                                       args.seconds, args.rate, args.seed)
+            print(f'{identities:>10} {"shared" if shared else "each":<8} {cpu:>6.2f} s {heartbeats:>10}  '
+                  f'{delivered}/{sent}', flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from crypto_utils import Session
+from enums import MsgType, IpcOp
+from fanout import decode_frame
+from frames import build_frame
+from history import MessageHistory
+from radio_ipc import RadioServer, RadioClient
+
+RADIO_MAC = '02:00:00:00:00:ff'
+PEER_MAC = '02:00:00:00:00:01'
+
+class StubRadio:
+    '''
+    Stands in for Me: a peer table and message listeners, no radio.
+    '''
+    def __init__(self, peers: int):
+        self.name = 'bench'
+        self.known_peers = {f'peer{i}': {'name': f'peer{i}', 'mac': f'02:00:00:00:01:{i:02x}',
+                                         'last_seen': time.time(), 'hops': 1} for i in range(peers)}
+        self.message_listeners = []
+
+    def register_message_listener(self, callback):
+        self.message_listeners.append(callback)
+
+    def send_message(self, id, text):
+        pass
+
+    def rename(self, new_name):
+        self.name = new_name
+
+class InProcessRadio:
+    '''
+    The API's view of the radio when both share a process, as before the
+    daemon: the same handlers, called directly.
+    '''
+    def __init__(self, server):
+        self.server = server
+
+    def name(self):
+        return self.server.name(None)
+
+    def known_peers(self):
+        return self.server.peers(None)
+
+def radio_loop(stop, counter):
+    '''
+    The radio's share of the daemon's CPU: decodes session-encrypted frames
+    in a loop, like frame_listener does. counter[0] is frames decoded.
+    '''
+    session = Session(os.urandom(32))
+    sessions = {PEER_MAC: session}
+    frames = [build_frame(MsgType.MSG, 1, seq, 'x' * 200, RADIO_MAC, PEER_MAC, session) for seq in range(64)]
+    while not stop.is_set():
+        for frame in frames:
+            decode_frame(frame, RADIO_MAC, sessions, False)
+        counter[0] += len(frames)
+
+def radio_rate(seconds: float) -> float:
+    stop = threading.Event()
+    counter = [0]
+    threading.Thread(target=radio_loop, args=(stop, counter), daemon=True).start()
+    time.sleep(0.5)
+    start_count, start_time = counter[0], time.perf_counter()
+    time.sleep(seconds)
+    rate = (counter[0] - start_count) / (time.perf_counter() - start_time)
+    stop.set()
+    return rate
+
+def http_load(app, stop, counter):
+    client = app.test_client()
+    while not stop.is_set():
+        client.get('/users')
+        counter[0] += 1
+
+def api_worker(path: str, seconds: float, niceness: int, results):
+    '''
+    An API worker process: serves /users from the daemon as fast as it can.
+    '''
+    os.nice(niceness)
+    import api
+    app = api.create_app(path)
+    stop = threading.Event()
+    counter = [0]
+    threading.Thread(target=http_load, args=(app, stop, counter), daemon=True).start()
+    time.sleep(seconds)
+    stop.set()
+    results.put(counter[0])
+
+def ipc_rate(path: str, batch: int, seconds: float) -> float:
+    client = RadioClient(path)
+    calls = [(IpcOp.PEERS, ())] * batch
+    done = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < seconds:
+        client.call_many(calls)
+        done += batch
+    return done / (time.perf_counter() - start_time)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the radio daemon IPC and its effect on the radio.')
+    parser.add_argument('--peers', type=int, default=50, help='peers in the snapshot PEERS returns')
+    parser.add_argument('--clients', type=int, default=4, help='API threads or worker processes under load')
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--nice', type=int, default=10, help='niceness of the API worker processes')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'radio.sock')
+    radio = StubRadio(args.peers)
+    server = RadioServer(radio, MessageHistory(os.path.join(os.path.dirname(path), 'history.db')), path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    time.sleep(0.2)
+
+    print(f'{os.cpu_count()} CPUs, PEERS snapshot of {args.peers} peers')
+    for batch in (1, 8, 64):
+        print(f'  batch {batch:<3} {ipc_rate(path, batch, args.seconds):8.0f} calls/s')
+
+    # Radio decode rate while the API serves /users flat out
+    print(f'\nradio frames decoded/s with {args.clients} API clients hammering /users')
+    print(f'  idle                 {radio_rate(args.seconds):8.0f}')
+
+    import api
+    api.peer = InProcessRadio(server)
+    stop = threading.Event()
+    counter = [0]
+    for _ in range(args.clients):
+        threading.Thread(target=http_load, args=(api.app, stop, counter), daemon=True).start()
+    rate = radio_rate(args.seconds)
+    stop.set()
+    print(f'  API in process       {rate:8.0f}   ({counter[0] / (args.seconds + 0.5):.0f} requests/s)')
+    time.sleep(0.5)
+
+    context = multiprocessing.get_context('spawn')
+    for niceness in sorted({0, args.nice}):
+        results = context.Queue()
+        workers = [context.Process(target=api_worker, args=(path, args.seconds + 2, niceness, results), daemon=True)
+                   for _ in range(args.clients)]
+        for worker in workers:
+            worker.start()
+        time.sleep(1.5)  # let the workers import and connect
+        rate = radio_rate(args.seconds)
+        requests = sum(results.get() for _ in workers)
+        label = f'API over IPC, nice {niceness}'
+        print(f'  {label:<20} {rate:8.0f}   ({requests / (args.seconds + 2):.0f} requests/s)')
+        for worker in workers:
+            worker.join()
+
+if __name__ == '__main__':
+    main()
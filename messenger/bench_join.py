@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import os
+import random
+from clock import VirtualClock
+from crypto_utils import TicketCache
+from enums import MsgType
+from frames import parse_frame
+from outbox import MessageOutbox
+from peer import Me
+from simulation import VirtualMedium, VirtualTransport
+
+POLL = 0.05  # virtual seconds between convergence checks
+HANDSHAKE_TYPES = {MsgType.HANDSHAKE_REQ, MsgType.HANDSHAKE_ACK, MsgType.ROSTER}
+
+class CountingMedium(VirtualMedium):
+    '''
+    A shared channel that counts the frames put on it by message type.
+    '''
+    def __init__(self, clock, rng):
+        super().__init__(clock, rng, shared=True)
+        self.counts = {}
+
+    def broadcast(self, sender, frame):
+        payload = parse_frame(frame)[3]
+        msg_type = MsgType(int(payload[3:5]))
+        self.counts[msg_type] = self.counts.get(msg_type, 0) + 1
+        super().broadcast(sender, frame)
+
+    def handshake_frames(self) -> int:
+        return sum(count for msg_type, count in self.counts.items() if msg_type in HANDSHAKE_TYPES)
+
+def build(nodes: int, roster: bool, seed: int):
+    random.seed(seed)
+    clock = VirtualClock()
+    medium = CountingMedium(clock, random.Random(seed))
+    peers = [Me(f'node{i}', tickets=TicketCache(os.devnull), mac=f'02:00:00:00:{i >> 8:02x}:{i & 0xff:02x}',
+                transports=[VirtualTransport(medium, f'n{i}')], mtu_probing=False,
+                outbox=MessageOutbox(None, clock), clock=clock, roster=roster)
+             for i in range(nodes)]
+    return clock, medium, peers
+
+def has_session(a, b) -> bool:
+    session, reverse = a.sessions.get(b.mac), b.sessions.get(a.mac)
+    return session is not None and reverse is not None and session.key == reverse.key
+
+def converge(clock, pairs, limit):
+    '''
+    Runs the clock until every (a, b) pair has a working session both ways
+    and a knows b as a peer, or limit virtual seconds pass. Returns the
+    time each took, None for never, and the pairs that never got both.
+    '''
+    start = clock.time()
+    no_session, unknown = set(pairs), set(pairs)
+    sessions_at = known_at = None
+    while clock.time() - start < limit and (no_session or unknown):
+        clock.run(clock.time() + POLL)
+        no_session = {(a, b) for a, b in no_session if not has_session(a, b)}
+        unknown = {(a, b) for a, b in unknown if b.name not in a.known_peers}
+        if sessions_at is None and not no_session:
+            sessions_at = clock.time() - start
+        if known_at is None and not unknown:
+            known_at = clock.time() - start
+    return sessions_at, known_at, len(no_session | unknown)
+
+def join(nodes: int, roster: bool, seed: int, limit: float):
+    '''
+    nodes - 1 peers settle in, then one more starts.
+    '''
+    clock, medium, peers = build(nodes, roster, seed)
+    joiner = peers.pop()
+    for peer in peers:
+        clock.call_later(random.uniform(0, 5), peer.start)
+    clock.run(clock.time() + 30)
+    medium.counts.clear()
+    joiner.start()
+    pairs = [(joiner, peer) for peer in peers] + [(peer, joiner) for peer in peers]
+    return converge(clock, pairs, limit) + (medium.handshake_frames(),)
+
+def power_cycle(nodes: int, roster: bool, seed: int, limit: float):
+    '''
+    Every node starts within the same second.
+    '''
+    clock, medium, peers = build(nodes, roster, seed)
+    for peer in peers:
+        clock.call_later(random.uniform(0, 1), peer.start)
+    pairs = [(a, b) for a in peers for b in peers if a is not b]
+    return converge(clock, pairs, limit) + (medium.handshake_frames(),)
+
+def seconds(value) -> str:
+    return f'{value:7.2f} s' if value is not None else '  never  '
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare joins answered by rosters with every peer answering.')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--limit', type=float, default=60, help='virtual seconds to wait for convergence')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenario', choices=['join', 'power-cycle'], nargs='+', default=['join', 'power-cycle'])
+    args = parser.parse_args()
+
+    print(f'{"scenario":<12} {"nodes":>5} {"answers":<8} {"handshake frames":>16} {"sessions":>10} '
+          f'{"peers known":>11}  unconverged pairs')
+    for scenario, run in (('join', join), ('power cycle', power_cycle)):
+        if scenario.replace(' ', '-') not in args.scenario:
+            continue
+        for nodes in args.nodes:
+            for roster in (False, True):
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    sessions_at, known_at, unconverged, frames = run(nodes, roster, args.seed, args.limit)
+                print(f'{scenario:<12} {nodes:>5} {"roster" if roster else "everyone":<8} {frames:>16} '
+                      f'{seconds(sessions_at):>10} {seconds(known_at):>11}  {unconverged}', flush=True)
+
+if __name__ == '__main__':
+    main()
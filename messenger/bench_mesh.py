@@ -0,0 +1,131 @@
+import argparse
+import math
+import random
+from mesh import RoutingTable
+
+HEARTBEAT_INTERVAL = 5.0  # seconds, same as Me.announcer
+HOP_LATENCY = 0.004  # seconds per hop: airtime of a ~1.3 kB frame plus handling
+FRAME_OVERHEAD = 24 + 8 + 16  # 802.11 + LLC/SNAP + "GF|tt|iiii|ssss|" header bytes
+RELAY_HEADER = 3 + 13 + 13 + 3  # "ttl|origin|final_dst|type|" added to a relayed frame
+
+def node_mac(i):
+    return f"02:00:00:{(i >> 16) & 0xff:02x}:{(i >> 8) & 0xff:02x}:{i & 0xff:02x}"
+
+def line_topology(n):
+    return {i: {j for j in (i - 1, i + 1) if 0 <= j < n} for i in range(n)}
+
+def grid_topology(n):
+    side = math.ceil(math.sqrt(n))
+    neighbors = {i: set() for i in range(n)}
+    for i in range(n):
+        row, col = divmod(i, side)
+        for j in (i - side, i + side, i - 1 if col > 0 else -1, i + 1 if col < side - 1 else -1):
+            if 0 <= j < n:
+                neighbors[i].add(j)
+    return neighbors
+
+def random_topology(n, rng):
+    '''
+    Random geometric graph in the unit square, with the radio range grown
+    until the graph is connected.
+    '''
+    points = [(rng.random(), rng.random()) for _ in range(n)]
+    radius = 1.5 / math.sqrt(n)
+    while True:
+        neighbors = {i: {j for j in range(n) if j != i and math.dist(points[i], points[j]) <= radius}
+                     for i in range(n)}
+        seen, stack = {0}, [0]
+        while stack:
+            for j in neighbors[stack.pop()] - seen:
+                seen.add(j)
+                stack.append(j)
+        if len(seen) == n:
+            return neighbors
+        radius *= 1.1
+
+def converge(neighbors, loss, rng, max_rounds=200):
+    '''
+    Runs heartbeat rounds until the tables stop changing for two rounds in a
+    row (a lossy round can look quiet). Returns (tables, rounds, vector
+    bytes sent).
+    '''
+    n = len(neighbors)
+    tables = {i: RoutingTable(node_mac(i)) for i in range(n)}
+    for i, adjacent in neighbors.items():
+        for j in adjacent:
+            tables[i].add_neighbor(node_mac(j), f"n{j}")
+
+    vector_bytes = 0
+    quiet_rounds = 0
+    for rounds in range(1, max_rounds + 1):
+        vectors = {i: tables[i].encode_vectors() for i in range(n)}
+        changed = False
+        for i in range(n):
+            for frame in vectors[i]:
+                vector_bytes += len(frame) + FRAME_OVERHEAD
+                for j in neighbors[i]:
+                    if rng.random() >= loss:
+                        before = len(tables[j].routes)
+                        tables[j].update_from_vector(node_mac(i), frame)
+                        changed |= len(tables[j].routes) != before
+        quiet_rounds = 0 if changed else quiet_rounds + 1
+        if quiet_rounds == 2:
+            return tables, rounds - 2, vector_bytes
+    return tables, max_rounds, vector_bytes
+
+def deliver(tables, src, dst, loss, rng, ttl):
+    '''
+    Forwards one frame hop by hop. Returns the hop count, or None if the
+    frame was lost, hit the TTL or had no route.
+    '''
+    current = node_mac(src)
+    target = node_mac(dst)
+    index = {node_mac(i): i for i in tables}
+    hops = 0
+    while current != target:
+        next_hop = tables[index[current]].next_hop(target)
+        if next_hop is None or hops >= ttl or rng.random() < loss:
+            return None
+        current = next_hop
+        hops += 1
+    return hops
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark distance-vector mesh relaying on simulated topologies.')
+    parser.add_argument('--sizes', default='10,25,50,100')
+    parser.add_argument('--loss', type=float, default=0.05, help='per-hop frame loss')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--payload', type=int, default=200, help='chat payload bytes')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    from peer import RELAY_TTL
+
+    print(f"{'topology':<8} {'nodes':>5} {'rounds':>6} {'conv(s)':>8} {'deliv%':>7} "
+          f"{'hops':>5} {'lat(ms)':>8} {'hb B/node/s':>12} {'relay ovh%':>10}")
+    for n in [int(x) for x in args.sizes.split(',')]:
+        for name in ('line', 'grid', 'random'):
+            rng = random.Random(args.seed)
+            neighbors = {'line': line_topology, 'grid': grid_topology}[name](n) if name != 'random' \
+                else random_topology(n, rng)
+            tables, rounds, vector_bytes = converge(neighbors, args.loss, rng)
+
+            delivered = []
+            for _ in range(args.messages):
+                src, dst = rng.sample(range(n), 2)
+                hops = deliver(tables, src, dst, args.loss, rng, RELAY_TTL)
+                if hops is not None:
+                    delivered.append(hops)
+
+            ratio = len(delivered) / args.messages
+            mean_hops = sum(delivered) / len(delivered) if delivered else 0
+            heartbeat_rate = vector_bytes / (rounds + 2) / n / HEARTBEAT_INTERVAL  # includes the two quiet rounds
+            # Extra airtime per delivered message versus a single direct frame
+            direct = args.payload + FRAME_OVERHEAD
+            relayed = mean_hops * (direct + RELAY_HEADER)
+            overhead = (relayed / direct - 1) * 100 if delivered else 0
+            print(f"{name:<8} {n:>5} {rounds:>6} {rounds * HEARTBEAT_INTERVAL:>8.0f} {ratio * 100:>7.1f} "
+                  f"{mean_hops:>5.2f} {mean_hops * HOP_LATENCY * 1000:>8.1f} {heartbeat_rate:>12.1f} {overhead:>10.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import glob
+import os
+import tempfile
+import time
+from transport import SimulatedMedium, SimulatedTransport
+from crypto_utils import TicketCache
+from dedup import ChunkStore
+from peer import Me, CHUNK_SIZE
+
+def run(probing: bool, max_frame: int, args):
+    '''
+    Sends one file over a link that drops frames longer than max_frame,
+    resending (which resumes with the missing chunks) until it arrives.
+    Returns (seconds, rounds, chunk size used, delivered).
+    '''
+    medium = SimulatedMedium(args.seed)
+    link = dict(loss=args.loss, rate=args.frame_rate, byte_rate=args.byte_rate, max_frame=max_frame)
+    alice = Me('alice', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:01',
+               transports=[SimulatedTransport(medium, 'a0', **link)], chunk_store=ChunkStore('store_a'),
+               mtu_probing=probing, pacing=args.pacing)
+    bob = Me('bob', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:02',
+             transports=[SimulatedTransport(medium, 'b0', **link)], chunk_store=ChunkStore('store_b'),
+             mtu_probing=probing, pacing=args.pacing)
+    bob.start()
+    alice.start()
+    # Handshake, then the probe
+    deadline = time.time() + 5
+    while time.time() < deadline and not ('bob' in alice.known_peers and (
+            not probing or 'mtu_probed' in alice.known_peers['bob'])):
+        time.sleep(0.05)
+
+    with open('payload.bin', 'wb') as f:
+        f.write(os.urandom(args.size))
+    for path in glob.glob('received_payload*'):
+        os.remove(path)
+    start_time = time.perf_counter()
+    rounds = 0
+    while not glob.glob('received_payload*') and rounds < args.max_rounds:
+        rounds += 1
+        alice.send_file('bob', 'payload.bin')
+        # Wait for FILE_ACK, which comes after the receiver has saved or checkpointed the file
+        deadline = time.time() + 5
+        while 'expected_ack' in alice.known_peers['bob'] and time.time() < deadline:
+            time.sleep(0.01)
+    elapsed = time.perf_counter() - start_time
+    chunk_size = alice.known_peers['bob'].get('chunk_size', CHUNK_SIZE)
+    return elapsed, rounds, chunk_size, bool(glob.glob('received_payload*'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark file goodput with fixed and probed chunk sizes.')
+    parser.add_argument('--size', type=int, default=1_000_000, help='file size in bytes')
+    parser.add_argument('--max-frames', default='1500,2304,4000', help='largest frame each link delivers')
+    parser.add_argument('--frame-rate', type=float, default=1000, help='per-frame airtime as frames per second')
+    parser.add_argument('--byte-rate', type=float, default=2_000_000, help='airtime per byte as bytes per second')
+    parser.add_argument('--loss', type=float, default=0.01, help='random frame loss on the air')
+    parser.add_argument('--max-rounds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--unpaced', dest='pacing', action='store_false', help='turn off AIMD pacing')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    results = []
+    for max_frame in map(int, args.max_frames.split(',')):
+        for probing in (False, True):
+            os.chdir(tempfile.mkdtemp())
+            results.append((max_frame, probing) + run(probing, max_frame, args))
+
+    print(f'\n{"max frame":>9} {"chunks":<7} {"chunk B":>7} {"rounds":>6} {"goodput":>12}')
+    for max_frame, probing, elapsed, rounds, chunk_size, delivered in results:
+        goodput = f'{args.size / elapsed / 1000:.1f} kB/s' if delivered else 'not delivered'
+        print(f'{max_frame:>9} {"probed" if probing else "fixed":<7} {chunk_size:>7} {rounds:>6} {goodput:>12}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import glob
+import os
+import tempfile
+import time
+from transport import SimulatedMedium, SimulatedTransport
+from crypto_utils import TicketCache
+from dedup import ChunkStore
+from peer import Me
+
+def run(pacing: bool, args):
+    '''
+    Sends one file from a fast sender to a receiver that can only process
+    args.process_rate frames per second, resending (which resumes with the
+    missing chunks) until it arrives. Returns (seconds, rounds, frames
+    sent, final pacing rate, loss estimate).
+    '''
+    medium = SimulatedMedium(args.seed)
+    sender_link = SimulatedTransport(medium, 'a0', loss=args.loss, rate=args.link_rate)
+    alice = Me('alice', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:01',
+               transports=[sender_link], chunk_store=ChunkStore('store_a'), pacing=pacing)
+    bob = Me('bob', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:02',
+             transports=[SimulatedTransport(medium, 'b0', process_rate=args.process_rate,
+                                            inbox_limit=args.inbox)],
+             chunk_store=ChunkStore('store_b'), pacing=pacing)
+    bob.start()
+    alice.start()
+    time.sleep(0.5)
+
+    with open('payload.bin', 'wb') as f:
+        f.write(os.urandom(args.size))
+    start_time = time.perf_counter()
+    rounds = 0
+    while not glob.glob('received_payload*') and rounds < args.max_rounds:
+        rounds += 1
+        alice.send_file('bob', 'payload.bin')
+        # Wait for FILE_ACK, which comes after the receiver has saved or checkpointed the file
+        deadline = time.time() + 5
+        while 'expected_ack' in alice.known_peers['bob'] and time.time() < deadline:
+            time.sleep(0.01)
+    elapsed = time.perf_counter() - start_time
+    pacer = alice.pacers[bob.mac]
+    return elapsed, rounds, alice.link_stats['a0']['frames_sent'], pacer.rate, pacer.loss
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark file goodput with and without AIMD pacing.')
+    parser.add_argument('--size', type=int, default=300_000, help='file size in bytes')
+    parser.add_argument('--link-rate', type=float, default=2000, help='sender link rate in frames per second')
+    # Well below the sender, so the receiver is the bottleneck
+    parser.add_argument('--process-rate', type=float, default=80, help='frames per second the receiver handles')
+    parser.add_argument('--inbox', type=int, default=64, help='receiver capture buffer in frames')
+    parser.add_argument('--loss', type=float, default=0.01, help='random frame loss on the air')
+    parser.add_argument('--max-rounds', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--unpaced', action='store_true', help='send as fast as the link allows')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    elapsed, rounds, frames, rate, loss = run(not args.unpaced, args)
+    label = 'unpaced' if args.unpaced else 'AIMD paced'
+    rate_text = f'{rate / 1000:.0f} kB/s' if rate else 'unlimited'
+    print(f'\n{label}: {args.size} bytes in {elapsed:.1f} s over {rounds} rounds, {frames} frames sent')
+    print(f'goodput {args.size / elapsed / 1000:.1f} kB/s, final rate {rate_text}, loss estimate {loss * 100:.1f}%')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import os
+import struct
+import threading
+import time
+from frames import build_frame
+from enums import MsgType
+from packet_ring import SOL_PACKET
+from transport import PacketTransport
+
+PACKET_STATISTICS = 6
+
+def run(iface: str, rings: bool, frames: list, batch: int):
+    '''
+    Floods prebuilt frames from one packet socket to another on iface and
+    returns (seconds spent sending, frames received, kernel drops, sender
+    and receiver transports).
+    '''
+    receiver = PacketTransport(iface, rings)
+    sender = PacketTransport(iface, rings)
+    receiver.open()
+    sender.open_sender()
+    received = [0]
+    marker = frames[-1]
+    done = threading.Event()
+
+    def on_frame(frame):
+        received[0] += 1
+        if frame == marker:
+            done.set()
+    threading.Thread(target=receiver.listen, args=(on_frame,), daemon=True).start()
+
+    start_time = time.perf_counter()
+    if rings:
+        for i in range(0, len(frames), batch):
+            sender.send_batch(frames[i:i + batch])
+    else:
+        for frame in frames:
+            sender.send(frame)
+    elapsed = time.perf_counter() - start_time
+    done.wait(2)  # the last frame may have been dropped
+    # tpacket_stats: frames seen, frames dropped because we weren't reading fast enough
+    _, drops = struct.unpack('=II', receiver.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12)[:8])
+    return elapsed, received[0], drops, sender, receiver
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark packet socket frame rates with and without rings.')
+    parser.add_argument('--iface', default='lo', help='interface to flood (lo or one end of a veth pair)')
+    parser.add_argument('--frames', type=int, default=50_000)
+    parser.add_argument('--size', type=int, default=1000, help='payload bytes per frame')
+    parser.add_argument('--batch', type=int, default=32, help='frames per send_batch call')
+    parser.add_argument('--plain', action='store_true', help='one send and one recv per frame')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size // 2).hex()
+    frames = [build_frame(MsgType.FILE_CHUNK, 1, seq, data, '02:00:00:00:00:02', '02:00:00:00:00:01')
+              for seq in range(args.frames)]
+    elapsed, received, drops, sender, receiver = run(args.iface, not args.plain, frames, args.batch)
+
+    label = 'send/recv per frame' if args.plain else 'RX ring + sendmmsg'
+    print(f'{label}: {args.frames} frames sent in {elapsed:.2f} s ({args.frames / elapsed:.0f} frames/s)')
+    print(f'  send syscalls per frame  {sender.send_calls / sender.frames_sent:.3f}')
+    print(f'  recv syscalls per frame  {receiver.recv_calls / max(received, 1):.3f}')
+    print(f'  received {received} ({received / args.frames * 100:.0f}%), dropped by the kernel {drops}')
+
+if __name__ == '__main__':
+    main()
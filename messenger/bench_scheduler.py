@@ -0,0 +1,77 @@
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+import peer
+import scheduler
+from transport import SimulatedMedium, SimulatedTransport
+from crypto_utils import TicketCache
+from peer import Me
+
+def run(fifo: bool, rate: float, file_size: int, interval: float):
+    '''
+    Sends chat messages every interval seconds, first on an idle link and
+    then during a file transfer. Returns (idle latencies, busy latencies) in
+    milliseconds.
+    '''
+    if fifo:
+        # Model the old inline sends: one FIFO the depth of a driver TX queue
+        peer.frame_priority = lambda msg_type: scheduler.BULK
+        scheduler.BULK_QUEUE_LIMIT = 1000
+
+    medium = SimulatedMedium(1)
+    alice = Me('alice', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:01',
+               transports=[SimulatedTransport(medium, 'a0', rate=rate)])
+    bob = Me('bob', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:02',
+             transports=[SimulatedTransport(medium, 'b0', rate=rate)])
+    latencies = []
+    bob.register_message_listener(lambda sender, text: latencies.append((time.time() - float(text)) * 1000))
+    bob.start()
+    alice.start()
+    time.sleep(0.5)
+
+    def chat(count):
+        for _ in range(count):
+            alice.send_message('bob', f'{time.time():.6f}')
+            time.sleep(interval)
+
+    chat(20)
+    time.sleep(0.5)
+    idle = latencies[:]
+    latencies.clear()
+
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(os.urandom(file_size))
+        f.flush()
+        transfer = threading.Thread(target=alice.send_file, args=('bob', f.name))
+        transfer.start()
+        time.sleep(0.2)
+        chat(int(file_size / 1000 / rate / interval * 0.8))
+        transfer.join()
+    time.sleep(0.5)
+    return idle, latencies[:]
+
+def summary(values):
+    if not values:
+        return 'no messages delivered'
+    values = sorted(values)
+    return (f'{len(values):>3} msgs  p50 {statistics.median(values):7.1f} ms  '
+            f'p95 {values[int(len(values) * 0.95) - 1]:7.1f} ms  max {values[-1]:7.1f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chat latency during a file transfer.')
+    parser.add_argument('--fifo', action='store_true', help='baseline: every frame through one FIFO queue')
+    parser.add_argument('--rate', type=float, default=400, help='link rate in frames per second')
+    parser.add_argument('--size', type=int, default=2_000_000, help='file size in bytes')
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between chat messages')
+    args = parser.parse_args()
+
+    idle, busy = run(args.fifo, args.rate, args.size, args.interval)
+    print(f'\n{"FIFO" if args.fifo else "priority scheduler"} at {args.rate:.0f} frames/s:')
+    print(f'  idle link:      {summary(idle)}')
+    print(f'  during a file:  {summary(busy)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+def child(eager_scapy: bool):
+    '''
+    Runs in a fresh interpreter: imports the peer, starts it on a simulated
+    medium and prints (time imports finished, time its first announcement
+    was on the air).
+    '''
+    if eager_scapy:
+        import scapy.all  # what importing peer used to cost
+    from transport import SimulatedMedium, SimulatedTransport
+    from crypto_utils import TicketCache
+    from peer import Me
+    imported = time.time()
+
+    medium = SimulatedMedium()
+    observer = SimulatedTransport(medium, 'observer')
+    me = Me('bench', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:01',
+            transports=[SimulatedTransport(medium, 'b0')])
+    me.start()
+    observer.inbox.get()  # the startup HANDSHAKE_REQ; HEARTBEATs follow every 5 s
+    print(imported, time.time(), flush=True)
+    os._exit(0)
+
+def run(eager_scapy: bool):
+    '''
+    Returns (seconds to import, seconds to first heartbeat) from process start.
+    '''
+    command = [sys.executable, os.path.abspath(__file__), '--child']
+    if eager_scapy:
+        command.append('--eager-scapy')
+    start_time = time.time()
+    output = subprocess.run(command, capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    imported, first_frame = map(float, output.split()[-2:])
+    return imported - start_time, first_frame - start_time
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark peer startup: process start to first heartbeat.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--eager-scapy', action='store_true', help='baseline: import scapy.all up front')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.eager_scapy)
+
+    results = [run(args.eager_scapy) for _ in range(args.runs)]
+    imports, heartbeats = zip(*results)
+    label = 'eager scapy import' if args.eager_scapy else 'lazy scapy import'
+    print(f'{label}, median of {args.runs} runs:')
+    print(f'  imports done      {statistics.median(imports) * 1000:7.0f} ms')
+    print(f'  first heartbeat   {statistics.median(heartbeats) * 1000:7.0f} ms')
+
+if __name__ == '__main__':
+    main()
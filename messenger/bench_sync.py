@@ -0,0 +1,110 @@
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import time
+from clock import VirtualClock
+from crypto_utils import TicketCache
+from enums import MsgType
+from frames import parse_frame
+from history import MessageHistory
+from history_sync import HistorySync, pack
+from outbox import MessageOutbox
+from peer import Me
+from simulation import VirtualMedium, VirtualTransport
+
+SYNC_TYPES = {MsgType.HISTORY_SYNC, MsgType.HISTORY_BULK}
+
+class CountingMedium(VirtualMedium):
+    '''
+    A single cell that counts the history frames and bytes put on the air.
+    '''
+    def __init__(self, clock, rng):
+        super().__init__(clock, rng)
+        self.frames = {msg_type: 0 for msg_type in SYNC_TYPES}
+        self.bytes = 0
+
+    def broadcast(self, sender, frame):
+        msg_type = MsgType(int(parse_frame(frame)[3][3:5]))
+        if msg_type in SYNC_TYPES:
+            self.frames[msg_type] += 1
+            self.bytes += len(frame)
+        super().broadcast(sender, frame)
+
+def conversation(me, history, peer):
+    '''
+    The conversation's (sender, text) pairs, with 'me' resolved to a name.
+    '''
+    history.flush()
+    return sorted((me.name if sender == 'me' else sender, text) for sender, _, text in history.conversation(peer))
+
+def matching(alice, alice_history, bob, bob_history):
+    return conversation(alice, alice_history, 'bob') == conversation(bob, bob_history, 'alice')
+
+def run(messages: int, missing: int, seed: int, directory: str):
+    '''
+    alice and bob share messages of history, then each lacks missing / 2
+    of the other's, before they meet again. Returns (sync frames, bulk
+    frames, bytes, virtual seconds until both logs match, whether they do,
+    bulk frames sending bob the whole conversation would take).
+    '''
+    random.seed(seed)
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    medium = CountingMedium(clock, rng)
+    nodes = []
+    for i, name in enumerate(('alice', 'bob')):
+        me = Me(name, tickets=TicketCache(os.devnull), mac=f'02:00:00:00:00:0{i + 1}',
+                transports=[VirtualTransport(medium, name)], mtu_probing=False,
+                outbox=MessageOutbox(None, clock), clock=clock)
+        history = MessageHistory(os.path.join(directory, f'{name}-{messages}-{missing}.db'))
+        nodes.append((me, history, HistorySync(me, history)))
+    (alice, alice_history, _), (bob, bob_history, _) = nodes
+    start = clock.time() - messages
+    for i in range(messages + missing):
+        sender = rng.choice(('alice', 'bob'))
+        text = f'message {i} ' + 'x' * rng.randint(10, 120)
+        ts = start + i
+        lost = i >= messages and (i - messages) % 2  # every other message after the gap reached only one side
+        for me, history, _ in nodes:
+            if lost and me is not (alice if sender == 'alice' else bob):
+                continue
+            own = sender == me.name
+            history.add('bob' if me is alice else 'alice', 'me' if own else sender, text, ts)
+
+    for me, _, _ in nodes:
+        me.start()
+    converged = None
+    clock.run(clock.time() + 1)
+    while clock.time() - start - messages < 120:
+        clock.run(clock.time() + 1)
+        if matching(alice, alice_history, bob, bob_history):
+            converged = clock.time() - start - messages
+            break
+    clock.run(clock.time() + 30)  # the initiator's recheck
+    return (medium.frames[MsgType.HISTORY_SYNC], medium.frames[MsgType.HISTORY_BULK], medium.bytes, converged,
+            matching(alice, alice_history, bob, bob_history),
+            len(pack([list(message) for message in alice_history.conversation('bob')])))
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure history reconciliation cost against history length.')
+    parser.add_argument('--messages', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--missing', type=int, nargs='+', default=[0, 10, 100])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    print(f'{"history":>8} {"missing":>8} {"sync frames":>12} {"bulk frames":>12} {"bytes":>9} {"full copy":>10}  converged')
+    for messages in args.messages:
+        for missing in args.missing:
+            cpu_start = time.process_time()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                sync_frames, bulk_frames, total, converged, equal, full = run(messages, missing, args.seed, directory)
+            cpu = time.process_time() - cpu_start
+            when = f'after {converged:.1f} s' if converged is not None else 'never'
+            print(f'{messages:>8} {missing:>8} {sync_frames:>12} {bulk_frames:>12} {total:>9} {full:>10}  '
+                  f'{when}{"" if equal else " (logs differ)"}, {cpu:.1f} s CPU', flush=True)
+
+if __name__ == '__main__':
+    main()
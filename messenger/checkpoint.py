@@ -0,0 +1,187 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+
+PARTIAL_DIR = 'partial_transfers'  # where incoming files live until they are complete
+CHECKPOINT_EVERY = 64  # chunks written between checkpoint saves
+
+def encode_ranges(ranges) -> str:
+    '''
+    Formats [(start, end), ...] inclusive index ranges as "0-4,9,12-15".
+    '''
+    return ','.join(f'{start}-{end}' if end > start else str(start) for start, end in ranges)
+
+def index_ranges(indexes):
+    '''
+    Collapses a collection of indexes into sorted inclusive ranges.
+    '''
+    ranges = []
+    for index in sorted(indexes):
+        if ranges and index == ranges[-1][1] + 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return [tuple(r) for r in ranges]
+
+def decode_ranges(text: str, limit: int = None):
+    '''
+    Parses "0-4,9,12-15" back into a set of indexes, leaving out any at or
+    above limit. Raises ValueError if it is malformed.
+    '''
+    indexes = set()
+    for part in text.split(',') if text else []:
+        start, _, end = part.partition('-')
+        end = int(end or start) + 1
+        indexes.update(range(int(start), end if limit is None else min(end, limit)))
+    return indexes
+
+class PartialFile:
+    '''
+    An incoming file written chunk by chunk straight to disk, with a bitmap
+    of the chunks received so far. The bitmap is checkpointed to a JSON file
+    next to the partial file, so a transfer interrupted by a TERMINATE, a
+    timeout or a restart can resume with only the missing chunks.
+
+    The SHA-256 of the file is computed as the contiguous prefix of received
+    chunks grows, so verifying a complete file needs no second pass.
+    '''
+    def __init__(self, key: str, filename: str, size: int, chunk_size: int,
+                 sha256: str = None, directory: str = PARTIAL_DIR):
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.sha256 = sha256
+        self.num_chunks = (size + chunk_size - 1) // chunk_size
+        self.data_path = os.path.join(directory, f'{key}.part')
+        self.checkpoint_path = os.path.join(directory, f'{key}.json')
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.bitmap = bytearray((self.num_chunks + 7) // 8)
+        self.received = 0
+        self.load_checkpoint()
+        self.fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.unsaved = 0
+
+        self.hasher = hashlib.sha256()
+        self.hashed = 0  # chunks folded into hasher, always a prefix of the file
+        with self.lock:
+            self.advance_hash()
+
+    def load_checkpoint(self):
+        '''
+        Restores the bitmap of an earlier attempt at the same file, if the
+        checkpoint matches its size and chunk size.
+        '''
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (checkpoint.get('size') != self.size or checkpoint.get('chunk_size') != self.chunk_size
+                or not os.path.exists(self.data_path)):
+            return
+        bitmap = base64.b64decode(checkpoint['bitmap'])
+        if len(bitmap) == len(self.bitmap):
+            self.bitmap = bytearray(bitmap)
+            self.received = sum(bin(b).count('1') for b in self.bitmap)
+
+    def save_checkpoint(self):
+        '''
+        Writes the bitmap after syncing the data it describes, so the
+        checkpoint never claims a chunk that isn't on disk.
+        '''
+        os.fsync(self.fd)
+        checkpoint = {
+            'filename': self.filename,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'sha256': self.sha256,
+            'bitmap': base64.b64encode(self.bitmap).decode('ascii'),
+        }
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self.unsaved = 0
+
+    def has(self, index: int) -> bool:
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def read_chunk(self, index: int) -> bytes:
+        length = min(self.chunk_size, self.size - index * self.chunk_size)
+        return os.pread(self.fd, length, index * self.chunk_size)
+
+    def write_chunk(self, index: int, data: bytes):
+        '''
+        Stores one chunk at its offset. Chunks already on disk are ignored.
+        '''
+        if not 0 <= index < self.num_chunks:
+            return
+        with self.lock:
+            if self.has(index):
+                return
+            os.pwrite(self.fd, data, index * self.chunk_size)
+            self.bitmap[index >> 3] |= 1 << (index & 7)
+            self.received += 1
+            self.unsaved += 1
+            if index == self.hashed:
+                self.hasher.update(data)
+                self.hashed += 1
+            self.advance_hash()
+            if self.unsaved >= CHECKPOINT_EVERY:
+                self.save_checkpoint()
+
+    def advance_hash(self):
+        while self.hashed < self.num_chunks and self.has(self.hashed):
+            self.hasher.update(self.read_chunk(self.hashed))
+            self.hashed += 1
+
+    @property
+    def complete(self) -> bool:
+        return self.received == self.num_chunks
+
+    def verified(self) -> bool:
+        '''
+        True if the file is complete and matches the sender's hash (or the
+        sender didn't send one).
+        '''
+        return self.complete and (self.sha256 is None or self.hasher.hexdigest() == self.sha256)
+
+    def missing_ranges(self):
+        '''
+        Returns the chunk indexes not yet received as inclusive ranges.
+        '''
+        return index_ranges(i for i in range(self.num_chunks) if not self.has(i))
+
+    def close(self):
+        '''
+        Keeps the partial file and its checkpoint for a later resume.
+        '''
+        with self.lock:
+            if self.fd is None:
+                return
+            self.save_checkpoint()
+            os.close(self.fd)
+            self.fd = None
+
+    def finish(self, path: str):
+        '''
+        Moves the complete file to path and drops the checkpoint.
+        '''
+        with self.lock:
+            os.close(self.fd)
+            self.fd = None
+            os.replace(self.data_path, path)
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+
+    def discard(self):
+        with self.lock:
+            os.close(self.fd)
+            self.fd = None
+            for path in (self.data_path, self.checkpoint_path):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,100 @@
+import heapq
+import itertools
+import threading
+import time
+
+VIRTUAL_EPOCH = 1_700_000_000.0  # where virtual time starts, so timestamps look like real ones
+
+class Clock:
+    '''
+    Real time. Everything in Me that reads the time, waits or schedules
+    something later goes through a clock, so a simulation can swap in a
+    VirtualClock and run faster than real time.
+    '''
+    virtual = False  # True when there are no threads and call_later events drive everything
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        '''
+        Waits up to timeout seconds for event to be set, and returns whether
+        it was.
+        '''
+        return event.wait(timeout)
+
+    def call_later(self, delay: float, fn, *args):
+        '''
+        Runs fn(*args) after delay seconds, on a thread of its own.
+        '''
+        timer = threading.Timer(delay, fn, args)
+        timer.daemon = True
+        timer.start()
+
+REAL_CLOCK = Clock()
+
+class VirtualClock(Clock):
+    '''
+    Simulated time for discrete-event runs. Nothing waits: call_later puts
+    an event on a heap, and run() takes them off in time order (events due
+    at the same time in the order they were scheduled), jumping the clock
+    to each one. sleep() in an event moves the clock forward, as if the
+    handler took that long. With no threads involved, a run depends only on
+    the events, so it repeats exactly.
+    '''
+    virtual = True
+
+    def __init__(self, start: float = VIRTUAL_EPOCH):
+        self.now = start
+        self.events = []  # (time, sequence, fn, args) heap
+        self.sequence = itertools.count()
+        self.processed = 0
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        '''
+        Runs events for up to timeout seconds, stopping early once one of
+        them sets event. Only for callers outside run(), like a script or a
+        command: an event handler waiting this way would run other events
+        in the middle of its own.
+        '''
+        if not event.is_set():
+            self.run(self.now + timeout, event.is_set)
+        return event.is_set()
+
+    def call_later(self, delay: float, fn, *args):
+        self.call_at(self.now + delay, fn, *args)
+
+    def call_at(self, when: float, fn, *args):
+        heapq.heappush(self.events, (when, next(self.sequence), fn, args))
+
+    def run(self, until: float, done=None):
+        '''
+        Runs every event due up to until (a virtual timestamp), then leaves
+        the clock there. If done() turns true after an event, stops there
+        instead.
+        '''
+        events = self.events
+        while events and events[0][0] <= until:
+            when, _, fn, args = heapq.heappop(events)
+            if when > self.now:
+                self.now = when
+            fn(*args)
+            self.processed += 1
+            if done is not None and done():
+                return
+        self.now = max(self.now, until)
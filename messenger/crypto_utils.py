@@ -1,6 +1,16 @@
 from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.DH import key_agreement
+from Crypto.Protocol.KDF import HKDF
+from Crypto.PublicKey import ECC
 from Crypto.Util.Padding import pad, unpad
+from Crypto.Util.strxor import strxor
 import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
 
 # symmetric key (32 bytes for AES-256)
 AES_KEY = b'Kx9#mP2$vL8@nQ5!wR7&tY4^uI6*oE3%'
@@ -40,3 +50,303 @@ def decrypt_data(encrypted_b64: str) -> str:
         return plaintext.decode('utf-8')
     except Exception as e:
         raise ValueError(f"Decryption error: {e}")
+
+
+# --- Per-peer session keys ---
+
+SESSION_REKEY_FRAMES = 1000  # a sender moves to the next key epoch after this many frames
+TICKETS_PATH = 'session_tickets.json'
+SESSION_TICKET_LIFETIME = 24 * 60 * 60  # resumption tickets expire after a day
+SESSION_PREFIX = '$'  # marks session-encrypted data ('$' never appears in base64)
+BLOCK_INDEXES = [i.to_bytes(2, 'big') for i in range(4096)]  # per-block counter suffixes, up to 64 KiB frames
+SESSION_TAG_BYTES = 4  # truncated tag, a cheap prefilter checked before a frame is decoded
+SESSION_MAC_BYTES = 16  # full MAC over the header, counter and ciphertext, checked before decrypting
+MAX_EPOCH_SKIP = 1  # epochs tried on either side of the newest verified one, without deriving further
+REPLAY_WINDOW = 64  # counters this far behind a direction's highest are still accepted once, for reordering
+
+def generate_keypair():
+    """
+    Generates an ephemeral P-256 key pair for the ECDH handshake.
+    """
+    return ECC.generate(curve='P-256')
+
+def export_public_key(key) -> str:
+    """
+    Returns the compressed public point of a key pair, base64-encoded.
+    """
+    return base64.b64encode(key.public_key().export_key(format='SEC1', compress=True)).decode('ascii')
+
+def derive_session_secret(own_key, peer_public_b64: str) -> tuple:
+    """
+    Runs ECDH against a peer's public key and returns (session_key,
+    resumption_secret). Both sides get the same values since the salt is
+    built from the two public keys in sorted order.
+    """
+    peer_public_raw = base64.b64decode(peer_public_b64.encode('ascii'))
+    peer_public = ECC.import_key(peer_public_raw, curve_name='P-256')
+    shared = key_agreement(static_priv=own_key, static_pub=peer_public, kdf=lambda z: z)
+
+    own_public_raw = own_key.public_key().export_key(format='SEC1', compress=True)
+    salt = b''.join(sorted([own_public_raw, peer_public_raw]))
+    session_key, resumption_secret = HKDF(shared, 32, salt, SHA256, 2, context=b'GhostFrames session')
+    return session_key, resumption_secret
+
+def derive_resumed_session(resumption_secret: bytes, nonce_a: bytes, nonce_b: bytes) -> bytes:
+    """
+    Derives a fresh session key from a stored resumption secret and the two
+    handshake nonces, skipping ECDH entirely.
+    """
+    salt = b''.join(sorted([nonce_a, nonce_b]))
+    return HKDF(resumption_secret, 32, salt, SHA256, context=b'GhostFrames resume')
+
+def frame_header(msg_type, msg_id: int, seq: int) -> bytes:
+    """
+    The type|msg_id|seq of a frame as the session tag covers it, so a body
+    can't be replayed under another header.
+    """
+    return f"{int(msg_type)}|{msg_id}|{seq}|".encode()
+
+def ticket_id(resumption_secret: bytes) -> str:
+    """
+    Short public identifier for a resumption secret.
+    """
+    return SHA256.new(resumption_secret).hexdigest()[:8]
+
+class Session:
+    '''
+    Per-peer AES-256-CTR session. The AES key schedule is set up once per key
+    epoch and reused for every frame; the nonce is the sender's MAC plus a
+    frame counter, so the two directions never share a keystream. After
+    SESSION_REKEY_FRAMES frames the sender ratchets to the next epoch key.
+
+    Each frame carries a keyed BLAKE2s tag of its header (frame_header)
+    and encoded body, truncated to SESSION_TAG_BYTES. Checking it is one C
+    call over the text as received, so nearly all frames forged by a node
+    without the key are dropped before any base64 decoding or AES. The tag
+    is only that prefilter: the body ends in a full SESSION_MAC_BYTES MAC
+    of the header, counter and ciphertext, checked before decrypting.
+
+    A receiver tries an epoch at most MAX_EPOCH_SKIP from the newest one
+    it has verified a frame under. A next epoch's key is derived aside and
+    only enters the chain, which then drops the older epochs, once a frame
+    under it has verified. A counter is accepted once per direction and
+    epoch: frames at or below the highest seen by more than REPLAY_WINDOW,
+    or already seen, are replays.
+    '''
+    def __init__(self, key: bytes, resumed: bool = False):
+        self.key = key
+        self.resumed = resumed
+        self.chains = {}  # sender_mac -> {epoch: key}, one ratchet per direction
+        # (sender_mac, epoch) -> (AES-ECB keystream generator, keyed tag hash, keyed MAC hash, key)
+        self.ciphers = {}
+        self.candidates = {}  # (sender_mac, epoch) -> cipher of an epoch ahead of the chain, not yet verified
+        self.tx_epoch = 0
+        self.tx_counter = 0
+        self.windows = {}  # (sender_mac, epoch) -> [highest counter, bitmap of the window below it]
+        self.lock = threading.Lock()
+
+    def cipher_for(self, sender_mac: str, epoch: int):
+        '''
+        Returns the (cipher, tag hash, MAC hash, key) for one direction and
+        epoch. An epoch ahead of the chain is derived from its newest key
+        without changing the chain; commit() keeps it.
+        '''
+        cipher = self.ciphers.get((sender_mac, epoch)) or self.candidates.get((sender_mac, epoch))
+        if cipher is not None:
+            return cipher
+
+        chain = self.chains.get(sender_mac) or {0: self.key}
+        newest = max(chain)
+        if epoch > newest + MAX_EPOCH_SKIP:
+            raise ValueError(f"Key epoch {epoch} is too far ahead")
+        if epoch < newest and epoch not in chain:
+            raise ValueError(f"Key epoch {epoch} has been discarded")
+        key = chain.get(epoch)
+        if key is None:
+            key, e = chain[newest], newest
+            while e < epoch:
+                key = HKDF(key, 32, b'', SHA256, context=b'GhostFrames rekey')
+                e += 1
+        tag_key, mac_key = HKDF(key, 32, b'', SHA256, 2, context=b'GhostFrames tag')
+        prefix = bytes.fromhex(sender_mac.replace(':', ''))
+        cipher = (AES.new(key, AES.MODE_ECB),
+                  hashlib.blake2s(prefix, digest_size=SESSION_TAG_BYTES, key=tag_key),
+                  hashlib.blake2s(prefix, digest_size=SESSION_MAC_BYTES, key=mac_key),
+                  key)
+        if epoch in chain:
+            self.ciphers[(sender_mac, epoch)] = cipher
+        else:
+            self.candidates[(sender_mac, epoch)] = cipher
+        return cipher
+
+    def confirmed(self, peer_mac: str) -> bool:
+        '''
+        True once a frame from peer_mac has verified under this session, so
+        the peer holds it too.
+        '''
+        return peer_mac in self.chains
+
+    def commit(self, sender_mac: str, epoch: int):
+        '''
+        Moves sender_mac's chain on to an epoch a frame has been verified
+        (or, for our own direction, sent) under, and drops the epochs more
+        than MAX_EPOCH_SKIP behind it. Called with the lock held.
+        '''
+        chain = self.chains.setdefault(sender_mac, {0: self.key})
+        if epoch in chain:
+            return
+        cipher = self.candidates.pop((sender_mac, epoch))
+        chain[epoch] = cipher[3]
+        self.ciphers[(sender_mac, epoch)] = cipher
+        for old in [k for k in chain if k < epoch - MAX_EPOCH_SKIP]:
+            del chain[old]
+            self.ciphers.pop((sender_mac, old), None)
+            self.windows.pop((sender_mac, old), None)
+        for key in [key for key in self.candidates if key[0] == sender_mac and key[1] <= epoch]:
+            del self.candidates[key]
+
+    def keystream_xor(self, epoch: int, sender_mac: str, counter: int, data: bytes) -> bytes:
+        prefix = bytes.fromhex(sender_mac.replace(':', '')) + counter.to_bytes(8, 'big')
+        blocks = (len(data) + AES.block_size - 1) // AES.block_size
+        counter_blocks = prefix + prefix.join(BLOCK_INDEXES[:blocks]) if blocks else b''
+        keystream = self.cipher_for(sender_mac, epoch)[0].encrypt(counter_blocks)
+        return strxor(data, keystream[:len(data)])
+
+    def tag(self, sender_mac: str, epoch: int, header: bytes, encoded: bytes) -> str:
+        tag_hash = self.cipher_for(sender_mac, epoch)[1].copy()
+        tag_hash.update(header)
+        tag_hash.update(encoded)
+        return tag_hash.hexdigest()
+
+    def mac(self, sender_mac: str, epoch: int, header: bytes, sealed: bytes) -> bytes:
+        mac_hash = self.cipher_for(sender_mac, epoch)[2].copy()
+        mac_hash.update(header)
+        mac_hash.update(sealed)
+        return mac_hash.digest()
+
+    def check_counter(self, sender_mac: str, epoch: int, counter: int):
+        '''
+        Records a counter received from sender_mac, raising ValueError if
+        it was seen before or is too old to tell. Called with the lock held.
+        '''
+        window = self.windows.get((sender_mac, epoch))
+        if window is None:
+            self.windows[(sender_mac, epoch)] = [counter, 1]
+            return
+        highest, seen = window
+        if counter > highest:
+            shift = counter - highest
+            window[0] = counter
+            window[1] = ((seen << shift) | 1) & ((1 << REPLAY_WINDOW) - 1) if shift < REPLAY_WINDOW else 1
+            return
+        offset = highest - counter
+        if offset >= REPLAY_WINDOW or seen >> offset & 1:
+            raise ValueError(f"replayed counter {counter} in epoch {epoch}")
+        window[1] = seen | 1 << offset
+
+    def encrypt(self, plaintext: str, sender_mac: str, header: bytes = b'') -> str:
+        '''
+        Encrypts with the next counter nonce and returns "$epoch.tag.base64".
+        header: the frame's frame_header, covered by the tag and the MAC.
+        '''
+        with self.lock:
+            if self.tx_counter >= SESSION_REKEY_FRAMES:
+                self.tx_epoch += 1
+                self.tx_counter = 0
+            epoch, counter = self.tx_epoch, self.tx_counter
+            self.tx_counter += 1
+            self.cipher_for(sender_mac, epoch)
+            self.commit(sender_mac, epoch)
+            sealed = counter.to_bytes(8, 'big') + self.keystream_xor(epoch, sender_mac, counter,
+                                                                     plaintext.encode('utf-8'))
+            encoded = base64.b64encode(sealed + self.mac(sender_mac, epoch, header, sealed))
+            tag = self.tag(sender_mac, epoch, header, encoded)
+        return f"{SESSION_PREFIX}{epoch}.{tag}.{encoded.decode('ascii')}"
+
+    def authentic(self, encrypted: str, sender_mac: str, header: bytes = b'') -> bool:
+        '''
+        Checks the truncated tag of "$epoch.tag.base64" data without
+        decoding it, or changing any state. False for forged frames, and
+        for frames under another key (a peer that restarted, or a session
+        still being set up).
+        '''
+        try:
+            epoch_str, tag, encoded = encrypted[len(SESSION_PREFIX):].split('.', 2)
+            with self.lock:
+                return hmac.compare_digest(tag, self.tag(sender_mac, int(epoch_str), header,
+                                                         encoded.encode('ascii')))
+        except (ValueError, TypeError):
+            return False
+
+    def decrypt(self, encrypted: str, sender_mac: str, header: bytes = b'') -> str:
+        '''
+        Decrypts "$epoch.tag.base64" data sent by the peer with the given
+        MAC under the given frame header, after checking its tag, its MAC
+        and that its counter is new.
+        '''
+        try:
+            epoch_str, tag, encoded = encrypted[len(SESSION_PREFIX):].split('.', 2)
+            epoch = int(epoch_str)
+            encoded = encoded.encode('ascii')
+            with self.lock:
+                if not hmac.compare_digest(tag, self.tag(sender_mac, epoch, header, encoded)):
+                    raise ValueError("bad tag (forged, or session key mismatch)")
+                raw = base64.b64decode(encoded)
+                sealed = raw[:-SESSION_MAC_BYTES]
+                if len(sealed) < 8 or not hmac.compare_digest(raw[-SESSION_MAC_BYTES:],
+                                                              self.mac(sender_mac, epoch, header, sealed)):
+                    raise ValueError("bad MAC (forged)")
+                counter = int.from_bytes(sealed[:8], 'big')
+                self.check_counter(sender_mac, epoch, counter)
+                self.commit(sender_mac, epoch)
+                body = self.keystream_xor(epoch, sender_mac, counter, sealed[8:])
+            return body.decode('utf-8')
+        except Exception as e:
+            raise ValueError(f"Session decryption error: {e}")
+
+class TicketCache:
+    '''
+    On-disk cache of resumption secrets, keyed by peer name, so a peer that
+    restarts can rejoin without a full ECDH.
+    '''
+    def __init__(self, path: str = TICKETS_PATH):
+        self.path = path
+        self.tickets = {}
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.tickets = json.load(f)
+        except (OSError, ValueError):
+            self.tickets = {}
+
+    def get(self, peer_name: str):
+        '''
+        Returns (ticket_id, resumption_secret) or None if there is no
+        unexpired ticket for this peer.
+        '''
+        entry = self.tickets.get(peer_name)
+        if not entry or entry['expires'] < time.time():
+            return None
+        return entry['ticket'], base64.b64decode(entry['secret'])
+
+    def ticket_ids(self, limit: int = 16):
+        '''
+        Returns the ids of the most recently issued valid tickets.
+        '''
+        now = time.time()
+        valid = [e for e in self.tickets.values() if e['expires'] >= now]
+        valid.sort(key=lambda e: e['expires'], reverse=True)
+        return [e['ticket'] for e in valid[:limit]]
+
+    def store(self, peer_name: str, resumption_secret: bytes):
+        with self.lock:
+            self.tickets[peer_name] = {
+                'ticket': ticket_id(resumption_secret),
+                'secret': base64.b64encode(resumption_secret).decode('ascii'),
+                'expires': time.time() + SESSION_TICKET_LIFETIME,
+            }
+            try:
+                with open(self.path, 'w') as f:
+                    json.dump(self.tickets, f)
+            except OSError as e:
+                print(f"Error saving session tickets: {e}")
@@ -0,0 +1,192 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+# Content-defined chunking for delta file transfers. Chunk boundaries come
+# from a hash of the 32 bytes before each position, so an insertion or
+# deletion only changes the chunks around it instead of shifting every
+# fixed-size chunk after it.
+#
+# Hashing every position in Python is far too slow, so the scan has two
+# stages. A one-bit-per-byte gear hash (each byte mapped to a bit with
+# bytes.translate) picks candidates wherever its last 6 bits match a fixed
+# pattern, found with bytes.find in C. Each candidate becomes a boundary if
+# the CRC-32 of its window has 7 low zero bits, for 1 in 8192 positions
+# overall.
+
+MIN_CHUNK = 2048
+MAX_CHUNK = 65536
+WINDOW = 32  # bytes hashed at each candidate boundary
+BOUNDARY_MASK = 0x7f  # CRC-32 bits that must be zero at a boundary
+HASH_BYTES = 16  # truncated SHA-256 identifying a chunk
+MANIFEST_ENTRIES_PER_FRAME = 30  # keeps each manifest frame under the chunk size
+
+STORE_DIR = 'chunk_store'
+STORE_MAX_BYTES = 256 * 1024 * 1024
+
+# Byte -> gear bit (as a 0/1 byte), and the bit pattern that marks a candidate
+GEAR_BITS = bytes(hashlib.sha256(bytes([b])).digest()[0] & 1 for b in range(256))
+CANDIDATE = bytes([1, 0, 0, 1, 1, 0])
+
+def chunk_boundaries(data: bytes):
+    '''
+    Returns the end offset of every content-defined chunk of data.
+    '''
+    bits = data.translate(GEAR_BITS)
+    ends = []
+    start = 0
+    while start < len(data):
+        limit = min(start + MAX_CHUNK, len(data))
+        pos = start + MIN_CHUNK - len(CANDIDATE)
+        while True:
+            found = bits.find(CANDIDATE, pos, limit)
+            if found == -1:
+                end = limit
+                break
+            end = found + len(CANDIDATE)
+            if not zlib.crc32(data[end - WINDOW:end]) & BOUNDARY_MASK:
+                break
+            pos = found + 1
+        ends.append(end)
+        start = end
+    return ends
+
+def chunk_hash(chunk: bytes) -> str:
+    return base64.urlsafe_b64encode(hashlib.sha256(chunk).digest()[:HASH_BYTES]).decode('ascii').rstrip('=')
+
+HASH_PATTERN = re.compile(r'[A-Za-z0-9_-]{%d}' % len(chunk_hash(b'')))  # what chunk_hash returns
+
+def check_hash(h: str) -> str:
+    '''
+    Returns h if it has the form of a chunk hash, so it's safe as a file
+    name in the store, and raises ValueError otherwise.
+    '''
+    if not HASH_PATTERN.fullmatch(h):
+        raise ValueError(f'Not a chunk hash: {h[:40]!r}')
+    return h
+
+def build_manifest(data: bytes):
+    '''
+    Splits data into content-defined chunks. Returns [(hash, offset, length)].
+    '''
+    entries = []
+    start = 0
+    for end in chunk_boundaries(data):
+        entries.append((chunk_hash(data[start:end]), start, end - start))
+        start = end
+    return entries
+
+def encode_manifest(entries):
+    '''
+    Returns manifest frame bodies of "hash.length" entries (length in hex).
+    '''
+    items = [f'{h}.{length:x}' for h, _, length in entries]
+    return [','.join(items[i:i + MANIFEST_ENTRIES_PER_FRAME])
+            for i in range(0, len(items), MANIFEST_ENTRIES_PER_FRAME)]
+
+def decode_manifest(body: str):
+    '''
+    Parses one manifest frame body into [(hash, length)]. Raises ValueError
+    if an entry isn't a chunk hash and a length up to MAX_CHUNK.
+    '''
+    entries = []
+    for item in body.split(',') if body else []:
+        h, _, length = item.partition('.')
+        length = int(length, 16)
+        if not 0 < length <= MAX_CHUNK:
+            raise ValueError(f'Bad chunk length: {length}')
+        entries.append((check_hash(h), length))
+    return entries
+
+class ChunkStore:
+    '''
+    On-disk store of chunks from earlier transfers, keyed by chunk hash and
+    bounded to max_bytes with least-recently-used eviction. Use order is
+    kept in file modification times so it survives a restart.
+    '''
+    def __init__(self, directory: str = STORE_DIR, max_bytes: int = STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.pinned = {}  # hash -> pin count; pinned chunks are promised to a sender and not evicted
+
+        files = []
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            stat = os.stat(os.path.join(directory, name))
+            files.append((stat.st_mtime, name, stat.st_size))
+        self.index = OrderedDict((name, size) for _, name, size in sorted(files))  # oldest first
+        self.total_bytes = sum(self.index.values())
+
+    def path(self, h: str) -> str:
+        return os.path.join(self.directory, check_hash(h))
+
+    def has(self, h: str) -> bool:
+        return h in self.index
+
+    def get(self, h: str) -> bytes:
+        with self.lock:
+            with open(self.path(h), 'rb') as f:
+                data = f.read()
+            self.index.move_to_end(h)
+            os.utime(self.path(h))
+            return data
+
+    def put(self, h: str, data: bytes):
+        '''
+        Stores data under h, which must be its chunk_hash.
+        '''
+        if chunk_hash(data) != h:
+            raise ValueError(f'Chunk does not match its hash {h}')
+        with self.lock:
+            if h in self.index:
+                self.index.move_to_end(h)
+                os.utime(self.path(h))
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(h), 'wb') as f:
+                f.write(data)
+            self.index[h] = len(data)
+            self.total_bytes += len(data)
+            self.evict()
+
+    def evict(self):
+        excess = self.total_bytes - self.max_bytes
+        victims = []
+        for h, size in self.index.items():
+            if excess <= 0:
+                break
+            if h not in self.pinned:
+                victims.append(h)
+                excess -= size
+        for h in victims:
+            self.total_bytes -= self.index.pop(h)
+            os.remove(self.path(h))
+
+    def pin(self, hashes):
+        with self.lock:
+            for h in hashes:
+                self.pinned[h] = self.pinned.get(h, 0) + 1
+
+    def unpin(self, hashes):
+        with self.lock:
+            for h in hashes:
+                count = self.pinned.get(h, 0) - 1
+                if count > 0:
+                    self.pinned[h] = count
+                else:
+                    self.pinned.pop(h, None)
+            self.evict()
+
+    def add_file(self, path: str):
+        '''
+        Chunks a file and stores every chunk, so later versions of it can be
+        sent as a delta.
+        '''
+        with open(path, 'rb') as f:
+            data = f.read()
+        for h, offset, length in build_manifest(data):
+            self.put(h, data[offset:offset + length])
@@ -14,7 +14,7 @@ class MsgType(IntEnum):
     RENAME_ACK    = 7  # none
 
     # File transfer
-    FILE_INIT     = 8  # filename|size
+    FILE_INIT     = 8  # filename|size|sha256|chunk_size
     FILE_CHUNK    = 9  # data
     FILE_END      = 10 # none
     FILE_ACK      = 11 # msg_id|[seqs]
@@ -22,3 +22,62 @@ class MsgType(IntEnum):
     # Control signals
     HEARTBEAT     = 12 # none
     TERMINATE     = 13 # none
+
+    # Group messaging (one broadcast frame per message)
+    GROUP_MSG     = 14 # group_id|member_macs|data
+    GROUP_ACK     = 15 # group_id|msg_id|member_index
+
+    # Mesh relaying
+    RELAY         = 16 # ttl|origin_mac|final_dst_mac|inner_type|inner_data
+
+    # Forward error correction for file transfers
+    FILE_PARITY   = 17 # block|block_size|parity_count|parity_index|chunk_size|data
+
+    # Resuming interrupted file transfers
+    FILE_RESUME   = 18 # msg_id|missing_chunk_ranges
+
+    # Delta file transfers
+    FILE_MANIFEST = 19 # seq 0: filename|size|sha256|frame_count, then hash.length,...
+    FILE_HAVE     = 20 # msg_id|needed_chunk_ranges
+
+    # Pacing feedback during file transfers
+    FILE_PROGRESS = 21 # msg_id|received_count|last_seq
+
+    # Path MTU discovery
+    MTU_PROBE     = 22 # size|padding (a FILE_CHUNK sized frame)
+    MTU_ACK       = 23 # probe_msg_id|size
+
+    # Latency probes (answered on a fast path, see Me.handle_ping)
+    PING          = 24 # sender_timestamp|padding
+    PONG          = 25 # the PING's data, echoed undecrypted
+
+    # Store-and-forward: messages queued while the peer was out of reach
+    MSG_BUNDLE    = 26 # JSON list of texts; answered with MSG_ACK
+
+    # Answer to a broadcast HANDSHAKE_REQ, from one peer for everyone (roster.py)
+    ROSTER        = 27 # joiner_mac|mac,public_key,name|...
+
+    # One heartbeat for several identities sharing a radio (identities.py)
+    HOST_HEARTBEAT = 28 # mac,mac,...
+
+    # History reconciliation after a peer rejoins (history_sync.py)
+    HISTORY_SYNC  = 29 # JSON {r: ranges to compare, k: key lists, d: in sync}
+    HISTORY_BULK  = 30 # JSON [[sender, ts, text], ...]
+
+class IpcOp(IntEnum):
+    # Requests from API processes to the radio daemon (radio_ipc.py)
+    SEND          = 1  # peer_id, text
+    RENAME        = 2  # name
+    NAME          = 3  # none
+    PEERS         = 4  # none
+    HISTORY       = 5  # query, peer, before, limit, offset
+    SUBSCRIBE     = 6  # none; MESSAGE events follow
+    PING          = 7  # peer_id, count, sizes
+    DELIVERY      = 8  # message_id
+    OUTBOX        = 9  # peer_id or None
+    ADMISSION     = 10 # none
+
+    # From the radio daemon
+    OK            = 64 # result
+    ERROR         = 65 # message
+    MESSAGE       = 66 # sender_id, text (an event, tag 0)
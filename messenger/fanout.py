@@ -0,0 +1,183 @@
+import ctypes
+import multiprocessing
+import os
+import struct
+import threading
+import zlib
+from multiprocessing.connection import wait
+from frames import parse_frame, BSSID
+from payload_utils import parse_payload
+from crypto_utils import decrypt_data, frame_header, Session, SESSION_PREFIX
+from packet_ring import SOL_PACKET
+from transport import PacketTransport, guarded
+
+PACKET_FANOUT = 18
+PACKET_FANOUT_DATA = 22
+PACKET_FANOUT_CBPF = 6  # the member is picked by a classic BPF program
+PACKET_FANOUT_FLAG_IGNORE_OUTGOING = 0x4000  # the group's own IGNORE_OUTGOING (Linux 4.20+)
+SKF_LL_OFF = 0xffe00000  # BPF loads relative to the link-layer header, wherever the driver left skb->data
+BROADCAST_MAC = "ff:ff:ff:ff:ff:ff"
+
+# Classic BPF: A = hash of the last 4 bytes of addr2 (the sender), behind a radiotap
+# header of any length. The kernel sends the frame to member A % members.
+SENDER_HASH_FILTER = [
+    (0x30, 0, 0, SKF_LL_OFF + 3),    # ldb [3]         radiotap length, high byte
+    (0x64, 0, 0, 8),                 # lsh #8
+    (0x07, 0, 0, 0),                 # tax
+    (0x30, 0, 0, SKF_LL_OFF + 2),    # ldb [2]         low byte
+    (0x4c, 0, 0, 0),                 # or x
+    (0x07, 0, 0, 0),                 # tax             X = start of the 802.11 header
+    (0x40, 0, 0, SKF_LL_OFF + 12),   # ld [x + 12]     addr2 bytes 2-5
+    (0x24, 0, 0, 0x9e3779b1),        # mul #0x9e3779b1 spread consecutive MACs over members
+    (0x74, 0, 0, 16),                # rsh #16
+    (0x16, 0, 0, 0),                 # ret a
+]
+
+def join_fanout(sock, group: int):
+    '''
+    Adds a bound packet socket to fanout group on its interface, with
+    frames spread over the members by sender MAC.
+    '''
+    try:
+        sock.setsockopt(SOL_PACKET, PACKET_FANOUT,
+                        group | (PACKET_FANOUT_CBPF | PACKET_FANOUT_FLAG_IGNORE_OUTGOING) << 16)
+    except OSError:
+        # Older kernels: our own transmissions are captured too, and skipped by Me
+        sock.setsockopt(SOL_PACKET, PACKET_FANOUT, group | PACKET_FANOUT_CBPF << 16)
+    program = b''.join(struct.pack('=HBBI', *op) for op in SENDER_HASH_FILTER)
+    buffer = ctypes.create_string_buffer(program)
+    sock.setsockopt(SOL_PACKET, PACKET_FANOUT_DATA,
+                    struct.pack('HP', len(SENDER_HASH_FILTER), ctypes.addressof(buffer)))
+
+def decode_frame(pkt, mac: str, sessions: dict, record: bool):
+    '''
+    A worker's share of Me.handle_frame: parsing, filtering and decrypting.
+    Returns (sender_mac, msg_type, msg_id, seq, data, encrypted_data,
+    frame_key, frame) for a frame addressed to us, or None. data is None
+    when the worker couldn't decrypt it (its copy of the session key lags
+    behind Me's), leaving it to Me; frame is only set when Me records.
+    '''
+    header = parse_frame(pkt)
+    if not header:
+        return None
+    dst_mac, sender_mac, bssid, payload = header
+    if bssid != BSSID or not payload or dst_mac not in (mac, BROADCAST_MAC):
+        return None
+    parsed = parse_payload(payload)
+    if not parsed:
+        return None
+    msg_type, msg_id, seq, encrypted_data = parsed
+    try:
+        if encrypted_data.startswith(SESSION_PREFIX):
+            data = sessions[sender_mac].decrypt(encrypted_data, sender_mac, frame_header(msg_type, msg_id, seq))
+        else:
+            data = decrypt_data(encrypted_data) if encrypted_data else ""
+    except (KeyError, ValueError):
+        data = None
+    # Identifies the transmission across interfaces without shipping the payload
+    frame_key = (sender_mac, msg_type, msg_id, seq, zlib.crc32(payload))
+    return (sender_mac, msg_type, msg_id, seq, data, encrypted_data, frame_key,
+            bytes(pkt) if record else None)
+
+def receive_worker(iface: str, group: int, mac: str, conn, record: bool):
+    '''
+    Receive process: joins the fanout group and sends what it decodes to
+    Me, one list per ring block. Session keys arrive on the same pipe.
+    '''
+    sessions = {}
+
+    def session_updates():
+        while True:
+            try:
+                peer_mac, key = conn.recv()
+            except (EOFError, OSError):
+                os._exit(0)  # Me is gone
+            if key is None:
+                sessions.pop(peer_mac, None)
+            else:
+                sessions[peer_mac] = Session(key)
+    threading.Thread(target=session_updates, daemon=True).start()
+
+    transport = PacketTransport(iface)
+    join_fanout(transport.open(), group)
+    conn.send(None)  # joined; frames for this worker go to its ring from now on
+
+    def on_frames(frames):
+        batch = []
+        for pkt in frames:
+            item = decode_frame(pkt, mac, sessions, record)
+            if item:
+                batch.append(item)
+        if batch:
+            try:
+                conn.send(batch)
+            except OSError:
+                os._exit(0)
+    transport.listen_batches(on_frames)
+
+class ReceivePool:
+    '''
+    Receives one interface with several processes, so parsing and
+    decryption aren't bound by one interpreter's GIL. The worker sockets
+    form a PACKET_FANOUT group that hashes on the sender MAC, so each
+    peer's frames stay in order in one worker. Everything with state (the
+    peer table, transfers, ACKs) stays in Me, which gets the decoded frames
+    back over one pipe per worker and pushes session keys the other way.
+    '''
+    def __init__(self, iface: str, workers: int, mac: str, record: bool = False):
+        self.name = iface
+        self.iface = iface
+        self.mac = mac
+        self.group = (os.getpid() + hash(iface)) & 0xffff
+        context = multiprocessing.get_context('spawn')  # Me is threaded; forking it isn't safe
+        self.conns = []
+        self.processes = []
+        for _ in range(workers):
+            ours, theirs = context.Pipe()
+            process = context.Process(target=receive_worker, args=(iface, self.group, mac, theirs, record),
+                                      daemon=True)
+            self.conns.append(ours)
+            self.processes.append(process)
+        self.lock = threading.Lock()  # session updates come from several of Me's threads
+        self.closed = False
+        self.callback_errors = 0  # decoded frames dropped because handling them raised
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        for conn in self.conns:
+            conn.recv()  # wait until every worker is in the group
+
+    def close(self):
+        self.closed = True
+        for process in self.processes:
+            process.terminate()
+
+    def set_session(self, peer_mac: str, key: bytes):
+        '''
+        Gives every worker the key for frames from peer_mac (None removes it).
+        Any of them may own the peer, as the kernel picks by hash.
+        '''
+        with self.lock:
+            for conn in self.conns:
+                conn.send((peer_mac, key))
+
+    def listen(self, callback):
+        '''
+        Blocks, calling callback(item) for every frame the workers decode
+        (see decode_frame). A frame whose callback raises is counted in
+        callback_errors and dropped.
+        '''
+        callback = guarded(self, callback)
+        conns = list(self.conns)
+        while conns:
+            for conn in wait(conns):
+                try:
+                    batch = conn.recv()
+                except EOFError:
+                    if not self.closed:
+                        print(f'[!] A receive worker on {self.iface} exited')
+                    conns.remove(conn)
+                    continue
+                for item in batch:
+                    callback(item)
@@ -0,0 +1,142 @@
+import math
+
+# Systematic erasure code over GF(256) for file chunks. A block of k data
+# chunks gets m parity chunks; any m missing data chunks can be rebuilt from
+# the rest. One parity chunk is a plain XOR; more use a Cauchy matrix, which
+# is MDS (any k of the k + m chunks are enough).
+#
+# Multiplying a whole chunk by a constant is a byte-to-byte mapping, so it
+# runs in C through bytes.translate() with one 256-byte table per constant,
+# and chunk-wide XOR goes through Python's big integers.
+
+FEC_BLOCK_SIZE = 16  # data chunks per FEC block
+MAX_PARITY = 8  # parity chunks per block at most
+TARGET_BLOCK_FAILURE = 0.01  # aim for at most 1% of blocks losing more than their parity
+
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    GF_EXP[_i] = GF_EXP[_i - 255]
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+def gf_inv(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return GF_EXP[255 - GF_LOG[a]]
+
+# MUL_TABLES[c] maps every byte b to c*b, for use with bytes.translate()
+MUL_TABLES = [bytes(gf_mul(c, b) for b in range(256)) for c in range(256)]
+
+def coefficient(j: int, i: int, m: int) -> int:
+    '''
+    Coefficient of data chunk i in parity chunk j.
+    '''
+    if m == 1:
+        return 1
+    # Cauchy matrix with disjoint point sets {i} and {255 - j}
+    return gf_inv(i ^ (255 - j))
+
+def pad(chunks, length):
+    return [chunk + bytes(length - len(chunk)) for chunk in chunks]
+
+def encode(chunks, m: int):
+    '''
+    Returns m parity chunks for a block of data chunks. Chunks shorter than
+    the longest one are zero-padded.
+    '''
+    length = max(len(c) for c in chunks)
+    chunks = pad(chunks, length)
+    parity = []
+    for j in range(m):
+        acc = 0
+        for i, chunk in enumerate(chunks):
+            acc ^= int.from_bytes(chunk.translate(MUL_TABLES[coefficient(j, i, m)]), 'little')
+        parity.append(acc.to_bytes(length, 'little'))
+    return parity
+
+def scale(value: int, factor: int, length: int) -> int:
+    '''
+    Multiplies a chunk held as an integer by a GF(256) constant.
+    '''
+    if factor == 1:
+        return value
+    return int.from_bytes(value.to_bytes(length, 'little').translate(MUL_TABLES[factor]), 'little')
+
+def solve(matrix, rhs, length: int):
+    '''
+    Gauss-Jordan elimination over GF(256). Each right-hand side is a whole
+    chunk held as an integer, so row operations are chunk-wide.
+    '''
+    n = len(matrix)
+    matrix = [row[:] for row in matrix]
+    rhs = rhs[:]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if matrix[r][col])
+        matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+        rhs[col], rhs[pivot] = rhs[pivot], rhs[col]
+        inv = gf_inv(matrix[col][col])
+        matrix[col] = [gf_mul(inv, v) for v in matrix[col]]
+        rhs[col] = scale(rhs[col], inv, length)
+        for r in range(n):
+            if r != col and matrix[r][col]:
+                factor = matrix[r][col]
+                matrix[r] = [v ^ gf_mul(factor, p) for v, p in zip(matrix[r], matrix[col])]
+                rhs[r] ^= scale(rhs[col], factor, length)
+    return rhs
+
+def decode(data: dict, parity: dict, k: int, m: int, length: int):
+    '''
+    Rebuilds missing data chunks of one block. data maps chunk index (0..k-1)
+    to bytes and parity maps parity index (0..m-1) to bytes. Returns a dict
+    of recovered chunks (padded to length), or None if too many are missing.
+    '''
+    missing = [i for i in range(k) if i not in data]
+    if not missing:
+        return {}
+    if len(missing) > len(parity):
+        return None
+
+    padded = {i: c + bytes(length - len(c)) for i, c in data.items()}
+    if m == 1:
+        acc = int.from_bytes(parity[0], 'little')
+        for chunk in padded.values():
+            acc ^= int.from_bytes(chunk, 'little')
+        return {missing[0]: acc.to_bytes(length, 'little')}
+
+    # Subtract the known chunks from each parity chunk, then solve for the missing ones
+    rows = sorted(parity)[:len(missing)]
+    rhs = []
+    for j in rows:
+        acc = int.from_bytes(parity[j], 'little')
+        for i, chunk in padded.items():
+            acc ^= int.from_bytes(chunk.translate(MUL_TABLES[coefficient(j, i, m)]), 'little')
+        rhs.append(acc)
+    matrix = [[coefficient(j, i, m) for i in missing] for j in rows]
+    solved = solve(matrix, rhs, length)
+    return {i: value.to_bytes(length, 'little') for i, value in zip(missing, solved)}
+
+def parity_count(loss_rate: float, k: int = FEC_BLOCK_SIZE) -> int:
+    '''
+    Smallest number of parity chunks that keeps the chance of a block losing
+    more frames than it can repair under TARGET_BLOCK_FAILURE, for the given
+    frame loss rate.
+    '''
+    loss_rate = min(max(loss_rate, 0.001), 0.5)
+    for m in range(1, MAX_PARITY + 1):
+        n = k + m
+        failure = sum(math.comb(n, lost) * loss_rate ** lost * (1 - loss_rate) ** (n - lost)
+                      for lost in range(m + 1, n + 1))
+        if failure <= TARGET_BLOCK_FAILURE:
+            return m
+    return MAX_PARITY
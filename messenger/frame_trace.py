@@ -0,0 +1,124 @@
+import os
+import queue
+import struct
+import threading
+import time
+from clock import REAL_CLOCK, Clock
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_VERSION = (2, 4)
+PCAP_SNAPLEN = 65535
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+
+PCAP_GLOBAL_HEADER = struct.Struct('<IHHiIII')
+PCAP_RECORD_HEADER = struct.Struct('<IIII')
+
+def write_pcap_header(f):
+    """
+    Writes a pcap global header for raw 802.11 frames with radiotap.
+    """
+    f.write(PCAP_GLOBAL_HEADER.pack(PCAP_MAGIC, PCAP_VERSION[0], PCAP_VERSION[1],
+                                    0, 0, PCAP_SNAPLEN, LINKTYPE_IEEE802_11_RADIOTAP))
+
+def write_pcap_record(f, timestamp: float, frame: bytes):
+    """
+    Writes a single frame record with the given capture timestamp.
+    """
+    ts_sec = int(timestamp)
+    ts_usec = int((timestamp - ts_sec) * 1_000_000)
+    f.write(PCAP_RECORD_HEADER.pack(ts_sec, ts_usec, len(frame), len(frame)))
+    f.write(frame)
+
+def read_pcap(path: str):
+    """
+    Yields (timestamp, frame_bytes) for every record in a pcap file.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(PCAP_GLOBAL_HEADER.size)
+        if len(header) < PCAP_GLOBAL_HEADER.size:
+            return
+        magic = struct.unpack('<I', header[:4])[0]
+        if magic == PCAP_MAGIC:
+            record = PCAP_RECORD_HEADER
+        elif magic == 0xd4c3b2a1:
+            record = struct.Struct('>IIII')
+        else:
+            raise ValueError(f"Not a pcap file: {path}")
+
+        while True:
+            rec_header = f.read(record.size)
+            if len(rec_header) < record.size:
+                return
+            ts_sec, ts_usec, incl_len, _ = record.unpack(rec_header)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                return  # truncated last record, e.g. the recorder was killed mid-write
+            yield ts_sec + ts_usec / 1_000_000, frame
+
+class TraceRecorder:
+    '''
+    Appends frames to a pcap file from a background writer thread so the
+    send and receive paths never block on disk. Frames without a capture
+    time are stamped from clock, virtual time for a simulated node.
+    '''
+    def __init__(self, path: str, flush_interval: float = 1.0, clock: Clock = REAL_CLOCK):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.frames_recorded = 0
+
+        self.queue = queue.Queue()
+        self.writer_thread = threading.Thread(target=self.writer, daemon=True)
+        self.writer_thread.start()
+
+    def record(self, pkt, timestamp: float = None):
+        '''
+        Queues a frame for writing. Accepts a scapy packet or raw bytes; scapy
+        packets are only serialized on the writer thread. Memoryviews (from a
+        receive ring) are copied, as the ring reuses their memory.
+        '''
+        if timestamp is None:
+            timestamp = getattr(pkt, 'time', None) or self.clock.time()
+        if isinstance(pkt, memoryview):
+            pkt = bytes(pkt)
+        self.queue.put((float(timestamp), pkt))
+
+    def writer(self):
+        '''
+        Drains the queue into the capture file, flushing at most every
+        flush_interval seconds.
+        '''
+        is_new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'ab') as f:
+            if is_new_file:
+                write_pcap_header(f)
+            last_flush = time.time()
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    f.flush()
+                    last_flush = time.time()
+                    continue
+
+                if item is None:
+                    f.flush()
+                    return
+
+                timestamp, pkt = item
+                try:
+                    write_pcap_record(f, timestamp, bytes(pkt))
+                    self.frames_recorded += 1
+                except Exception as e:
+                    print(f'Error recording frame: {e}')
+
+                if time.time() - last_flush > self.flush_interval:
+                    f.flush()
+                    last_flush = time.time()
+
+    def close(self):
+        '''
+        Writes any queued frames and stops the writer thread.
+        '''
+        self.queue.put(None)
+        self.writer_thread.join()
@@ -0,0 +1,96 @@
+from payload_utils import build_payload
+from enums import MsgType
+from crypto_utils import encrypt_data, frame_header
+
+BSSID = "02:07:08:15:19:20"  # pseudo-BSSID every GhostFrames frame carries in addr3
+
+# The same bytes scapy builds for RadioTap()/Dot11(type=2, subtype=0, ...)/LLC()/SNAP(),
+# so peers on either codec interoperate and old captures still replay
+RADIOTAP_HEADER = b"\x00\x00\x08\x00\x00\x00\x00\x00"  # version, pad, length 8, no fields present
+DATA_FRAME_CONTROL = b"\x08\x00"  # type 2 (data), subtype 0, no flags
+LLC_SNAP = b"\xaa\xaa\x03\x00\x00\x00\x00\x00"
+BSSID_BYTES = bytes.fromhex(BSSID.replace(":", ""))
+
+RADIOTAP_PRESENT_TSFT = 0x1
+RADIOTAP_PRESENT_FLAGS = 0x2
+RADIOTAP_PRESENT_EXT = 0x80000000
+RADIOTAP_FLAG_FCS = 0x10  # frame ends with a 4-byte FCS
+
+def mac_bytes(mac: str) -> bytes:
+    return bytes.fromhex(mac.replace(":", ""))
+
+def build_frame(msg_type: MsgType, msg_id: int, seq: int, data: str,
+                dst: str, src: str, session=None) -> bytes:
+    """
+    Encrypts the data (with the peer's session if given, otherwise the shared
+    key) and builds the full RadioTap/802.11 frame, without sending it.
+    """
+    encrypted_data = encrypt_payload(msg_type, msg_id, seq, data, src, session)
+    return build_encrypted_frame(msg_type, msg_id, seq, encrypted_data, dst, src)
+
+def encrypt_payload(msg_type: MsgType, msg_id: int, seq: int, data: str, src: str, session=None) -> str:
+    """
+    Encrypts frame data from src with a session, whose tag covers the frame
+    header, or with the shared key. Empty data stays empty.
+    """
+    if not data:
+        return ""
+    if session is not None:
+        return session.encrypt(data, src, frame_header(msg_type, msg_id, seq))
+    return encrypt_data(data)
+
+def build_encrypted_frame(msg_type: MsgType, msg_id: int, seq: int, encrypted_data: str,
+                          dst: str, src: str) -> bytes:
+    """
+    Builds the full RadioTap/802.11 frame around data that is already
+    encrypted (or empty), like a PING body echoed back in a PONG.
+    """
+    payload = build_payload(msg_type, msg_id, seq, encrypted_data)
+    return b"".join((RADIOTAP_HEADER, DATA_FRAME_CONTROL, b"\x00\x00", mac_bytes(dst), mac_bytes(src),
+                     BSSID_BYTES, b"\x00\x00", LLC_SNAP, payload))
+
+def radiotap_has_fcs(frame: bytes, length: int) -> bool:
+    """
+    Checks the radiotap Flags field for a trailing FCS, which monitor-mode
+    drivers often leave on captured frames.
+    """
+    present = int.from_bytes(frame[4:8], "little")
+    if not present & RADIOTAP_PRESENT_FLAGS:
+        return False
+    offset = 8
+    word = present
+    while word & RADIOTAP_PRESENT_EXT:
+        word = int.from_bytes(frame[offset:offset + 4], "little")
+        offset += 4
+    if present & RADIOTAP_PRESENT_TSFT:
+        offset = (offset + 7) & ~7  # TSFT is 8-byte aligned
+        offset += 8
+    return offset < length and bool(frame[offset] & RADIOTAP_FLAG_FCS)
+
+def parse_frame(frame: bytes):
+    """
+    Splits a captured RadioTap/802.11 frame (bytes or a memoryview) into
+    its addresses and body. Returns (addr1, addr2, addr3, payload as bytes),
+    or None if it isn't an unprotected data frame.
+    """
+    if len(frame) < 8:
+        return None
+    length = int.from_bytes(frame[2:4], "little")
+    end = len(frame) - 4 if radiotap_has_fcs(frame, length) else len(frame)
+    if end < length + 24:
+        return None
+    frame_control, flags = frame[length], frame[length + 1]
+    if frame_control & 0x0c != 0x08 or flags & 0x40:
+        return None  # not a data frame, or encrypted at the link layer
+
+    body = length + 24
+    if flags & 0x03 == 0x03:
+        body += 6  # addr4 in WDS frames
+    if frame_control & 0x80:
+        body += 2  # QoS control
+    if frame[body:body + 3] == LLC_SNAP[:3]:
+        body += len(LLC_SNAP)
+    addr1 = frame[length + 4:length + 10].hex(":")
+    addr2 = frame[length + 10:length + 16].hex(":")
+    addr3 = frame[length + 16:length + 22].hex(":")
+    return addr1, addr2, addr3, bytes(frame[body:end])
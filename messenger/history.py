@@ -0,0 +1,216 @@
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+HISTORY_PATH = 'message_history.db'
+WRITE_BATCH = 512  # messages committed per transaction at most
+SEARCH_WINDOW = 300  # most recent matches that get ranked; page back with before=
+SEARCH_LIMIT = 100  # largest page a search returns
+BM25_K1 = 1.2  # term frequency saturation
+BM25_B = 0.75  # length normalization
+WORD = re.compile(r'\w+')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    peer TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    ts REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_ts ON messages(ts);
+CREATE INDEX IF NOT EXISTS messages_peer ON messages(peer, id);
+-- Messages stored older than one stored before them, like those history
+-- sync recovers; all others are in time order
+CREATE TABLE IF NOT EXISTS late_messages (id INTEGER PRIMARY KEY, ts REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS late_messages_ts ON late_messages(ts);
+-- Running totals for the average message length BM25 normalizes by
+CREATE TABLE IF NOT EXISTS history_stats (messages INTEGER NOT NULL, words INTEGER NOT NULL);
+INSERT INTO history_stats SELECT 0, 0 WHERE NOT EXISTS (SELECT 1 FROM history_stats);
+-- Contentless index: the text is only stored in messages. peer_token is the
+-- conversation as a single token, so a peer filter is a doclist intersection.
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, peer_token, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+);
+'''
+
+def peer_token(peer: str) -> str:
+    return 'p' + peer.encode('utf-8').hex()
+
+def fold(text: str) -> list:
+    '''
+    The words of text as the index tokenizes them: lower case, no diacritics.
+    '''
+    text = text.lower()
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return WORD.findall(text)
+
+def match_expression(query: str, peer: str = None):
+    '''
+    Turns free text into an FTS5 query: every word must appear, the last one
+    only as a prefix if the query ends in *. Returns None if there are no words.
+    '''
+    words = WORD.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if query.rstrip().endswith('*'):
+        terms[-1] += '*'
+    expression = '{text}: (' + ' AND '.join(terms) + ')'
+    if peer is not None:
+        expression += f' AND {{peer_token}}: {peer_token(peer)}'
+    return expression
+
+class MessageHistory:
+    '''
+    Message history in SQLite with an FTS5 full-text index, updated as
+    messages are stored. add() only queues the message, so the receive path
+    never waits on the database; a writer thread commits them in batches.
+    Searches use their own connection per thread and, with WAL, never wait
+    for the writer either.
+    '''
+    def __init__(self, path: str = HISTORY_PATH):
+        self.path = path
+        self.local = threading.local()
+        db = self.connection()
+        db.executescript(SCHEMA)
+        db.commit()
+        self.newest = db.execute('SELECT MAX(ts) FROM messages').fetchone()[0] or 0
+        self.messages_stored = 0
+        self.listeners = []
+
+        self.queue = queue.Queue()
+        self.writer_thread = threading.Thread(target=self.writer, daemon=True)
+        self.writer_thread.start()
+
+    def connection(self):
+        '''
+        This thread's connection to the database.
+        '''
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    def register_listener(self, callback):
+        '''
+        Registers a callback(peer, sender, timestamp, text) called for every
+        message added, before it is queued.
+        '''
+        self.listeners.append(callback)
+
+    def add(self, peer: str, sender: str, text: str, timestamp: float = None):
+        '''
+        Queues a message in the conversation with peer for storing.
+        '''
+        timestamp = timestamp or time.time()
+        for callback in self.listeners:
+            callback(peer, sender, timestamp, text)
+        self.queue.put((peer, sender, timestamp, text))
+
+    def flush(self):
+        '''
+        Blocks until every queued message is stored and searchable.
+        '''
+        self.queue.join()
+
+    def writer(self):
+        db = self.connection()
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                words = 0
+                with db:
+                    for peer, sender, timestamp, text in batch:
+                        cursor = db.execute('INSERT INTO messages (peer, sender, ts, text) VALUES (?, ?, ?, ?)',
+                                            (peer, sender, timestamp, text))
+                        db.execute('INSERT INTO messages_fts (rowid, text, peer_token) VALUES (?, ?, ?)',
+                                   (cursor.lastrowid, text, peer_token(peer)))
+                        if timestamp < self.newest:
+                            db.execute('INSERT INTO late_messages (id, ts) VALUES (?, ?)',
+                                       (cursor.lastrowid, timestamp))
+                        else:
+                            self.newest = timestamp
+                        words += len(WORD.findall(text))
+                    db.execute('UPDATE history_stats SET messages = messages + ?, words = words + ?',
+                               (len(batch), words))
+                self.messages_stored += len(batch)
+            except sqlite3.Error as e:
+                print(f'Error storing messages: {e}')
+            for _ in batch:
+                self.queue.task_done()
+
+    def conversation(self, peer: str) -> list:
+        '''
+        Every stored message with peer as (sender, ts, text), oldest first.
+        Call flush() first to include the ones still queued.
+        '''
+        return self.connection().execute('SELECT sender, ts, text FROM messages WHERE peer = ? ORDER BY id',
+                                         (peer,)).fetchall()
+
+    def search(self, query: str, peer: str = None, before: float = None,
+               limit: int = 20, offset: int = 0) -> list:
+        '''
+        Messages matching every word of query, best match (BM25) first,
+        optionally only with peer and only older than the before timestamp.
+        Ranking covers the SEARCH_WINDOW most recent matches, which keeps
+        common words fast; paging further back is done with before.
+        Returns a list of {id, peer, sender, ts, text, score} dicts.
+        '''
+        expression = match_expression(query, peer)
+        if expression is None:
+            return []
+        limit = max(1, min(limit, SEARCH_LIMIT))
+        db = self.connection()
+        # before= filters on ts as the doclist is walked, but walking every
+        # newer match to get there is slow (~50 ms for a common word in 300k
+        # messages), so the walk also starts at a rowid bound FTS5 can seek
+        # to: the last in-order row older than before, or a later late one.
+        max_id = None
+        if before is not None:
+            bounds = db.execute('''
+                SELECT (SELECT id FROM messages WHERE ts < ?1 ORDER BY ts DESC, id DESC LIMIT 1),
+                       (SELECT MAX(id) FROM late_messages WHERE ts < ?1)''', (before,)).fetchone()
+            if bounds == (None, None):
+                return []
+            max_id = max(bound for bound in bounds if bound is not None)
+        # Walking the newest matches off the doclist is cheap; FTS5's bm25()
+        # isn't, as it counts every match of each term first (~45 ms for a
+        # common word in 1M messages). So the window is fetched plainly and
+        # scored here. CROSS JOIN keeps FTS5 the outer loop.
+        rows = db.execute(f'''
+            SELECT m.id, m.peer, m.sender, m.ts, m.text
+            FROM messages_fts CROSS JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? {'AND messages_fts.rowid <= ? AND m.ts < ?' if max_id is not None else ''}
+            ORDER BY messages_fts.rowid DESC LIMIT ?''',
+            [expression] + ([max_id, before] if max_id is not None else []) + [SEARCH_WINDOW]).fetchall()
+        messages, words = db.execute('SELECT messages, words FROM history_stats').fetchone()
+        average_length = words / messages if messages else 1
+        terms = fold(query)
+        prefix = terms.pop() if query.rstrip().endswith('*') else None
+        results = []
+        for row in rows:
+            tokens = fold(row[4])
+            # Every result has every term, so their document frequencies (the
+            # IDF part of BM25) weigh all rows alike and are left out
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / average_length)
+            frequencies = [tokens.count(term) for term in terms]
+            if prefix is not None:
+                frequencies.append(sum(token.startswith(prefix) for token in tokens))
+            score = sum(f * (BM25_K1 + 1) / (f + norm) for f in frequencies)
+            results.append({'id': row[0], 'peer': row[1], 'sender': row[2], 'ts': row[3], 'text': row[4],
+                            'score': score})
+        results.sort(key=lambda result: (-result['score'], -result['id']))
+        return results[offset:offset + limit]
@@ -0,0 +1,323 @@
+import hashlib
+import json
+import math
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from itertools import accumulate
+from enums import MsgType
+
+# History reconciliation between two peers after one of them rejoins. Each
+# side keys every message in its conversation with the other by a 64-bit
+# hash of its sender, text and how many identical messages came before it
+# (the two logs stamp a message at different times, so time can't be part
+# of the key). The side with the lower MAC sends the count and fingerprint
+# (the sum of the keys) of the whole key space; wherever the other side's
+# differ, it splits the range into SYNC_FANOUT parts and sends theirs back,
+# and so on. A range with few messages on one side is sent as its keys
+# instead, so the other side can tell exactly which messages each lacks.
+# Missing messages then go out as HISTORY_BULK frames, several per frame,
+# in the bulk transmit class so they're paced behind chat. Frames scale
+# with the number of differing messages times the depth of the split,
+# not with the length of the history.
+#
+# Only a peer's own messages are taken from it: one can't write into our
+# side of the log, so each side only sends the other what it wrote itself,
+# and messages of ours that our log lost stay lost.
+#
+# Frames are not acknowledged. Once a comparison goes quiet for
+# SYNC_RECHECK the initiator compares the whole key space again, which
+# costs one frame each way when the logs agree, up to SYNC_ROUNDS times.
+
+KEY_SPACE = 1 << 64
+SYNC_FANOUT = 16  # parts a differing range is split into
+SYNC_KEYS = 16  # a range with at most this many messages is sent as its keys
+SYNC_FRAME_BYTES = 900  # HISTORY_SYNC and HISTORY_BULK bodies, under the chunk size
+SYNC_DELAY = 2.0  # seconds after a peer (re)joins before comparing, for the session to settle
+SYNC_RECHECK = 5.0  # seconds without sync frames before the initiator compares again
+SYNC_ROUNDS = 3  # comparisons per rejoin at most
+RECENT_BULK = 1024  # bulk frames remembered, to drop copies
+
+def message_key(sender: str, text: str, occurrence: int) -> int:
+    digest = hashlib.blake2b(f'{sender}\0{occurrence}\0{text}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+def pack(items: list) -> list:
+    '''
+    Splits JSON-encodable items into groups of at most SYNC_FRAME_BYTES
+    encoded, one per frame (an item larger than that gets a frame of its own).
+    '''
+    groups, group, size = [], [], 0
+    for item in items:
+        length = len(json.dumps(item, separators=(',', ':'))) + 1
+        if group and size + length > SYNC_FRAME_BYTES:
+            groups.append(group)
+            group, size = [], 0
+        group.append(item)
+        size += length
+    if group:
+        groups.append(group)
+    return groups
+
+def encode(value) -> str:
+    return json.dumps(value, separators=(',', ':'))
+
+def is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def valid_range(lo, hi) -> bool:
+    return is_int(lo) and is_int(hi) and 0 <= lo < hi <= KEY_SPACE
+
+def valid_sync(body) -> bool:
+    '''
+    Whether a HISTORY_SYNC body is a dict of [lo, hi, count, fingerprint]
+    ranges and [lo, hi, keys, want] key lists, so on_sync can't trip on it.
+    '''
+    if not isinstance(body, dict):
+        return False
+    ranges, key_lists = body.get('r', []), body.get('k', [])
+    if not isinstance(ranges, list) or not isinstance(key_lists, list):
+        return False
+    for item in ranges:
+        if not (isinstance(item, list) and len(item) == 4 and valid_range(*item[:2])
+                and is_int(item[2]) and item[2] >= 0 and is_int(item[3]) and 0 <= item[3] < KEY_SPACE):
+            return False
+    for item in key_lists:
+        if not (isinstance(item, list) and len(item) == 4 and valid_range(*item[:2])
+                and isinstance(item[2], list) and all(is_int(key) for key in item[2]) and isinstance(item[3], bool)):
+            return False
+    return True
+
+class ConversationIndex:
+    '''
+    One conversation's messages by key, in key order, with prefix sums of
+    the keys so any range's count and fingerprint take two bisections.
+    '''
+    def __init__(self):
+        self.keys = []
+        self.messages = {}  # key -> (sender, ts, text)
+        self.occurrences = {}  # (sender, text) -> messages with both so far
+        self.prefix = None  # sums of keys[:i], rebuilt after a change
+
+    def add(self, sender: str, ts: float, text: str) -> int:
+        occurrence = self.occurrences.get((sender, text), 0)
+        self.occurrences[(sender, text)] = occurrence + 1
+        key = message_key(sender, text, occurrence)
+        insort(self.keys, key)
+        self.messages[key] = (sender, ts, text)
+        self.prefix = None
+        return key
+
+    def bounds(self, lo: int, hi: int):
+        return bisect_left(self.keys, lo), bisect_left(self.keys, hi)
+
+    def fingerprint(self, lo: int, hi: int):
+        '''
+        (count, sum of keys mod 2^64) of the messages with keys in [lo, hi).
+        '''
+        if self.prefix is None:
+            self.prefix = list(accumulate(self.keys, initial=0))
+        i, j = self.bounds(lo, hi)
+        return j - i, (self.prefix[j] - self.prefix[i]) % KEY_SPACE
+
+    def range_keys(self, lo: int, hi: int) -> list:
+        i, j = self.bounds(lo, hi)
+        return self.keys[i:j]
+
+class HistorySync:
+    '''
+    Reconciles the MessageHistory conversation with each peer that
+    (re)joins Me. Conversations are indexed on first use, then kept up to
+    date as messages are added to the history. stats counts comparisons
+    started and finished, sync frames and messages each way.
+    '''
+    def __init__(self, me, history):
+        self.me = me
+        self.history = history
+        self.lock = threading.RLock()
+        self.indexes = {}  # peer id -> ConversationIndex
+        self.sessions = {}  # peer id -> {round, updated, done}, where we compare as initiator
+        self.recent_bulk = OrderedDict()  # (peer id, msg_id, seq) of bulk frames handled
+        self.stats = {'syncs': 0, 'in_sync': 0, 'sync_frames': 0, 'bulk_frames': 0,
+                      'messages_sent': 0, 'messages_received': 0}
+        history.register_listener(self.on_stored)
+        me.register_peer_listener(self.on_peer_joined)
+        me.register_frame_listener(MsgType.HISTORY_SYNC, self.on_sync)
+        me.register_frame_listener(MsgType.HISTORY_BULK, self.on_bulk)
+
+    def sender_name(self, sender: str) -> str:
+        return self.me.name if sender == 'me' else sender
+
+    def index(self, peer_id: str) -> ConversationIndex:
+        '''
+        The index of the conversation with peer_id, built from the history
+        the first time.
+        '''
+        with self.lock:
+            index = self.indexes.get(peer_id)
+            if index is None:
+                self.history.flush()
+                index = ConversationIndex()
+                for sender, ts, text in self.history.conversation(peer_id):
+                    index.add(self.sender_name(sender), ts, text)
+                self.indexes[peer_id] = index
+            return index
+
+    def on_stored(self, peer_id, sender, ts, text):
+        with self.lock:
+            index = self.indexes.get(peer_id)
+            if index is not None:
+                index.add(self.sender_name(sender), ts, text)
+
+    def on_peer_joined(self, peer_id):
+        '''
+        The side with the lower MAC starts the comparison, so only one does.
+        '''
+        mac = self.me.known_peers.get(peer_id, {}).get('mac')
+        if mac and self.me.mac < mac:
+            self.me.clock.call_later(SYNC_DELAY, self.start_sync, peer_id, 0)
+
+    def start_sync(self, peer_id, round=0):
+        if 'mac' not in self.me.known_peers.get(peer_id, {}):
+            return
+        with self.lock:
+            self.sessions[peer_id] = {'round': round, 'updated': self.me.clock.time(), 'done': False}
+            count, fingerprint = self.index(peer_id).fingerprint(0, KEY_SPACE)
+        self.stats['syncs'] += 1
+        self.send_sync(peer_id, [[0, KEY_SPACE, count, fingerprint]], [])
+        self.me.clock.call_later(SYNC_RECHECK, self.recheck, peer_id, round)
+
+    def recheck(self, peer_id, round):
+        with self.lock:
+            session = self.sessions.get(peer_id)
+            if session is None or session['done'] or session['round'] != round:
+                return
+            quiet = self.me.clock.time() - session['updated']
+            if quiet < SYNC_RECHECK:
+                self.me.clock.call_later(SYNC_RECHECK - quiet, self.recheck, peer_id, round)
+                return
+            if round + 1 >= SYNC_ROUNDS:
+                del self.sessions[peer_id]
+                return
+        self.start_sync(peer_id, round + 1)
+
+    def send_sync(self, peer_id, ranges, key_lists, done=False):
+        mac = self.me.known_peers.get(peer_id, {}).get('mac')
+        if not mac:
+            return
+        if done:
+            bodies = [encode({'d': 1})]
+        else:
+            # Each frame is a body of its own, so a lost one only loses its ranges
+            bodies = [encode({'r': [item[1] for item in group if item[0] == 'r'],
+                              'k': [item[1] for item in group if item[0] == 'k']})
+                      for group in pack([('r', item) for item in ranges] + [('k', item) for item in key_lists])]
+        msg_id = self.me.get_next_msg_id()
+        for seq, body in enumerate(bodies):
+            self.me.send(MsgType.HISTORY_SYNC, msg_id, seq, body, mac)
+            self.stats['sync_frames'] += 1
+
+    def on_sync(self, peer_id, msg_id, seq, data):
+        '''
+        Compares the ranges and key lists a peer sent with ours, and
+        answers with the ranges to compare further, key lists, and the
+        messages it lacks.
+        '''
+        try:
+            body = json.loads(data)
+        except ValueError:
+            return
+        if not valid_sync(body):
+            return
+        ranges, key_lists = body.get('r', []), body.get('k', [])
+        with self.lock:
+            session = self.sessions.get(peer_id)
+            if session is not None:
+                session['updated'] = self.me.clock.time()
+                if body.get('d'):
+                    session['done'] = True
+                    self.stats['in_sync'] += 1
+                    return
+            index = self.index(peer_id)
+            reply_ranges, reply_keys, missing = [], [], []
+            in_sync = False  # the whole key space matched
+            for lo, hi, count, fingerprint in ranges:
+                my_count, my_fingerprint = index.fingerprint(lo, hi)
+                if (my_count, my_fingerprint) == (count, fingerprint):
+                    in_sync = in_sync or (lo, hi) == (0, KEY_SPACE)
+                    continue
+                if count == 0:
+                    missing.extend(index.range_keys(lo, hi))  # they have none of these
+                elif my_count <= SYNC_KEYS:
+                    reply_keys.append([lo, hi, index.range_keys(lo, hi), True])
+                else:
+                    step = -(-(hi - lo) // SYNC_FANOUT)
+                    for part_lo in range(lo, hi, step):
+                        part_hi = min(part_lo + step, hi)
+                        reply_ranges.append([part_lo, part_hi, *index.fingerprint(part_lo, part_hi)])
+            for lo, hi, keys, want in key_lists:
+                theirs = set(keys)
+                mine = index.range_keys(lo, hi)
+                missing.extend(key for key in mine if key not in theirs)
+                if want:
+                    shared = [key for key in mine if key in theirs]
+                    if len(shared) < len(theirs):
+                        reply_keys.append([lo, hi, shared, False])  # they work out what we lack
+            # The peer only takes messages we wrote from us
+            bulk = [list(index.messages[key]) for key in missing if index.messages[key][0] == self.me.name]
+        if reply_ranges or reply_keys:
+            self.send_sync(peer_id, reply_ranges, reply_keys)
+        elif in_sync:
+            self.send_sync(peer_id, [], [], done=True)
+        if bulk:
+            bulk.sort(key=lambda message: message[1])
+            if self.me.clock.virtual:
+                self.send_bulk(peer_id, bulk)
+            else:
+                # Bulk frames wait for room in the peer's bulk queue; the listener mustn't
+                threading.Thread(target=self.send_bulk, args=(peer_id, bulk), daemon=True).start()
+
+    def send_bulk(self, peer_id, messages):
+        mac = self.me.known_peers.get(peer_id, {}).get('mac')
+        if not mac:
+            return
+        msg_id = self.me.get_next_msg_id()
+        for seq, group in enumerate(pack(messages)):
+            body = encode(group)
+            self.me.send(MsgType.HISTORY_BULK, msg_id, seq, body, mac)
+            self.stats['bulk_frames'] += 1
+        self.stats['messages_sent'] += len(messages)
+        print(f'Sent {len(messages)} missed messages to {peer_id}')
+
+    def on_bulk(self, peer_id, msg_id, seq, data):
+        '''
+        Stores messages peer_id wrote in our conversation that we lacked.
+        '''
+        try:
+            messages = json.loads(data)
+        except ValueError:
+            return
+        if not isinstance(messages, list):
+            return
+        with self.lock:
+            if (peer_id, msg_id, seq) in self.recent_bulk:
+                return
+            self.recent_bulk[(peer_id, msg_id, seq)] = True
+            if len(self.recent_bulk) > RECENT_BULK:
+                self.recent_bulk.popitem(last=False)
+            session = self.sessions.get(peer_id)
+            if session is not None:
+                session['updated'] = self.me.clock.time()
+            stored = 0
+            for message in messages:
+                if not isinstance(message, list) or len(message) != 3:
+                    continue
+                sender, ts, text = message
+                if (sender != peer_id or not isinstance(text, str)
+                        or not isinstance(ts, (int, float)) or isinstance(ts, bool) or not math.isfinite(ts)):
+                    continue
+                self.history.add(peer_id, sender, text, float(ts))
+                stored += 1
+        self.stats['messages_received'] += stored
+        if stored:
+            print(f'Recovered {stored} missed messages with {peer_id}')
@@ -0,0 +1,268 @@
+import hashlib
+import os
+import queue
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from frames import parse_frame, BSSID
+from payload_utils import parse_payload
+from crypto_utils import decrypt_data, SESSION_PREFIX
+from admission import AdmissionControl
+from enums import MsgType
+from mesh import compact_mac
+from scheduler import TransmitScheduler, InlineScheduler
+from clock import Clock, REAL_CLOCK
+from peer import BROADCAST_MAC, HEARTBEAT_INTERVAL, RECENT_FRAMES_SIZE
+
+# Several identities (bots, service accounts) on one radio. Each Me on a
+# SharedRadio has its own locally administered MAC, keys, peers and
+# transfers, but the interfaces, their transmit schedulers and the capture
+# are the radio's: every frame is captured and parsed once, a unicast frame
+# goes to the identity addr1 names (and is decrypted by it alone), and a
+# broadcast frame is decrypted once under the shared key and handed to
+# every identity. Frames between identities on the radio never come back
+# from the air, so they are looped back locally. One HOST_HEARTBEAT lists
+# every identity instead of each sending its own HEARTBEAT; identities
+# with mesh relaying still send theirs, which carry their routing vectors.
+# Each identity keeps its session tickets, outbox, chunk store and partial
+# transfers in a directory of its own under the radio's, named after it.
+
+HOST_HEARTBEAT_MACS = 64  # identity MACs per HOST_HEARTBEAT frame, under the chunk size
+IDENTITIES_DIR = 'identities'  # where identities on a radio keep their state, one directory each
+
+def local_mac(rng=random) -> str:
+    '''
+    A random unicast, locally administered MAC (x2:, x6:, xa: or xe:).
+    '''
+    first = rng.getrandbits(8) & 0xfc | 0x02
+    return ':'.join(f'{b:02x}' for b in [first] + [rng.getrandbits(8) for _ in range(5)])
+
+class SharedRadio:
+    '''
+    The interfaces, transmit schedulers and capture pipeline shared by the
+    Me identities created with radio=this one. Identities join the
+    demultiplexer when they start and leave it when they stop. start() runs
+    one capture thread per interface, plus the loopback and heartbeat
+    threads (clock events under a VirtualClock). directory: where the
+    identities keep their state.
+    '''
+    def __init__(self, transports: list, clock: Clock = None, admission: bool = True,
+                 directory: str = IDENTITIES_DIR):
+        self.transports = transports
+        self.directory = directory
+        self.clock = clock or REAL_CLOCK
+        self.identities = {}  # mac -> Me
+        self.lock = threading.Lock()
+        self.link_stats = {t.name: {
+            'frames_sent': 0, 'bytes_sent': 0, 'send_time': 0.0,
+            'frames_received': 0, 'duplicates': 0,
+            'chunks_sent': 0, 'chunks_lost': 0, 'loss': 0.0,
+        } for t in self.transports}
+        self.recent_frames = OrderedDict()  # frame keys of recent frames, for cross-link dedup
+        # Broadcast frames are admitted once for the radio, before their one decryption;
+        # each identity still rate-limits what it handles
+        self.admission = AdmissionControl(clock=self.clock) if admission else None
+        if self.clock.virtual:
+            self.schedulers = {t.name: InlineScheduler(lambda pkt, t=t: self.transmit(pkt, t), t.name)
+                               for t in self.transports}
+        else:
+            self.schedulers = {t.name: TransmitScheduler(
+                lambda pkt, t=t: self.transmit(pkt, t), t.name,
+                (lambda pkts, t=t: self.transmit_batch(pkts, t)) if hasattr(t, 'send_batch') else None)
+                for t in self.transports}
+        self.loopback = queue.Queue()  # (frame, link) sent to an identity on this radio
+        self.started = False
+
+    def new_mac(self) -> str:
+        '''
+        A locally administered MAC no identity on this radio has.
+        '''
+        while True:
+            mac = local_mac()
+            if mac not in self.identities:
+                return mac
+
+    def state_dir(self, name: str) -> str:
+        '''
+        Creates and returns the directory of the identity called name. Names
+        come from peers (the gateway's UDP peers), so they are reduced to
+        safe characters, with a hash of the name to keep them apart.
+        '''
+        safe = re.sub(r'[^A-Za-z0-9_-]', '_', name)[:32]
+        digest = hashlib.blake2b(name.encode(), digest_size=4).hexdigest()
+        path = os.path.join(self.directory, f'{safe}-{digest}')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def add(self, me):
+        with self.lock:
+            identities = dict(self.identities)
+            identities[me.mac] = me
+            self.identities = identities  # replaced, so the capture threads iterate without the lock
+
+    def remove(self, me):
+        with self.lock:
+            identities = dict(self.identities)
+            identities.pop(me.mac, None)
+            self.identities = identities
+
+    def transmit(self, pkt, link):
+        '''
+        Puts a frame on the air, and hands it to the identities on this
+        radio it is for. Called from the link's scheduler.
+        '''
+        start_time = time.perf_counter()
+        link.send(pkt)
+        stats = self.link_stats[link.name]
+        stats['send_time'] += time.perf_counter() - start_time
+        stats['frames_sent'] += 1
+        stats['bytes_sent'] += len(pkt)
+        self.loop_back(pkt, link)
+
+    def transmit_batch(self, pkts, link):
+        start_time = time.perf_counter()
+        link.send_batch(pkts)
+        stats = self.link_stats[link.name]
+        stats['send_time'] += time.perf_counter() - start_time
+        stats['frames_sent'] += len(pkts)
+        stats['bytes_sent'] += sum(len(pkt) for pkt in pkts)
+        for pkt in pkts:
+            self.loop_back(pkt, link)
+
+    def loop_back(self, pkt, link):
+        '''
+        Queues a frame we sent for local delivery if it is broadcast or
+        addressed to one of our identities. It is handled later, off the
+        scheduler, so a handler that sends can't wait on its own link.
+        '''
+        if len(self.identities) < 2:
+            return
+        dst_mac = parse_frame(pkt)[0]
+        if dst_mac != BROADCAST_MAC and dst_mac not in self.identities:
+            return
+        if self.clock.virtual:
+            self.clock.call_later(0, self.receive, pkt, link, True)
+        else:
+            self.loopback.put((pkt, link))
+
+    def loopback_listener(self):
+        while True:
+            pkt, link = self.loopback.get()
+            self.receive(pkt, link, True)
+
+    def capture(self, transport):
+        '''
+        Captures frames on one transport for every identity.
+        '''
+        transport.listen(lambda pkt: self.receive(pkt, transport))
+
+    def count_received(self, link, frame_key):
+        '''
+        Counts a frame captured on link. Returns False if the same
+        transmission was already heard on another interface.
+        '''
+        stats = self.link_stats[link.name]
+        stats['frames_received'] += 1
+        if len(self.transports) > 1:
+            if frame_key in self.recent_frames:
+                stats['duplicates'] += 1
+                return False
+            self.recent_frames[frame_key] = True
+            if len(self.recent_frames) > RECENT_FRAMES_SIZE:
+                self.recent_frames.popitem(last=False)
+        return True
+
+    def receive(self, pkt, link, local=False):
+        '''
+        Parses a frame once and hands it to the identities it is for, as
+        the (sender_mac, msg_type, msg_id, seq, data, encrypted_data,
+        frame_key, frame) items Me.handle_decoded takes. local: looped back
+        from one of our identities rather than captured.
+        '''
+        identities = self.identities
+        header = parse_frame(pkt)
+        if not header:
+            return
+        dst_mac, sender_mac, bssid, payload = header
+        if bssid != BSSID or not payload:
+            return
+        # Our own transmissions, on kernels that capture them too; they were looped back
+        if not local and sender_mac in identities:
+            return
+        if dst_mac == BROADCAST_MAC:
+            targets = [me for mac, me in identities.items() if mac != sender_mac]
+        else:
+            # Monitor mode hears unicast traffic between other peers too
+            me = identities.get(dst_mac)
+            if me is None:
+                return
+            targets = [me]
+        if not targets:
+            return
+        parsed = parse_payload(payload)
+        if not parsed:
+            return
+        msg_type, msg_id, seq, encrypted_data = parsed
+        # Identifies the transmission across interfaces, as in fanout.decode_frame
+        frame_key = (sender_mac, msg_type, msg_id, seq, zlib.crc32(payload))
+        if not local and not self.count_received(link, frame_key):
+            return
+
+        # Unicast frames are admitted and decrypted by their identity, with its session
+        data = None
+        if dst_mac == BROADCAST_MAC and not encrypted_data.startswith(SESSION_PREFIX):
+            if not local and self.admission is not None:
+                known = any(sender_mac in me.sessions for me in targets)
+                if not self.admission.admit(sender_mac, known, msg_type):
+                    return
+            try:
+                data = decrypt_data(encrypted_data) if encrypted_data else ""
+            except Exception:
+                return
+        frame = bytes(pkt) if any(me.recorder for me in targets) else None
+        item = (sender_mac, msg_type, msg_id, seq, data, encrypted_data, frame_key, frame)
+        for me in targets:
+            me.handle_decoded(item, link, counted=True)
+
+    def heartbeat(self):
+        '''
+        Sends one HOST_HEARTBEAT for every identity without mesh relaying,
+        from the first of them.
+        '''
+        macs = [mac for mac, me in self.identities.items() if not me.routing]
+        if not macs:
+            return
+        host = self.identities[macs[0]]
+        msg_id = host.get_next_msg_id()
+        for seq, i in enumerate(range(0, len(macs), HOST_HEARTBEAT_MACS)):
+            body = ','.join(compact_mac(mac) for mac in macs[i:i + HOST_HEARTBEAT_MACS])
+            host.send(MsgType.HOST_HEARTBEAT, msg_id, seq, body, BROADCAST_MAC)
+
+    def heartbeater(self):
+        while True:
+            self.clock.sleep(HEARTBEAT_INTERVAL)
+            self.heartbeat()
+
+    def scheduled_heartbeat(self):
+        self.heartbeat()
+        self.clock.call_later(HEARTBEAT_INTERVAL, self.scheduled_heartbeat)
+
+    def start(self):
+        '''
+        Starts capturing and heartbeats, once.
+        '''
+        if self.started:
+            return
+        self.started = True
+        if self.clock.virtual:
+            for transport in self.transports:
+                self.capture(transport)  # virtual transports only register the callback
+            self.clock.call_later(HEARTBEAT_INTERVAL, self.scheduled_heartbeat)
+            return
+        for transport in self.transports:
+            threading.Thread(target=self.capture, args=(transport,), daemon=True).start()
+        threading.Thread(target=self.loopback_listener, daemon=True).start()
+        threading.Thread(target=self.heartbeater, daemon=True).start()
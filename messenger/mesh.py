@@ -0,0 +1,111 @@
+from clock import REAL_CLOCK
+
+MAX_HOPS = 15  # routes longer than this are treated as unreachable
+ROUTE_TIMEOUT = 16  # seconds without a refresh before a learned route is dropped
+VECTOR_ENTRIES_PER_FRAME = 40  # keeps each heartbeat under the chunk size
+
+def compact_mac(mac: str) -> str:
+    return mac.replace(':', '')
+
+def expand_mac(compact: str) -> str:
+    return ':'.join(compact[i:i + 2] for i in range(0, 12, 2))
+
+def escape_name(name: str) -> str:
+    '''
+    Escapes the entry separator in a name for a vector (and the escape
+    character itself); other names go out as they are.
+    '''
+    return name.replace('%', '%25').replace(',', '%2C')
+
+def unescape_name(name: str) -> str:
+    return name.replace('%2C', ',').replace('%25', '%')
+
+class RoutingTable:
+    '''
+    Distance-vector routing table. Each destination MAC maps to the
+    neighbor to forward through and the hop count to reach it.
+    '''
+    def __init__(self, own_mac: str, clock=REAL_CLOCK):
+        self.own_mac = own_mac
+        self.clock = clock
+        self.routes = {}  # dest_mac -> {next_hop, hops, name, updated}
+
+    def add_neighbor(self, mac: str, name: str):
+        '''
+        Records a peer heard directly (one hop away).
+        '''
+        self.routes[mac] = {'next_hop': mac, 'hops': 1, 'name': name, 'updated': self.clock.time()}
+
+    def add_route(self, dest_mac: str, next_hop: str, hops: int, name: str):
+        '''
+        Records a destination we heard of from a neighbor other than through
+        its heartbeat (a roster), unless we already have a route to it.
+        '''
+        if dest_mac != self.own_mac and dest_mac not in self.routes:
+            self.routes[dest_mac] = {'next_hop': next_hop, 'hops': hops, 'name': name, 'updated': self.clock.time()}
+
+    def remove_neighbor(self, mac: str):
+        '''
+        Drops a neighbor and every route that went through it.
+        '''
+        for dest in [d for d, r in self.routes.items() if r['next_hop'] == mac]:
+            del self.routes[dest]
+
+    def next_hop(self, dest_mac: str):
+        route = self.routes.get(dest_mac)
+        return route['next_hop'] if route else None
+
+    def encode_vectors(self):
+        '''
+        Returns the reachability vector as a list of heartbeat bodies. Each
+        entry is "<dest mac><hops><last 2 bytes of next hop><name>", so
+        receivers can apply split horizon, with ',' in the name escaped.
+        '''
+        entries = [f"{compact_mac(dest)}{route['hops']:x}{compact_mac(route['next_hop'])[-4:]}"
+                   f"{escape_name(route['name'])}"
+                   for dest, route in self.routes.items() if route['hops'] < MAX_HOPS]
+        return [','.join(entries[i:i + VECTOR_ENTRIES_PER_FRAME])
+                for i in range(0, len(entries), VECTOR_ENTRIES_PER_FRAME)] or [""]
+
+    def update_from_vector(self, neighbor_mac: str, vector: str):
+        '''
+        Merges a neighbor's heartbeat vector. Returns the list of
+        (dest_mac, name) destinations that were not reachable before.
+        '''
+        if neighbor_mac not in self.routes or self.routes[neighbor_mac]['hops'] != 1:
+            return []  # only trust vectors from direct neighbors
+
+        now = self.clock.time()
+        self.routes[neighbor_mac]['updated'] = now
+        own_suffix = compact_mac(self.own_mac)[-4:]
+        new_destinations = []
+        for entry in vector.split(',') if vector else []:
+            if len(entry) < 17 or entry[12] not in '0123456789abcdef':
+                continue
+            dest = expand_mac(entry[:12])
+            hops = int(entry[12], 16) + 1
+            via_suffix = entry[13:17]
+            name = unescape_name(entry[17:])
+            if dest == self.own_mac or dest == neighbor_mac or via_suffix == own_suffix:
+                continue  # split horizon: never learn a route that goes through us
+            if hops > MAX_HOPS:
+                continue
+
+            route = self.routes.get(dest)
+            if route is None or hops < route['hops'] or route['next_hop'] == neighbor_mac:
+                if route is None:
+                    new_destinations.append((dest, name))
+                self.routes[dest] = {'next_hop': neighbor_mac, 'hops': hops, 'name': name, 'updated': now}
+        return new_destinations
+
+    def expire(self):
+        '''
+        Drops routes that haven't been refreshed recently. Returns the
+        removed destination MACs.
+        '''
+        cutoff = self.clock.time() - ROUTE_TIMEOUT
+        expired = [dest for dest, route in self.routes.items()
+                   if route['hops'] > 1 and route['updated'] < cutoff]
+        for dest in expired:
+            del self.routes[dest]
+        return expired
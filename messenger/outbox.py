@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+from clock import REAL_CLOCK
+
+OUTBOX_PATH = 'outbox.json'
+OUTBOX_TTL = 24 * 3600  # seconds a queued message waits for its peer before it expires
+OUTBOX_MAX_MESSAGES = 200  # queued messages per peer; the oldest are dropped past this
+OUTBOX_MAX_BYTES = 256 * 1024  # queued text per peer; the oldest are dropped past this
+STATUS_LIMIT = 1000  # finished messages whose delivery status is kept for the API
+
+QUEUED = 'queued'  # waiting for the peer to be heard from
+SENT = 'sent'  # on the air, waiting for the ACK
+DELIVERED = 'delivered'
+EXPIRED = 'expired'  # queued longer than OUTBOX_TTL
+DROPPED = 'dropped'  # pushed out by the per-peer caps
+FINISHED = {DELIVERED, EXPIRED, DROPPED}
+
+class MessageOutbox:
+    '''
+    Direct messages for peers we can't reach right now, kept per peer in a
+    JSON file so they survive a restart, and the delivery status of every
+    message sent through it. Peers are remembered by MAC as well, so a
+    heartbeat from a peer that was dropped for not answering is enough to
+    flush its messages. With path None nothing is saved.
+    '''
+    def __init__(self, path: str = OUTBOX_PATH, clock=REAL_CLOCK):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        # message id -> {id, peer, text, queued_at, status, updated, held}, oldest first.
+        # Only held messages (ones that waited in the outbox) are saved; the
+        # status of a message that went straight out isn't worth a write.
+        self.messages = {}
+        self.macs = {}  # peer id -> last MAC it was reached at
+        self.next_id = 1
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            for message in saved['messages']:
+                if message['status'] == SENT:
+                    message['status'] = QUEUED  # we stopped before the ACK came
+                self.messages[message['id']] = message
+            self.macs = saved['macs']
+            self.next_id = saved['next_id']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def add(self, peer_id: str, text: str, status: str = QUEUED) -> str:
+        '''
+        Tracks a message to peer_id and returns its id. A queued message
+        may push the oldest ones queued for that peer past the caps.
+        '''
+        with self.lock:
+            message_id = f'm{self.next_id}'
+            self.next_id += 1
+            now = self.clock.time()
+            self.messages[message_id] = {'id': message_id, 'peer': peer_id, 'text': text,
+                                         'queued_at': now, 'status': status, 'updated': now,
+                                         'held': status == QUEUED}
+            finished = [m['id'] for m in self.messages.values() if m['status'] in FINISHED]
+            for old_id in finished[:max(0, len(finished) - STATUS_LIMIT)]:
+                del self.messages[old_id]
+            if status == QUEUED:
+                queued = [m for m in self.messages.values() if m['peer'] == peer_id and m['status'] == QUEUED]
+                total = sum(len(m['text'].encode()) for m in queued)
+                while len(queued) > 1 and (len(queued) > OUTBOX_MAX_MESSAGES or total > OUTBOX_MAX_BYTES):
+                    oldest = queued.pop(0)
+                    total -= len(oldest['text'].encode())
+                    oldest['status'] = DROPPED
+                    oldest['updated'] = now
+                    print(f'[!] Outbox for {peer_id} is full; dropped message {oldest["id"]}')
+                self.save()
+        return message_id
+
+    def set_status(self, message_ids: list, status: str):
+        with self.lock:
+            now = self.clock.time()
+            changed_held = False
+            for message_id in message_ids:
+                message = self.messages.get(message_id)
+                if message and message['status'] not in FINISHED:
+                    message['status'] = status
+                    message['updated'] = now
+                    message['held'] = message['held'] or status == QUEUED
+                    changed_held = changed_held or message['held']
+            if changed_held:
+                self.save()
+
+    def queued(self, peer_id: str) -> list:
+        '''
+        Returns the messages waiting for peer_id, oldest first, after
+        expiring those past OUTBOX_TTL.
+        '''
+        self.expire()
+        return [m for m in list(self.messages.values()) if m['peer'] == peer_id and m['status'] == QUEUED]
+
+    def pending(self, peer_id: str = None) -> list:
+        '''
+        Returns the messages not delivered yet (queued or sent), for one
+        peer or all of them.
+        '''
+        self.expire()
+        return [dict(m) for m in list(self.messages.values())
+                if m['status'] not in FINISHED and peer_id in (None, m['peer'])]
+
+    def status(self, message_id: str):
+        '''
+        Returns a copy of the message with its status, or None if it isn't
+        tracked (never was, or finished long enough ago to be forgotten).
+        '''
+        self.expire()
+        message = self.messages.get(message_id)
+        return dict(message) if message else None
+
+    def expire(self):
+        cutoff = self.clock.time() - OUTBOX_TTL
+        expired = [m['id'] for m in list(self.messages.values())
+                   if m['status'] == QUEUED and m['queued_at'] < cutoff]
+        if expired:
+            print(f'[!] {len(expired)} queued messages expired undelivered')
+            self.set_status(expired, EXPIRED)
+
+    def remember_mac(self, peer_id: str, mac: str):
+        if self.macs.get(peer_id) != mac:
+            with self.lock:
+                self.macs[peer_id] = mac
+                self.save()
+
+    def peer_for_mac(self, mac: str):
+        '''
+        Returns the id of the peer last reached at mac that has messages
+        queued, or None.
+        '''
+        for peer_id, peer_mac in list(self.macs.items()):
+            if peer_mac == mac and self.queued(peer_id):
+                return peer_id
+        return None
+
+    def save(self):
+        '''
+        Writes the held messages out. Called with the lock held.
+        '''
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'messages': [m for m in self.messages.values() if m['held']], 'macs': self.macs,
+                           'next_id': self.next_id}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving outbox: {e}")
@@ -0,0 +1,85 @@
+import threading
+
+INITIAL_RATE = 100_000  # bytes per second a new destination starts at
+MIN_RATE = 10_000
+MAX_RATE = 5_000_000
+ADDITIVE_STEP = 20_000  # bytes per second added for each loss-free report
+DECREASE_FACTOR = 0.7  # rate multiplier when a report shows loss
+LOSS_THRESHOLD = 0.02  # interval loss above this counts as congestion
+PROGRESS_EVERY = 32  # file frames a receiver takes in between FILE_PROGRESS reports
+PACING_BURST = 4096  # token bucket depth: about two frames, so frames stay evenly spaced
+
+class PacingController:
+    '''
+    Additive-increase, multiplicative-decrease pacing for bulk frames to one
+    destination. The receiver reports every PROGRESS_EVERY frames how many
+    it has and which one it saw last; comparing that with what was sent up
+    to that frame gives the loss over the interval. The rate doubles until
+    the first loss (slow start), then grows by ADDITIVE_STEP per clean report
+    and is cut by DECREASE_FACTOR at most once per round of reports.
+    '''
+    def __init__(self, rate: float = INITIAL_RATE, max_rate: float = None, adaptive: bool = True):
+        self.base_rate = rate
+        self.max_rate = max_rate  # user cap, if any
+        self.adaptive = adaptive  # without it only max_rate applies
+        self.loss = 0.0  # smoothed loss estimate
+        self.slow_start = True
+        self.sent = 0  # bulk frames sent so far
+        self.positions = {}  # msg_id -> {seq: value of sent after that frame}
+        self.last_report = {}  # msg_id -> (position, received count) at the previous report
+        self.recovering_until = 0  # reports about frames sent before this are ignored for decreases
+        self.lock = threading.Lock()
+
+    @property
+    def rate(self):
+        '''
+        Current rate in bytes per second, or None for unlimited.
+        '''
+        if not self.adaptive:
+            return self.max_rate
+        return min(self.base_rate, self.max_rate) if self.max_rate else self.base_rate
+
+    def on_sent(self, msg_id: int, seq: int):
+        with self.lock:
+            self.sent += 1
+            self.positions.setdefault(msg_id, {})[seq] = self.sent
+
+    def on_report(self, msg_id: int, received: int, last_seq: int) -> bool:
+        '''
+        Handles a FILE_PROGRESS report. Returns True if the rate changed.
+        '''
+        with self.lock:
+            position = self.positions.get(msg_id, {}).get(last_seq)
+            if position is None:
+                return False
+            previous_position, previous_received = self.last_report.get(msg_id, (0, 0))
+            if msg_id not in self.last_report:
+                previous_position = min(self.positions[msg_id].values()) - 1
+            sent = position - previous_position
+            if sent <= 0:
+                return False
+            self.last_report[msg_id] = (position, received)
+            loss = min(max(1 - (received - previous_received) / sent, 0.0), 1.0)
+            self.loss = 0.8 * self.loss + 0.2 * loss
+            if not self.adaptive:
+                return False
+
+            if loss > LOSS_THRESHOLD:
+                if position <= self.recovering_until:
+                    return False  # same congestion episode as the last cut
+                self.base_rate = max(MIN_RATE, self.base_rate * DECREASE_FACTOR)
+                self.slow_start = False
+                self.recovering_until = self.sent
+            elif self.slow_start:
+                self.base_rate = min(MAX_RATE, self.base_rate * 2)
+            else:
+                self.base_rate = min(MAX_RATE, self.base_rate + ADDITIVE_STEP)
+            return True
+
+    def finish(self, msg_id: int):
+        '''
+        Forgets a finished transfer.
+        '''
+        with self.lock:
+            self.positions.pop(msg_id, None)
+            self.last_report.pop(msg_id, None)
@@ -0,0 +1,144 @@
+import ctypes
+import ctypes.util
+import errno
+import mmap
+import os
+import select
+import struct
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+PACKET_IGNORE_OUTGOING = 23  # Linux 4.20+
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 0x1
+
+RING_BLOCK_SIZE = 1 << 18  # bytes per ring block; the kernel fills a block with many frames before handing it over
+RING_BLOCKS = 16
+RING_FRAME_SIZE = 2048  # only used to size the ring; TPACKET_V3 packs frames back to back
+RING_BLOCK_TIMEOUT = 10  # ms before the kernel hands over a partly filled block
+RING_POLL_TIMEOUT = 1000  # ms per poll() while waiting for a block
+SEND_BATCH = 64  # frames per sendmmsg call
+
+# tpacket_block_desc from offset 8: block_status, num_pkts, offset_to_first_pkt
+BLOCK_HEADER = struct.Struct('=III')
+BLOCK_STATUS_OFFSET = 8
+# tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac
+FRAME_HEADER = struct.Struct('=IIIIIIH')
+
+class RxRing:
+    '''
+    A TPACKET_V3 receive ring on a packet socket. The kernel copies captured
+    frames straight into memory shared with us and hands it over a block
+    (many frames) at a time, so a busy link costs one poll() per block
+    rather than one recv() per frame.
+    '''
+    def __init__(self, sock, block_size: int = RING_BLOCK_SIZE, blocks: int = RING_BLOCKS):
+        sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        frames = block_size // RING_FRAME_SIZE * blocks
+        sock.setsockopt(SOL_PACKET, PACKET_RX_RING, struct.pack(
+            '=7I', block_size, blocks, RING_FRAME_SIZE, frames, RING_BLOCK_TIMEOUT, 0, 0))
+        self.block_size = block_size
+        self.blocks = blocks
+        self.map = mmap.mmap(sock.fileno(), block_size * blocks, mmap.MAP_SHARED,
+                             mmap.PROT_READ | mmap.PROT_WRITE)
+        self.view = memoryview(self.map)
+        self.poller = select.poll()
+        self.poller.register(sock.fileno(), select.POLLIN | select.POLLERR)
+        self.block = 0  # next block to read
+
+    def next_block(self):
+        '''
+        Returns the frames of the next block as memoryviews into the ring,
+        or None if the kernel hasn't filled it yet. The views are only
+        valid until release() hands the block back.
+        '''
+        offset = self.block * self.block_size
+        status, count, position = BLOCK_HEADER.unpack_from(self.map, offset + BLOCK_STATUS_OFFSET)
+        if not status & TP_STATUS_USER:
+            return None
+        frames = []
+        position += offset
+        for _ in range(count):
+            next_offset, _, _, snaplen, _, _, mac = FRAME_HEADER.unpack_from(self.map, position)
+            start = position + mac
+            frames.append(self.view[start:start + snaplen])
+            position += next_offset
+        return frames
+
+    def release(self):
+        '''
+        Hands the current block back to the kernel and moves to the next.
+        '''
+        struct.pack_into('=I', self.map, self.block * self.block_size + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+        self.block = (self.block + 1) % self.blocks
+
+    def wait(self):
+        self.poller.poll(RING_POLL_TIMEOUT)
+
+class IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(IoVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', MsgHdr), ('msg_len', ctypes.c_uint)]
+
+def load_sendmmsg():
+    '''
+    Returns libc's sendmmsg, or None where there isn't one.
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+class BatchSender:
+    '''
+    Sends lists of frames on a bound packet socket with sendmmsg, up to
+    SEND_BATCH frames per system call.
+    '''
+    def __init__(self, sock, sendmmsg, batch: int = SEND_BATCH):
+        self.fd = sock.fileno()
+        self.sendmmsg = sendmmsg
+        self.batch = batch
+        self.iovecs = (IoVec * batch)()
+        self.messages = (MMsgHdr * batch)()
+        for message, iovec in zip(self.messages, self.iovecs):
+            message.msg_hdr.msg_iov = ctypes.pointer(iovec)
+            message.msg_hdr.msg_iovlen = 1
+
+    def send(self, frames: list) -> int:
+        '''
+        Sends every frame, blocking while the interface queue is full.
+        Returns the number of system calls made.
+        '''
+        calls = 0
+        for first in range(0, len(frames), self.batch):
+            chunk = frames[first:first + self.batch]
+            buffer = b''.join(chunk)  # keeps the frames in one place while the kernel reads them
+            address = ctypes.cast(ctypes.c_char_p(buffer), ctypes.c_void_p).value
+            for iovec, frame in zip(self.iovecs, chunk):
+                iovec.iov_base = address
+                iovec.iov_len = len(frame)
+                address += len(frame)
+            sent = 0
+            while sent < len(chunk):
+                result = self.sendmmsg(self.fd, ctypes.byref(self.messages[sent]), len(chunk) - sent, 0)
+                calls += 1
+                if result < 0:
+                    error = ctypes.get_errno()
+                    if error == errno.EINTR:
+                        continue
+                    raise OSError(error, os.strerror(error))
+                sent += result
+        return calls
@@ -1,5 +1,9 @@
+import fcntl
+import socket
+import struct
 from enums import MsgType
-from scapy.all import get_if_hwaddr
+
+SIOCGIFHWADDR = 0x8927
 
 def build_payload(msg_type: MsgType, msg_id: int, seq: int, data: str = "") -> bytes:
     """
@@ -27,10 +31,18 @@ def parse_payload(payload: bytes):
 
 def get_mac(interface):
     """
-    Get the MAC address of a network interface using scapy.
+    Get the MAC address of a network interface from sysfs, falling back to
+    the SIOCGIFHWADDR ioctl.
     """
     try:
-        return get_if_hwaddr(interface)
-    except:
+        with open(f"/sys/class/net/{interface}/address") as f:
+            return f.read().strip()
+    except OSError:
+        pass
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            ifreq = fcntl.ioctl(s.fileno(), SIOCGIFHWADDR, struct.pack("256s", interface.encode()[:15]))
+        return ifreq[18:24].hex(":")
+    except OSError:
         print(f"Error: Could not get MAC address for {interface}, using default MAC")
-        return "aa:bb:cc:dd:ee:ff"
\ No newline at end of file
+        return "aa:bb:cc:dd:ee:ff"
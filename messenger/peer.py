@@ -4,40 +4,240 @@ import time
 import threading
 import os
 import base64
-from send_frame import send_frame
-from sniff_frames import sniff_frames
+import hashlib
+import math
+import re
+from collections import OrderedDict
+from datetime import datetime
+from frames import build_frame, build_encrypted_frame, encrypt_payload, parse_frame, BSSID
 from enums import MsgType
 from payload_utils import parse_payload, get_mac
-from crypto_utils import decrypt_data
-from scapy.all import sniff, Dot11, Raw
+from crypto_utils import (decrypt_data, generate_keypair, export_public_key, derive_session_secret,
+                          derive_resumed_session, Session, TicketCache, SESSION_PREFIX, TICKETS_PATH,
+                          frame_header)
+from frame_trace import TraceRecorder
+from transport import open_transport, PacketTransport
+from fanout import ReceivePool
+from mesh import RoutingTable, compact_mac, expand_mac, MAX_HOPS
+import fec
+from checkpoint import PartialFile, PARTIAL_DIR, encode_ranges, decode_ranges, index_ranges
+from dedup import ChunkStore, STORE_DIR, build_manifest, encode_manifest, decode_manifest
+from scheduler import TransmitScheduler, InlineScheduler, CONTROL, CHAT, BULK
+from pacing import PacingController, PROGRESS_EVERY, PACING_BURST
+from outbox import MessageOutbox, OUTBOX_PATH, QUEUED, SENT, DELIVERED
+from admission import AdmissionControl
+from clock import Clock, REAL_CLOCK
+from roster import encode_roster, decode_roster, ROSTER_BACKOFF, JOIN_WAIT, JOIN_RETRIES
 
 CHUNK_SIZE = 1000 # typically 1500 bytes MTU data, leave some room in case
+GROUP_ACK_SLOT = 0.002 # group members stagger their ACKs by member index to avoid collisions
+ACK_POLL_INTERVAL = 0.005 # seconds between ACK deadline checks while ACKs are outstanding
+HEARTBEAT_INTERVAL = 5 # seconds between heartbeats
+RECENT_FRAMES_SIZE = 2048 # frames remembered for dropping copies heard on more than one interface
+RELAY_TTL = MAX_HOPS # max hops for a relayed frame
+RESUME_WAIT = 0.5 # seconds a sender waits for the receiver's resume offer after FILE_INIT
+TRANSFER_IDLE_TIMEOUT = 60 # seconds without chunks before an incoming transfer is checkpointed and dropped
+MANIFEST_WAIT = 1.0 # seconds a delta sender waits for FILE_HAVE after its manifest
+MTU_PROBE_SIZES = (512, 768, 1000, 1100, 1200, 1400, 1700, 2000, 2400) # file chunk sizes probed, ascending
+MTU_PROBE_COPIES = 2 # probes of each size, so one lost frame doesn't cap the chunk size
+MTU_PROBE_WAIT = 1.0 # seconds to wait for MTU_ACKs
+MIN_CHUNK_SIZE, MAX_CHUNK_SIZE = MTU_PROBE_SIZES[0], MTU_PROBE_SIZES[-1] # chunk sizes a FILE_INIT may ask for
+MAX_FILE_SIZE = 1 << 32 # bytes in a received file, a bitmap of up to 1 MiB at MIN_CHUNK_SIZE
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}') # a FILE_INIT's hash, which names its partial file
+SESSION_REPLACE_INTERVAL = 10 # seconds before a handshake may replace a peer's session again (handshakes aren't authenticated)
+HANDSHAKE_SETTLE = 1.0 # seconds after a handshake before our own session traffic (MTU probes, outbox), for the reverse handshake or the joiner's roster to settle the session
+MTU_REPROBE_LOSS = 0.2 # re-probe a peer when its frame loss estimate rises above this
+MTU_REPROBE_INTERVAL = 30 # seconds between probes of one peer
+PING_COUNT = 20 # PINGs per padding size in a probe train
+PING_SIZES = (64, 512, 1000) # padding bytes of the PINGs in a probe train, one size after the other
+PING_INTERVAL = 0.02 # seconds between PINGs
+PING_WAIT = 1.0 # seconds to wait for the PONGs after the last PING of a size
+OUTBOX_ACK_WAIT = 0.5 # seconds to wait for a MSG_BUNDLE's ACK, doubling each retry
+OUTBOX_RETRIES = 4 # MSG_BUNDLE sends before its messages go back to waiting
+# Unicast types forwarded hop by hop, and broadcast types flooded, when mesh relaying is on
+RELAYED_TYPES = {MsgType.MSG, MsgType.MSG_ACK, MsgType.FILE_INIT, MsgType.FILE_CHUNK,
+                 MsgType.FILE_END, MsgType.FILE_ACK, MsgType.FILE_PARITY, MsgType.FILE_RESUME,
+                 MsgType.FILE_MANIFEST, MsgType.FILE_HAVE, MsgType.FILE_PROGRESS, MsgType.GROUP_MSG,
+                 MsgType.GROUP_ACK, MsgType.MSG_BUNDLE, MsgType.HISTORY_SYNC, MsgType.HISTORY_BULK,
+                 MsgType.RENAME}
+FLOODED_TYPES = {MsgType.GROUP_MSG, MsgType.RENAME}
+# Transmit priority classes; everything else (handshakes, ACKs, heartbeats) is CONTROL.
+# FILE_INIT and FILE_END are bulk so they stay in order with the chunks.
+CHAT_TYPES = {MsgType.MSG, MsgType.GROUP_MSG, MsgType.RENAME, MsgType.MSG_BUNDLE}
+BULK_TYPES = {MsgType.FILE_INIT, MsgType.FILE_CHUNK, MsgType.FILE_PARITY, MsgType.FILE_END,
+              MsgType.FILE_MANIFEST, MsgType.MTU_PROBE, MsgType.HISTORY_BULK}
+PACED_TYPES = {MsgType.FILE_CHUNK, MsgType.FILE_PARITY} # frames counted by the receiver's FILE_PROGRESS
+# Sent under the shared key: handshakes and rosters set sessions up, and PINGs come back undecrypted in PONGs
+SHARED_KEY_TYPES = {MsgType.HANDSHAKE_REQ, MsgType.HANDSHAKE_ACK, MsgType.ROSTER, MsgType.PING}
 
 IFACE = "wlan1mon"
-SRC_MAC = get_mac(IFACE)
 BROADCAST_MAC = "ff:ff:ff:ff:ff:ff" # initialize to default for discovery
 
 waiting_for_ack = threading.Event()
 
+def ping_stats(size, count, rtts):
+    '''
+    Summarizes a probe train of count PINGs, given {seq: RTT in seconds} of
+    the ones answered: loss, RTT min/avg/p99 and jitter (the mean change
+    between consecutive RTTs), in milliseconds.
+    '''
+    times = [rtts[seq] * 1000 for seq in sorted(rtts)]
+    stats = {'size': size, 'sent': count, 'received': len(times), 'loss': 1 - len(times) / count,
+             'min': None, 'avg': None, 'p99': None, 'jitter': None}
+    if times:
+        ordered = sorted(times)
+        stats['min'] = ordered[0]
+        stats['avg'] = sum(times) / len(times)
+        stats['p99'] = ordered[math.ceil(len(ordered) * 0.99) - 1]
+        stats['jitter'] = sum(abs(b - a) for a, b in zip(times, times[1:])) / max(len(times) - 1, 1)
+    return stats
+
+def frame_priority(msg_type):
+    '''
+    Returns the transmit scheduler class for a message type.
+    '''
+    if msg_type in BULK_TYPES:
+        return BULK
+    if msg_type in CHAT_TYPES:
+        return CHAT
+    return CONTROL
+
 class Me:
     '''
     Handles a connection to the local network.
     '''
-    def __init__(self, name: str, debug_mode: bool = False):
+    def __init__(self, name: str, debug_mode: bool = False, recorder: TraceRecorder = None,
+                 tickets: TicketCache = None, transports: list = None, mac: str = None,
+                 mesh: bool = False, chunk_store: ChunkStore = None, pacing: bool = True,
+                 receive_workers: int = 0, mtu_probing: bool = True, outbox: MessageOutbox = None,
+                 admission: bool = True, clock: Clock = None, roster: bool = True, radio=None):
         self.id = name
         self.name = name
         self.debug_mode = debug_mode
-
-        self.msg_id_counter = 1
+        self.recorder = recorder  # Optional pcap recorder for every frame sent or received
+        # Optional SharedRadio whose interfaces, schedulers and capture this
+        # identity uses alongside others (identities.py)
+        self.radio = radio
+        self.mac = mac or (radio.new_mac() if radio else get_mac(IFACE))
+        # Time, waits and timers; a VirtualClock runs the node without threads (simulation.py)
+        self.clock = clock or (radio.clock if radio else REAL_CLOCK)
+        # Where the tickets, outbox, chunk store and partial transfers go by
+        # default: the working directory, or our own one on a shared radio
+        self.state_dir = radio.state_dir(name) if radio else ''
+
+        # Every interface we send and listen on; transports[0] carries control traffic
+        self.transports = radio.transports if radio else transports or [open_transport(IFACE)]
+        # Optional receive processes per packet socket interface (fanout.py)
+        self.receive_pools = {t.name: ReceivePool(t.iface, receive_workers, self.mac, recorder is not None)
+                              for t in self.transports
+                              if receive_workers and not radio and isinstance(t, PacketTransport)}
+        self.link_stats = radio.link_stats if radio else {t.name: {
+            'frames_sent': 0, 'bytes_sent': 0, 'send_time': 0.0,
+            'frames_received': 0, 'duplicates': 0,
+            'chunks_sent': 0, 'chunks_lost': 0, 'loss': 0.0,
+        } for t in self.transports}
+        self.recent_frames = OrderedDict()  # (sender_mac, payload) of recent frames, for cross-link dedup
+        # Per-source and global rate limits on frames we decrypt, against floods
+        self.admission = AdmissionControl(clock=self.clock) if admission else None
+        # Each link is owned by a scheduler thread that sends its queued frames by priority
+        if radio:
+            self.schedulers = radio.schedulers
+        elif self.clock.virtual:
+            self.schedulers = {t.name: InlineScheduler(lambda pkt, t=t: self.transmit(pkt, t), t.name)
+                               for t in self.transports}
+        else:
+            self.schedulers = {t.name: TransmitScheduler(
+                lambda pkt, t=t: self.transmit(pkt, t), t.name,
+                (lambda pkts, t=t: self.transmit_batch(pkts, t)) if hasattr(t, 'send_batch') else None)
+                for t in self.transports}
+        self.pacing = pacing  # adapt each peer's file transfer rate to its FILE_PROGRESS reports
+        self.pacers = {}  # peer mac -> PacingController
+        self.mtu_probing = mtu_probing  # find each peer's largest deliverable chunk after the handshake
+        self.mtu_probes = {}  # probe msg_id -> {peer_id, mac, acked sizes}
+        self.probing_macs = set()  # peers with a probe running
+        self.ping_trains = {}  # PING msg_id -> {count, rtts: {seq: RTT} of the PONGs back so far, event once all are}
+        self.ping_stamps = {}  # queued PING frame -> (msg_id, seq, padding, dst), stamped as it is transmitted
+        self.chunk_links = {}  # file msg_id -> {seq: link name}, to attribute losses to links
+        self.sent_file_seqs = {}  # file msg_id -> chunk and parity seqs sent, to estimate loss from FILE_ACK
+
+        # Optional multi-hop relaying
+        self.routing = RoutingTable(self.mac, self.clock) if mesh else None
+        self.relay_seen = OrderedDict()  # (origin_mac, type, msg_id, seq) of flooded frames already forwarded
+
+        # One ephemeral key pair and nonce per run, so every REQ/ACK we send
+        # leads the peer to the same session key; that session is kept, so
+        # its frame counters never start again under the same key
+        self.keypair = generate_keypair()
+        self.public_key = export_public_key(self.keypair)
+        self.handshake_nonce = os.urandom(16)
+        self.sessions = {}  # peer mac -> Session
+        self.retired_sessions = {}  # peer mac -> Session of a peer that left, taken up again if it rejoins
+        self.handshake_answers = {}  # peer mac -> (key, nonce and tickets of the REQ its session answers, our ACK)
+        self.session_replaced = {}  # peer mac -> clock.monotonic() when a handshake last replaced its session
+        # peer mac -> (Session, public key) a handshake replaced, and the (peer id, resumption secret)
+        # to store once the peer sends under the new session; a frame under the old one restores it
+        self.replaced_sessions = {}
+        self.peer_keys = {}  # peer mac -> its ECDH public key, for the rosters we send
+        self.tickets = tickets if tickets is not None else TicketCache(os.path.join(self.state_dir, TICKETS_PATH))
+        # Joins are answered by one peer's roster rather than by everyone (roster.py)
+        self.roster = roster
+        self.join_answers = {}  # joiner mac -> {name, known: peer macs to list, told: macs it has heard of}, while we back off
+        self.joined = False  # a roster or HANDSHAKE_ACK came back after our announcement
+        self.listed_peers = {}  # mac -> id of a peer a roster listed, without mesh not known until heard directly
+
+        # Random start so a restarted peer isn't dropped as a duplicate of its previous run
+        self.msg_id_counter = random.randint(1, 9000)
 
         self.known_peers = {}
         self.received_messages = {}  # Track (sender_mac, msg_id, seq) to prevent duplicates
-        self.file_transfers = {}  # Track ongoing file transfers: {(sender_mac, msg_id): {filename, size, chunks, received_seqs}}
+        self.file_transfers = {}  # Track ongoing file transfers: {(sender_mac, msg_id): {filename, size, partial, received_seqs}}
+        self.resume_offers = {}  # file or manifest msg_id we're sending -> {event, missing chunk indexes, count of chunks}
+        self.manifests = {}  # (sender_mac, msg_id) -> incoming delta manifest
+        # Chunks of files received before
+        self.chunk_store = chunk_store if chunk_store is not None else ChunkStore(os.path.join(self.state_dir, STORE_DIR))
+        self.groups = {}  # group_id -> [peer_id, ...]
+        self.pending_group_acks = {}  # msg_id -> {group_id, members, data, acked, attempt, latest_by}
+        # Messages for peers out of reach, sent as MSG_BUNDLEs once they're heard from again
+        self.outbox = (outbox if outbox is not None
+                       else MessageOutbox(os.path.join(self.state_dir, OUTBOX_PATH), self.clock))
+        self.outbox_bundles = {}  # MSG_BUNDLE msg_id -> bundle waiting for its MSG_ACK
+        self.flushing = set()  # peer ids with an outbox flush running
 
         self.message_listeners = []
+        self.group_message_listeners = []
+        self.peer_listeners = []
+        self.frame_handlers = {  # frame types Me handles itself; others go to frame listeners
+            MsgType.HANDSHAKE_REQ: self.on_handshake_req,
+            MsgType.HANDSHAKE_ACK: self.on_handshake_ack,
+            MsgType.ROSTER: self.on_roster,
+            MsgType.MSG_ACK: self.on_msg_ack,
+            MsgType.RENAME: self.on_rename,
+            MsgType.RENAME_ACK: self.on_rename_ack,
+            MsgType.TERMINATE: self.on_terminate,
+            MsgType.HEARTBEAT: self.on_heartbeat,
+            MsgType.HOST_HEARTBEAT: self.on_host_heartbeat,
+            MsgType.RELAY: self.on_relay,
+            MsgType.MSG: self.on_msg,
+            MsgType.MSG_BUNDLE: self.on_msg_bundle,
+            MsgType.GROUP_MSG: self.on_group_msg,
+            MsgType.GROUP_ACK: self.on_group_ack,
+            MsgType.FILE_INIT: self.on_file_init,
+            MsgType.FILE_RESUME: self.on_file_offer,
+            MsgType.FILE_HAVE: self.on_file_offer,
+            MsgType.FILE_MANIFEST: self.on_file_manifest,
+            MsgType.FILE_CHUNK: self.on_file_chunk,
+            MsgType.FILE_PARITY: self.on_file_parity,
+            MsgType.FILE_PROGRESS: self.on_file_progress,
+            MsgType.FILE_END: self.on_file_end,
+            MsgType.FILE_ACK: self.on_file_ack,
+            MsgType.MTU_PROBE: self.on_mtu_probe,
+            MsgType.MTU_ACK: self.on_mtu_ack,
+        }
+        self.frame_listeners = {}  # msg type -> callbacks for types handled outside Me
 
         self.timeout_ack_thread = threading.Thread(target=self.timeout_ack, daemon=True)
-        self.frame_listener_thread = threading.Thread(target=self.frame_listener, daemon=True)
+        self.frame_listener_threads = [threading.Thread(target=self.frame_listener, args=(t,), daemon=True)
+                                       for t in self.transports if not radio]
         self.announcer_thread = threading.Thread(target=self.announcer, daemon=True)
 
     def get_next_msg_id(self):
@@ -62,18 +262,22 @@ class Me:
         # Print message when a new peer is added
         if is_new_peer and 'name' in info:
             print(f'{info["name"]} has joined the network')
+            for callback in self.peer_listeners:
+                callback(id)
 
     def should_stop_timeout_ack(self):
         '''
         Returns true if there are no expected acks from any peers.
         '''
+        if self.pending_group_acks:
+            return False
         return not self.known_peers or not any('expected_ack' in p for p in self.known_peers.values())
 
     def cleanup_old_messages(self):
         '''
         Remove received message entries older than 90 seconds to prevent memory growth.
         '''
-        current_time = time.time()
+        current_time = self.clock.time()
         cutoff_time = current_time - 90  # 90 seconds
         
         # Create a new dict with only recent messages
@@ -88,33 +292,85 @@ class Me:
         '''
         while True:
             waiting_for_ack.wait()
-            for id, peer in self.known_peers.items():
-                if 'expected_ack' not in peer:
-                    continue
-                ack = peer['expected_ack']
-                if time.time() > ack['latest_by']:
-                    if ack['attempt'] >= 5:
-                        # Check if peer ID is still in known peers
-                        if id in self.known_peers:
-                            if ack.get('type') == 'file':
-                                print(f'File transfer failed: No ACK received after 5 attempts from {id}')
-                                # Don't remove peer for file transfer failures, just clear the expected ACK
-                                del self.known_peers[id]['expected_ack']
-                            else:
-                                print('No ACK received after 5 attempts, removing peer')
-                                del self.known_peers[id]
-                            
-                            if self.should_stop_timeout_ack():
-                                waiting_for_ack.clear()
-                        break
-
-                    ack['attempt'] += 1
-                    if ack.get('type') == 'file':
-                        # Longer timeout for file transfers (starts at 500ms, doubles each retry)
-                        ack['latest_by'] = time.time() + (0.5 * (2 ** ack['attempt']))
-                    else:
-                        # Regular message timeout (starts at 50ms, doubles each retry)
-                        ack['latest_by'] = time.time() + (0.05 * (2 ** ack['attempt']))
+            # Deadlines are tens of ms apart; polling faster only steals the GIL from the scheduler threads
+            self.clock.sleep(ACK_POLL_INTERVAL)
+            self.check_acks()
+
+    def expect_ack_by(self, deadline):
+        '''
+        Makes sure ACK deadlines are checked again after deadline: wakes
+        timeout_ack, or under a virtual clock, where there is no such
+        thread, schedules a check for when the poll would have run.
+        '''
+        if self.clock.virtual:
+            self.clock.call_at(deadline + ACK_POLL_INTERVAL, self.check_acks)
+        else:
+            waiting_for_ack.set()
+
+    def check_acks(self):
+        '''
+        Gives up on, or extends the deadline of, every ACK that's overdue.
+        '''
+        self.check_group_acks()
+        for id, peer in self.known_peers.items():
+            if 'expected_ack' not in peer:
+                continue
+            ack = peer['expected_ack']
+            if self.clock.time() > ack['latest_by']:
+                if ack['attempt'] >= 5:
+                    # Check if peer ID is still in known peers
+                    if id in self.known_peers:
+                        if ack.get('type') == 'file':
+                            print(f'File transfer failed: No ACK received after 5 attempts from {id}')
+                            # Don't remove peer for file transfer failures, just clear the expected ACK
+                            del self.known_peers[id]['expected_ack']
+                        else:
+                            print('No ACK received after 5 attempts, removing peer')
+                            if self.routing and 'mac' in peer:
+                                self.routing.remove_neighbor(peer['mac'])
+                            del self.known_peers[id]
+                            # The message waits in the outbox until we hear from the peer again
+                            if 'message_id' in ack:
+                                self.outbox.remember_mac(id, peer['mac'])
+                                self.outbox.set_status([ack['message_id']], QUEUED)
+                        
+                        if self.should_stop_timeout_ack():
+                            waiting_for_ack.clear()
+                    break
+
+                ack['attempt'] += 1
+                if ack.get('type') == 'file':
+                    # Longer timeout for file transfers (starts at 500ms, doubles each retry)
+                    ack['latest_by'] = self.clock.time() + (0.5 * (2 ** ack['attempt']))
+                else:
+                    # Regular message timeout (starts at 50ms, doubles each retry)
+                    ack['latest_by'] = self.clock.time() + (0.05 * (2 ** ack['attempt']))
+                self.expect_ack_by(ack['latest_by'])
+
+    def check_group_acks(self):
+        '''
+        Retransmits group messages whose ACK deadline passed, but only to the
+        members whose bit is still missing from the ACK bitmap.
+        '''
+        for msg_id, pending in list(self.pending_group_acks.items()):
+            if self.clock.time() <= pending['latest_by']:
+                continue
+
+            missing = [(i, member) for i, member in enumerate(pending['members'])
+                       if not pending['acked'] & (1 << i)]
+            if pending['attempt'] >= 5:
+                names = ', '.join(peer_id for _, (peer_id, _) in missing)
+                print(f'Group message {msg_id} to {pending["group_id"]} not acknowledged by: {names}')
+                del self.pending_group_acks[msg_id]
+                if self.should_stop_timeout_ack():
+                    waiting_for_ack.clear()
+                continue
+
+            pending['attempt'] += 1
+            pending['latest_by'] = self.clock.time() + (0.1 * (2 ** pending['attempt']))
+            self.expect_ack_by(pending['latest_by'])
+            for _, (_, mac) in missing:
+                self.send(MsgType.GROUP_MSG, msg_id, 1, pending['data'], mac)
 
     def register_message_listener(self, callback):
         '''
@@ -129,337 +385,1406 @@ class Me:
         '''
         self.message_listeners.remove(callback)
 
-    def frame_listener(self):
+    def register_group_message_listener(self, callback):
         '''
-        Listens for all frame types and handles them appropriately.
+        Registers a callback(group_id, sender_id, text) to be called when a
+        group message is received.
         '''
-        def handler(pkt):
-            if pkt.haslayer(Dot11):
-                dot11 = pkt[Dot11]
-                # Only process our frames with the right pseudo-BSSID
-                if dot11.addr3 == "02:07:08:15:19:20" and pkt.haslayer(Raw):
-                    payload = pkt[Raw].load
-                    parsed = parse_payload(payload)
-                    if parsed:
-                        msg_type, msg_id, seq, encrypted_data = parsed
-                        sender_mac = dot11.addr2
-                        
-                        # Decrypt the data
-                        try:
-                            data = decrypt_data(encrypted_data) if encrypted_data else ""
-                        except Exception as e:
-                            if self.debug_mode:
-                                print(f"[!] Decryption failed for frame from {sender_mac}: {e}")
-                            return
-                        
-                        if self.debug_mode:
-                            print(f"[+] Received frame: Type={msg_type.name}, ID={msg_id}, Seq={seq}, From={sender_mac}, Data='{data}'")
-                        
-                        # Skip our own frames
-                        if sender_mac == SRC_MAC:
-                            if self.debug_mode:
-                                print(f"[*] Ignoring own frame")
-                            return
-                        
-                        if msg_type == MsgType.HANDSHAKE_REQ:
-                            # Check for duplicate handshake requests
-                            message_key = (sender_mac, msg_id, seq)
-                            if message_key in self.received_messages:
-                                if self.debug_mode:
-                                    print(f"[*] Ignoring duplicate handshake request: ID={msg_id}, Seq={seq} from {sender_mac}")
-                                return
-                            
-                            # Record this handshake as received
-                            self.received_messages[message_key] = time.time()
-                            
-                            # Parse handshake request: "port|name" format
-                            parts = data.split('|')
-                            if len(parts) >= 2:
-                                peer_id = parts[1]  # Use name as ID for now
-                                if peer_id != id:  # Don't add ourselves
-                                    # Check if this is a new peer
-                                    is_new_peer = peer_id not in self.known_peers
-                                    self.update_peer(peer_id, {
-                                        'name': peer_id,
-                                        'mac': sender_mac,  # Source MAC
-                                        'last_seen': time.time(),
-                                    })
-                                    
-                                    # Send handshake acknowledgment
-                                    ack_data = f"0|{self.name}"  # port not used, just name
-                                    send_frame(MsgType.HANDSHAKE_ACK, self.get_next_msg_id(), 0, 
-                                             ack_data, IFACE, sender_mac, SRC_MAC, self.debug_mode)
-
-                                    # If this is a new peer, also send a handshake request back for mutual discovery
-                                    if is_new_peer:
-                                        req_data = f"0|{self.name}"  # port not used, just name
-                                        send_frame(MsgType.HANDSHAKE_REQ, self.get_next_msg_id(), 0, 
-                                                 req_data, IFACE, sender_mac, SRC_MAC, self.debug_mode)
-
-                        elif msg_type == MsgType.HANDSHAKE_ACK:
-                            # Check for duplicate handshake acks
-                            message_key = (sender_mac, msg_id, seq)
-                            if message_key in self.received_messages:
-                                if self.debug_mode:
-                                    print(f"[*] Ignoring duplicate handshake ack: ID={msg_id}, Seq={seq} from {sender_mac}")
-                                return
-                            
-                            # Record this handshake ack as received
-                            self.received_messages[message_key] = time.time()
-                            
-                            # Parse handshake ack: "port|name" format
-                            parts = data.split('|')
-                            if len(parts) >= 2:
-                                peer_id = parts[1]
-                                if peer_id != id:
-                                    self.update_peer(peer_id, {
-                                        'name': peer_id,
-                                        'mac': sender_mac,
-                                        'last_seen': time.time(),
-                                    })
-
-                        elif msg_type == MsgType.MSG_ACK:
-                            # Parse ACK: "msg_id|seq" format
-                            parts = data.split('|')
-                            if len(parts) >= 2:
-                                ack_msg_id = int(parts[0])
-                                ack_seq = int(parts[1])
-                                
-                                # Find peer by MAC address
-                                peer_id = None
-                                for pid, pinfo in self.known_peers.items():
-                                    if pinfo.get('mac') == sender_mac:
-                                        peer_id = pid
-                                        break
-                                
-                                if peer_id and peer_id in self.known_peers:
-                                    peer = self.known_peers[peer_id]
-                                    if 'expected_ack' in peer and peer['expected_ack']['msg_id'] == ack_msg_id:
-                                        del peer['expected_ack']
-                                        if self.should_stop_timeout_ack():
-                                            waiting_for_ack.clear()
-                                        print('ACK received from', peer_id, 'for msg_id', ack_msg_id)
-                                    else:
-                                        print('ACK received from', peer_id, 'for unknown msg_id', ack_msg_id, '(maybe sent late?)')
-
-                        elif msg_type == MsgType.RENAME:
-                            # Find sender by MAC address
-                            sender_id = None
-                            for pid, pinfo in self.known_peers.items():
-                                if pinfo.get('mac') == sender_mac:
-                                    sender_id = pid
-                                    break
-
-                            if sender_id and sender_id in self.known_peers:
-                                old_name = self.known_peers[sender_id]['name']
-                                self.known_peers[sender_id]['name'] = data
-                                print(f'{old_name} has renamed to {data}')
-
-                                # TODO temp: also change the peer ID to the new name
-                                self.known_peers[data] = self.known_peers.pop(sender_id)
-
-                                # Send RENAME_ACK
-                                send_frame(MsgType.RENAME_ACK, self.get_next_msg_id(), 0, 
-                                         "", IFACE, sender_mac, SRC_MAC, self.debug_mode)
-
-                        elif msg_type == MsgType.RENAME_ACK:
-                            # No action needed for RENAME_ACK currently
-                            pass
-
-                        elif msg_type == MsgType.TERMINATE:
-                            # Find sender by MAC address and remove from peers
-                            sender_id = None
-                            for pid, pinfo in self.known_peers.items():
-                                if pinfo.get('mac') == sender_mac:
-                                    sender_id = pid
-                                    break
-                            
-                            if sender_id and sender_id in self.known_peers:
-                                sender_name = self.known_peers[sender_id]['name']
-                                del self.known_peers[sender_id]
-                                print(f'{sender_name} has left the network')
-
-                        elif msg_type == MsgType.HEARTBEAT:
-                            # Update last_seen for known peers on heartbeat
-                            for pid, pinfo in self.known_peers.items():
-                                if pinfo.get('mac') == sender_mac:
-                                    pinfo['last_seen'] = time.time()
-                                    if self.debug_mode:
-                                        print(f"[*] Heartbeat from {pinfo['name']}")
-                                    break
-
-                        elif msg_type == MsgType.MSG:
-                            # Check for duplicate messages
-                            message_key = (sender_mac, msg_id, seq)
-                            if message_key in self.received_messages:
-                                if self.debug_mode:
-                                    print(f"[*] Ignoring duplicate message: ID={msg_id}, Seq={seq} from {sender_mac}")
-                                return
-                            
-                            # Record this message as received
-                            self.received_messages[message_key] = time.time()
-                            
-                            # Find sender by MAC address
-                            sender_id = None
-                            for pid, pinfo in self.known_peers.items():
-                                if pinfo.get('mac') == sender_mac:
-                                    sender_id = pid
-                                    break
-                            
-                            if sender_id:
-                                # Small delay to make sure sender has updated state
-                                # TODO: This should be a temporary solution but it's the easiest I could think of for now
-                                time.sleep(0.001)
-                                
-                                # Send acknowledgment
-                                ack_data = f"{msg_id}|{seq}"
-                                send_frame(MsgType.MSG_ACK, self.get_next_msg_id(), 0, 
-                                         ack_data, IFACE, sender_mac, SRC_MAC, self.debug_mode)
-                                
-                                sender_name = self.known_peers.get(sender_id, {'name': 'Unknown'})['name']
-                                print(f'{sender_name} -> {self.name}: {data}')
-
-                                # Notify listeners
-                                for callback in self.message_listeners:
-                                    callback(sender_id, data)
-                            
-                            # Periodically clean up old message records
-                            if len(self.received_messages) > 100:  # Clean up when we have many entries
-                                self.cleanup_old_messages()
-
-                        elif msg_type == MsgType.FILE_INIT:
-                            # Check for duplicate file init
-                            message_key = (sender_mac, msg_id, seq)
-                            if message_key in self.received_messages:
-                                if self.debug_mode:
-                                    print(f"[*] Ignoring duplicate file init: ID={msg_id}, Seq={seq} from {sender_mac}")
-                                return
-                            
-                            # Record this file init as received
-                            self.received_messages[message_key] = time.time()
-                            
-                            # Parse file init: "filename|size" format
-                            parts = data.split('|')
-                            if len(parts) >= 2:
-                                filename = parts[0]
-                                file_size = int(parts[1])
-                                
-                                # Initialize file transfer tracking
-                                transfer_key = (sender_mac, msg_id)
-                                self.file_transfers[transfer_key] = {
-                                    'filename': filename,
-                                    'size': file_size,
-                                    'chunks': {},
-                                    'received_seqs': set()
-                                }
-                                
-                                # Find sender name
-                                sender_name = "Unknown"
-                                for pid, pinfo in self.known_peers.items():
-                                    if pinfo.get('mac') == sender_mac:
-                                        sender_name = pinfo['name']
-                                        break
-                                
-                                print(f'Receiving file {filename} ({file_size} bytes) from {sender_name}...')
-
-                        elif msg_type == MsgType.FILE_CHUNK:
-                            # Check for duplicate file chunk
-                            message_key = (sender_mac, msg_id, seq)
-                            if message_key in self.received_messages:
-                                if self.debug_mode:
-                                    print(f"[*] Ignoring duplicate file chunk: ID={msg_id}, Seq={seq} from {sender_mac}")
-                                return
-                            
-                            # Record this file chunk as received
-                            self.received_messages[message_key] = time.time()
-                            
-                            # Store chunk data
-                            transfer_key = (sender_mac, msg_id)
-                            if transfer_key in self.file_transfers:
-                                transfer = self.file_transfers[transfer_key]
-                                # Decode base64 chunk data
-                                try:
-                                    chunk_data = base64.b64decode(data.encode('ascii'))
-                                    transfer['chunks'][seq] = chunk_data
-                                    transfer['received_seqs'].add(seq)
-                                    
-                                    if self.debug_mode:
-                                        print(f"[*] Received file chunk {seq} ({len(chunk_data)} bytes)")
-                                except Exception as e:
-                                    print(f"Error decoding file chunk: {e}")
-
-                        elif msg_type == MsgType.FILE_END:
-                            # Check for duplicate file end
-                            message_key = (sender_mac, msg_id, seq)
-                            if message_key in self.received_messages:
-                                if self.debug_mode:
-                                    print(f"[*] Ignoring duplicate file end: ID={msg_id}, Seq={seq} from {sender_mac}")
-                                return
-                            
-                            # Record this file end as received
-                            self.received_messages[message_key] = time.time()
-                            
-                            # Finalize file transfer
-                            transfer_key = (sender_mac, msg_id)
-                            if transfer_key in self.file_transfers:
-                                transfer = self.file_transfers[transfer_key]
-                                transfer['received_seqs'].add(seq)  # Add FILE_END seq
-                                
-                                # Send FILE_ACK with received sequence numbers
-                                received_seqs_str = ','.join(map(str, sorted(transfer['received_seqs'])))
-                                ack_data = f"{msg_id}|{received_seqs_str}"
-                                send_frame(MsgType.FILE_ACK, self.get_next_msg_id(), 0, 
-                                         ack_data, IFACE, sender_mac, SRC_MAC, self.debug_mode)
-                                
-                                # Reassemble and save file
-                                self.reassemble_file(transfer_key)
-
-                        elif msg_type == MsgType.FILE_ACK:
-                            # Parse FILE_ACK: "msg_id|seq1,seq2,seq3..." format
-                            parts = data.split('|')
-                            if len(parts) >= 2:
-                                ack_msg_id = int(parts[0])
-                                received_seqs = set(map(int, parts[1].split(','))) if parts[1] else set()
-                                
-                                # Find peer by MAC address
-                                peer_id = None
-                                for pid, pinfo in self.known_peers.items():
-                                    if pinfo.get('mac') == sender_mac:
-                                        peer_id = pid
-                                        break
-                                
-                                if peer_id and peer_id in self.known_peers:
-                                    peer = self.known_peers[peer_id]
-                                    peer_name = peer['name']
-                                    
-                                    # Clear expected ACK if this matches
-                                    if 'expected_ack' in peer and peer['expected_ack']['msg_id'] == ack_msg_id:
-                                        del peer['expected_ack']
-                                        if self.should_stop_timeout_ack():
-                                            waiting_for_ack.clear()
-                                        print(f'File transfer completed! ACK received from {peer_name}: {len(received_seqs)} chunks for msg_id {ack_msg_id}')
-                                    else:
-                                        print(f'File transfer ACK from {peer_name}: received {len(received_seqs)} chunks for msg_id {ack_msg_id} (maybe sent late?)')
-                    else:
+        self.group_message_listeners.append(callback)
+
+    def register_peer_listener(self, callback):
+        '''
+        Registers a callback(peer_id) to be called when a peer joins, or
+        comes back after it was dropped.
+        '''
+        self.peer_listeners.append(callback)
+
+    def register_frame_listener(self, msg_type, callback):
+        '''
+        Registers a callback(peer_id, msg_id, seq, data) for decrypted
+        frames of a type Me leaves to others, from known peers.
+        '''
+        self.frame_listeners.setdefault(msg_type, []).append(callback)
+
+    def transmit(self, pkt, link=None):
+        '''
+        Puts a fully built frame on the air, on the given transport or the
+        primary one. Called from the link's scheduler thread. Replay and test
+        harnesses override this to run without a radio.
+        '''
+        link = link or self.transports[0]
+        if self.ping_stamps:
+            pkt = self.stamp_ping(pkt)
+        start_time = time.perf_counter()
+        link.send(pkt)
+        stats = self.link_stats[link.name]
+        stats['send_time'] += time.perf_counter() - start_time
+        stats['frames_sent'] += 1
+        stats['bytes_sent'] += len(pkt)
+
+    def transmit_batch(self, pkts, link):
+        '''
+        Puts several frames on a link that can send them in one call
+        (PacketTransport.send_batch). Called from the link's scheduler thread.
+        '''
+        if self.ping_stamps:
+            pkts = [self.stamp_ping(pkt) for pkt in pkts]
+        start_time = time.perf_counter()
+        link.send_batch(pkts)
+        stats = self.link_stats[link.name]
+        stats['send_time'] += time.perf_counter() - start_time
+        stats['frames_sent'] += len(pkts)
+        stats['bytes_sent'] += sum(len(pkt) for pkt in pkts)
+
+    def stamp_ping(self, pkt):
+        '''
+        Rebuilds a queued PING with the time it goes on the air, so its RTT
+        leaves out the time it waited in the scheduler.
+        '''
+        entry = self.ping_stamps.pop(pkt, None)
+        if entry is None:
+            return pkt
+        msg_id, seq, padding, dst = entry
+        pkt = build_frame(MsgType.PING, msg_id, seq, f"{self.clock.monotonic():.6f}|{padding}", dst, self.mac)
+        if self.recorder:
+            self.recorder.record(pkt)
+        return pkt
+
+    def send(self, msg_type, msg_id, seq, data, dst, link=None, priority=None, block=True):
+        '''
+        Builds, queues for transmission and (if enabled) records a frame from
+        this peer. Bulk frames block while the peer's bulk queue is full,
+        unless block is False, in which case they are dropped.
+        '''
+        if priority is None:
+            priority = frame_priority(msg_type)
+        if msg_type in PACED_TYPES:
+            self.pacer_for(dst).on_sent(msg_id, seq)
+        if self.routing and msg_type in RELAYED_TYPES:
+            # Wrap frames for peers out of radio range, and floods, in a RELAY frame
+            next_hop = BROADCAST_MAC if dst == BROADCAST_MAC else self.routing.next_hop(dst)
+            if (next_hop and next_hop != dst) or (dst == BROADCAST_MAC and msg_type in FLOODED_TYPES):
+                # The inner data is encrypted end to end under our session with dst, once dst has
+                # shown it holds it, so relays only read the outer header
+                session = self.sessions.get(dst)
+                if session is not None and not session.confirmed(dst):
+                    session = None
+                inner_data = encrypt_payload(msg_type, msg_id, seq, data, self.mac, session)
+                relay_data = f"{RELAY_TTL}|{compact_mac(self.mac)}|{compact_mac(dst)}|{int(msg_type)}|{inner_data}"
+                return self.send(MsgType.RELAY, msg_id, seq, relay_data, next_hop, link, priority, block)
+
+        session = None
+        if msg_type not in SHARED_KEY_TYPES:
+            session = self.sessions.get(dst)
+        pkt = build_frame(msg_type, msg_id, seq, data, dst, self.mac, session)
+        link = link or self.transports[0]
+        if not self.schedulers[link.name].enqueue(pkt, dst, priority, block):
+            if self.debug_mode:
+                print(f"[*] Bulk queue to {dst} full, dropping frame: Type={msg_type.name}, ID={msg_id}, Seq={seq}")
+            return None
+        if self.recorder:
+            self.recorder.record(pkt)
+        if self.debug_mode:
+            timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+            print(f"[{timestamp}] Sent frame (encrypted): {parse_frame(pkt)[3]!r}")
+        return pkt
+
+    def handle_frame(self, pkt, link=None):
+        '''
+        Handles a single captured frame (raw RadioTap/802.11 bytes, or a
+        memoryview only valid during the call), dispatching on its message type.
+        '''
+        header = parse_frame(pkt)
+        if header:
+            dst_mac, sender_mac, bssid, payload = header
+            # Only process our frames with the right pseudo-BSSID
+            if bssid == BSSID and payload:
+                # Monitor mode hears unicast traffic between other peers too
+                if dst_mac not in (self.mac, BROADCAST_MAC):
+                    return
+
+                if link is not None and not self.count_received(link, (sender_mac, payload)):
+                    return
+
+                # Our own transmissions are already recorded by send()
+                if self.recorder and sender_mac != self.mac:
+                    self.recorder.record(pkt)
+
+                parsed = parse_payload(payload)
+                if parsed:
+                    msg_type, msg_id, seq, encrypted_data = parsed
+                    header = frame_header(msg_type, msg_id, seq)
+                    if not self.admit(sender_mac, encrypted_data, header=header, msg_type=msg_type):
+                        return
+                    if msg_type in (MsgType.PING, MsgType.PONG):
+                        self.handle_ping(msg_type, msg_id, seq, encrypted_data, sender_mac, link)
+                        return
+
+                    # Decrypt the data
+                    try:
+                        data = self.decrypt_frame(encrypted_data, sender_mac, header)
+                    except Exception as e:
                         if self.debug_mode:
-                            print(f"[!] Received unparseable frame payload: {payload!r}")
+                            print(f"[!] Decryption failed for frame from {sender_mac}: {e}")
+                        return
+                    self.handle_decrypted(msg_type, msg_id, seq, data, sender_mac)
+                else:
+                    if self.debug_mode:
+                        print(f"[!] Received unparseable frame payload: {payload!r}")
+
+    def handle_decoded(self, item, link, counted=False):
+        '''
+        Handles a frame a receive worker (see fanout.decode_frame) or a
+        SharedRadio has already parsed and, if it could, decrypted.
+        counted: the radio already counted it in link_stats.
+        '''
+        sender_mac, msg_type, msg_id, seq, data, encrypted_data, frame_key, pkt = item
+        if not counted and not self.count_received(link, frame_key):
+            return
+        if self.recorder and pkt and sender_mac != self.mac:
+            self.recorder.record(pkt)
+        header = frame_header(msg_type, msg_id, seq)
+        if not self.admit(sender_mac, encrypted_data, verified=data is not None, header=header, msg_type=msg_type):
+            return
+        if msg_type in (MsgType.PING, MsgType.PONG):
+            self.handle_ping(msg_type, msg_id, seq, encrypted_data, sender_mac, link)
+            return
+        if data is None:
+            try:
+                data = self.decrypt_frame(encrypted_data, sender_mac, header)
+            except Exception as e:
+                if self.debug_mode:
+                    print(f"[!] Decryption failed for frame from {sender_mac}: {e}")
+                return
+        self.handle_decrypted(msg_type, msg_id, seq, data, sender_mac)
+
+    def handle_ping(self, msg_type, msg_id, seq, encrypted_data, sender_mac, link):
+        '''
+        Fast path for latency probes, taken before decryption and dispatch
+        so they time the link rather than our frame handling. A PING is
+        echoed straight back as a PONG with its body still encrypted; a
+        PONG is timestamped before its body is decrypted for the send time.
+        '''
+        if sender_mac == self.mac:
+            return
+        if msg_type == MsgType.PING:
+            pkt = build_encrypted_frame(MsgType.PONG, msg_id, seq, encrypted_data, sender_mac, self.mac)
+            link = link or self.transports[0]
+            self.schedulers[link.name].enqueue(pkt, sender_mac, CONTROL, False)
+            if self.recorder:
+                self.recorder.record(pkt)
+            return
+        received = self.clock.monotonic()
+        train = self.ping_trains.get(msg_id)
+        if train is None or seq in train['rtts']:
+            return
+        try:
+            sent = float(decrypt_data(encrypted_data).split('|', 1)[0])
+        except ValueError:
+            return
+        train['rtts'][seq] = received - sent
+        if len(train['rtts']) >= train['count']:
+            train['event'].set()
+
+    def admit(self, sender_mac, encrypted_data, verified=False, header=b'', msg_type=None):
+        '''
+        Admission stage ahead of decryption: returns False for frames that
+        are forged or over their source's rate, which are dropped unread.
+        '''
+        if self.replaced_sessions:
+            self.check_replaced_session(sender_mac, encrypted_data, header)
+        if self.admission is None or sender_mac == self.mac:
+            return True
+        if self.radio and sender_mac in self.radio.identities:
+            return True  # looped back by our radio; captured frames with these MACs never get here
+        return self.admission.admit_frame(sender_mac, encrypted_data, self.sessions.get(sender_mac), verified,
+                                          header, msg_type)
+
+    def count_received(self, link, frame_key):
+        '''
+        Counts a frame received on link. Returns False if the same
+        transmission was already heard on another of our interfaces.
+        '''
+        stats = self.link_stats[link.name]
+        stats['frames_received'] += 1
+        if len(self.transports) > 1:
+            if frame_key in self.recent_frames:
+                stats['duplicates'] += 1
+                return False
+            self.recent_frames[frame_key] = True
+            if len(self.recent_frames) > RECENT_FRAMES_SIZE:
+                self.recent_frames.popitem(last=False)
+        return True
+
+    def decrypt_frame(self, encrypted_data, sender_mac, header=b''):
+        '''
+        Decrypts frame data with the sender's session, or the shared key.
+        header: the frame's frame_header, which a session tag covers.
+        Raises ValueError if it can't.
+        '''
+        if encrypted_data.startswith(SESSION_PREFIX):
+            session = self.sessions.get(sender_mac)
+            if session is None:
+                raise ValueError("no session with sender")
+            return session.decrypt(encrypted_data, sender_mac, header)
+        return decrypt_data(encrypted_data) if encrypted_data else ""
+
+    def open_relayed(self, msg_type, msg_id, seq, inner_data, origin_mac):
+        '''
+        Decrypts the inner data of a RELAY frame, which the origin encrypted
+        under its session with us, or with the shared key for a flood or
+        before it had heard from us under the session. Returns None if it
+        can't be read.
+        '''
+        try:
+            return self.decrypt_frame(inner_data, origin_mac, frame_header(msg_type, msg_id, seq))
+        except ValueError as e:
+            if self.debug_mode:
+                print(f"[*] Dropping relayed frame from {origin_mac}: {e}")
+            return None
+
+    def handle_decrypted(self, msg_type, msg_id, seq, data, sender_mac):
+        if self.debug_mode:
+            print(f"[+] Received frame: Type={msg_type.name}, ID={msg_id}, Seq={seq}, From={sender_mac}, Data='{data}'")
+        
+        # Skip our own frames
+        if sender_mac == self.mac:
+            if self.debug_mode:
+                print(f"[*] Ignoring own frame")
+            return
+        
+        self.dispatch(msg_type, msg_id, seq, data, sender_mac)
+
+    def dispatch(self, msg_type, msg_id, seq, data, sender_mac):
+        '''
+        Handles a decrypted frame from sender_mac with the handler for its
+        message type (frame_handlers), or hands it to the frame listeners
+        registered for that type.
+        '''
+        handler = self.frame_handlers.get(msg_type)
+        if handler is not None:
+            handler(msg_id, seq, data, sender_mac)
+        elif msg_type in self.frame_listeners:
+            sender_id = next((pid for pid, pinfo in list(self.known_peers.items())
+                              if pinfo.get('mac') == sender_mac), None)
+            if sender_id:
+                for callback in self.frame_listeners[msg_type]:
+                    callback(sender_id, msg_id, seq, data)
+
+    def on_handshake_req(self, msg_id, seq, data, sender_mac):
+        '''
+        A peer announcing itself, or joining: sets up a session and answers
+        with a HANDSHAKE_ACK, or leaves the answer to a roster.
+        '''
+        # Check for duplicate handshake requests
+        message_key = (sender_mac, msg_id, seq)
+        if message_key in self.received_messages:
+            if self.debug_mode:
+                print(f"[*] Ignoring duplicate handshake request: ID={msg_id}, Seq={seq} from {sender_mac}")
+            return
+        
+        # Record this handshake as received
+        self.received_messages[message_key] = self.clock.time()
+        
+        # Parse handshake request: "port|name|public_key|nonce|ticket_ids[|r]" format
+        parts = data.split('|')
+        if len(parts) >= 2:
+            peer_id = parts[1]  # Use name as ID for now
+            if peer_id != id:  # Don't add ourselves
+                # Check if this is a new peer
+                is_new_peer = peer_id not in self.known_peers
+                self.update_peer(peer_id, {
+                    'name': peer_id,
+                    'mac': sender_mac,  # Source MAC
+                    'last_seen': self.clock.time(),
+                    'hops': 1,
+                })
+                if self.routing:
+                    self.routing.add_neighbor(sender_mac, peer_id)
+                
+                if self.roster and len(parts) >= 6 and parts[5] == 'r':
+                    # A joiner that takes rosters: set the session up from its key
+                    # (a full ECDH, which it can mirror from a roster) and leave the
+                    # answer to whoever backs off the least
+                    if self.peer_keys.get(sender_mac) != parts[2] or sender_mac not in self.sessions:
+                        self.accept_handshake(peer_id, sender_mac, parts[:4])
+                        if self.mtu_probing:
+                            self.start_mtu_probe(peer_id)
+                    self.answer_join(peer_id, sender_mac)
+                    self.flush_outbox(peer_id, HANDSHAKE_SETTLE)
+                    return
+
+                # Send handshake acknowledgment
+                ack_data = f"0|{self.name}"  # port not used, just name
+                if len(parts) >= 4:
+                    ack_data = self.accept_handshake(peer_id, sender_mac, parts)
+                    if ack_data is None:
+                        return
+                self.send(MsgType.HANDSHAKE_ACK, self.get_next_msg_id(), 0,
+                         ack_data, sender_mac)
+
+                # If this is a new peer, also send a handshake request back for mutual discovery
+                if is_new_peer:
+                    self.send(MsgType.HANDSHAKE_REQ, self.get_next_msg_id(), 0,
+                             self.handshake_data(), sender_mac)
+                self.flush_outbox(peer_id, HANDSHAKE_SETTLE)
+
+    def on_handshake_ack(self, msg_id, seq, data, sender_mac):
+        '''
+        The answer to our HANDSHAKE_REQ: sets up our side of the session.
+        '''
+        # Check for duplicate handshake acks
+        message_key = (sender_mac, msg_id, seq)
+        if message_key in self.received_messages:
+            if self.debug_mode:
+                print(f"[*] Ignoring duplicate handshake ack: ID={msg_id}, Seq={seq} from {sender_mac}")
+            return
+        
+        # Record this handshake ack as received
+        self.received_messages[message_key] = self.clock.time()
+        
+        # Parse handshake ack: "port|name|public_key" or "port|name|R|ticket_id|nonce" format
+        parts = data.split('|')
+        if len(parts) >= 2:
+            peer_id = parts[1]
+            if peer_id != id:
+                self.update_peer(peer_id, {
+                    'name': peer_id,
+                    'mac': sender_mac,
+                    'last_seen': self.clock.time(),
+                    'hops': 1,
+                })
+                if self.routing:
+                    self.routing.add_neighbor(sender_mac, peer_id)
+                if len(parts) >= 3:
+                    self.complete_handshake(peer_id, sender_mac, parts)
+                self.joined = True
+                if self.mtu_probing:
+                    self.start_mtu_probe(peer_id)
+                self.flush_outbox(peer_id, HANDSHAKE_SETTLE)
+
+    def on_roster(self, msg_id, seq, data, sender_mac):
+        '''
+        Someone answered a join: everyone in it gets a session, and a roster
+        for a joiner we're backing off for may make our answer redundant.
+        '''
+        joiner_mac, entries = decode_roster(data)
+        if joiner_mac == self.mac:
+            self.joined = True
+        answer = self.join_answers.get(joiner_mac)
+        if answer:
+            answer['told'].add(sender_mac)
+            answer['told'].update(mac for mac, _, _ in entries)
+        for mac, public_key, name in entries:
+            self.learn_peer(name, mac, public_key, replace=mac == joiner_mac,
+                            via=None if mac == sender_mac else sender_mac)
+
+    def on_msg_ack(self, msg_id, seq, data, sender_mac):
+        '''
+        The ACK of a direct message or an outbox bundle.
+        '''
+        # Parse ACK: "msg_id|seq" format
+        parts = data.split('|')
+        if len(parts) >= 2:
+            ack_msg_id = int(parts[0])
+            ack_seq = int(parts[1])
+
+            # ACK for an outbox bundle: on to the next one
+            bundle = self.outbox_bundles.pop(ack_msg_id, None)
+            if bundle:
+                self.outbox.set_status(bundle['message_ids'], DELIVERED)
+                print(f'Delivered {len(bundle["message_ids"])} queued messages to {bundle["peer_id"]}')
+                self.send_bundle(bundle['peer_id'])
+                return
+            
+            # Find peer by MAC address
+            peer_id = None
+            for pid, pinfo in self.known_peers.items():
+                if pinfo.get('mac') == sender_mac:
+                    peer_id = pid
+                    break
+            
+            if peer_id and peer_id in self.known_peers:
+                peer = self.known_peers[peer_id]
+                if 'expected_ack' in peer and peer['expected_ack']['msg_id'] == ack_msg_id:
+                    if 'message_id' in peer['expected_ack']:
+                        self.outbox.set_status([peer['expected_ack']['message_id']], DELIVERED)
+                    del peer['expected_ack']
+                    if self.should_stop_timeout_ack():
+                        waiting_for_ack.clear()
+                    print('ACK received from', peer_id, 'for msg_id', ack_msg_id)
+                else:
+                    print('ACK received from', peer_id, 'for unknown msg_id', ack_msg_id, '(maybe sent late?)')
+
+    def on_rename(self, msg_id, seq, data, sender_mac):
+        '''
+        A peer taking a new name.
+        '''
+        # Find sender by MAC address
+        sender_id = None
+        for pid, pinfo in self.known_peers.items():
+            if pinfo.get('mac') == sender_mac:
+                sender_id = pid
+                break
 
-        sniff(iface=IFACE, prn=handler, store=0)
+        if sender_id and sender_id in self.known_peers:
+            old_name = self.known_peers[sender_id]['name']
+            self.known_peers[sender_id]['name'] = data
+            print(f'{old_name} has renamed to {data}')
+
+            # TODO temp: also change the peer ID to the new name
+            self.known_peers[data] = self.known_peers.pop(sender_id)
+
+            # Send RENAME_ACK
+            self.send(MsgType.RENAME_ACK, self.get_next_msg_id(), 0, 
+                     "", sender_mac)
+
+    def on_rename_ack(self, msg_id, seq, data, sender_mac):
+        '''
+        Nothing to do for a RENAME_ACK yet.
+        '''
+        pass
+
+    def on_terminate(self, msg_id, seq, data, sender_mac):
+        '''
+        A peer leaving the network.
+        '''
+        # Find sender by MAC address and remove from peers
+        sender_id = None
+        for pid, pinfo in self.known_peers.items():
+            if pinfo.get('mac') == sender_mac:
+                sender_id = pid
+                break
+        
+        if sender_id and sender_id in self.known_peers:
+            sender_name = self.known_peers[sender_id]['name']
+            del self.known_peers[sender_id]
+            self.set_session(sender_mac, None)
+            if self.routing:
+                self.routing.remove_neighbor(sender_mac)
+            print(f'{sender_name} has left the network')
+
+        # Keep what we have of their files in case they come back
+        self.close_transfers([key for key in list(self.file_transfers) if key[0] == sender_mac])
+
+    def on_heartbeat(self, msg_id, seq, data, sender_mac):
+        '''
+        A peer's periodic announcement: it is still in range, and with mesh
+        relaying, which peers it can reach.
+        '''
+        # Update last_seen for known peers on heartbeat
+        sender_id = None
+        for pid, pinfo in self.known_peers.items():
+            if pinfo.get('mac') == sender_mac:
+                pinfo['last_seen'] = self.clock.time()
+                sender_id = pid
+                # Heard directly, so a neighbor even if a roster said otherwise
+                if self.routing and pinfo.get('hops') != 1:
+                    pinfo['hops'] = 1
+                    self.routing.add_neighbor(sender_mac, pid)
+                if self.debug_mode:
+                    print(f"[*] Heartbeat from {pinfo['name']}")
+                break
+
+        # A peer we dropped for not answering is back in range, or one a
+        # roster listed is in range: restore it (its session is still set
+        # up) and hand it the messages it missed
+        if sender_id is None:
+            sender_id = self.outbox.peer_for_mac(sender_mac) or self.listed_peers.get(sender_mac)
+            self.listed_peers.pop(sender_mac, None)
+            if sender_id and sender_id not in self.known_peers:
+                self.update_peer(sender_id, {
+                    'name': sender_id,
+                    'mac': sender_mac,
+                    'last_seen': self.clock.time(),
+                    'hops': 1,
+                })
+                if self.routing:
+                    self.routing.add_neighbor(sender_mac, sender_id)
+        if sender_id:
+            self.flush_outbox(sender_id)
+
+        # Heartbeats from mesh peers carry their reachability vector
+        if self.routing and data:
+            for dest_mac, dest_name in self.routing.update_from_vector(sender_mac, data):
+                if dest_name not in self.known_peers:
+                    self.update_peer(dest_name, {'name': dest_name, 'mac': dest_mac})
+            for pinfo in self.known_peers.values():
+                route = self.routing.routes.get(pinfo.get('mac'))
+                if route and route['next_hop'] == sender_mac and route['hops'] > 1:
+                    pinfo['last_seen'] = self.clock.time()
+                    pinfo['hops'] = route['hops']
+
+    def on_host_heartbeat(self, msg_id, seq, data, sender_mac):
+        '''
+        One heartbeat for every identity sharing the sender's radio
+        (identities.py).
+        '''
+        for compact in data.split(','):
+            if len(compact) == 12 and expand_mac(compact) != self.mac:
+                self.dispatch(MsgType.HEARTBEAT, msg_id, seq, "", expand_mac(compact))
+
+    def on_relay(self, msg_id, seq, data, sender_mac):
+        '''
+        A frame relayed through the mesh: handled if it is for us, and passed
+        on towards its destination if not.
+        '''
+        # Parse relay: "ttl|origin_mac|final_dst_mac|inner_type|inner_data" format
+        if not self.routing:
+            return
+        parts = data.split('|', 4)
+        if len(parts) < 5:
+            return
+        ttl, origin, final_dst, inner_data = parts[0], parts[1], parts[2], parts[4]
+        try:
+            ttl, inner_type = int(ttl), MsgType(int(parts[3]))
+        except ValueError:
+            return
+        if inner_type not in RELAYED_TYPES:
+            if self.debug_mode:
+                print(f"[*] Dropping relayed {inner_type.name} from {origin}: not a relayed type")
+            return
+        origin_mac = expand_mac(origin)
+        final_mac = expand_mac(final_dst)
+        if origin_mac == self.mac:
+            return
+
+        if final_mac == BROADCAST_MAC:
+            # Floods reach us from several neighbors; only handle and forward the first copy
+            relay_key = (origin_mac, inner_type, msg_id, seq)
+            if relay_key in self.relay_seen:
+                return
+            self.relay_seen[relay_key] = True
+            if len(self.relay_seen) > RECENT_FRAMES_SIZE:
+                self.relay_seen.popitem(last=False)
+
+        if final_mac in (self.mac, BROADCAST_MAC):
+            inner = self.open_relayed(inner_type, msg_id, seq, inner_data, origin_mac)
+            if inner is not None:
+                self.dispatch(inner_type, msg_id, seq, inner, origin_mac)
+
+        if final_mac != self.mac and ttl > 1:
+            next_hop = BROADCAST_MAC if final_mac == BROADCAST_MAC else self.routing.next_hop(final_mac)
+            if next_hop:
+                forward_data = f"{ttl - 1}|{origin}|{final_dst}|{int(inner_type)}|{inner_data}"
+                # Never block the listener on a full bulk queue; a dropped chunk is recovered end to end
+                self.send(MsgType.RELAY, msg_id, seq, forward_data, next_hop,
+                          priority=frame_priority(inner_type), block=False)
+            elif self.debug_mode:
+                print(f"[*] No route to {final_mac}, dropping relayed frame")
+
+    def on_msg(self, msg_id, seq, data, sender_mac):
+        '''
+        A direct message: ACKed and handed to the message listeners once.
+        '''
+        # Check for duplicate messages
+        message_key = (sender_mac, msg_id, seq)
+        if message_key in self.received_messages:
+            if self.debug_mode:
+                print(f"[*] Ignoring duplicate message: ID={msg_id}, Seq={seq} from {sender_mac}")
+            return
+        
+        # Record this message as received
+        self.received_messages[message_key] = self.clock.time()
+        
+        # Find sender by MAC address
+        sender_id = None
+        for pid, pinfo in self.known_peers.items():
+            if pinfo.get('mac') == sender_mac:
+                sender_id = pid
+                break
+        
+        if sender_id:
+            # Small delay to make sure sender has updated state
+            # TODO: This should be a temporary solution but it's the easiest I could think of for now
+            self.clock.sleep(0.001)
+            
+            # Send acknowledgment
+            ack_data = f"{msg_id}|{seq}"
+            self.send(MsgType.MSG_ACK, self.get_next_msg_id(), 0, 
+                     ack_data, sender_mac)
+            
+            sender_name = self.known_peers.get(sender_id, {'name': 'Unknown'})['name']
+            print(f'{sender_name} -> {self.name}: {data}')
+
+            # Notify listeners
+            for callback in self.message_listeners:
+                callback(sender_id, data)
+        
+        # Periodically clean up old message records
+        if len(self.received_messages) > 100:  # Clean up when we have many entries
+            self.cleanup_old_messages()
+
+    def on_msg_bundle(self, msg_id, seq, data, sender_mac):
+        '''
+        Messages held for us while we were out of reach: a JSON list of texts.
+        '''
+        sender_id = None
+        for pid, pinfo in self.known_peers.items():
+            if pinfo.get('mac') == sender_mac:
+                sender_id = pid
+                break
+        if not sender_id:
+            return
+
+        # Always ACK, so a bundle whose ACK was lost isn't resent forever,
+        # but only deliver the first copy
+        message_key = (sender_mac, msg_id, seq)
+        duplicate = message_key in self.received_messages
+        self.received_messages[message_key] = self.clock.time()
+        self.send(MsgType.MSG_ACK, self.get_next_msg_id(), 0, f"{msg_id}|{seq}", sender_mac)
+        if duplicate:
+            return
+        try:
+            texts = json.loads(data)
+        except ValueError:
+            return
+
+        sender_name = self.known_peers.get(sender_id, {'name': 'Unknown'})['name']
+        for text in texts:
+            print(f'{sender_name} -> {self.name}: {text}')
+            for callback in self.message_listeners:
+                callback(sender_id, text)
+
+    def on_group_msg(self, msg_id, seq, data, sender_mac):
+        '''
+        A message to a group we may be in, ACKed in our slot.
+        '''
+        # Parse group message: "group_id|member_macs|text" format
+        parts = data.split('|', 2)
+        if len(parts) < 3:
+            return
+        group_id, member_macs, text = parts
+        members = member_macs.split(',')
+        own_mac = self.mac.replace(':', '')
+        if own_mac not in members:
+            return
+        member_index = members.index(own_mac)
+
+        # Stagger ACKs by member index so the group doesn't answer all at once.
+        # Duplicates (targeted retransmits) are ACKed again since our first ACK was lost.
+        ack_data = f"{group_id}|{msg_id}|{member_index}"
+        self.clock.call_later(member_index * GROUP_ACK_SLOT, self.send,
+                              MsgType.GROUP_ACK, self.get_next_msg_id(), 0, ack_data, sender_mac)
+
+        message_key = (sender_mac, msg_id, seq)
+        if message_key in self.received_messages:
+            if self.debug_mode:
+                print(f"[*] Ignoring duplicate group message: ID={msg_id}, Seq={seq} from {sender_mac}")
+            return
+        self.received_messages[message_key] = self.clock.time()
+
+        sender_id = None
+        for pid, pinfo in self.known_peers.items():
+            if pinfo.get('mac') == sender_mac:
+                sender_id = pid
+                break
+
+        if sender_id:
+            print(f'{self.known_peers[sender_id]["name"]} -> {group_id}: {text}')
+            for callback in self.group_message_listeners:
+                callback(group_id, sender_id, text)
+
+        if len(self.received_messages) > 100:
+            self.cleanup_old_messages()
+
+    def on_group_ack(self, msg_id, seq, data, sender_mac):
+        '''
+        A member's ACK of one of our group messages.
+        '''
+        # Parse group ACK: "group_id|msg_id|member_index" format
+        parts = data.split('|')
+        if len(parts) >= 3:
+            ack_msg_id = int(parts[1])
+            member_index = int(parts[2])
+            pending = self.pending_group_acks.get(ack_msg_id)
+            if pending and member_index < len(pending['members']) \
+                    and pending['members'][member_index][1] == sender_mac:
+                pending['acked'] |= 1 << member_index
+                if pending['acked'] == (1 << len(pending['members'])) - 1:
+                    del self.pending_group_acks[ack_msg_id]
+                    if self.should_stop_timeout_ack():
+                        waiting_for_ack.clear()
+                    print(f'Group message {ack_msg_id} delivered to all {len(pending["members"])} members of {pending["group_id"]}')
+
+    def on_file_init(self, msg_id, seq, data, sender_mac):
+        '''
+        A peer offering a file: starts the transfer, and tells the sender
+        which chunks we still need if we have part of it.
+        '''
+        # Check for duplicate file init
+        message_key = (sender_mac, msg_id, seq)
+        if message_key in self.received_messages:
+            if self.debug_mode:
+                print(f"[*] Ignoring duplicate file init: ID={msg_id}, Seq={seq} from {sender_mac}")
+            return
+        
+        # Record this file init as received
+        self.received_messages[message_key] = self.clock.time()
+        
+        # Parse file init: "filename|size|sha256|chunk_size[|manifest_msg_id]" format ("filename|size" from older peers)
+        parts = data.split('|')
+        if len(parts) >= 2:
+            sender_name = next((pinfo['name'] for pinfo in self.known_peers.values()
+                                if pinfo.get('mac') == sender_mac), None)
+            if sender_name is None:
+                print(f'Error: file offered by {sender_mac}, which is not a known peer, ignoring it')
+                return
+            filename = os.path.basename(parts[0])
+            sha256 = parts[2] if len(parts) >= 4 else None
+            try:
+                file_size = int(parts[1])
+                chunk_size = int(parts[3]) if len(parts) >= 4 else CHUNK_SIZE
+                manifest_id = int(parts[4]) if len(parts) >= 5 else None
+            except ValueError:
+                file_size = -1
+            # The hash names the partial file on disk, and the sizes its bitmap
+            if (not 0 <= file_size <= MAX_FILE_SIZE or not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE
+                    or (sha256 is not None and not SHA256_PATTERN.fullmatch(sha256))):
+                print(f'Error: bad file offer from {sender_name}, ignoring it')
+                return
+
+            # A file is identified by its hash, so an earlier attempt at it is picked up from its checkpoint
+            if sha256:
+                self.close_transfers([key for key, t in list(self.file_transfers.items())
+                                      if t['partial'].sha256 == sha256])
+            partial_key = sha256 or f"{compact_mac(sender_mac)}_{msg_id}"
+            partial = PartialFile(partial_key, filename, file_size, chunk_size, sha256,
+                                  os.path.join(self.state_dir, PARTIAL_DIR))
+            
+            # Initialize file transfer tracking
+            transfer_key = (sender_mac, msg_id)
+            self.file_transfers[transfer_key] = {
+                'filename': filename,
+                'size': file_size,
+                'partial': partial,
+                'received_seqs': set(),
+                'last_activity': self.clock.time(),
+            }
+            # A delta transfer carries only the chunks a manifest said we lack
+            if manifest_id is not None:
+                self.file_transfers[transfer_key]['manifest_key'] = (sender_mac, manifest_id)
+
+            if partial.received:
+                print(f'Resuming file {filename} from {sender_name}: '
+                      f'{partial.received}/{partial.num_chunks} chunks already received')
+            else:
+                print(f'Receiving file {filename} ({file_size} bytes) from {sender_name}...')
+
+            # Offer to resume: tell the sender which chunks we still need
+            if sha256:
+                resume_data = f"{msg_id}|{encode_ranges(partial.missing_ranges())}"
+                self.send(MsgType.FILE_RESUME, self.get_next_msg_id(), 0, resume_data, sender_mac)
+
+    def on_file_offer(self, msg_id, seq, data, sender_mac):
+        '''
+        The receiver's FILE_RESUME after our FILE_INIT, or its FILE_HAVE
+        after our manifest: the chunks it needs.
+        '''
+        # Parse resume offer or manifest reply: "msg_id|missing_ranges" format
+        parts = data.split('|')
+        if len(parts) >= 2:
+            offer = self.resume_offers.get(int(parts[0]))
+            if offer is not None:
+                offer['missing'] = decode_ranges(parts[1], offer['count'])
+                offer['event'].set()
+
+    def on_file_manifest(self, msg_id, seq, data, sender_mac):
+        '''
+        The content-defined chunk manifest of a delta transfer; answered with
+        a FILE_HAVE of the chunks our chunk store lacks.
+        '''
+        # Seq 0 is "filename|size|sha256|frame_count", later seqs are "hash.length,..." entries.
+        # Repeats aren't dropped: a resent header means our FILE_HAVE was lost.
+        manifest_key = (sender_mac, msg_id)
+        manifest = self.manifests.setdefault(manifest_key, {'header': None, 'frames': {}})
+        manifest['updated'] = self.clock.time()
+        try:
+            if seq == 0:
+                parts = data.split('|')
+                if len(parts) < 4:
+                    return
+                manifest['header'] = {'filename': os.path.basename(parts[0]), 'size': int(parts[1]),
+                                      'sha256': parts[2], 'frame_count': int(parts[3])}
+            else:
+                manifest['frames'][seq] = decode_manifest(data)
+        except ValueError as e:
+            print(f'Error: bad manifest from {sender_mac}: {e}')
+            return  # what came of it is dropped once it goes quiet
+
+        header = manifest['header']
+        if not header or len(manifest['frames']) < header['frame_count']:
+            return
+        if 'needed' in manifest and seq != 0:
+            return
+        if 'needed' not in manifest:
+            self.plan_delta(manifest)
+        have_data = f"{msg_id}|{encode_ranges(index_ranges(manifest['needed']))}"
+        self.send(MsgType.FILE_HAVE, self.get_next_msg_id(), 0, have_data, sender_mac)
+
+    def on_file_chunk(self, msg_id, seq, data, sender_mac):
+        '''
+        A chunk of a file being sent to us.
+        '''
+        # Check for duplicate file chunk
+        message_key = (sender_mac, msg_id, seq)
+        if message_key in self.received_messages:
+            if self.debug_mode:
+                print(f"[*] Ignoring duplicate file chunk: ID={msg_id}, Seq={seq} from {sender_mac}")
+            return
+        
+        # Record this file chunk as received
+        self.received_messages[message_key] = self.clock.time()
+        
+        # Store chunk data
+        transfer_key = (sender_mac, msg_id)
+        if transfer_key in self.file_transfers:
+            transfer = self.file_transfers[transfer_key]
+            # Decode base64 chunk data
+            try:
+                chunk_data = base64.b64decode(data.encode('ascii'))
+                transfer['partial'].write_chunk(seq - 2, chunk_data)
+                transfer['received_seqs'].add(seq)
+                transfer['last_activity'] = self.clock.time()
+                self.report_progress(transfer, msg_id, seq, sender_mac)
+                
+                if self.debug_mode:
+                    print(f"[*] Received file chunk {seq} ({len(chunk_data)} bytes)")
+            except Exception as e:
+                print(f"Error decoding file chunk: {e}")
+
+    def on_file_parity(self, msg_id, seq, data, sender_mac):
+        '''
+        An FEC parity frame, which can rebuild a lost chunk of its block.
+        '''
+        # Check for duplicate parity frames
+        message_key = (sender_mac, msg_id, seq)
+        if message_key in self.received_messages:
+            return
+        self.received_messages[message_key] = self.clock.time()
+
+        # Parse parity: "block|block_size|parity_count|parity_index|chunk_size|data" format
+        transfer_key = (sender_mac, msg_id)
+        parts = data.split('|')
+        if transfer_key in self.file_transfers and len(parts) >= 6:
+            transfer = self.file_transfers[transfer_key]
+            block, block_size, parity_count, parity_index, chunk_size = map(int, parts[:5])
+            fec_block = transfer.setdefault('parity', {}).setdefault(block, {
+                'block_size': block_size, 'parity_count': parity_count,
+                'chunk_size': chunk_size, 'parity': {},
+            })
+            fec_block['parity'][parity_index] = base64.b64decode(parts[5].encode('ascii'))
+            transfer['received_seqs'].add(seq)
+            self.report_progress(transfer, msg_id, seq, sender_mac)
+
+    def on_file_progress(self, msg_id, seq, data, sender_mac):
+        '''
+        The receiver's report on a file we are sending, which paces it.
+        '''
+        # Parse progress report: "msg_id|received_count|last_seq" format
+        parts = data.split('|')
+        pacer = self.pacers.get(sender_mac)
+        if pacer and len(parts) >= 3:
+            if pacer.on_report(int(parts[0]), int(parts[1]), int(parts[2])):
+                self.apply_pacing(sender_mac)
+
+    def on_file_end(self, msg_id, seq, data, sender_mac):
+        '''
+        The end of a file: reassembled if every chunk came, and answered with
+        the FILE_ACK of the chunks we have.
+        '''
+        # Check for duplicate file end
+        message_key = (sender_mac, msg_id, seq)
+        if message_key in self.received_messages:
+            if self.debug_mode:
+                print(f"[*] Ignoring duplicate file end: ID={msg_id}, Seq={seq} from {sender_mac}")
+            return
+        
+        # Record this file end as received
+        self.received_messages[message_key] = self.clock.time()
+        
+        # Finalize file transfer
+        transfer_key = (sender_mac, msg_id)
+        if transfer_key in self.file_transfers:
+            transfer = self.file_transfers[transfer_key]
+            transfer['received_seqs'].add(seq)  # Add FILE_END seq
+
+            # Rebuild lost chunks from parity
+            if transfer.get('parity'):
+                self.recover_chunks(transfer)
+            
+            # Send FILE_ACK with received sequence numbers (as heard, before FEC recovery)
+            received_seqs_str = ','.join(map(str, sorted(transfer['received_seqs'])))
+            ack_data = f"{msg_id}|{received_seqs_str}"
+            self.send(MsgType.FILE_ACK, self.get_next_msg_id(), 0, 
+                     ack_data, sender_mac)
+            
+            # Reassemble and save file
+            self.reassemble_file(transfer_key)
+
+    def on_file_ack(self, msg_id, seq, data, sender_mac):
+        '''
+        The receiver's FILE_ACK: which chunks of our file it has.
+        '''
+        # Parse FILE_ACK: "msg_id|seq1,seq2,seq3..." format
+        parts = data.split('|')
+        if len(parts) >= 2:
+            ack_msg_id = int(parts[0])
+            received_seqs = set(map(int, parts[1].split(','))) if parts[1] else set()
+            
+            # Find peer by MAC address
+            peer_id = None
+            for pid, pinfo in self.known_peers.items():
+                if pinfo.get('mac') == sender_mac:
+                    peer_id = pid
+                    break
+            
+            if sender_mac in self.pacers:
+                self.pacers[sender_mac].finish(ack_msg_id)
+
+            if peer_id and peer_id in self.known_peers:
+                peer = self.known_peers[peer_id]
+                peer_name = peer['name']
+                
+                self.record_link_losses(ack_msg_id, received_seqs)
+
+                # Track the raw frame loss to this peer, which sizes FEC parity
+                sent_seqs = self.sent_file_seqs.pop(ack_msg_id, None)
+                if sent_seqs:
+                    loss = 1 - len(sent_seqs & received_seqs) / len(sent_seqs)
+                    peer['loss'] = 0.7 * peer.get('loss', loss) + 0.3 * loss
+                    # Losses may mean the path no longer carries our chunk size
+                    if self.mtu_probing and peer['loss'] > MTU_REPROBE_LOSS:
+                        self.start_mtu_probe(peer_id)
+
+                # Clear expected ACK if this matches
+                if 'expected_ack' in peer and peer['expected_ack']['msg_id'] == ack_msg_id:
+                    del peer['expected_ack']
+                    if self.should_stop_timeout_ack():
+                        waiting_for_ack.clear()
+                    print(f'File transfer completed! ACK received from {peer_name}: {len(received_seqs)} chunks for msg_id {ack_msg_id}')
+                else:
+                    print(f'File transfer ACK from {peer_name}: received {len(received_seqs)} chunks for msg_id {ack_msg_id} (maybe sent late?)')
+
+    def on_mtu_probe(self, msg_id, seq, data, sender_mac):
+        '''
+        A peer probing our chunk size; acknowledged so it can chunk files to
+        fit.
+        '''
+        # Probe: "size|padding"; acknowledge the size so the sender can chunk files to fit
+        size = data.split('|', 1)[0]
+        self.send(MsgType.MTU_ACK, self.get_next_msg_id(), 0, f"{msg_id}|{size}", sender_mac)
+
+    def on_mtu_ack(self, msg_id, seq, data, sender_mac):
+        '''
+        A peer's answer to one of our MTU probes.
+        '''
+        # Parse probe ACK: "probe_msg_id|size" format
+        parts = data.split('|')
+        if len(parts) >= 2:
+            probe = self.mtu_probes.get(int(parts[0]))
+            if probe is not None:
+                probe['acked'].add(int(parts[1]))
+                if int(parts[1]) == MTU_PROBE_SIZES[-1]:
+                    self.finish_mtu_probe(int(parts[0]))  # nothing larger to wait for
+
+    def frame_listener(self, transport):
+        '''
+        Listens for all frame types on one transport and handles them
+        appropriately.
+        '''
+        pool = self.receive_pools.get(transport.name)
+        if pool:
+            pool.listen(lambda item: self.handle_decoded(item, transport))
+        else:
+            transport.listen(lambda pkt: self.handle_frame(pkt, transport))
+
+    def set_session(self, peer_mac, session):
+        '''
+        Installs (or with None, drops) the session with a peer, passing its
+        key on to any receive workers.
+        '''
+        if session is None:
+            retired = self.sessions.pop(peer_mac, None)
+            if retired is not None:
+                self.retired_sessions[peer_mac] = retired
+        else:
+            self.sessions[peer_mac] = session
+        for pool in self.receive_pools.values():
+            pool.set_session(peer_mac, session.key if session else None)
+
+    def install_session(self, peer_mac, key, resumed=False, ticket=None):
+        '''
+        Sets up the session with a peer under key, unless the one we have
+        (or had, before it left) already uses that key: repeated handshakes
+        with a peer derive the same key, and a new Session would count its
+        frames from 0 again and reuse their keystream. ticket: the (peer id,
+        resumption secret) to store for a new session. Returns True if the
+        session is new, and None if it would replace ours too soon after
+        another (see may_replace_session). Called before peer_keys is updated.
+
+        Handshakes aren't authenticated, so a session that replaces another
+        is on probation until the peer uses it (see check_replaced_session);
+        its ticket is stored then.
+        '''
+        session = self.sessions.get(peer_mac) or self.retired_sessions.get(peer_mac)
+        if session is not None and session.key == key:
+            if peer_mac not in self.sessions:
+                self.set_session(peer_mac, session)
+            return False
+        replaced = self.sessions.get(peer_mac)
+        if replaced is not None:
+            if not self.may_replace_session(peer_mac):
+                return None
+            self.session_replaced[peer_mac] = self.clock.monotonic()
+            # Keep the session the peer last proved it has, through repeated replacements
+            old = self.replaced_sessions.get(peer_mac, (replaced, self.peer_keys.get(peer_mac), None))
+            self.replaced_sessions[peer_mac] = (old[0], old[1], ticket)
+        elif ticket:
+            self.tickets.store(*ticket)
+        self.retired_sessions.pop(peer_mac, None)
+        self.set_session(peer_mac, Session(key, resumed))
+        return True
+
+    def check_replaced_session(self, sender_mac, encrypted_data, header):
+        '''
+        Settles a session a handshake replaced, on a session frame from the
+        peer: a frame under the new session means the peer took it up (and
+        its ticket is stored); one under the old session means the
+        handshake wasn't the peer's, and the old session is put back.
+        '''
+        replaced = self.replaced_sessions.get(sender_mac)
+        if replaced is None or not encrypted_data.startswith(SESSION_PREFIX):
+            return
+        old_session, old_key, ticket = replaced
+        session = self.sessions.get(sender_mac)
+        if session is not None and session.authentic(encrypted_data, sender_mac, header):
+            del self.replaced_sessions[sender_mac]
+            if ticket:
+                self.tickets.store(*ticket)
+        elif old_session.authentic(encrypted_data, sender_mac, header):
+            del self.replaced_sessions[sender_mac]
+            self.set_session(sender_mac, old_session)
+            if old_key:
+                self.peer_keys[sender_mac] = old_key
+            self.handshake_answers.pop(sender_mac, None)
+            if self.debug_mode:
+                print(f"[!] {sender_mac} still uses its old session; restored it over a spoofed handshake")
+
+    def may_replace_session(self, peer_mac):
+        '''
+        Whether a handshake may replace our session with peer_mac now. A
+        peer that restarted needs one replacement; frames spoofing its MAC
+        get no more than one every SESSION_REPLACE_INTERVAL.
+        '''
+        replaced = self.session_replaced.get(peer_mac, -math.inf)
+        return self.clock.monotonic() - replaced >= SESSION_REPLACE_INTERVAL
+
+    def handshake_data(self, roster=False):
+        '''
+        Returns the HANDSHAKE_REQ body: our ECDH public key, handshake nonce
+        and the resumption tickets we still hold, and with roster a flag
+        asking for a roster rather than an ACK from everyone.
+        '''
+        ticket_ids = ','.join(self.tickets.ticket_ids())
+        data = f"0|{self.name}|{self.public_key}|{self.handshake_nonce.hex()}|{ticket_ids}"  # port not used
+        return data + '|r' if roster else data
+
+    def accept_handshake(self, peer_id, peer_mac, parts):
+        '''
+        Sets up a session from a HANDSHAKE_REQ and returns the HANDSHAKE_ACK
+        body. Resumes from a ticket when the peer still holds one we know,
+        otherwise runs a full ECDH. A repeat of the REQ our session answered
+        gets the same ACK without either; a REQ that may not replace our
+        session now (may_replace_session) gets None, before any crypto.
+        '''
+        request = '|'.join(parts[2:5])
+        answered = self.handshake_answers.get(peer_mac)
+        if peer_mac in self.sessions:
+            if answered and answered[0] == request:
+                return answered[1]
+            if not self.may_replace_session(peer_mac):
+                if self.debug_mode:
+                    print(f"[*] Ignoring handshake from {peer_id}: its session was replaced moments ago")
+                return None
+        peer_tickets = parts[4].split(',') if len(parts) >= 5 and parts[4] else []
+        ticket = self.tickets.get(peer_id)
+        if ticket and ticket[0] in peer_tickets:
+            peer_nonce = bytes.fromhex(parts[3])
+            key = derive_resumed_session(ticket[1], peer_nonce, self.handshake_nonce)
+            if self.install_session(peer_mac, key, resumed=True) is None:
+                return None
+            if self.debug_mode:
+                print(f"[*] Resumed session with {peer_id} from ticket {ticket[0]}")
+            ack_data = f"0|{self.name}|R|{ticket[0]}|{self.handshake_nonce.hex()}"
+        else:
+            key, resumption_secret = derive_session_secret(self.keypair, parts[2])
+            installed = self.install_session(peer_mac, key, ticket=(peer_id, resumption_secret))
+            if installed is None:
+                return None
+            if installed and self.debug_mode:
+                print(f"[*] New ECDH session with {peer_id}")
+            ack_data = f"0|{self.name}|{self.public_key}"
+        self.peer_keys[peer_mac] = parts[2]
+        self.handshake_answers[peer_mac] = (request, ack_data)
+        return ack_data
+
+    def complete_handshake(self, peer_id, peer_mac, parts):
+        '''
+        Sets up our side of the session from a HANDSHAKE_ACK.
+        '''
+        if parts[2] == 'R':
+            ticket = self.tickets.get(peer_id)
+            if len(parts) < 5 or not ticket or ticket[0] != parts[3]:
+                print(f'{peer_id} tried to resume with an unknown ticket')
+                return
+            key = derive_resumed_session(ticket[1], self.handshake_nonce, bytes.fromhex(parts[4]))
+            if self.install_session(peer_mac, key, resumed=True) and self.debug_mode:
+                print(f"[*] Resumed session with {peer_id} from ticket {ticket[0]}")
+            return
+
+        session = self.sessions.get(peer_mac)
+        if session is not None:
+            if self.peer_keys.get(peer_mac) == parts[2] and not session.resumed:
+                return  # an ACK for the session we have, which needs no ECDH
+            if not self.may_replace_session(peer_mac):
+                return
+        key, resumption_secret = derive_session_secret(self.keypair, parts[2])
+        installed = self.install_session(peer_mac, key, ticket=(peer_id, resumption_secret))
+        if installed is not None:
+            self.peer_keys[peer_mac] = parts[2]
+        if installed and self.debug_mode:
+            print(f"[*] New ECDH session with {peer_id}")
+
+    def learn_peer(self, peer_id, peer_mac, public_key, replace=False, via=None):
+        '''
+        Sets up a session with a peer listed in a roster, from its public
+        key. A session we already have is kept unless replace is set and
+        the key changed (the joiner itself, restarted). via: the roster's
+        sender, when that isn't the peer itself. The peer may be out of our
+        range, so with mesh relaying it is routed through via until we hear
+        it directly, and without it only becomes a known peer once we do.
+        '''
+        if peer_mac == self.mac or peer_id == self.name:
+            return
+        if peer_mac in self.sessions and (not replace or self.peer_keys.get(peer_mac) == public_key
+                                          or not self.may_replace_session(peer_mac)):
+            return
+        try:
+            key, resumption_secret = derive_session_secret(self.keypair, public_key)
+        except Exception as e:
+            if self.debug_mode:
+                print(f"[!] Bad key for {peer_id} in roster: {e}")
+            return
+        if self.install_session(peer_mac, key, ticket=(peer_id, resumption_secret)) is None:
+            return
+        self.peer_keys[peer_mac] = public_key
+        if via and not self.routing:
+            self.listed_peers[peer_mac] = peer_id
+            return
+        hops = 2 if via else 1
+        self.update_peer(peer_id, {
+            'name': peer_id,
+            'mac': peer_mac,
+            'last_seen': self.clock.time(),
+            'hops': hops,
+        })
+        if self.routing and via:
+            self.routing.add_route(peer_mac, via, hops, peer_id)
+        elif self.routing:
+            self.routing.add_neighbor(peer_mac, peer_id)
+        if self.mtu_probing:
+            self.start_mtu_probe(peer_id)
+        self.flush_outbox(peer_id, HANDSHAKE_SETTLE)
+
+    def answer_join(self, peer_id, peer_mac):
+        '''
+        Schedules our roster for a joiner after a random backoff, unless one
+        is already scheduled. It lists the peers we hear directly now; the
+        joiner is already listening, so it hears anyone announcing later
+        for itself.
+        '''
+        if peer_mac in self.join_answers:
+            return
+        known = [pinfo['mac'] for pinfo in list(self.known_peers.values())
+                 if pinfo.get('hops') == 1 and pinfo.get('mac') in self.peer_keys and pinfo['mac'] != peer_mac]
+        self.join_answers[peer_mac] = {'name': peer_id, 'known': known, 'told': set()}
+        self.clock.call_later(random.uniform(0, ROSTER_BACKOFF), self.send_roster, peer_mac)
+
+    def send_roster(self, joiner_mac):
+        '''
+        Broadcasts the roster for a joiner: the joiner, us and the peers
+        answer_join picked, leaving out those the rosters we heard in the
+        meantime listed. Sends nothing if they listed all of them, us
+        included.
+        '''
+        answer = self.join_answers.pop(joiner_mac, None)
+        if answer is None or joiner_mac not in self.peer_keys:
+            return
+        told = answer['told']
+        names = {pinfo.get('mac'): pid for pid, pinfo in list(self.known_peers.items())}
+        entries = [(mac, self.peer_keys[mac], names[mac]) for mac in answer['known']
+                   if mac not in told and mac in names]
+        if self.mac in told and not entries:
+            return
+        entries = [(joiner_mac, self.peer_keys[joiner_mac], answer['name']),
+                   (self.mac, self.public_key, self.name)] + entries
+        msg_id = self.get_next_msg_id()
+        for seq, body in enumerate(encode_roster(joiner_mac, entries)):
+            self.send(MsgType.ROSTER, msg_id, seq, body, BROADCAST_MAC)
 
     def announcer(self):
         '''
         Sends initial handshake request and then periodic heartbeats to announce presence.
         '''
-        # Send initial handshake request on startup
-        announce_data = f"0|{self.name}"  # port not used, just name
-        send_frame(MsgType.HANDSHAKE_REQ, self.get_next_msg_id(), 0, 
-                 announce_data, IFACE, BROADCAST_MAC, SRC_MAC, self.debug_mode)
-        
+        self.announce()
+
         # Then send heartbeats every 5 seconds
         while True:
-            time.sleep(5)
-            send_frame(MsgType.HEARTBEAT, self.get_next_msg_id(), 0, 
-                     "", IFACE, BROADCAST_MAC, SRC_MAC, self.debug_mode)
+            self.clock.sleep(HEARTBEAT_INTERVAL)
+            self.heartbeat()
+
+    def announce(self, attempt=0):
+        '''
+        Sends the initial handshake request, to everyone in range. Until a
+        roster (or an ACK) comes back, it is sent again JOIN_WAIT later,
+        doubling and randomized, up to JOIN_RETRIES times.
+        '''
+        self.send(MsgType.HANDSHAKE_REQ, self.get_next_msg_id(), 0, 
+                 self.handshake_data(self.roster), BROADCAST_MAC)
+        if self.roster and attempt < JOIN_RETRIES:
+            self.clock.call_later(JOIN_WAIT * 2 ** attempt * random.uniform(1, 1.5), self.announce_again, attempt + 1)
+
+    def announce_again(self, attempt):
+        if not self.joined:
+            self.announce(attempt)
+
+    def heartbeat(self):
+        '''
+        Periodic housekeeping, then a heartbeat.
+        '''
+        # Incoming transfers that went quiet without a FILE_END are checkpointed and dropped
+        cutoff = self.clock.time() - TRANSFER_IDLE_TIMEOUT
+        self.close_transfers([key for key, t in list(self.file_transfers.items())
+                              if t['last_activity'] < cutoff])
+        active = {t.get('manifest_key') for t in list(self.file_transfers.values())}
+        for key, manifest in list(self.manifests.items()):
+            if manifest['updated'] < cutoff and key not in active:
+                self.chunk_store.unpin(manifest.get('pinned', []))
+                del self.manifests[key]
+
+        if self.radio and not self.routing:
+            return  # the radio's HOST_HEARTBEAT covers us
+        if not self.routing:
+            self.send(MsgType.HEARTBEAT, self.get_next_msg_id(), 0, 
+                     "", BROADCAST_MAC)
+            return
+
+        # Mesh heartbeats carry our reachability vector, split over several frames if needed
+        for dest_mac in self.routing.expire():
+            for pid in [pid for pid, p in self.known_peers.items() if p.get('mac') == dest_mac]:
+                print(f'{pid} is no longer reachable')
+                del self.known_peers[pid]
+        msg_id = self.get_next_msg_id()
+        for seq, vector in enumerate(self.routing.encode_vectors()):
+            self.send(MsgType.HEARTBEAT, msg_id, seq, vector, BROADCAST_MAC)
+
+    def scheduled_heartbeat(self):
+        '''
+        The announcer loop as clock events, under a virtual clock.
+        '''
+        self.heartbeat()
+        self.clock.call_later(HEARTBEAT_INTERVAL, self.scheduled_heartbeat)
+
+    def start_mtu_probe(self, peer_id):
+        '''
+        Finds the largest file chunk that gets through to a peer, unless a
+        probe is running or the last one was less than MTU_REPROBE_INTERVAL
+        ago: HANDSHAKE_SETTLE from now, sends MTU_PROBE frames as large as a
+        FILE_CHUNK of each of MTU_PROBE_SIZES, and finish_mtu_probe keeps the
+        largest size the peer acknowledges. The probe runs on clock events,
+        so it takes no thread and works under a VirtualClock.
+        '''
+        peer = self.known_peers.get(peer_id)
+        if not peer or 'mac' not in peer or peer['mac'] in self.probing_macs:
+            return
+        if self.clock.time() - peer.get('mtu_probed', 0) < MTU_REPROBE_INTERVAL:
+            return
+        self.probing_macs.add(peer['mac'])
+        msg_id = self.get_next_msg_id()
+        self.mtu_probes[msg_id] = {'peer_id': peer_id, 'mac': peer['mac'], 'acked': set()}
+        self.clock.call_later(HANDSHAKE_SETTLE, self.send_mtu_probes, msg_id)
+
+    def send_mtu_probes(self, msg_id):
+        probe = self.mtu_probes.get(msg_id)
+        if probe is None:
+            return
+        seq = 0
+        for _ in range(MTU_PROBE_COPIES):
+            for size in MTU_PROBE_SIZES:
+                padding = base64.b64encode(os.urandom(size)).decode('ascii')
+                self.send(MsgType.MTU_PROBE, msg_id, seq, f"{size}|{padding}", probe['mac'])
+                seq += 1
+        self.clock.call_later(MTU_PROBE_WAIT, self.finish_mtu_probe, msg_id)
+
+    def finish_mtu_probe(self, msg_id):
+        '''
+        Ends a probe once MTU_PROBE_WAIT is up or the largest size is
+        acknowledged, keeping the largest size acknowledged in
+        peer['chunk_size']. Adapters that quietly drop large frames are
+        caught this way; without any answer (an older peer) the chunk size
+        stays at CHUNK_SIZE.
+        '''
+        probe = self.mtu_probes.pop(msg_id, None)
+        if probe is None:
+            return
+        peer_id, peer_mac = probe['peer_id'], probe['mac']
+        self.probing_macs.discard(peer_mac)
+        peer = self.known_peers.get(peer_id)
+        if peer is None or peer.get('mac') != peer_mac:
+            return
+        peer['mtu_probed'] = self.clock.time()
+        if not probe['acked']:
+            if self.debug_mode:
+                print(f"[*] No MTU probe answers from {peer_id}, keeping {peer.get('chunk_size', CHUNK_SIZE)} byte chunks")
+            return
+        chunk_size = max(probe['acked'])
+        if chunk_size != peer.get('chunk_size'):
+            print(f'File chunks to {peer["name"]}: {chunk_size} bytes')
+        peer['chunk_size'] = chunk_size
+
+    def ping(self, peer_id, count=PING_COUNT, sizes=PING_SIZES):
+        '''
+        Runs a probe train to a known peer: count PINGs of each padding size,
+        PING_INTERVAL apart, timed by their PONGs. Returns a list of
+        ping_stats dicts, one per size, or None if the peer isn't known.
+        Under a VirtualClock, the clock runs while the train waits.
+        '''
+        peer = self.known_peers.get(peer_id)
+        if not peer or 'mac' not in peer:
+            print('Unknown peer ID')
+            return None
+
+        results = []
+        for size in sizes:
+            msg_id = self.get_next_msg_id()
+            train = {'count': count, 'rtts': {}, 'event': threading.Event()}
+            self.ping_trains[msg_id] = train
+            padding = 'x' * size
+            pkts = []
+            for seq in range(count):
+                # Queued with a placeholder time, and stamped by transmit
+                pkt = build_frame(MsgType.PING, msg_id, seq, f"0|{padding}", peer['mac'], self.mac)
+                self.ping_stamps[pkt] = (msg_id, seq, padding, peer['mac'])
+                pkts.append(pkt)
+                self.schedulers[self.transports[0].name].enqueue(pkt, peer['mac'], CONTROL)
+                self.clock.wait(train['event'], PING_INTERVAL)
+            self.clock.wait(train['event'], PING_WAIT)
+            del self.ping_trains[msg_id]
+            for pkt in pkts:
+                self.ping_stamps.pop(pkt, None)
+            results.append(ping_stats(size, count, train['rtts']))
+        return results
 
     def rename(self, new_name):
         '''
@@ -468,22 +1793,27 @@ class Me:
         '''
         self.id = new_name
         self.name = new_name
-        send_frame(MsgType.RENAME, self.get_next_msg_id(), 0, 
-                 new_name, IFACE, BROADCAST_MAC, SRC_MAC, self.debug_mode)
+        self.send(MsgType.RENAME, self.get_next_msg_id(), 0, 
+                 new_name, BROADCAST_MAC)
 
     def send_message(self, id, text):
         '''
-        Sends a direct message to a known peer. Prints an error if the peer
-        ID is not known.
+        Sends a direct message to a peer and returns its outbox message id,
+        for delivery status. Messages to a peer that isn't reachable (not
+        known, or still waiting for an earlier message's ACK) are queued in
+        the outbox and sent when we hear from it.
         '''
-        if id not in self.known_peers:
-            print('Unknown peer ID')
-            return
+        peer = self.known_peers.get(id)
+        if not peer or 'mac' not in peer or 'expected_ack' in peer or self.outbox.queued(id):
+            message_id = self.outbox.add(id, text)
+            if peer and 'mac' in peer:
+                self.flush_outbox(id)
+            else:
+                print(f'{id} is not reachable; message queued')
+            return message_id
 
-        peer = self.known_peers[id]
-        if 'mac' not in peer:
-            print('Peer MAC address not known')
-            return
+        message_id = self.outbox.add(id, text, SENT)
+        self.outbox.remember_mac(id, peer['mac'])
 
         # Send message frame with seq=1 (messages are not chunked)
         msg_id = self.get_next_msg_id()
@@ -491,21 +1821,142 @@ class Me:
         self.update_peer(id, {
             'expected_ack': {
                 'msg_id': msg_id,
+                'message_id': message_id,
                 'attempt': 0,
-                'latest_by': time.time() + 0.05 # 50 ms to ack, doubles each retry
+                'latest_by': self.clock.time() + 0.05 # 50 ms to ack, doubles each retry
             },
         })
-        waiting_for_ack.set()
+        self.expect_ack_by(self.known_peers[id]['expected_ack']['latest_by'])
 
-        send_frame(MsgType.MSG, msg_id, 1,
-                 text, IFACE, peer['mac'], SRC_MAC, self.debug_mode)
+        self.send(MsgType.MSG, msg_id, 1,
+                 text, peer['mac'])
 
         peer_name = peer['name']
         print(f'{self.name} -> {peer_name}: {text}')
+        return message_id
+
+    def flush_outbox(self, peer_id, delay=0):
+        '''
+        Sends a peer the messages queued for it after delay seconds, unless
+        a flush to it is running already.
+        '''
+        if peer_id in self.flushing or not self.outbox.queued(peer_id):
+            return
+        self.flushing.add(peer_id)
+        self.clock.call_later(delay, self.send_bundle, peer_id)
+
+    def send_bundle(self, peer_id):
+        '''
+        Sends the oldest messages queued for a peer as one MSG_BUNDLE frame,
+        as many as fit in one of the peer's file chunks. The next bundle
+        only goes out when this one is ACKed, so a long backlog is paced by
+        the link instead of flooding the queues. Ends the flush when
+        nothing is left, or the peer is gone.
+        '''
+        peer = self.known_peers.get(peer_id)
+        messages = self.outbox.queued(peer_id)
+        if not peer or 'mac' not in peer or not messages:
+            self.flushing.discard(peer_id)
+            return
+        # Texts aren't base64 encoded like chunks, so a bundle gets 4/3 of the chunk size
+        limit = peer.get('chunk_size', CHUNK_SIZE) * 4 // 3
+        bundle = [messages[0]]
+        size = len(json.dumps([messages[0]['text']]))
+        for message in messages[1:]:
+            size += len(json.dumps(message['text'])) + 2
+            if size > limit:
+                break
+            bundle.append(message)
+
+        msg_id = self.get_next_msg_id()
+        message_ids = [m['id'] for m in bundle]
+        self.outbox_bundles[msg_id] = {'peer_id': peer_id, 'mac': peer['mac'], 'message_ids': message_ids,
+                                       'data': json.dumps([m['text'] for m in bundle]), 'attempt': 0}
+        self.outbox.set_status(message_ids, SENT)
+        self.resend_bundle(msg_id)
+
+    def resend_bundle(self, msg_id):
+        '''
+        (Re)sends a bundle still waiting for its ACK, every OUTBOX_ACK_WAIT
+        doubling. After OUTBOX_RETRIES sends its messages go back to
+        waiting, with the rest, for the next time we hear from the peer.
+        '''
+        bundle = self.outbox_bundles.get(msg_id)
+        if bundle is None:
+            return  # ACKed
+        if bundle['attempt'] >= OUTBOX_RETRIES:
+            del self.outbox_bundles[msg_id]
+            self.outbox.set_status(bundle['message_ids'], QUEUED)
+            self.flushing.discard(bundle['peer_id'])
+            print(f'No ACK from {bundle["peer_id"]} for queued messages; keeping them queued')
+            return
+        self.send(MsgType.MSG_BUNDLE, msg_id, 1, bundle['data'], bundle['mac'])
+        self.clock.call_later(OUTBOX_ACK_WAIT * 2 ** bundle['attempt'], self.resend_bundle, msg_id)
+        bundle['attempt'] += 1
+
+    def create_group(self, group_id, member_ids):
+        '''
+        Creates (or replaces) a named group of known peers.
+        '''
+        if '|' in group_id:
+            print('Group ID cannot contain "|"')
+            return
+        unknown = [peer_id for peer_id in member_ids if peer_id not in self.known_peers]
+        if unknown:
+            print(f'Unknown peer ID(s): {", ".join(unknown)}')
+            return
+        self.groups[group_id] = list(member_ids)
+        print(f'Group {group_id} created with {len(member_ids)} members')
 
-    def send_file(self, peer_id, file_path):
+    def send_group_message(self, group_id, text):
         '''
-        Sends a file to a known peer by breaking it into chunks.
+        Sends one broadcast frame to every member of a group. Members ACK
+        individually and only the ones that miss it get a retransmit.
+        '''
+        if group_id not in self.groups:
+            print('Unknown group ID')
+            return
+
+        members = []
+        for peer_id in self.groups[group_id]:
+            peer = self.known_peers.get(peer_id)
+            if peer and 'mac' in peer:
+                members.append((peer_id, peer['mac']))
+            else:
+                print(f'Skipping {peer_id}: not currently reachable')
+        if not members:
+            print('No reachable group members')
+            return
+
+        msg_id = self.get_next_msg_id()
+        member_macs = ','.join(mac.replace(':', '') for _, mac in members)
+        data = f"{group_id}|{member_macs}|{text}"
+
+        self.pending_group_acks[msg_id] = {
+            'group_id': group_id,
+            'members': members,
+            'data': data,
+            'acked': 0,  # bit i is set once members[i] has ACKed
+            'attempt': 0,
+            # 100 ms plus the time the last member waits for its ACK slot
+            'latest_by': self.clock.time() + 0.1 + len(members) * GROUP_ACK_SLOT,
+        }
+        self.expect_ack_by(self.pending_group_acks[msg_id]['latest_by'])
+
+        self.send(MsgType.GROUP_MSG, msg_id, 1, data, BROADCAST_MAC)
+        print(f'{self.name} -> {group_id}: {text}')
+
+    def send_file(self, peer_id, file_path, use_fec: bool = False, use_dedup: bool = False):
+        '''
+        Sends a file to a known peer by breaking it into chunks. If the peer
+        already has part of the file from an interrupted transfer, only the
+        chunks it is missing are sent. With use_fec,
+        each block of chunks is followed by parity frames sized to the loss
+        rate seen on earlier transfers, so the receiver can rebuild lost
+        chunks on its own. With use_dedup, a manifest of content-defined
+        chunks goes first and only the chunks the peer doesn't have in its
+        chunk store are sent. Under a VirtualClock, the clock runs while it
+        waits for the peer's answers.
         '''
         if peer_id not in self.known_peers:
             print('Unknown peer ID')
@@ -529,61 +1980,348 @@ class Me:
 
         filename = os.path.basename(file_path)
         file_size = len(file_data)
-        msg_id = self.get_next_msg_id()
         
         print(f'Sending file {filename} ({file_size} bytes) to {peer["name"]}...')
 
-        # Send FILE_INIT
-        init_data = f"{filename}|{file_size}"
-        send_frame(MsgType.FILE_INIT, msg_id, 1, init_data, IFACE, peer['mac'], SRC_MAC, self.debug_mode)
+        # A delta transfer sends only the chunks the peer lacks, tied to the manifest that lists them all
+        manifest_id = None
+        if use_dedup:
+            delta = self.send_manifest(peer, filename, file_data)
+            if delta is not None:
+                manifest_id, file_data = delta
+                file_size = len(file_data)
+
+        file_hash = hashlib.sha256(file_data).hexdigest()
+        chunk_size = peer.get('chunk_size', CHUNK_SIZE)  # probed per peer, see start_mtu_probe
+        init_data = f"{filename}|{file_size}|{file_hash}|{chunk_size}"
+        if manifest_id is not None:
+            init_data += f"|{manifest_id}"
+        msg_id = self.get_next_msg_id()
 
-        # Send FILE_CHUNK frames
-        seq = 2  # Start from seq 2 (seq 1 was FILE_INIT)
-        for i in range(0, file_size, CHUNK_SIZE):
-            chunk = file_data[i:i + CHUNK_SIZE]
-            # Encode chunk as base64 to handle binary data safely
-            chunk_b64 = base64.b64encode(chunk).decode('ascii')
-            send_frame(MsgType.FILE_CHUNK, msg_id, seq, chunk_b64, IFACE, peer['mac'], SRC_MAC, self.debug_mode)
-            seq += 1
+        # Send FILE_INIT and give the receiver a moment to offer a resume
+        offer = {'event': threading.Event(), 'missing': None, 'count': math.ceil(file_size / chunk_size)}
+        self.resume_offers[msg_id] = offer
+        self.send(MsgType.FILE_INIT, msg_id, 1, init_data, peer['mac'])
+        self.clock.wait(offer['event'], RESUME_WAIT)
+        del self.resume_offers[msg_id]
+
+        chunks = [file_data[i:i + chunk_size] for i in range(0, file_size, chunk_size)]
+        # Without an offer (lost, or an older peer) everything is sent
+        needed = offer['missing'] if offer['missing'] is not None else set(range(len(chunks)))
+        if len(needed) < len(chunks):
+            print(f'Resuming: {peer["name"]} already has {len(chunks) - len(needed)} of {len(chunks)} chunks')
+
+        # Send FILE_CHUNK frames, striped across our links. Chunk i has seq i + 2 (seq 1 was FILE_INIT)
+        end_seq = len(chunks) + 2
+        parity_seq = end_seq + 1  # parity frames are numbered after FILE_END
+        parity_count = fec.parity_count(peer.get('loss', 0.0)) if use_fec else 0
+        frames = []
+        for block_start in range(0, len(chunks), fec.FEC_BLOCK_SIZE):
+            block = chunks[block_start:block_start + fec.FEC_BLOCK_SIZE]
+            block_needed = [i for i in range(block_start, block_start + len(block)) if i in needed]
+            if not block_needed:
+                continue
+            for i in block_needed:
+                # Encode chunk as base64 to handle binary data safely
+                chunk_b64 = base64.b64encode(chunks[i]).decode('ascii')
+                frames.append((MsgType.FILE_CHUNK, i + 2, chunk_b64))
+            if parity_count:
+                block_index = block_start // fec.FEC_BLOCK_SIZE
+                for j, parity in enumerate(fec.encode(block, parity_count)):
+                    parity_data = (f"{block_index}|{fec.FEC_BLOCK_SIZE}|{parity_count}|{j}|{chunk_size}|"
+                                   f"{base64.b64encode(parity).decode('ascii')}")
+                    frames.append((MsgType.FILE_PARITY, parity_seq, parity_data))
+                    parity_seq += 1
+        self.sent_file_seqs[msg_id] = {frame_seq for _, frame_seq, _ in frames}
+        self.apply_pacing(peer['mac'])
+        self.send_chunks_striped(msg_id, frames, peer['mac'])
 
         # Set up expected FILE_ACK with timeout and retry logic
         self.update_peer(peer_id, {
             'expected_ack': {
                 'msg_id': msg_id,
                 'attempt': 0,
-                'latest_by': time.time() + 0.5,  # 500ms for file transfer ACK (longer than regular messages)
+                'latest_by': self.clock.time() + 0.5,  # 500ms for file transfer ACK (longer than regular messages)
                 'type': 'file'  # Mark this as a file transfer ACK
             },
         })
-        waiting_for_ack.set()
+        self.expect_ack_by(self.known_peers[peer_id]['expected_ack']['latest_by'])
 
         # Send FILE_END
-        send_frame(MsgType.FILE_END, msg_id, seq, "", IFACE, peer['mac'], SRC_MAC, self.debug_mode)
+        self.send(MsgType.FILE_END, msg_id, end_seq, "", peer['mac'])
+
+        parity_note = f' plus {parity_seq - end_seq - 1} parity frames' if use_fec else ''
+        print(f'File {filename} sent in {len(needed)} chunks{parity_note}')
+
+    def send_manifest(self, peer, filename, file_data):
+        '''
+        Sends the content-defined chunk manifest of a file and waits for the
+        peer's FILE_HAVE. Returns (manifest msg_id, delta) where delta is the
+        concatenation of the chunks the peer asked for, or None if the peer
+        never answered.
+        '''
+        entries = build_manifest(file_data)
+        bodies = encode_manifest(entries)
+        manifest_id = self.get_next_msg_id()
+        offer = {'event': threading.Event(), 'missing': None, 'count': len(entries)}
+        self.resume_offers[manifest_id] = offer
+        header = f"{filename}|{len(file_data)}|{hashlib.sha256(file_data).hexdigest()}|{len(bodies)}"
+        for attempt in range(2):
+            self.send(MsgType.FILE_MANIFEST, manifest_id, 0, header, peer['mac'])
+            for seq, body in enumerate(bodies, 1):
+                self.send(MsgType.FILE_MANIFEST, manifest_id, seq, body, peer['mac'])
+            if self.clock.wait(offer['event'], MANIFEST_WAIT):
+                break
+        del self.resume_offers[manifest_id]
+
+        if offer['missing'] is None:
+            print(f'No manifest reply from {peer["name"]}, sending the whole file')
+            return None
+        delta = b''.join(file_data[offset:offset + length]
+                         for i, (_, offset, length) in enumerate(entries) if i in offer['missing'])
+        print(f'{peer["name"]} needs {len(offer["missing"])} of {len(entries)} chunks: '
+              f'sending {len(delta)} of {len(file_data)} bytes')
+        return manifest_id, delta
+
+    def plan_delta(self, manifest):
+        '''
+        Works out which chunks of a complete incoming manifest we need: the
+        first copy of every chunk not already in our chunk store. The ones
+        we have are pinned until the file is rebuilt.
+        '''
+        entries = [entry for seq in sorted(manifest['frames']) for entry in manifest['frames'][seq]]
+        needed = set()
+        have = set()
+        seen = set()
+        for i, (h, _) in enumerate(entries):
+            if h in seen:
+                continue
+            seen.add(h)
+            if self.chunk_store.has(h):
+                have.add(h)
+            else:
+                needed.add(i)
+        self.chunk_store.pin(have)
+        manifest['entries'] = entries
+        manifest['needed'] = needed
+        manifest['pinned'] = have
+
+    def rebuild_from_manifest(self, manifest, partial, path):
+        '''
+        Writes the file a manifest describes to path, taking new chunks in
+        order from the received delta and the rest from the chunk store.
+        Returns True if the result matches the manifest's hash. Raises
+        ValueError if a received chunk doesn't match its hash, before it
+        goes into the store.
+        '''
+        hasher = hashlib.sha256()
+        written = {}  # chunk hash -> offset in the output, for chunks repeated within the file
+        delta_offset = 0
+        with open(partial.data_path, 'rb') as delta, open(path, 'w+b') as out:
+            for i, (h, length) in enumerate(manifest['entries']):
+                if i in manifest['needed']:
+                    delta.seek(delta_offset)
+                    chunk = delta.read(length)
+                    delta_offset += length
+                    self.chunk_store.put(h, chunk)
+                elif h in written:
+                    position = out.tell()
+                    out.seek(written[h])
+                    chunk = out.read(length)
+                    out.seek(position)
+                else:
+                    chunk = self.chunk_store.get(h)
+                written.setdefault(h, out.tell())
+                out.write(chunk)
+                hasher.update(chunk)
+        return hasher.hexdigest() == manifest['header']['sha256']
+
+    def set_rate_limit(self, peer_id, rate):
+        '''
+        Caps file transfer traffic to a peer at rate bytes per second (None
+        or 0 removes the cap). Pacing still adapts below the cap. Chat and
+        control frames are never held back.
+        '''
+        peer = self.known_peers.get(peer_id)
+        if not peer or 'mac' not in peer:
+            print('Unknown peer ID')
+            return
+        self.pacer_for(peer['mac']).max_rate = rate or None
+        self.apply_pacing(peer['mac'])
+
+    def pacer_for(self, mac):
+        pacer = self.pacers.get(mac)
+        if pacer is None:
+            pacer = self.pacers[mac] = PacingController(adaptive=self.pacing)
+        return pacer
 
-        print(f'File {filename} sent in {seq-1} chunks')
+    def apply_pacing(self, mac):
+        '''
+        Sets the token buckets for a peer's file frames to its pacing rate,
+        split across links by weight. Frames to a peer out of radio range
+        are paced at the next hop.
+        '''
+        rate = self.pacer_for(mac).rate
+        next_hop = (self.routing.next_hop(mac) if self.routing else None) or mac
+        weights = self.link_weights()
+        total = sum(weights.values())
+        for transport in self.transports:
+            share = rate * weights[transport.name] / total if rate else None
+            self.schedulers[transport.name].set_limit(next_hop, share, PACING_BURST)
+
+    def report_progress(self, transfer, msg_id, seq, sender_mac):
+        '''
+        Every PROGRESS_EVERY file frames, tells the sender how many we have
+        and which one came last, so it can pace to what we actually receive.
+        Counted in CHUNK_SIZE frames, so the sender's rate ramps up per byte
+        whatever chunk size it probed.
+        '''
+        received = len(transfer['received_seqs'])
+        every = max(1, PROGRESS_EVERY * CHUNK_SIZE // transfer['partial'].chunk_size)
+        if received % every == 0:
+            self.send(MsgType.FILE_PROGRESS, self.get_next_msg_id(), 0,
+                      f"{msg_id}|{received}|{seq}", sender_mac)
+
+    def link_weights(self):
+        '''
+        Returns each link's share of bulk traffic: its measured throughput
+        scaled by its delivery rate. Links are weighted equally until all of
+        them have been measured.
+        '''
+        weights = {}
+        for transport in self.transports:
+            stats = self.link_stats[transport.name]
+            if stats['send_time'] == 0:
+                return {t.name: 1.0 for t in self.transports}
+            throughput = stats['bytes_sent'] / stats['send_time']
+            weights[transport.name] = throughput * max(1 - stats['loss'], 0.05)
+        return weights
+
+    def send_chunks_striped(self, msg_id, frames, dst):
+        '''
+        Sends (msg_type, seq, data) bulk frames across all links in
+        proportion to link_weights(), with one sending thread per link, and
+        returns once they have all been transmitted.
+        '''
+        if len(self.transports) == 1:
+            for msg_type, seq, data in frames:
+                self.send(msg_type, msg_id, seq, data, dst)
+            self.schedulers[self.transports[0].name].drain(dst)
+            return
+
+        # Smooth weighted round-robin keeps each link's chunks spread through the file
+        weights = self.link_weights()
+        total = sum(weights.values())
+        current = {name: 0.0 for name in weights}
+        assigned = {t.name: [] for t in self.transports}
+        for frame in frames:
+            for name in current:
+                current[name] += weights[name]
+            best = max(current, key=current.get)
+            current[best] -= total
+            assigned[best].append(frame)
+
+        self.chunk_links[msg_id] = {seq: name for name, items in assigned.items() for _, seq, _ in items}
+
+        def send_on(transport, items):
+            for msg_type, seq, data in items:
+                self.send(msg_type, msg_id, seq, data, dst, transport)
+
+        threads = [threading.Thread(target=send_on, args=(t, assigned[t.name]))
+                   for t in self.transports if assigned[t.name]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Wait for the chunks to be on the air, so FILE_END (on the primary link) follows
+        # all of them and the ACK timer starts from there
+        for transport in self.transports:
+            self.schedulers[transport.name].drain(dst)
+
+    def record_link_losses(self, msg_id, received_seqs):
+        '''
+        Attributes the chunks missing from a FILE_ACK to the links that
+        carried them and updates each link's loss estimate.
+        '''
+        links = self.chunk_links.pop(msg_id, None)
+        if not links:
+            return
+        sent = {}
+        lost = {}
+        for seq, name in links.items():
+            sent[name] = sent.get(name, 0) + 1
+            if seq not in received_seqs:
+                lost[name] = lost.get(name, 0) + 1
+        for name, count in sent.items():
+            stats = self.link_stats[name]
+            stats['chunks_sent'] += count
+            stats['chunks_lost'] += lost.get(name, 0)
+            stats['loss'] = 0.7 * stats['loss'] + 0.3 * (lost.get(name, 0) / count)
+
+    def recover_chunks(self, transfer):
+        '''
+        Rebuilds missing data chunks of each FEC block from its parity
+        frames, without asking the sender for a retransmission.
+        '''
+        partial = transfer['partial']
+        recovered = 0
+        unrecoverable = 0
+        for block, fec_block in transfer['parity'].items():
+            block_size = fec_block['block_size']
+            first = block * block_size
+            k = min(block_size, partial.num_chunks - first)
+            if k <= 0:
+                continue
+            data = {i: partial.read_chunk(first + i) for i in range(k) if partial.has(first + i)}
+            if len(data) == k:
+                continue
+
+            length = len(next(iter(fec_block['parity'].values())))
+            rebuilt = fec.decode(data, fec_block['parity'], k, fec_block['parity_count'], length)
+            if rebuilt is None:
+                unrecoverable += k - len(data)
+                continue
+            for i, chunk in rebuilt.items():
+                index = first + i
+                # Only the file's last chunk is short; trim the zero padding
+                partial.write_chunk(index, chunk[:partial.size - index * partial.chunk_size])
+                recovered += 1
+
+        if recovered or unrecoverable:
+            print(f'FEC recovered {recovered} lost chunks of {transfer["filename"]}'
+                  + (f', {unrecoverable} could not be recovered' if unrecoverable else ''))
 
     def reassemble_file(self, transfer_key):
         '''
-        Reassembles received file chunks and saves the file.
+        Saves a finished transfer once it is complete and matches its hash.
+        An incomplete one is kept on disk so a later FILE_INIT can resume it.
         '''
-        if transfer_key not in self.file_transfers:
+        transfer = self.file_transfers.pop(transfer_key, None)
+        if transfer is None:
             return
 
-        transfer = self.file_transfers[transfer_key]
+        partial = transfer['partial']
         filename = transfer['filename']
-        expected_size = transfer['size']
-        chunks = transfer['chunks']
 
-        # Sort chunks by sequence number and reassemble
-        sorted_seqs = sorted(chunks.keys())
-        file_data = b''
-        
-        for seq in sorted_seqs:
-            file_data += chunks[seq]
+        # Find sender name
+        sender_mac = transfer_key[0]
+        sender_name = "Unknown"
+        for pid, pinfo in self.known_peers.items():
+            if pinfo.get('mac') == sender_mac:
+                sender_name = pinfo['name']
+                break
+
+        if not partial.complete:
+            partial.close()
+            missing = partial.num_chunks - partial.received
+            print(f'{filename} from {sender_name} is missing {missing} of {partial.num_chunks} chunks, '
+                  f'kept for resuming')
+            return
 
-        # Verify file size
-        if len(file_data) != expected_size:
-            print(f'Warning: File size mismatch for {filename}. Expected {expected_size}, got {len(file_data)}')
+        if not partial.verified():
+            print(f'Error: {filename} from {sender_name} does not match its SHA-256, discarding it')
+            partial.discard()
+            return
 
         # Save file with a prefix to avoid overwriting
         safe_filename = f"received_{filename}"
@@ -593,25 +2331,51 @@ class Me:
             safe_filename = f"received_{name}_{counter}{ext}"
             counter += 1
 
+        if 'manifest_key' in transfer:
+            manifest = self.manifests.pop(transfer['manifest_key'], None)
+            if manifest is None or 'entries' not in manifest:
+                print(f'Error: no manifest for the delta of {filename} from {sender_name}')
+                partial.discard()
+                return
+            try:
+                rebuilt = self.rebuild_from_manifest(manifest, partial, safe_filename)
+            except Exception as e:
+                rebuilt = False
+                print(f'Error rebuilding {filename}: {e}')
+            finally:
+                self.chunk_store.unpin(manifest['pinned'])
+                partial.discard()
+            if not rebuilt:
+                print(f'Error: rebuilt {filename} from {sender_name} does not match its SHA-256, discarding it')
+                if os.path.exists(safe_filename):
+                    os.remove(safe_filename)
+                return
+            print(f'File saved as {safe_filename} ({manifest["header"]["size"]} bytes, '
+                  f'{partial.size} sent) from {sender_name}')
+            return
+
         try:
-            with open(safe_filename, 'wb') as f:
-                f.write(file_data)
-            
-            # Find sender name
-            sender_mac = transfer_key[0]
-            sender_name = "Unknown"
-            for pid, pinfo in self.known_peers.items():
-                if pinfo.get('mac') == sender_mac:
-                    sender_name = pinfo['name']
-                    break
-            
-            print(f'File saved as {safe_filename} ({len(file_data)} bytes) from {sender_name}')
-            
+            partial.finish(safe_filename)
+            print(f'File saved as {safe_filename} ({partial.size} bytes) from {sender_name}')
         except Exception as e:
             print(f'Error saving file {safe_filename}: {e}')
+            return
+
+        # Keep its chunks so later versions of this file can be sent as a delta
+        threading.Thread(target=self.chunk_store.add_file, args=(os.path.abspath(safe_filename),), daemon=True).start()
 
-        # Clean up transfer tracking
-        del self.file_transfers[transfer_key]
+    def close_transfers(self, transfer_keys):
+        '''
+        Stops tracking incoming transfers, checkpointing each one so the
+        chunks received so far survive for a resume.
+        '''
+        for transfer_key in transfer_keys:
+            transfer = self.file_transfers.pop(transfer_key, None)
+            if transfer is None:
+                continue
+            partial = transfer['partial']
+            partial.close()
+            print(f'Transfer of {transfer["filename"]} paused at {partial.received}/{partial.num_chunks} chunks')
 
     def send_terminate(self):
         '''
@@ -619,16 +2383,42 @@ class Me:
         '''
         for id, peer in self.known_peers.items():
             if 'mac' in peer:
-                send_frame(MsgType.TERMINATE, self.get_next_msg_id(), 1, 
-                         "", IFACE, peer['mac'], SRC_MAC, self.debug_mode)
+                self.send(MsgType.TERMINATE, self.get_next_msg_id(), 1, 
+                         "", peer['mac'])
         print('Terminate frames sent to all peers')
 
+    def stop(self):
+        '''
+        Checkpoints unfinished incoming transfers, gives queued frames (like
+        TERMINATE) a moment to go out, then flushes and closes the frame
+        recorder, if any.
+        '''
+        self.close_transfers(list(self.file_transfers))
+        if self.radio:
+            self.radio.remove(self)
+        for scheduler in self.schedulers.values():
+            scheduler.flush(timeout=2.0)
+        if self.recorder:
+            self.recorder.close()
+
     def start(self):
         '''
         Starts the connection threads.
         '''
+        if self.radio:
+            self.radio.add(self)  # frames for us arrive through the radio's capture
+        if self.clock.virtual:
+            # No threads: frames arrive, and the announcer and ACK checks run, as clock events
+            for transport in [] if self.radio else self.transports:
+                self.frame_listener(transport)  # virtual transports only register the callback
+            self.clock.call_later(0, self.announce)
+            self.clock.call_later(HEARTBEAT_INTERVAL, self.scheduled_heartbeat)
+            return
         self.timeout_ack_thread.start()
-        self.frame_listener_thread.start()
+        for pool in self.receive_pools.values():
+            pool.start()
+        for thread in self.frame_listener_threads:
+            thread.start()
         self.announcer_thread.start()
 
     def cmd(self):
@@ -640,6 +2430,16 @@ class Me:
 ls                    = list known peers
 msg <id> <message>    = send message to peer
 file <id> <filepath>  = send file to peer
+fecfile <id> <path>   = send file to peer with FEC parity frames
+deltafile <id> <path> = send only the parts of a file the peer doesn't have
+limit <id> <kB/s>     = cap file transfer rate to peer (0 = no cap)
+pacing                = show file transfer pacing rate, loss and chunk size per peer
+group <gid> <id,id..> = create a group of peers
+gmsg <gid> <message>  = send message to every member of a group
+links                 = show per-interface statistics
+ping <id> [size,..]   = measure RTT, loss and jitter to a peer per PING padding size
+outbox                = list messages not delivered yet
+admission             = show frames admitted and dropped before decryption
 q                     = send terminate frame and quit''')
 
         while True:
@@ -649,14 +2449,71 @@ q                     = send terminate frame and quit''')
             if parts[0] == 'ls':
                 for id, info in self.known_peers.items():
                     name = info['name']
-                    last_seen_secs = time.time() - info['last_seen']
-                    print(f'{name} ({id}) last seen {last_seen_secs}s ago')
+                    last_seen_secs = self.clock.time() - info.get('last_seen', self.clock.time())
+                    via = f' ({info["hops"]} hops away)' if info.get('hops', 1) > 1 else ''
+                    print(f'{name} ({id}) last seen {last_seen_secs}s ago{via}')
             elif parts[0] == 'msg' and len(parts) == 3:
                 self.send_message(parts[1], parts[2])
             elif parts[0] == 'file' and len(parts) == 3:
                 self.send_file(parts[1], parts[2])
+            elif parts[0] == 'fecfile' and len(parts) == 3:
+                self.send_file(parts[1], parts[2], use_fec=True)
+            elif parts[0] == 'deltafile' and len(parts) == 3:
+                self.send_file(parts[1], parts[2], use_dedup=True)
+            elif parts[0] == 'limit' and len(parts) == 3:
+                try:
+                    rate = float(parts[2]) * 1000
+                except ValueError:
+                    print('Usage: limit <id> <kB/s>')
+                    continue
+                self.set_rate_limit(parts[1], rate)
+            elif parts[0] == 'pacing':
+                for id, info in self.known_peers.items():
+                    pacer = self.pacers.get(info.get('mac'))
+                    if pacer:
+                        rate = f'{pacer.rate / 1000:.0f} kB/s' if pacer.rate else 'unlimited'
+                        print(f'{id}: {rate}, loss {pacer.loss * 100:.1f}%, '
+                              f'{info.get("chunk_size", CHUNK_SIZE)} byte chunks')
+            elif parts[0] == 'group' and len(parts) == 3:
+                self.create_group(parts[1], parts[2].split(','))
+            elif parts[0] == 'gmsg' and len(parts) == 3:
+                self.send_group_message(parts[1], parts[2])
+            elif parts[0] == 'ping' and len(parts) >= 2:
+                try:
+                    sizes = tuple(map(int, parts[2].split(','))) if len(parts) == 3 else PING_SIZES
+                except ValueError:
+                    print('Usage: ping <id> [size,size..]')
+                    continue
+                for stats in self.ping(parts[1], sizes=sizes) or []:
+                    line = f'{stats["size"]:>5} B: {stats["received"]}/{stats["sent"]} PONGs, loss {stats["loss"] * 100:.0f}%'
+                    if stats['received']:
+                        line += (f', rtt min/avg/p99 {stats["min"]:.2f}/{stats["avg"]:.2f}/{stats["p99"]:.2f} ms'
+                                 f', jitter {stats["jitter"]:.2f} ms')
+                    print(line)
+            elif parts[0] == 'outbox':
+                for message in self.outbox.pending():
+                    queued_secs = self.clock.time() - message['queued_at']
+                    print(f'{message["id"]} to {message["peer"]}, {message["status"]} for {queued_secs:.0f}s: {message["text"]}')
+            elif parts[0] == 'admission':
+                if self.admission:
+                    print(', '.join(f'{key} {value}' for key, value in self.admission.stats().items()))
+                else:
+                    print('Admission control is off')
+            elif parts[0] == 'links':
+                weights = self.link_weights()
+                links = {link.name: link for link in self.transports}
+                for link_name, stats in self.link_stats.items():
+                    throughput = stats['bytes_sent'] / stats['send_time'] if stats['send_time'] else 0
+                    # Frames whose handling raised, in the capture thread or the receive workers' reader
+                    errors = sum(getattr(source, 'callback_errors', 0)
+                                 for source in (links.get(link_name), self.receive_pools.get(link_name)))
+                    print(f'{link_name}: sent {stats["frames_sent"]} frames ({throughput / 1000:.1f} kB/s), '
+                          f'received {stats["frames_received"]} ({stats["duplicates"]} duplicates, '
+                          f'{errors} dropped on errors), '
+                          f'loss {stats["loss"] * 100:.1f}%, weight {weights[link_name]:.0f}')
             elif parts[0] == 'q':
                 self.send_terminate()
+                self.stop()
                 break
             else:
                 print('Unknown command')
@@ -664,8 +2521,14 @@ q                     = send terminate frame and quit''')
 if __name__ == '__main__':
     name = input('What\'s your name? ')
     debug_mode = input('Enable debug mode to show all frames sent and received (y/n):').startswith('y')
+    trace_path = input('Record frames to a pcap file (leave blank to skip): ').strip()
+    ifaces = input(f'Monitor interfaces, comma separated (default {IFACE}): ').strip() or IFACE
+    mesh = input('Relay frames for peers out of range (y/n): ').startswith('y')
+    workers = input('Receive worker processes per interface (default 0, all in this process): ').strip()
     id = f'{name}' # TODO: make unique
 
-    me = Me(name, debug_mode)
+    transports = [open_transport(iface.strip()) for iface in ifaces.split(',')]
+    me = Me(name, debug_mode, TraceRecorder(trace_path) if trace_path else None, transports=transports,
+            mesh=mesh, receive_workers=int(workers or 0))
     me.start()
     me.cmd()
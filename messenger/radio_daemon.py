@@ -0,0 +1,35 @@
+import argparse
+from peer import Me, IFACE
+from frame_trace import TraceRecorder
+from history import MessageHistory, HISTORY_PATH
+from history_sync import HistorySync
+from radio_ipc import RadioServer, RADIO_SOCKET
+from transport import open_transport
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the radio (Me) as a daemon that API processes connect to.')
+    parser.add_argument('--name', default='Anonymous')
+    parser.add_argument('--ifaces', default=IFACE, help='monitor interfaces, comma separated')
+    parser.add_argument('--socket', default=RADIO_SOCKET, help='Unix socket API clients connect to')
+    parser.add_argument('--history', default=HISTORY_PATH, help='message history database')
+    parser.add_argument('--trace', help='record frames to this pcap file')
+    parser.add_argument('--mesh', action='store_true', help='relay frames for peers out of range')
+    parser.add_argument('--workers', type=int, default=0, help='receive worker processes per interface')
+    parser.add_argument('--debug', action='store_true', help='show all frames sent and received')
+    args = parser.parse_args()
+
+    transports = [open_transport(iface.strip()) for iface in args.ifaces.split(',')]
+    me = Me(args.name, args.debug, TraceRecorder(args.trace) if args.trace else None, transports=transports,
+            mesh=args.mesh, receive_workers=args.workers)
+    history = MessageHistory(args.history)
+    HistorySync(me, history)  # catches up conversations with peers that rejoin
+    server = RadioServer(me, history, args.socket)
+    me.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        me.send_terminate()
+        me.stop()
+
+if __name__ == '__main__':
+    main()
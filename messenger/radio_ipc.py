@@ -0,0 +1,366 @@
+import itertools
+import marshal
+import os
+import socket
+import struct
+import threading
+from enums import IpcOp
+
+RADIO_SOCKET = '/tmp/ghostframes-radio.sock'
+IPC_READ_SIZE = 65536  # bytes per recv; every complete message in them is handled in one pass
+IPC_TIMEOUT = 10.0  # seconds a client waits for a reply
+OUTBOX_LIMIT = 8 * 1024 * 1024  # unsent bytes before a client that stopped reading is dropped
+
+HEADER = struct.Struct('!IBI')  # body length, op, tag (0 for events)
+BACKGROUND_OPS = {IpcOp.PING}  # commands that take seconds, answered from a thread of their own
+
+class IpcError(Exception):
+    '''
+    The radio daemon refused a command, or can't be reached.
+    '''
+
+def encode_message(op: int, tag: int, value) -> bytes:
+    '''
+    A message is a header and a marshal body. marshal is C fast and takes
+    exactly what crosses the socket (None, numbers, str, bytes, lists and
+    dicts); both ends run the same interpreter from the same tree.
+    '''
+    body = marshal.dumps(value)
+    return HEADER.pack(len(body), op, tag) + body
+
+def read_messages(buffer: bytearray):
+    '''
+    Splits the complete messages off the front of buffer. Returns a list of
+    (op, tag, value) and how many bytes they took; the rest is a message
+    still arriving.
+    '''
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= HEADER.size:
+        length, op, tag = HEADER.unpack_from(buffer, offset)
+        start = offset + HEADER.size
+        if len(buffer) - start < length:
+            break
+        messages.append((op, tag, marshal.loads(buffer[start:start + length])))
+        offset = start + length
+    return messages, offset
+
+class Outbox:
+    '''
+    Writes to one IPC connection from a thread of its own. Whatever was
+    queued while the last write was going out (replies, events) goes out
+    together in the next one, so a busy connection costs one syscall per
+    batch, and the radio threads that queue events never block on a socket.
+    '''
+    def __init__(self, sock):
+        self.sock = sock
+        self.queued = []
+        self.queued_bytes = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.writer_thread = threading.Thread(target=self.writer, daemon=True)
+        self.writer_thread.start()
+
+    def push(self, data: bytes):
+        with self.condition:
+            if self.closed:
+                return
+            self.queued.append(data)
+            self.queued_bytes += len(data)
+            if self.queued_bytes > OUTBOX_LIMIT:
+                print('[!] IPC client is not reading; disconnecting it')
+                self.close()
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def writer(self):
+        while True:
+            with self.condition:
+                while not self.queued and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                data = b''.join(self.queued)
+                self.queued = []
+                self.queued_bytes = 0
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+                return
+
+class RadioServer:
+    '''
+    Serves a started Me to API processes over a Unix socket, so HTTP
+    handling and JSON run in other processes instead of competing with
+    frame processing for this one's GIL. Any number of clients may connect.
+    Each connection is read by its own thread; all the complete commands
+    in one read are handled together and their replies written together.
+    Received messages are stored in history and pushed to subscribers.
+    '''
+    def __init__(self, me, history, path: str = RADIO_SOCKET):
+        self.me = me
+        self.history = history
+        self.path = path
+        self.subscribers = set()  # Outboxes of clients that sent SUBSCRIBE
+        self.handlers = {
+            IpcOp.SEND: self.send,
+            IpcOp.RENAME: self.rename,
+            IpcOp.NAME: self.name,
+            IpcOp.PEERS: self.peers,
+            IpcOp.HISTORY: self.search,
+            IpcOp.SUBSCRIBE: self.subscribe,
+            IpcOp.PING: self.ping,
+            IpcOp.DELIVERY: self.delivery,
+            IpcOp.OUTBOX: self.undelivered,
+            IpcOp.ADMISSION: self.admission,
+        }
+        me.register_message_listener(self.on_message)
+
+    def serve_forever(self):
+        '''
+        Accepts clients until the process exits.
+        '''
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left behind by a previous run
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)  # clients can send as us
+        server.listen()
+        print(f'Radio listening for API clients on {self.path}')
+        while True:
+            sock, _ = server.accept()
+            threading.Thread(target=self.serve_client, args=(sock,), daemon=True).start()
+
+    def serve_client(self, sock):
+        outbox = Outbox(sock)
+        buffer = bytearray()
+        try:
+            while True:
+                data = sock.recv(IPC_READ_SIZE)
+                if not data:
+                    break
+                buffer += data
+                messages, consumed = read_messages(buffer)
+                del buffer[:consumed]
+                replies = []
+                for op, tag, args in messages:
+                    if op in BACKGROUND_OPS:
+                        threading.Thread(target=lambda op=op, tag=tag, args=args:
+                                         outbox.push(self.handle(outbox, op, tag, args)), daemon=True).start()
+                    else:
+                        replies.append(self.handle(outbox, op, tag, args))
+                if replies:
+                    outbox.push(b''.join(replies))
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            print(f'[!] Dropping IPC client: {e}')
+        finally:
+            self.subscribers.discard(outbox)
+            outbox.close()
+            sock.close()
+
+    def handle(self, outbox, op: int, tag: int, args) -> bytes:
+        handler = self.handlers.get(op)
+        if handler is None:
+            return encode_message(IpcOp.ERROR, tag, f'Unknown command {op}')
+        try:
+            return encode_message(IpcOp.OK, tag, handler(outbox, *args))
+        except (IpcError, TypeError, ValueError) as e:
+            return encode_message(IpcOp.ERROR, tag, str(e))
+
+    def on_message(self, sender_id, text):
+        '''
+        Message listener on Me: runs on a radio thread, so it only queues.
+        '''
+        self.history.add(sender_id, sender_id, text)
+        if self.subscribers:
+            event = encode_message(IpcOp.MESSAGE, 0, [sender_id, text])
+            for outbox in list(self.subscribers):
+                outbox.push(event)
+
+    def send(self, outbox, peer_id: str, text: str):
+        message_id = self.me.send_message(peer_id, text)
+        self.history.add(peer_id, 'me', text)
+        return self.me.outbox.status(message_id)
+
+    def rename(self, outbox, name: str):
+        self.me.rename(name)
+
+    def name(self, outbox):
+        return self.me.name
+
+    def peers(self, outbox):
+        return {id: {'name': info.get('name', id), 'last_seen': info.get('last_seen'), 'hops': info.get('hops', 1)}
+                for id, info in list(self.me.known_peers.items())}
+
+    def search(self, outbox, query: str, peer: str = None, before: float = None, limit: int = 20, offset: int = 0):
+        return self.history.search(query, peer=peer, before=before, limit=limit, offset=offset)
+
+    def subscribe(self, outbox):
+        self.subscribers.add(outbox)
+
+    def ping(self, outbox, peer_id: str, count: int, sizes: list):
+        if 'mac' not in self.me.known_peers.get(peer_id, {}):
+            raise IpcError(f'Unknown peer {peer_id}')
+        return self.me.ping(peer_id, count, sizes)
+
+    def delivery(self, outbox, message_id: str):
+        status = self.me.outbox.status(message_id)
+        if status is None:
+            raise IpcError(f'Unknown message {message_id}')
+        return status
+
+    def undelivered(self, outbox, peer_id: str = None):
+        return self.me.outbox.pending(peer_id)
+
+    def admission(self, outbox):
+        if self.me.admission is None:
+            raise IpcError('Admission control is off')
+        return self.me.admission.stats()
+
+class RadioClient:
+    '''
+    An API process's connection to the radio daemon, with the parts of Me
+    the API uses. Safe to share between request threads. call_many() sends
+    several commands in one write and gets their replies in one read.
+    Message listeners run on the connection's reader thread.
+    '''
+    def __init__(self, path: str = RADIO_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.lock = threading.Lock()
+        self.tags = itertools.count(1)
+        self.pending = {}  # tag -> [Event, reply op, reply value]
+        self.closed = False
+        self.message_listeners = []
+        self.subscribed = False
+        self.reader_thread = threading.Thread(target=self.reader, daemon=True)
+        self.reader_thread.start()
+
+    def call_many(self, calls: list, timeout: float = IPC_TIMEOUT) -> list:
+        '''
+        Sends [(op, args), ...] in one round trip and returns their results
+        in order. Raises IpcError if any of them failed.
+        '''
+        waiters = []
+        data = []
+        with self.lock:
+            if self.closed:
+                raise IpcError('Not connected to the radio daemon')
+            for op, args in calls:
+                tag = next(self.tags)
+                waiter = [threading.Event(), IpcOp.ERROR, 'No reply from the radio daemon']
+                self.pending[tag] = waiter
+                waiters.append(waiter)
+                data.append(encode_message(op, tag, list(args)))
+            self.sock.sendall(b''.join(data))
+        results = []
+        for waiter in waiters:
+            waiter[0].wait(timeout)
+            if waiter[1] != IpcOp.OK:
+                raise IpcError(waiter[2])
+            results.append(waiter[2])
+        return results
+
+    def call(self, op: int, *args):
+        return self.call_many([(op, args)])[0]
+
+    def reader(self):
+        buffer = bytearray()
+        while True:
+            try:
+                data = self.sock.recv(IPC_READ_SIZE)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            buffer += data
+            messages, consumed = read_messages(buffer)
+            del buffer[:consumed]
+            for op, tag, value in messages:
+                if op == IpcOp.MESSAGE:
+                    for callback in list(self.message_listeners):
+                        try:
+                            callback(*value)
+                        except Exception as e:
+                            print(f'Message listener failed: {e}')
+                    continue
+                waiter = self.pending.pop(tag, None)
+                if waiter:
+                    waiter[1:] = [op, value]
+                    waiter[0].set()
+        with self.lock:
+            self.closed = True
+            for waiter in self.pending.values():
+                waiter[0].set()
+            self.pending.clear()
+        print('[!] Lost the connection to the radio daemon')
+
+    def send_message(self, id: str, text: str) -> dict:
+        '''
+        Sends or queues a message. Returns its outbox entry: id, peer, text,
+        queued_at, status ('sent' or 'queued') and updated.
+        '''
+        return self.call(IpcOp.SEND, id, text)
+
+    def delivery(self, message_id: str) -> dict:
+        '''
+        The outbox entry of a message send_message returned, with its
+        current status: queued, sent, delivered, expired or dropped.
+        '''
+        return self.call(IpcOp.DELIVERY, message_id)
+
+    def undelivered(self, peer_id: str = None) -> list:
+        '''
+        Messages not delivered yet, for one peer or all of them.
+        '''
+        return self.call(IpcOp.OUTBOX, peer_id)
+
+    def admission(self) -> dict:
+        '''
+        Counters of the radio's admission stage: frames admitted, source
+        MACs tracked, and frames dropped before decryption by reason.
+        '''
+        return self.call(IpcOp.ADMISSION)
+
+    def rename(self, new_name: str):
+        self.call(IpcOp.RENAME, new_name)
+
+    def name(self) -> str:
+        return self.call(IpcOp.NAME)
+
+    def known_peers(self) -> dict:
+        '''
+        Snapshot of the daemon's peers: id -> {name, last_seen, hops}.
+        '''
+        return self.call(IpcOp.PEERS)
+
+    def search(self, query: str, peer: str = None, before: float = None, limit: int = 20, offset: int = 0) -> list:
+        return self.call(IpcOp.HISTORY, query, peer, before, limit, offset)
+
+    def ping(self, peer_id: str, count: int, sizes: list) -> list:
+        '''
+        Runs Me.ping in the daemon. Takes as long as the probe train does,
+        so there's no timeout; a lost daemon still ends the wait.
+        '''
+        return self.call_many([(IpcOp.PING, (peer_id, count, list(sizes)))], timeout=None)[0]
+
+    def register_message_listener(self, callback):
+        '''
+        Registers a callback(sender_id, text) for messages the radio receives.
+        '''
+        self.message_listeners.append(callback)
+        if not self.subscribed:
+            self.subscribed = True
+            self.call(IpcOp.SUBSCRIBE)
+
+    def remove_message_listener(self, callback):
+        self.message_listeners.remove(callback)
@@ -0,0 +1,84 @@
+import argparse
+import os
+import time
+from frame_trace import read_pcap
+from crypto_utils import TicketCache
+from peer import Me
+
+class ReplayMe(Me):
+    '''
+    A peer that never touches the radio: frames it would send are counted
+    and dropped, so a capture can be fed through the real frame handler.
+    identity: the Me a capture was recorded at, whose MAC and ECDH key pair
+    we take over so its sessions can be decrypted. Other keyword arguments
+    go to Me (transports, clock, outbox, ...).
+    '''
+    def __init__(self, name: str, debug_mode: bool = False, identity: Me = None, **kwargs):
+        # Replays must not touch the real resumption ticket cache
+        kwargs.setdefault('tickets', TicketCache(os.devnull))
+        if identity is not None:
+            kwargs.setdefault('mac', identity.mac)
+        super().__init__(name, debug_mode, **kwargs)
+        if identity is not None:
+            self.keypair = identity.keypair
+            self.public_key = identity.public_key
+            self.handshake_nonce = identity.handshake_nonce
+        self.frames_sent = 0
+
+    def transmit(self, frame, link=None):
+        self.frames_sent += 1
+
+    def transmit_batch(self, frames, link):
+        self.frames_sent += len(frames)
+
+def replay(me: Me, path: str, realtime: bool = False, speed: float = 1.0):
+    '''
+    Feeds every frame in a capture into me.handle_frame(). In realtime mode
+    the original inter-frame gaps (divided by speed) are kept, otherwise
+    frames are replayed as fast as possible. On a virtual clock, the clock
+    is run up to each frame's time in the capture instead, so rate limits
+    and timers see the original timing. Returns (frames, seconds).
+    '''
+    frames = list(read_pcap(path))
+    if not frames:
+        return 0, 0.0
+
+    first_ts = frames[0][0]
+    start_time = time.perf_counter()
+    clock_start = me.clock.time()
+    for ts, frame in frames:
+        if me.clock.virtual:
+            me.clock.run(clock_start + (ts - first_ts) / speed)
+        elif realtime:
+            delay = (ts - first_ts) / speed - (time.perf_counter() - start_time)
+            if delay > 0:
+                time.sleep(delay)
+        me.handle_frame(frame)
+    return len(frames), time.perf_counter() - start_time
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a GhostFrames capture into the frame handler.')
+    parser.add_argument('capture', help='pcap file written by TraceRecorder')
+    parser.add_argument('--name', default='replay', help='name of the replaying peer')
+    parser.add_argument('--realtime', action='store_true', help='keep the original frame timing')
+    parser.add_argument('--speed', type=float, default=1.0, help='speed-up factor for --realtime')
+    parser.add_argument('--repeat', type=int, default=1, help='number of passes over the capture')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    total_frames = 0
+    total_elapsed = 0.0
+    for i in range(args.repeat):
+        # Fresh peer each pass so duplicate suppression doesn't skew later passes
+        me = ReplayMe(args.name, args.debug)
+        frames, elapsed = replay(me, args.capture, args.realtime, args.speed)
+        total_frames += frames
+        total_elapsed += elapsed
+        print(f'[*] Pass {i + 1}: {frames} frames in {elapsed:.3f} seconds, '
+              f'{me.frames_sent} frames sent in reply, {len(me.known_peers)} peers known')
+
+    if total_elapsed > 0:
+        print(f'[*] Average rate: {total_frames / total_elapsed:.2f} frames/sec')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+from mesh import compact_mac, expand_mac
+
+# Rosters answer a join. A node that starts broadcasts one HANDSHAKE_REQ;
+# everyone who hears it sets up a session from the public key in it, but
+# only one of them answers, with a broadcast ROSTER listing the joiner, the
+# responder and the peers the responder hears directly, each with its
+# public key, so the joiner can set up every session on its own. Peers
+# wait a random time up to ROSTER_BACKOFF before answering and stay quiet
+# if the rosters they hear in the meantime already listed them and
+# everyone they would list. Third parties that missed the join learn the
+# joiner from the roster too.
+#
+# Without rosters every peer answered with a HANDSHAKE_ACK and a
+# HANDSHAKE_REQ of its own, which the joiner ACKed: about 3N frames per
+# join, and N² when a whole room starts at once.
+
+ROSTER_BACKOFF = 0.5  # longest random wait before answering a join
+ROSTER_ENTRIES_PER_FRAME = 12  # keeps each roster frame under the chunk size
+JOIN_WAIT = 2.0  # seconds a joiner waits for a roster before announcing again, doubling each time
+JOIN_RETRIES = 3  # announcements after the first when no roster comes
+
+def encode_roster(joiner_mac: str, entries: list) -> list:
+    '''
+    Returns the ROSTER bodies for a join: "<joiner mac>|<entry>|<entry>...",
+    each entry "<mac>,<public key>,<name>" (the name last, as the only
+    free-form field).
+    '''
+    encoded = [f"{compact_mac(mac)},{public_key},{name}" for mac, public_key, name in entries]
+    return ['|'.join([compact_mac(joiner_mac)] + encoded[i:i + ROSTER_ENTRIES_PER_FRAME])
+            for i in range(0, len(encoded), ROSTER_ENTRIES_PER_FRAME)]
+
+def decode_roster(data: str):
+    '''
+    Returns (joiner_mac, [(mac, public_key, name), ...]) from a ROSTER
+    body, skipping malformed entries.
+    '''
+    fields = data.split('|')
+    entries = []
+    for field in fields[1:]:
+        parts = field.split(',', 2)
+        if len(parts) == 3 and len(parts[0]) == 12 and parts[1] and parts[2]:
+            entries.append((expand_mac(parts[0]), parts[1], parts[2]))
+    return expand_mac(fields[0]), entries
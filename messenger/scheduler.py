@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import deque
+
+# Priority classes, served strictly in this order
+CONTROL = 0  # handshakes, ACKs, heartbeats: late ones get peers dropped
+CHAT = 1  # interactive messages
+BULK = 2  # file transfers
+
+DRR_QUANTUM = 2048  # bytes added to a peer's deficit per round, at least one full frame
+BULK_QUEUE_LIMIT = 64  # bulk frames queued per peer before the sender blocks
+TRANSMIT_BATCH = 32  # frames ready at once that go to the link in one call, if it takes batches
+
+class TokenBucket:
+    '''
+    Allows rate units (bytes, frames) per second on average, with bursts of
+    up to burst. The transmit scheduler paces bulk bytes with it; admission
+    control and the UDP gateway count frames and messages.
+    '''
+    def __init__(self, rate: float, burst: float = None, now: float = None):
+        self.rate = rate
+        self.burst = burst or rate / 10
+        self.tokens = self.burst
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, size: int, now: float) -> float:
+        '''
+        Seconds until size units may be sent (0 if they can go now).
+        '''
+        self.refill(now)
+        # A frame bigger than the burst goes as soon as the bucket is full
+        needed = min(size, self.burst)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def consume(self, size: int):
+        self.tokens -= size
+
+    def take(self, now: float, floor: float = 0) -> bool:
+        '''
+        Takes a token if more than floor + 1 are left.
+        '''
+        self.refill(now)
+        if self.tokens < floor + 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class TransmitScheduler:
+    '''
+    Owns one link: every frame for it is queued here and sent by a single
+    thread. Classes are served in strict priority order. Within a class each
+    destination has its own FIFO queue, and destinations share the link by
+    deficit round-robin, so one large transfer can't starve another peer.
+    With transmit_batch, every frame that may go at once (in the same
+    order) is handed over in one call.
+    '''
+    def __init__(self, transmit, name: str = '', transmit_batch=None):
+        self.transmit = transmit  # callable(pkt) that puts a frame on the link
+        self.transmit_batch = transmit_batch  # optional callable([pkt, ...]) for several frames
+        self.name = name
+        self.classes = [{'queues': {}, 'active': deque(), 'deficit': {}} for _ in (CONTROL, CHAT, BULK)]
+        self.limits = {}  # dst -> TokenBucket for its bulk traffic
+        self.in_flight = set()  # dsts of the frames being transmitted
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def enqueue(self, pkt, dst: str, priority: int = CONTROL, block: bool = True):
+        '''
+        Queues a frame. Bulk senders block while the destination already has
+        BULK_QUEUE_LIMIT frames waiting; with block=False the frame is
+        dropped instead. Returns False if it was dropped.
+        '''
+        size = len(pkt)
+        with self.cond:
+            cls = self.classes[priority]
+            queue = cls['queues'].get(dst)
+            if priority == BULK:
+                while queue is not None and len(queue) >= BULK_QUEUE_LIMIT:
+                    if not block:
+                        return False
+                    self.cond.wait()
+                    queue = cls['queues'].get(dst)
+            if queue is None:
+                queue = cls['queues'][dst] = deque()
+                cls['active'].append(dst)
+                cls['deficit'][dst] = 0
+            queue.append((pkt, size))
+            self.cond.notify_all()
+        return True
+
+    def set_limit(self, dst: str, rate: float, burst: float = None):
+        '''
+        Caps bulk traffic to dst at rate bytes per second (None removes it).
+        '''
+        with self.cond:
+            bucket = self.limits.get(dst)
+            if rate and bucket:
+                bucket.refill(time.monotonic())
+                bucket.rate = rate
+                bucket.burst = burst or rate / 10
+            elif rate:
+                self.limits[dst] = TokenBucket(rate, burst)
+            else:
+                self.limits.pop(dst, None)
+            self.cond.notify_all()
+
+    def drain(self, dst: str):
+        '''
+        Blocks until every frame queued for dst has been transmitted.
+        '''
+        with self.cond:
+            while dst in self.in_flight or any(dst in cls['queues'] for cls in self.classes):
+                self.cond.wait()
+
+    def flush(self, timeout: float = None) -> bool:
+        '''
+        Blocks until nothing is queued or in flight, or timeout passes.
+        Returns True if the link went idle.
+        '''
+        with self.cond:
+            return self.cond.wait_for(
+                lambda: not self.in_flight and not any(cls['queues'] for cls in self.classes), timeout)
+
+    def pending(self) -> int:
+        with self.cond:
+            return sum(len(q) for cls in self.classes for q in cls['queues'].values())
+
+    def next_frame(self, now: float):
+        '''
+        Picks the next frame to send. Returns (pkt, dst, None), or
+        (None, None, seconds to wait) when only rate-limited peers have
+        frames (seconds is None when nothing is queued at all).
+        '''
+        wait = None
+        for priority, cls in enumerate(self.classes):
+            active = cls['active']
+            blocked = set()  # rate-limited destinations seen in this pass
+            while active and len(blocked) < len(active):
+                dst = active[0]
+                queue = cls['queues'][dst]
+                size = queue[0][1]
+                bucket = self.limits.get(dst) if priority == BULK else None
+                bucket_wait = bucket.wait_time(size, now) if bucket else 0.0
+                if bucket_wait:
+                    wait = bucket_wait if wait is None else min(wait, bucket_wait)
+                    blocked.add(dst)
+                    active.rotate(-1)
+                    continue
+                if cls['deficit'][dst] < size:
+                    cls['deficit'][dst] += DRR_QUANTUM
+                    active.rotate(-1)
+                    continue
+
+                cls['deficit'][dst] -= size
+                pkt, _ = queue.popleft()
+                if bucket:
+                    bucket.consume(size)
+                if not queue:
+                    # An idle peer doesn't bank credit for later
+                    active.popleft()
+                    del cls['queues'][dst]
+                    del cls['deficit'][dst]
+                return pkt, dst, None
+        return None, None, wait
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.in_flight.clear()
+                self.cond.notify_all()
+                while True:
+                    pkt, dst, wait = self.next_frame(time.monotonic())
+                    if pkt is not None:
+                        break
+                    self.cond.wait(wait)
+                batch = [pkt]
+                self.in_flight.add(dst)
+                while self.transmit_batch and len(batch) < TRANSMIT_BATCH:
+                    pkt, dst, _ = self.next_frame(time.monotonic())
+                    if pkt is None:
+                        break
+                    batch.append(pkt)
+                    self.in_flight.add(dst)
+                self.cond.notify_all()  # a bulk queue has room again
+            try:
+                if len(batch) > 1:
+                    self.transmit_batch(batch)
+                else:
+                    self.transmit(batch[0])
+            except Exception as e:
+                print(f'Error transmitting on {self.name}: {e}')
+
+class InlineScheduler:
+    '''
+    Stands in for TransmitScheduler under a virtual clock, where there are
+    no threads: every frame goes to the link as soon as it's queued, and
+    the simulated link models airtime.
+    '''
+    def __init__(self, transmit, name: str = ''):
+        self.transmit = transmit
+        self.name = name
+
+    def enqueue(self, pkt, dst: str, priority: int = CONTROL, block: bool = True):
+        self.transmit(pkt)
+        return True
+
+    def set_limit(self, dst: str, rate: float, burst: float = None):
+        pass
+
+    def drain(self, dst: str):
+        pass
+
+    def flush(self, timeout: float = None) -> bool:
+        return True
+
+    def pending(self) -> int:
+        return 0
@@ -0,0 +1,208 @@
+import argparse
+import contextlib
+import hashlib
+import math
+import os
+import random
+import statistics
+import time
+from clock import VirtualClock
+from crypto_utils import TicketCache
+from outbox import MessageOutbox
+from peer import Me
+
+# Discrete-event simulation: many Me nodes on one VirtualClock, with frames
+# carried by a VirtualMedium instead of threads and sockets. Nodes are
+# placed at random in a square and hear each other within radio range.
+# Everything (placement, loss, traffic, churn, msg ids) comes from one seed,
+# so a run repeats exactly, and an hour of virtual time takes as much CPU
+# as handling its frames does.
+#
+# Chat, ACKs, heartbeats, handshakes, the outbox, mesh relaying and (with
+# mtu_probing) MTU probes are simulated. File transfers and pings run the
+# clock while they wait, so a script can call them between runs, but the
+# scenario here doesn't.
+
+class VirtualMedium:
+    '''
+    A radio channel under a VirtualClock. A frame reaches every online
+    transport in range of the sender after its airtime, unless lost. On a
+    shared channel one frame is on the air at a time, so a burst of frames
+    queues up behind each other as it would in one cell.
+    '''
+    def __init__(self, clock: VirtualClock, rng: random.Random, radio_range: float = None, loss: float = 0.0,
+                 shared: bool = False):
+        self.clock = clock
+        self.random = rng
+        self.radio_range = radio_range  # None: everyone hears everyone
+        self.loss = loss
+        self.shared = shared
+        self.busy_until = clock.time()  # end of the frame on the air, on a shared channel
+        self.frames_sent = 0
+        self.transports = []
+        self.neighbors = {}  # transport -> transports in range, worked out once placed
+        self.frames_delivered = 0
+
+    def attach(self, transport):
+        self.transports.append(transport)
+        self.neighbors.clear()
+
+    def in_range(self, a, b) -> bool:
+        if self.radio_range is None:
+            return True
+        return math.dist(a.position, b.position) <= self.radio_range
+
+    def broadcast(self, sender, frame: bytes):
+        receivers = self.neighbors.get(sender)
+        if receivers is None:
+            receivers = self.neighbors[sender] = [t for t in self.transports
+                                                  if t is not sender and self.in_range(sender, t)]
+        airtime = sender.airtime(frame)
+        self.frames_sent += 1
+        if self.shared:
+            self.busy_until = max(self.busy_until, self.clock.time()) + airtime
+            airtime = self.busy_until - self.clock.time()
+        for transport in receivers:
+            if transport.online and not (self.loss and self.random.random() < self.loss):
+                self.clock.call_later(airtime, transport.deliver, frame)
+                self.frames_delivered += 1
+
+class VirtualTransport:
+    '''
+    A transport on a VirtualMedium. listen() only registers the callback;
+    frames are handed to it by clock events. A transport that isn't
+    online neither sends nor hears anything, like a node out of range.
+    '''
+    def __init__(self, medium: VirtualMedium, name: str, position=(0.0, 0.0),
+                 rate: float = 1000, byte_rate: float = 1_000_000):
+        self.name = name
+        self.medium = medium
+        self.position = position
+        self.rate = rate  # frames per second
+        self.byte_rate = byte_rate
+        self.online = True
+        self.callback = None
+        medium.attach(self)
+
+    def airtime(self, frame: bytes) -> float:
+        return 1 / self.rate + len(frame) / self.byte_rate
+
+    def send(self, frame: bytes):
+        if self.online:
+            self.medium.broadcast(self, frame)
+
+    def listen(self, callback):
+        self.callback = callback
+
+    def deliver(self, frame: bytes):
+        if self.online and self.callback:
+            self.callback(frame)
+
+class Simulation:
+    '''
+    A scenario: nodes join at random times in the first HEARTBEAT_INTERVAL,
+    each sends chat messages to random peers it knows, and nodes drop off
+    the air for a while and come back. Collects what was sent and when each
+    message arrived.
+    '''
+    def __init__(self, nodes: int, seed: int = 1, area: float = 900, radio_range: float = 100,
+                 loss: float = 0.0, mesh: bool = False, chat_interval: float = 60,
+                 churn_interval: float = 30, offline_time: float = 120, mtu_probing: bool = False):
+        random.seed(seed)  # Me picks its first msg_id from the global generator
+        self.random = random.Random(seed)
+        self.clock = VirtualClock()
+        self.medium = VirtualMedium(self.clock, self.random, radio_range, loss)
+        self.chat_interval = chat_interval
+        self.churn_interval = churn_interval
+        self.offline_time = offline_time
+        self.nodes = []
+        for i in range(nodes):
+            position = (self.random.uniform(0, area), self.random.uniform(0, area))
+            transport = VirtualTransport(self.medium, f'n{i}', position)
+            self.nodes.append(Me(f'node{i}', tickets=TicketCache(os.devnull), mac=f'02:00:00:00:{i >> 8:02x}:{i & 0xff:02x}',
+                                 transports=[transport], mesh=mesh, mtu_probing=mtu_probing,
+                                 outbox=MessageOutbox(None, self.clock), clock=self.clock))
+        self.sent = {}  # text -> virtual send time
+        self.delivered = {}  # text -> virtual delivery time (first copy)
+        self.outages = 0
+
+    def on_message(self, node, sender_id, text):
+        if text not in self.delivered:
+            self.delivered[text] = self.clock.time()
+
+    def chat(self, node):
+        peers = [peer_id for peer_id, info in node.known_peers.items() if 'mac' in info]
+        if peers and node.transports[0].online:
+            text = f'{node.name}#{len(self.sent)}'
+            self.sent[text] = self.clock.time()
+            node.send_message(self.random.choice(peers), text)
+        self.clock.call_later(self.random.expovariate(1 / self.chat_interval), self.chat, node)
+
+    def churn(self):
+        node = self.random.choice(self.nodes)
+        transport = node.transports[0]
+        if transport.online:
+            transport.online = False
+            self.outages += 1
+            self.clock.call_later(self.random.uniform(0, self.offline_time), setattr, transport, 'online', True)
+        self.clock.call_later(self.random.expovariate(1 / self.churn_interval), self.churn)
+
+    def run(self, seconds: float):
+        start = self.clock.time()
+        for node in self.nodes:
+            node.register_message_listener(lambda sender_id, text, node=node: self.on_message(node, sender_id, text))
+            self.clock.call_later(self.random.uniform(0, 5), node.start)
+            self.clock.call_later(5 + self.random.expovariate(1 / self.chat_interval), self.chat, node)
+        if self.churn_interval:
+            self.clock.call_later(self.random.expovariate(1 / self.churn_interval), self.churn)
+        self.clock.run(start + seconds)
+
+    def fingerprint(self) -> str:
+        '''
+        Digest of every message sent and when it arrived; equal for two runs
+        with the same seed and parameters.
+        '''
+        log = ''.join(f'{text}@{self.sent[text]:.6f}>{self.delivered.get(text, -1):.6f};' for text in sorted(self.sent))
+        return hashlib.sha256(log.encode()).hexdigest()[:16]
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many virtual nodes faster than real time.')
+    parser.add_argument('--nodes', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=3600, help='virtual time to simulate')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--area', type=float, default=900, help='side of the square nodes are placed in (m)')
+    parser.add_argument('--range', type=float, default=100, help='radio range (m); 0 for a single cell')
+    parser.add_argument('--loss', type=float, default=0.0, help='random frame loss')
+    parser.add_argument('--mesh', action='store_true', help='relay frames for peers out of range')
+    parser.add_argument('--chat-interval', type=float, default=60, help='mean seconds between messages per node')
+    parser.add_argument('--churn-interval', type=float, default=30, help='mean seconds between outages (0: none)')
+    parser.add_argument('--offline-time', type=float, default=120, help='longest outage (s)')
+    parser.add_argument('--mtu-probing', action='store_true', help="probe each peer's chunk size after handshakes")
+    parser.add_argument('--verbose', action='store_true', help="show the nodes' output")
+    args = parser.parse_args()
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    sim = Simulation(args.nodes, args.seed, args.area, args.range or None, args.loss, args.mesh,
+                     args.chat_interval, args.churn_interval, args.offline_time, args.mtu_probing)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(None if args.verbose else devnull):
+        sim.run(args.seconds)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    neighbors = statistics.mean(len(receivers) for receivers in sim.medium.neighbors.values())
+    known = statistics.mean(len(node.known_peers) for node in sim.nodes)
+    pending = sum(len(node.outbox.pending()) for node in sim.nodes)
+    latencies = sorted(sim.delivered[text] - sim.sent[text] for text in sim.delivered if text in sim.sent)
+    print(f'{args.nodes} nodes, {args.seconds:.0f} s virtual, seed {args.seed}: {wall:.1f} s wall, {cpu:.1f} s CPU '
+          f'({args.seconds / wall:.0f}x real time)')
+    print(f'  {sim.clock.processed} events, {sim.medium.frames_delivered} frame deliveries, {sim.outages} outages')
+    print(f'  {neighbors:.1f} nodes in range on average, {known:.1f} known peers per node at the end')
+    print(f'  {len(sim.sent)} messages sent, {len(sim.delivered)} delivered, {pending} still in outboxes')
+    if latencies:
+        print(f'  delivery latency p50 {statistics.median(latencies) * 1000:.1f} ms, '
+              f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms')
+    print(f'  fingerprint {sim.fingerprint()}')
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,20 @@
 from datetime import datetime
-from scapy.all import sniff, Dot11, Raw
 from payload_utils import parse_payload
 from enums import MsgType
 from crypto_utils import decrypt_data
+from frames import parse_frame, BSSID
 
 def sniff_frames(iface: str, filter_substring: bytes = None, debug: bool = True, callback=None):
+    # scapy takes seconds to import on a Pi, so only load it once we capture
+    from scapy.sendrecv import sniff
+
     def handler(pkt):
-        if pkt.haslayer(Dot11):
-            dot11 = pkt[Dot11]
+        header = parse_frame(bytes(pkt))
+        if header:
+            _, _, bssid, payload = header
             # Only match frames with the right pseudo-BSSID
             # TODO: also only match frames with the right source address post-handshake
-            if dot11.addr3 == "02:07:08:15:19:20" and pkt.haslayer(Raw):
-                payload = pkt[Raw].load
+            if bssid == BSSID and payload:
                 if filter_substring is None or filter_substring in payload:
                     parsed = parse_payload(payload)
                     if parsed:
@@ -0,0 +1,90 @@
+import os
+import pytest
+import crypto_utils
+from admission import (AdmissionControl, HANDSHAKE_BURST, PEER_BURST, PEER_RATE, UNKNOWN_BURST,
+                       UNKNOWN_RATE, UNKNOWN_RESERVE, UNKNOWN_TOTAL_BURST)
+from clock import VirtualClock
+from crypto_utils import Session, frame_header
+from enums import MsgType
+
+PEER = '02:00:00:00:00:01'
+HEADER = frame_header(MsgType.MSG, 1, 1)
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+@pytest.fixture
+def admission(clock):
+    return AdmissionControl(clock=clock)
+
+def known_peer(admission, clock):
+    '''
+    Lets PEER's bucket fill up, as it starts out like any unknown MAC's.
+    '''
+    admission.admit(PEER, True)
+    clock.run(clock.time() + PEER_BURST / PEER_RATE)
+
+def admitted(admission, count, sender_mac=PEER, known=False, msg_type=MsgType.MSG):
+    return sum(admission.admit(sender_mac, known, msg_type) for _ in range(count))
+
+def test_unknown_mac_gets_a_burst_then_a_trickle(admission, clock):
+    assert admitted(admission, UNKNOWN_BURST + 5) == UNKNOWN_BURST
+    assert admission.drops['unknown_rate'] == 5
+    clock.run(clock.time() + 2 / UNKNOWN_RATE)
+    assert admitted(admission, 5) == 2
+
+def test_known_peer_gets_its_own_large_bucket(admission, clock):
+    known_peer(admission, clock)
+    assert admitted(admission, PEER_BURST + 10, known=True) == PEER_BURST
+    assert admission.drops['peer_rate'] == 10
+    clock.run(clock.time() + 101 / PEER_RATE)  # a token to spare for float rounding
+    assert admitted(admission, 100, known=True) == 100
+
+def test_unknown_macs_share_one_bucket(admission):
+    macs = [f'02:00:00:00:{i >> 8:02x}:{i & 0xff:02x}' for i in range(UNKNOWN_TOTAL_BURST * 2)]
+    assert sum(admission.admit(mac, False) for mac in macs) == UNKNOWN_TOTAL_BURST
+    assert admission.drops['unknown_total'] == UNKNOWN_TOTAL_BURST
+    # A peer we have a session with isn't held up by them
+    assert admission.admit(PEER, True)
+
+def test_handshakes_have_their_own_budget_even_from_known_macs(admission, clock):
+    known_peer(admission, clock)
+    assert admitted(admission, HANDSHAKE_BURST + 3, known=True, msg_type=MsgType.HANDSHAKE_REQ) == HANDSHAKE_BURST
+    assert admission.drops['handshake_rate'] == 3
+    assert admission.admit(PEER, True, MsgType.MSG)
+
+def test_unknown_macs_cant_use_the_reserved_share_of_the_global_bucket(clock):
+    admission = AdmissionControl(global_rate=0, global_burst=10, clock=clock)
+    for i in range(10):
+        admission.admit(f'02:00:00:00:01:{i:02x}', False)
+    assert admission.drops['global'] == 10 * (1 - UNKNOWN_RESERVE)
+    assert admitted(admission, 10, known=True) == 10 * (1 - UNKNOWN_RESERVE)
+
+def test_session_frames_without_a_session_are_dropped(admission):
+    assert not admission.admit_frame(PEER, '$0.00000000.AAAA', None, header=HEADER)
+    assert admission.drops['no_session'] == 1
+
+def test_forged_frames_are_charged_to_their_source(admission, clock):
+    known_peer(admission, clock)
+    session = Session(os.urandom(32))
+    for _ in range(PEER_BURST):
+        assert not admission.admit_frame(PEER, '$0.00000000.AAAA', session, header=HEADER)
+    assert admission.drops['forged'] == PEER_BURST
+    assert admission.admitted == 1
+    # The forgeries used up the MAC's bucket, but not the session
+    genuine = Session(session.key).encrypt('hello', PEER, HEADER)
+    assert not admission.admit_frame(PEER, genuine, session, header=HEADER)
+    assert admission.drops['peer_rate'] == 1
+    assert session.decrypt(genuine, PEER, HEADER) == 'hello'
+
+def test_epochs_away_from_the_newest_derive_no_key(admission, monkeypatch):
+    session = Session(os.urandom(32))
+    derivations = []
+    hkdf = crypto_utils.HKDF
+    monkeypatch.setattr(crypto_utils, 'HKDF', lambda *args, **kwargs: derivations.append(1) or hkdf(*args, **kwargs))
+    for epoch in (2, 60, 10 ** 9):
+        assert not admission.admit_frame(PEER, f'${epoch}.00000000.AAAA', session, header=HEADER)
+    assert derivations == []
+    assert session.chains == {} and session.candidates == {}
+    assert admission.drops['forged'] == 3
@@ -0,0 +1,29 @@
+import pytest
+from dedup import ChunkStore, MAX_CHUNK, build_manifest, chunk_hash, decode_manifest, encode_manifest
+
+DATA = bytes(range(256)) * 64
+
+def test_manifest_round_trip():
+    entries = build_manifest(DATA)
+    decoded = [entry for body in encode_manifest(entries) for entry in decode_manifest(body)]
+    assert decoded == [(h, length) for h, _, length in entries]
+
+@pytest.mark.parametrize('body', ['../../etc/passwd.10', f'{chunk_hash(b"x")}/...10', 'AAAA.10',
+                                  f'{chunk_hash(b"x")}.0', f'{chunk_hash(b"x")}.-10',
+                                  f'{chunk_hash(b"x")}.{MAX_CHUNK + 1:x}', f'{chunk_hash(b"x")}.zz'])
+def test_bad_manifest_entries_are_rejected(body):
+    with pytest.raises(ValueError):
+        decode_manifest(body)
+
+def test_store_only_takes_chunks_under_their_own_hash(tmp_path):
+    store = ChunkStore(str(tmp_path / 'store'))
+    store.put(chunk_hash(b'good'), b'good')
+    with pytest.raises(ValueError):
+        store.put(chunk_hash(b'good'), b'evil')  # already stored, still checked
+    with pytest.raises(ValueError):
+        store.put(chunk_hash(b'other'), b'evil')
+    with pytest.raises(ValueError):
+        store.put('../outside', b'evil')
+    assert store.get(chunk_hash(b'good')) == b'good'
+    assert not store.has(chunk_hash(b'other'))
+    assert not (tmp_path / 'outside').exists()
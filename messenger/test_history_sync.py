@@ -0,0 +1,84 @@
+import json
+import os
+import random
+import pytest
+from clock import VirtualClock
+from crypto_utils import TicketCache
+from dedup import ChunkStore
+from history import MessageHistory
+from history_sync import KEY_SPACE, HistorySync
+from outbox import MessageOutbox
+from peer import Me
+from simulation import VirtualMedium, VirtualTransport
+
+# Sync frames handed straight to HistorySync, as if from alice.
+
+@pytest.fixture
+def me(tmp_path):
+    clock = VirtualClock()
+    me = Me('bob', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:02',
+            transports=[VirtualTransport(VirtualMedium(clock, random.Random(1)), 'bob')], mtu_probing=False,
+            chunk_store=ChunkStore(str(tmp_path / 'chunks')), outbox=MessageOutbox(None, clock), clock=clock)
+    me.update_peer('alice', {'name': 'alice', 'mac': '02:00:00:00:00:01', 'last_seen': clock.time(), 'hops': 1})
+    return me
+
+@pytest.fixture
+def history(tmp_path):
+    return MessageHistory(str(tmp_path / 'history.db'))
+
+def conversation(history):
+    history.flush()
+    return [(sender, text) for sender, _, text in history.conversation('alice')]
+
+def test_bulk_only_takes_the_peers_own_messages(me, history):
+    sync = HistorySync(me, history)
+    sync.on_bulk('alice', 1, 0, json.dumps([['alice', 100, 'hi'], ['bob', 101, 'I owe alice 10'],
+                                            ['carol', 102, 'hello']]))
+    assert conversation(history) == [('alice', 'hi')]
+    assert sync.stats['messages_received'] == 1
+
+@pytest.mark.parametrize('data', [
+    '[1, 2]',
+    '[["alice", "noon", "hi"], ["alice", null, "hi"], ["alice", true, "hi"], ["alice", 1e999, "hi"]]',
+    '[["alice", 100, 5], ["alice", 100]]',
+])
+def test_malformed_bulk_frames_store_nothing(me, history, data):
+    sync = HistorySync(me, history)
+    sync.on_bulk('alice', 1, 0, data)
+    assert conversation(history) == []
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    {'r': 5},
+    {'r': [[0, KEY_SPACE, 1]]},
+    {'r': [['0', KEY_SPACE, 1, 2]]},
+    {'r': [[KEY_SPACE, 0, 1, 2]]},
+    {'r': [[0, KEY_SPACE, 1.5, 2]]},
+    {'k': [[0, KEY_SPACE, 7, True]]},
+    {'k': [[0, KEY_SPACE, ['x'], True]]},
+    {'k': [[0, KEY_SPACE, [], 'yes']]},
+])
+def test_malformed_sync_frames_are_ignored(me, history, body):
+    sent = []
+    me.transmit = lambda pkt, link=None: sent.append(pkt)
+    sync = HistorySync(me, history)
+    sync.on_sync('alice', 1, 0, json.dumps(body))
+    assert sent == []
+
+def test_only_our_own_messages_are_sent_back(me, history):
+    history.add('alice', 'me', 'mine', 100)
+    history.add('alice', 'alice', 'theirs', 101)
+    sync = HistorySync(me, history)
+    bulk = []
+    sync.send_bulk = lambda peer_id, messages: bulk.extend(messages)
+    sync.on_sync('alice', 1, 0, json.dumps({'r': [[0, KEY_SPACE, 0, 0]]}))
+    assert bulk == [['bob', 100, 'mine']]
+
+def test_messages_stored_late_are_found_before_their_time(history):
+    for i in range(10):
+        history.add('alice', 'alice', f'news {i}', 1000 + i)
+    history.add('alice', 'alice', 'old news', 500)  # recovered by a sync
+    history.flush()
+    assert [result['text'] for result in history.search('news', before=600)] == ['old news']
+    assert len(history.search('news', before=1005)) == 6
+    assert history.search('news', before=400) == []
@@ -0,0 +1,87 @@
+import os
+import random
+import pytest
+from clock import VirtualClock
+from crypto_utils import Session, TicketCache, decrypt_data
+from dedup import ChunkStore
+from enums import MsgType
+from frames import parse_frame
+from mesh import RoutingTable, compact_mac
+from outbox import MessageOutbox
+from payload_utils import parse_payload
+from peer import Me
+from simulation import VirtualMedium, VirtualTransport
+
+ALICE, BOB, CAROL = '02:00:00:00:00:01', '02:00:00:00:00:02', '02:00:00:00:00:03'
+
+def test_vector_names_with_commas_and_escapes_round_trip():
+    clock = VirtualClock()
+    bob = RoutingTable(BOB, clock)
+    for i, name in enumerate(['carol, the second', '%2C', 'a%b,c']):
+        bob.add_neighbor(f'02:00:00:00:01:0{i}', name)
+    alice = RoutingTable(ALICE, clock)
+    alice.add_neighbor(BOB, 'bob')
+    learned = [entry for vector in bob.encode_vectors() for entry in alice.update_from_vector(BOB, vector)]
+    assert sorted(name for _, name in learned) == sorted(['carol, the second', '%2C', 'a%b,c'])
+
+def node(name, mac, clock, tmp_path):
+    return Me(name, tickets=TicketCache(os.devnull), mac=mac, mesh=True,
+              transports=[VirtualTransport(VirtualMedium(clock, random.Random(1)), name)], mtu_probing=False,
+              chunk_store=ChunkStore(str(tmp_path / f'{name}_chunks')), outbox=MessageOutbox(None, clock), clock=clock)
+
+@pytest.fixture
+def alice_and_carol(tmp_path):
+    '''
+    alice and carol, two hops apart through bob, with a session both have used.
+    '''
+    clock = VirtualClock()
+    alice, carol = node('alice', ALICE, clock, tmp_path), node('carol', CAROL, clock, tmp_path)
+    key = os.urandom(32)
+    for me, peer_id, peer_mac in ((alice, 'carol', CAROL), (carol, 'alice', ALICE)):
+        me.update_peer(peer_id, {'name': peer_id, 'mac': peer_mac, 'last_seen': clock.time(), 'hops': 2})
+        me.routing.add_neighbor(BOB, 'bob')
+        me.routing.add_route(peer_mac, BOB, 2, peer_id)
+        me.set_session(peer_mac, Session(key))
+    carol.sessions[ALICE].decrypt(alice.sessions[CAROL].encrypt('hi', ALICE), ALICE)
+    alice.sessions[CAROL].decrypt(carol.sessions[ALICE].encrypt('hi', CAROL), CAROL)
+    return alice, carol
+
+def relayed(alice, send):
+    '''
+    Returns the RELAY bodies alice sends for send(), as bob would read them.
+    '''
+    frames = []
+    alice.transmit = lambda pkt, link=None: frames.append(parse_payload(parse_frame(pkt)[3]))
+    send()
+    return [(msg_id, seq, decrypt_data(data)) for msg_type, msg_id, seq, data in frames if msg_type == MsgType.RELAY]
+
+def test_relays_cant_read_what_they_pass_on(alice_and_carol):
+    alice, carol = alice_and_carol
+    [(msg_id, seq, data)] = relayed(alice, lambda: alice.send_message('carol', 'the secret'))
+    assert 'the secret' not in data
+    received = []
+    carol.register_message_listener(lambda sender_id, text: received.append((sender_id, text)))
+    carol.dispatch(MsgType.RELAY, msg_id, seq, data, BOB)
+    assert received == [('alice', 'the secret')]
+
+def test_relayed_frames_under_the_session_cant_be_changed(alice_and_carol):
+    alice, carol = alice_and_carol
+    [(msg_id, seq, data)] = relayed(alice, lambda: alice.send_message('carol', 'the secret'))
+    received = []
+    carol.register_message_listener(lambda sender_id, text: received.append(text))
+    carol.dispatch(MsgType.RELAY, msg_id, seq + 1, data, BOB)  # the session tag covers the inner header
+    carol.dispatch(MsgType.RELAY, msg_id, seq, data.replace(f'|{int(MsgType.MSG)}|', f'|{int(MsgType.GROUP_MSG)}|'), BOB)
+    assert received == []
+
+@pytest.mark.parametrize('data', [
+    f'3|{compact_mac(ALICE)}|{compact_mac(CAROL)}|{int(MsgType.TERMINATE)}|',
+    f'3|{compact_mac(ALICE)}|{compact_mac(CAROL)}|{int(MsgType.HANDSHAKE_REQ)}|0|mallory|key|00|',
+    f'3|{compact_mac(ALICE)}|{compact_mac(CAROL)}|999|',
+    f'x|{compact_mac(ALICE)}|{compact_mac(CAROL)}|{int(MsgType.MSG)}|',
+    f'3|{compact_mac(ALICE)}|{compact_mac(CAROL)}|y|',
+])
+def test_relayed_control_and_malformed_frames_are_dropped(alice_and_carol, data):
+    _, carol = alice_and_carol
+    carol.dispatch(MsgType.RELAY, 1, 1, data, BOB)
+    assert carol.known_peers['alice']['name'] == 'alice'
+    assert 'mallory' not in carol.known_peers
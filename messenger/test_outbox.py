@@ -0,0 +1,77 @@
+import pytest
+from clock import VirtualClock
+from outbox import (DELIVERED, DROPPED, EXPIRED, OUTBOX_MAX_BYTES, OUTBOX_MAX_MESSAGES, OUTBOX_TTL, QUEUED, SENT,
+                    STATUS_LIMIT, MessageOutbox)
+
+MAC = '02:00:00:00:00:01'
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+@pytest.fixture
+def outbox(clock):
+    return MessageOutbox(None, clock)
+
+def statuses(outbox, message_ids):
+    return [outbox.status(message_id)['status'] for message_id in message_ids]
+
+def test_queued_messages_expire_after_the_ttl(outbox, clock):
+    old = outbox.add('alice', 'old')
+    clock.run(clock.time() + OUTBOX_TTL / 2)
+    new = outbox.add('alice', 'new')
+    clock.run(clock.time() + OUTBOX_TTL / 2 + 1)
+    assert [m['text'] for m in outbox.queued('alice')] == ['new']
+    assert statuses(outbox, [old, new]) == [EXPIRED, QUEUED]
+
+def test_messages_on_the_air_dont_expire(outbox, clock):
+    sent = outbox.add('alice', 'hello', SENT)
+    clock.run(clock.time() + OUTBOX_TTL + 1)
+    assert statuses(outbox, [sent]) == [SENT]
+
+def test_a_full_queue_drops_its_oldest_messages(outbox):
+    ids = [outbox.add('alice', f'message {i}') for i in range(OUTBOX_MAX_MESSAGES + 2)]
+    other = outbox.add('bob', 'not affected')
+    assert statuses(outbox, ids[:3]) == [DROPPED, DROPPED, QUEUED]
+    assert len(outbox.queued('alice')) == OUTBOX_MAX_MESSAGES
+    assert statuses(outbox, [other]) == [QUEUED]
+
+def test_the_byte_cap_drops_the_oldest_but_keeps_one_message(outbox):
+    half = 'x' * (OUTBOX_MAX_BYTES // 2)
+    first, second, third = (outbox.add('alice', half) for _ in range(3))
+    assert statuses(outbox, [first, second, third]) == [DROPPED, QUEUED, QUEUED]
+    # A message bigger than the cap on its own still waits
+    huge = outbox.add('alice', 'x' * (OUTBOX_MAX_BYTES + 1))
+    assert [m['id'] for m in outbox.queued('alice')] == [huge]
+
+def test_finished_messages_keep_their_status(outbox, clock):
+    message_id = outbox.add('alice', 'hello')
+    outbox.set_status([message_id], DELIVERED)
+    clock.run(clock.time() + OUTBOX_TTL + 1)
+    outbox.set_status([message_id], QUEUED)
+    assert statuses(outbox, [message_id]) == [DELIVERED]
+
+def test_only_the_newest_finished_statuses_are_kept(outbox):
+    ids = [outbox.add('alice', f'message {i}', DELIVERED) for i in range(STATUS_LIMIT + 5)]
+    assert outbox.status(ids[0]) is None
+    assert outbox.status(ids[-STATUS_LIMIT])['status'] == DELIVERED
+
+def test_held_messages_survive_a_restart(tmp_path, clock):
+    path = str(tmp_path / 'outbox.json')
+    outbox = MessageOutbox(path, clock)
+    held = outbox.add('alice', 'waited')
+    outbox.set_status([held], SENT)
+    straight = outbox.add('alice', 'went straight out', SENT)
+    outbox.remember_mac('alice', MAC)
+
+    restarted = MessageOutbox(path, clock)
+    assert statuses(restarted, [held]) == [QUEUED]  # we stopped before its ACK came
+    assert restarted.status(straight) is None
+    assert restarted.peer_for_mac(MAC) == 'alice'
+    assert restarted.add('alice', 'next') not in (held, straight)
+
+def test_peer_for_mac_needs_queued_messages(outbox):
+    outbox.remember_mac('alice', MAC)
+    assert outbox.peer_for_mac(MAC) is None
+    outbox.add('alice', 'hello')
+    assert outbox.peer_for_mac(MAC) == 'alice'
@@ -0,0 +1,86 @@
+import pytest
+from pacing import (ADDITIVE_STEP, DECREASE_FACTOR, INITIAL_RATE, MAX_RATE, MIN_RATE, PROGRESS_EVERY,
+                    PacingController)
+
+MSG_ID = 7
+
+def send(pacer, first_seq, count=PROGRESS_EVERY, msg_id=MSG_ID):
+    '''
+    Sends count bulk frames from first_seq on, returning the last seq.
+    '''
+    for seq in range(first_seq, first_seq + count):
+        pacer.on_sent(msg_id, seq)
+    return first_seq + count - 1
+
+def test_clean_reports_double_the_rate_in_slow_start():
+    pacer = PacingController()
+    last = send(pacer, 0)
+    assert pacer.on_report(MSG_ID, PROGRESS_EVERY, last)
+    assert pacer.rate == INITIAL_RATE * 2
+    last = send(pacer, last + 1)
+    assert pacer.on_report(MSG_ID, 2 * PROGRESS_EVERY, last)
+    assert pacer.rate == INITIAL_RATE * 4
+
+def test_loss_cuts_the_rate_then_it_grows_additively():
+    pacer = PacingController()
+    last = send(pacer, 0)
+    assert pacer.on_report(MSG_ID, PROGRESS_EVERY // 2, last)
+    assert pacer.rate == INITIAL_RATE * DECREASE_FACTOR
+    assert not pacer.slow_start
+    last = send(pacer, last + 1)
+    assert pacer.on_report(MSG_ID, PROGRESS_EVERY // 2 + PROGRESS_EVERY, last)
+    assert pacer.rate == pytest.approx(INITIAL_RATE * DECREASE_FACTOR + ADDITIVE_STEP)
+
+def test_loss_among_frames_sent_before_a_cut_doesnt_cut_again():
+    pacer = PacingController()
+    middle = send(pacer, 0)
+    last = send(pacer, middle + 1)
+    assert pacer.on_report(MSG_ID, PROGRESS_EVERY // 2, middle)
+    # These frames were already on their way when the rate was cut
+    assert not pacer.on_report(MSG_ID, PROGRESS_EVERY, last)
+    assert pacer.rate == INITIAL_RATE * DECREASE_FACTOR
+    # Loss among frames sent after the cut is a new episode
+    last = send(pacer, last + 1)
+    assert pacer.on_report(MSG_ID, PROGRESS_EVERY + PROGRESS_EVERY // 2, last)
+    assert pacer.rate == pytest.approx(INITIAL_RATE * DECREASE_FACTOR ** 2)
+
+def test_rate_stays_within_its_bounds():
+    pacer = PacingController(rate=MIN_RATE)
+    last = send(pacer, 0)
+    pacer.on_report(MSG_ID, 0, last)
+    assert pacer.rate == MIN_RATE
+    pacer = PacingController(rate=MAX_RATE)
+    last = send(pacer, 0)
+    pacer.on_report(MSG_ID, PROGRESS_EVERY, last)
+    assert pacer.rate == MAX_RATE
+
+def test_user_cap_limits_the_adaptive_rate():
+    pacer = PacingController(max_rate=150_000)
+    last = send(pacer, 0)
+    pacer.on_report(MSG_ID, PROGRESS_EVERY, last)
+    assert pacer.base_rate == INITIAL_RATE * 2
+    assert pacer.rate == 150_000
+
+def test_without_adaptation_only_the_cap_applies_but_loss_is_tracked():
+    pacer = PacingController(max_rate=150_000, adaptive=False)
+    last = send(pacer, 0)
+    assert not pacer.on_report(MSG_ID, PROGRESS_EVERY // 2, last)
+    assert pacer.rate == 150_000
+    assert pacer.loss == pytest.approx(0.2 * 0.5)
+    assert PacingController(adaptive=False).rate is None
+
+def test_reports_about_frames_not_sent_or_forgotten_are_ignored():
+    pacer = PacingController()
+    last = send(pacer, 0)
+    assert not pacer.on_report(MSG_ID, PROGRESS_EVERY, last + 1)
+    assert not pacer.on_report(MSG_ID + 1, PROGRESS_EVERY, last)
+    pacer.finish(MSG_ID)
+    assert not pacer.on_report(MSG_ID, PROGRESS_EVERY, last)
+    assert pacer.rate == INITIAL_RATE
+
+def test_a_repeated_report_is_ignored():
+    pacer = PacingController()
+    last = send(pacer, 0)
+    assert pacer.on_report(MSG_ID, PROGRESS_EVERY, last)
+    assert not pacer.on_report(MSG_ID, PROGRESS_EVERY, last)
+    assert pacer.rate == INITIAL_RATE * 2
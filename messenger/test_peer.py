@@ -0,0 +1,106 @@
+import hashlib
+import os
+import random
+import pytest
+from checkpoint import PARTIAL_DIR
+from clock import VirtualClock
+from crypto_utils import TicketCache
+from dedup import ChunkStore
+from enums import MsgType
+from outbox import MessageOutbox
+from pacing import DECREASE_FACTOR, INITIAL_RATE, PROGRESS_EVERY
+from peer import MTU_PROBE_SIZES, Me
+from simulation import VirtualMedium, VirtualTransport
+
+# Frames handed straight to Me.dispatch, as if decrypted from the named peer.
+
+PEER_MAC = '02:00:00:00:00:01'
+STRANGER_MAC = '02:00:00:00:00:09'
+
+@pytest.fixture
+def me(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    clock = VirtualClock()
+    me = Me('bob', tickets=TicketCache(os.devnull), mac='02:00:00:00:00:02',
+            transports=[VirtualTransport(VirtualMedium(clock, random.Random(1)), 'bob')], mtu_probing=False,
+            chunk_store=ChunkStore(str(tmp_path / 'chunks')), outbox=MessageOutbox(None, clock), clock=clock)
+    me.update_peer('alice', {'name': 'alice', 'mac': PEER_MAC, 'last_seen': clock.time(), 'hops': 1})
+    return me
+
+SHA256 = hashlib.sha256(b'data').hexdigest()
+
+def test_file_init_from_a_peer_starts_a_transfer(me):
+    me.dispatch(MsgType.FILE_INIT, 7, 1, f'data.bin|4|{SHA256}|1000', PEER_MAC)
+    assert me.file_transfers[(PEER_MAC, 7)]['partial'].num_chunks == 1
+    assert os.path.exists(os.path.join(PARTIAL_DIR, f'{SHA256}.part'))
+
+@pytest.mark.parametrize('data', [
+    'data.bin|4|../../outside|1000',  # the hash names the partial file
+    f'data.bin|4|{SHA256.upper()}|1000',
+    f'data.bin|4|{SHA256}|0',
+    f'data.bin|4|{SHA256}|100000',
+    f'data.bin|{1 << 40}|{SHA256}|1000',
+    f'data.bin|-4|{SHA256}|1000',
+    f'data.bin|four|{SHA256}|1000',
+    f'data.bin|4|{SHA256}|1000|x',
+])
+def test_bad_file_inits_are_ignored(me, data):
+    me.dispatch(MsgType.FILE_INIT, 7, 1, data, PEER_MAC)
+    assert me.file_transfers == {}
+    assert not os.path.exists(PARTIAL_DIR) or os.listdir(PARTIAL_DIR) == []
+
+def test_file_init_from_a_stranger_is_ignored(me):
+    me.dispatch(MsgType.FILE_INIT, 7, 1, f'data.bin|4|{SHA256}|1000', STRANGER_MAC)
+    assert me.file_transfers == {}
+
+def test_progress_reports_pace_file_frames_to_the_peer(me):
+    me.transmit = lambda pkt, link=None: None
+    for seq in range(2, 2 + PROGRESS_EVERY):
+        me.send(MsgType.FILE_CHUNK, 9, seq, 'chunk', PEER_MAC)
+    me.dispatch(MsgType.FILE_PROGRESS, 10, 0, f'9|{PROGRESS_EVERY // 2}|{PROGRESS_EVERY + 1}', PEER_MAC)
+    assert me.pacers[PEER_MAC].rate == INITIAL_RATE * DECREASE_FACTOR
+    # Only the peer the frames went to reports on them
+    me.dispatch(MsgType.FILE_PROGRESS, 11, 0, f'9|0|{PROGRESS_EVERY + 1}', STRANGER_MAC)
+    assert STRANGER_MAC not in me.pacers
+
+@pytest.fixture
+def pair(tmp_path, monkeypatch):
+    '''
+    alice and bob on a virtual medium, started and known to each other.
+    alice probes bob's chunk size.
+    '''
+    monkeypatch.chdir(tmp_path)
+    clock = VirtualClock()
+    medium = VirtualMedium(clock, random.Random(1))
+    nodes = [Me(name, tickets=TicketCache(os.devnull), mac=mac, transports=[VirtualTransport(medium, name)],
+                mtu_probing=name == 'alice', chunk_store=ChunkStore(str(tmp_path / f'{name}_chunks')),
+                outbox=MessageOutbox(None, clock), clock=clock)
+             for name, mac in (('alice', PEER_MAC), ('bob', '02:00:00:00:00:02'))]
+    for node in nodes:
+        node.start()
+    clock.run(clock.time() + 5)
+    return nodes
+
+def test_mtu_probe_runs_on_the_virtual_clock(pair):
+    alice, bob = pair
+    assert alice.known_peers['bob']['chunk_size'] == MTU_PROBE_SIZES[-1]
+    assert alice.mtu_probes == {} and alice.probing_macs == set()
+
+def test_ping_times_pongs_on_the_virtual_clock(pair):
+    alice, bob = pair
+    start = alice.clock.time()
+    stats, = alice.ping('bob', count=5, sizes=(64,))
+    assert stats['received'] == 5
+    # The RTT is two airtimes, in virtual time
+    assert 0 < stats['min'] < 10  # ms
+    assert alice.clock.time() - start < 1
+
+def test_pings_are_stamped_when_transmitted(pair):
+    alice, bob = pair
+    clock, scheduler = alice.clock, alice.schedulers['alice']
+    # Hold every frame back in the scheduler for half a second
+    scheduler.enqueue = lambda pkt, dst, priority=0, block=True: clock.call_later(0.5, scheduler.transmit, pkt) or True
+    stats, = alice.ping('bob', count=3, sizes=(64,))
+    assert stats['received'] == 3
+    assert stats['p99'] < 10  # ms: the half second in the queue isn't in the RTT
+    assert alice.ping_stamps == {}
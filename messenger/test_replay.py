@@ -0,0 +1,258 @@
+import os
+import random
+import time
+import pytest
+from clock import REAL_CLOCK, VIRTUAL_EPOCH, VirtualClock
+from crypto_utils import TicketCache, generate_keypair
+from dedup import ChunkStore, build_manifest
+from enums import MsgType
+from frame_trace import TraceRecorder, read_pcap, write_pcap_header, write_pcap_record
+from frames import parse_frame
+from history import MessageHistory
+from history_sync import HistorySync
+from outbox import MessageOutbox
+from payload_utils import parse_payload
+from peer import Me
+from replay import ReplayMe, replay
+from simulation import VirtualMedium, VirtualTransport
+from transport import SimulatedMedium, SimulatedTransport
+
+# Each test records what bob hears while alice talks to it, on a virtual
+# clock unless the script needs threads, then replays the capture into a
+# ReplayMe that takes over bob's identity, and checks what the frame
+# handler made of it.
+
+SETTLE = 5 # seconds to let handshakes, ACKs and retries play out
+
+def node(name, transport, clock, index, recorder=None):
+    return Me(name, tickets=TicketCache(os.devnull), mac=f'02:00:00:00:00:0{index}',
+              transports=[transport], mtu_probing=False, chunk_store=ChunkStore(os.path.abspath(f'{name}_chunks')),
+              outbox=MessageOutbox(None, clock), clock=clock, recorder=recorder)
+
+def settle(clock, done):
+    '''
+    Runs a virtual clock for SETTLE seconds, or waits up to SETTLE real
+    seconds for done().
+    '''
+    if clock.virtual:
+        clock.run(clock.time() + SETTLE)
+        return
+    deadline = time.time() + SETTLE
+    while not done() and time.time() < deadline:
+        time.sleep(0.01)
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    '''
+    Runs setup(alice, bob) before the peers start and script(alice, bob,
+    clock) once they know each other, and returns (capture path, bob). With virtual=False the peers run on the real clock
+    and a threaded SimulatedMedium, for scripts that wait on replies, like
+    send_file(use_dedup=True). Received files and checkpoints go to
+    tmp_path/recorded while recording and to tmp_path/replayed after.
+    '''
+    def record(script=None, virtual=True, setup=None):
+        os.mkdir(tmp_path / 'recorded')
+        monkeypatch.chdir(tmp_path / 'recorded')
+        path = str(tmp_path / 'bob.pcap')
+        if virtual:
+            clock = VirtualClock()
+            medium = VirtualMedium(clock, random.Random(1), shared=True)  # one frame on the air at a time, in order
+            transports = [VirtualTransport(medium, name) for name in ('alice', 'bob')]
+        else:
+            clock = REAL_CLOCK
+            medium = SimulatedMedium(1)
+            transports = [SimulatedTransport(medium, name) for name in ('alice', 'bob')]
+        alice = node('alice', transports[0], clock, 1)
+        bob = node('bob', transports[1], clock, 2, TraceRecorder(path, clock=clock))
+        if setup:
+            setup(alice, bob)
+        for me in (alice, bob):
+            me.start()
+        settle(clock, lambda: 'bob' in alice.known_peers and 'alice' in bob.known_peers)
+        if script:
+            script(alice, bob, clock)
+        settle(clock, lambda: 'expected_ack' not in alice.known_peers['bob'])
+        bob.stop()
+        os.mkdir(tmp_path / 'replayed')
+        monkeypatch.chdir(tmp_path / 'replayed')
+        return path, bob
+    return record
+
+def replayer(bob, **kwargs):
+    # Stores are given absolute paths, as saved files are added to them on a
+    # thread that may run after the test has left its directory
+    clock = VirtualClock()
+    return ReplayMe('bob', identity=bob, transports=[VirtualTransport(VirtualMedium(clock, random.Random(1)), 'bob')],
+                    mtu_probing=False, chunk_store=ChunkStore(os.path.abspath('chunk_store')),
+                    outbox=MessageOutbox(None, clock), clock=clock, **kwargs)
+
+def sent_types(me):
+    '''
+    Swaps me.transmit for one that keeps the type of each frame me sends.
+    '''
+    types = []
+    me.transmit = lambda pkt, link=None: types.append(frame_type(pkt))
+    return types
+
+def frame_type(frame):
+    return parse_payload(parse_frame(frame)[3])[0]
+
+def without(path, dropped):
+    '''
+    Copies a capture without the frames for which dropped(index, type, frame)
+    is true, as if they had been lost on the air.
+    '''
+    lossy = path.replace('.pcap', '-lossy.pcap')
+    with open(lossy, 'wb') as f:
+        write_pcap_header(f)
+        for i, (ts, frame) in enumerate(read_pcap(path)):
+            if not dropped(i, frame_type(frame), frame):
+                write_pcap_record(f, ts, frame)
+    return lossy
+
+def chat(alice, bob, clock):
+    for i in range(3):
+        alice.send_message('bob', f'hello {i}')
+        clock.run(clock.time() + 1)
+
+def test_replayed_messages_are_delivered_once(capture):
+    path, bob = capture(chat)
+    me = replayer(bob)
+    received = []
+    me.register_message_listener(lambda sender_id, text: received.append((sender_id, text)))
+
+    frames, _ = replay(me, path)
+    assert frames == len(list(read_pcap(path)))
+    assert 'alice' in me.known_peers
+    assert received == [('alice', 'hello 0'), ('alice', 'hello 1'), ('alice', 'hello 2')]
+    assert me.frames_sent > 0  # the handshake and MSG_ACKs were answered
+
+    # A second pass hears only repeats: nothing is delivered again
+    replay(me, path)
+    assert len(received) == 3
+
+def test_replay_without_identity_cannot_read_sessions(capture):
+    path, bob = capture(chat)
+    me = replayer(bob)
+    me.keypair = generate_keypair()  # bob's MAC, but not its key
+    received = []
+    me.register_message_listener(lambda sender_id, text: received.append(text))
+    replay(me, path)
+    assert received == []
+
+def group_chat(alice, bob, clock):
+    alice.create_group('team', ['bob'])
+    alice.send_group_message('team', 'hello team')
+
+def test_replayed_group_message_is_acked_on_the_clock(capture):
+    path, bob = capture(group_chat)
+    me = replayer(bob)
+    received = []
+    me.register_group_message_listener(lambda group_id, sender_id, text: received.append((group_id, sender_id, text)))
+    types = sent_types(me)
+
+    replay(me, path)
+    assert received == [('team', 'alice', 'hello team')]
+    me.clock.run(me.clock.time() + 1)
+    assert types.count(MsgType.GROUP_ACK) == 1
+
+    # A repeat is ACKed again, as our first ACK may have been lost, but not delivered again
+    replay(me, path)
+    me.clock.run(me.clock.time() + 1)
+    assert len(received) == 1
+    assert types.count(MsgType.GROUP_ACK) == 2
+
+FILE_DATA = bytes(range(256)) * 20  # 5 chunks
+
+def send_file(alice, bob, clock, use_fec=False, use_dedup=False):
+    with open('data.bin', 'wb') as f:
+        f.write(FILE_DATA)
+    alice.send_file('bob', 'data.bin', use_fec=use_fec, use_dedup=use_dedup)
+
+def received_file(path='received_data.bin'):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_replayed_file_with_a_lost_chunk_is_rebuilt_from_parity(capture):
+    path, bob = capture(lambda alice, bob, clock: send_file(alice, bob, clock, use_fec=True))
+    assert MsgType.FILE_PARITY in {frame_type(frame) for _, frame in read_pcap(path)}
+    chunks = [i for i, (_, frame) in enumerate(read_pcap(path)) if frame_type(frame) == MsgType.FILE_CHUNK]
+    me = replayer(bob)
+    replay(me, without(path, lambda i, msg_type, frame: i == chunks[2]))
+    assert received_file() == FILE_DATA
+
+def test_replayed_file_resumes_from_the_checkpoint_of_an_earlier_run(capture):
+    path, bob = capture(lambda alice, bob, clock: send_file(alice, bob, clock))
+    chunks = [i for i, (_, frame) in enumerate(read_pcap(path)) if frame_type(frame) == MsgType.FILE_CHUNK]
+
+    # The first run stops after two chunks, the second only hears the rest
+    me = replayer(bob)
+    replay(me, without(path, lambda i, msg_type, frame: i > chunks[1]))
+    me.stop()
+    me = replayer(bob)
+    replay(me, without(path, lambda i, msg_type, frame: i in chunks[:2]))
+    assert received_file() == FILE_DATA
+
+OLD_DATA = random.Random(1).randbytes(256 * 1024)
+NEW_DATA = OLD_DATA[:100000] + b'an edit in the middle' + OLD_DATA[100000:]
+
+def send_versions(alice, bob, clock):
+    for data in (OLD_DATA, NEW_DATA):
+        with open('data.bin', 'wb') as f:
+            f.write(data)
+        alice.send_file('bob', 'data.bin', use_dedup=True)
+        settle(clock, lambda: 'expected_ack' not in alice.known_peers['bob'])
+
+def test_replayed_delta_transfer_is_rebuilt_from_the_chunk_store(capture):
+    path, bob = capture(send_versions, virtual=False)
+    chunks = {}  # file msg_id -> FILE_CHUNK frames
+    for i, (_, frame) in enumerate(read_pcap(path)):
+        msg_type, msg_id, _, _ = parse_payload(parse_frame(frame)[3])
+        if msg_type == MsgType.FILE_CHUNK:
+            chunks[msg_id] = chunks.get(msg_id, 0) + 1
+        elif msg_type == MsgType.FILE_END and len(chunks) == 1:
+            first_end = i
+    old_chunks, new_chunks = chunks.values()
+    assert new_chunks < old_chunks / 4  # only the edited chunks went out again
+
+    me = replayer(bob)
+    replay(me, without(path, lambda i, msg_type, frame: i > first_end))
+    assert received_file() == OLD_DATA
+    # The saved file goes into the chunk store on a thread of its own, which
+    # bob had finished before the second manifest came
+    settle(REAL_CLOCK, lambda: all(me.chunk_store.has(h) for h, _, _ in build_manifest(OLD_DATA)))
+    replay(me, without(path, lambda i, msg_type, frame: i <= first_end))
+    assert received_file('received_data_1.bin') == NEW_DATA
+
+SHARED = [('alice', 'hi'), ('bob', 'hello'), ('alice', 'how are things')]
+MISSED = [('alice', 'are you there?'), ('alice', 'call me')]
+
+def history(name, messages):
+    '''
+    A history of the alice/bob conversation as name saw it, one message a second.
+    '''
+    history = MessageHistory(f'{name}.db')
+    for i, (sender, text) in enumerate(messages):
+        history.add('bob' if name == 'alice' else 'alice', 'me' if sender == name else sender, text, VIRTUAL_EPOCH - 100 + i)
+    return history
+
+def conversation(history, peer):
+    history.flush()
+    return sorted((sender, text) for sender, _, text in history.conversation(peer))
+
+def missed_messages(alice, bob):
+    # bob was away for the last two messages
+    HistorySync(alice, history('alice', SHARED + MISSED))
+    HistorySync(bob, history('bob', SHARED))
+
+def test_replayed_history_sync_recovers_missed_messages(capture):
+    path, bob = capture(setup=missed_messages)
+    assert MsgType.HISTORY_BULK in {frame_type(frame) for _, frame in read_pcap(path)}
+
+    me = replayer(bob)
+    me_history = history('bob', SHARED)
+    sync = HistorySync(me, me_history)
+    replay(me, path)
+    assert sync.stats['messages_received'] == len(MISSED)
+    assert conversation(me_history, 'alice') == sorted(('me' if sender == 'bob' else sender, text)
+                                                       for sender, text in SHARED + MISSED)
@@ -0,0 +1,106 @@
+import os
+import random
+import pytest
+from clock import VirtualClock
+from crypto_utils import TicketCache
+from enums import MsgType
+from frames import parse_frame
+from outbox import MessageOutbox
+from payload_utils import parse_payload
+from peer import HEARTBEAT_INTERVAL, Me
+from roster import JOIN_RETRIES, JOIN_WAIT, ROSTER_ENTRIES_PER_FRAME, decode_roster, encode_roster
+from simulation import VirtualMedium, VirtualTransport
+
+MACS = [f'02:00:00:00:00:{i:02x}' for i in range(1, 40)]
+
+def test_roster_round_trip_is_split_into_frames():
+    entries = [(mac, f'key{i}', f'name {i}, with a comma') for i, mac in enumerate(MACS)]
+    bodies = encode_roster(MACS[0], entries)
+    assert len(bodies) == -(-len(entries) // ROSTER_ENTRIES_PER_FRAME)
+    decoded = []
+    for body in bodies:
+        joiner_mac, frame_entries = decode_roster(body)
+        assert joiner_mac == MACS[0]
+        decoded.extend(frame_entries)
+    assert decoded == entries
+
+def test_malformed_roster_entries_are_skipped():
+    body = encode_roster(MACS[0], [(MACS[1], 'key', 'alice')])[0]
+    body += '|020000000002,key|0200,key,bob|020000000003,,carol|020000000004,key,'
+    assert decode_roster(body) == (MACS[0], [(MACS[1], 'key', 'alice')])
+
+class Room:
+    '''
+    Nodes on one virtual channel, counting the frames of each type sent.
+    '''
+    def __init__(self):
+        self.clock = VirtualClock()
+        self.medium = VirtualMedium(self.clock, random.Random(1))
+        self.sent = {}
+        broadcast = self.medium.broadcast
+        def counting_broadcast(sender, frame):
+            msg_type = parse_payload(parse_frame(frame)[3])[0]
+            self.sent[msg_type] = self.sent.get(msg_type, 0) + 1
+            broadcast(sender, frame)
+        self.medium.broadcast = counting_broadcast
+        self.nodes = []
+
+    def add(self, count=1):
+        for _ in range(count):
+            i = len(self.nodes)
+            node = Me(f'node{i}', tickets=TicketCache(os.devnull), mac=MACS[i],
+                      transports=[VirtualTransport(self.medium, f'node{i}')], mtu_probing=False,
+                      outbox=MessageOutbox(None, self.clock), clock=self.clock)
+            self.nodes.append(node)
+            node.start()
+        return self.nodes[-1]
+
+    def run(self, seconds):
+        self.clock.run(self.clock.time() + seconds)
+
+    def everyone_knows_everyone(self):
+        return all(b.mac in a.sessions and b.name in a.known_peers
+                   for a in self.nodes for b in self.nodes if a is not b)
+
+@pytest.fixture
+def room():
+    random.seed(1)  # backoffs and msg ids
+    return Room()
+
+def test_a_join_is_answered_by_one_roster(room):
+    room.add(8)
+    room.run(10)
+    assert room.everyone_knows_everyone()
+    room.sent.clear()
+    joiner = room.add()
+    # The peers a roster lists become known peers once heard directly
+    room.run(HEARTBEAT_INTERVAL + 1)
+    assert room.everyone_knows_everyone()
+    assert joiner.joined
+    assert room.sent.get(MsgType.ROSTER, 0) <= 2
+    assert room.sent.get(MsgType.HANDSHAKE_ACK, 0) == 0
+    assert room.sent[MsgType.HANDSHAKE_REQ] == 1
+
+def test_sessions_from_a_roster_carry_messages(room):
+    room.add(3)
+    room.run(10)
+    joiner = room.add()
+    room.run(5)
+    received = []
+    room.nodes[0].register_message_listener(lambda sender_id, text: received.append((sender_id, text)))
+    joiner.send_message('node0', 'hello')
+    room.run(1)
+    assert received == [(joiner.name, 'hello')]
+
+def test_a_room_that_starts_at_once_converges(room):
+    room.add(10)
+    room.run(15)
+    assert room.everyone_knows_everyone()
+    # Short of the N² answers of every peer answering every join
+    assert room.sent.get(MsgType.HANDSHAKE_ACK, 0) + room.sent[MsgType.ROSTER] < 10 * 10
+
+def test_a_joiner_nobody_answers_announces_again_and_gives_up(room):
+    joiner = room.add()
+    room.run(JOIN_WAIT * 2 ** (JOIN_RETRIES + 1))
+    assert not joiner.joined
+    assert room.sent[MsgType.HANDSHAKE_REQ] == JOIN_RETRIES + 1
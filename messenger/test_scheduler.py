@@ -0,0 +1,91 @@
+import pytest
+from scheduler import BULK, BULK_QUEUE_LIMIT, CHAT, CONTROL, DRR_QUANTUM, TransmitScheduler
+
+# Frames are queued and taken off with next_frame() while holding the
+# scheduler's lock, so its sending thread can't take any in between.
+
+@pytest.fixture
+def scheduler():
+    sent = []
+    scheduler = TransmitScheduler(sent.append, 'test')
+    scheduler.sent = sent
+    return scheduler
+
+def frame(dst, i, size):
+    return f'{dst}{i}'.encode().ljust(size, b'.')
+
+def order(scheduler, now=0.0):
+    '''
+    Takes every frame that may go at now off the queues, returning their
+    destinations in order.
+    '''
+    dsts = []
+    while True:
+        pkt, dst, _ = scheduler.next_frame(now)
+        if pkt is None:
+            return dsts
+        dsts.append(dst)
+
+def test_classes_are_served_in_strict_priority(scheduler):
+    with scheduler.cond:
+        scheduler.enqueue(frame('bulk', 0, 100), 'a', BULK)
+        scheduler.enqueue(frame('chat', 0, 100), 'b', CHAT)
+        scheduler.enqueue(frame('control', 0, 100), 'c', CONTROL)
+        scheduler.enqueue(frame('chat', 1, 100), 'a', CHAT)
+        assert order(scheduler) == ['c', 'b', 'a', 'a']
+
+def test_destinations_share_a_class_round_robin(scheduler):
+    with scheduler.cond:
+        for dst in 'ab':
+            for i in range(10):
+                scheduler.enqueue(frame(dst, i, 1000), dst, BULK)
+        dsts = order(scheduler)
+    per_round = DRR_QUANTUM // 1000
+    assert dsts[:4 * per_round] == (['a'] * per_round + ['b'] * per_round) * 2
+    assert dsts.count('a') == dsts.count('b') == 10
+
+def test_destinations_get_equal_bytes_not_equal_frames(scheduler):
+    with scheduler.cond:
+        for i in range(40):
+            scheduler.enqueue(frame('small', i, 250), 'small', BULK)
+        for i in range(10):
+            scheduler.enqueue(frame('large', i, 1000), 'large', BULK)
+        dsts = order(scheduler)[:30]
+    # Until the large frames run out, each side has sent about as many bytes
+    small, large = dsts.count('small') * 250, dsts.count('large') * 1000
+    assert abs(small - large) <= DRR_QUANTUM
+
+def test_an_idle_destination_banks_no_credit(scheduler):
+    with scheduler.cond:
+        scheduler.enqueue(frame('a', 0, 100), 'a', BULK)
+        assert order(scheduler) == ['a']
+        assert 'a' not in scheduler.classes[BULK]['deficit']
+
+def test_full_bulk_queue_drops_frames_that_wont_wait(scheduler):
+    with scheduler.cond:
+        for i in range(BULK_QUEUE_LIMIT):
+            assert scheduler.enqueue(frame('a', i, 100), 'a', BULK, block=False)
+        assert not scheduler.enqueue(frame('a', BULK_QUEUE_LIMIT, 100), 'a', BULK, block=False)
+        # Only bulk frames are capped
+        assert scheduler.enqueue(frame('a', 0, 100), 'a', CHAT, block=False)
+        assert scheduler.pending() == BULK_QUEUE_LIMIT + 1
+
+def test_rate_limited_destination_waits_without_holding_up_others(scheduler):
+    with scheduler.cond:
+        scheduler.set_limit('a', 10_000, 1000)
+        bucket = scheduler.limits['a']
+        bucket.updated = 0.0
+        for i in range(3):
+            scheduler.enqueue(frame('a', i, 1000), 'a', BULK)
+            scheduler.enqueue(frame('b', i, 1000), 'b', BULK)
+        assert order(scheduler) == ['a', 'b', 'b', 'b']
+        pkt, _, wait = scheduler.next_frame(0.0)
+        assert pkt is None and wait == pytest.approx(0.1)
+        assert order(scheduler, 0.1) == ['a']
+
+def test_frames_are_sent_by_the_scheduler_thread(scheduler):
+    frames = [frame('a', i, 100) for i in range(20)]
+    for pkt in frames:
+        scheduler.enqueue(pkt, 'a', BULK)
+    assert scheduler.flush(5)
+    assert scheduler.sent == frames
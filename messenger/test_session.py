@@ -0,0 +1,84 @@
+import base64
+import os
+import pytest
+from crypto_utils import REPLAY_WINDOW, SESSION_MAC_BYTES, SESSION_REKEY_FRAMES, Session, frame_header
+
+MAC = '02:00:00:00:00:01'
+HEADER = frame_header(1, 42, 1)
+
+@pytest.fixture
+def pair():
+    key = os.urandom(32)
+    return Session(key), Session(key)
+
+def test_round_trip(pair):
+    sender, receiver = pair
+    assert receiver.decrypt(sender.encrypt('hello', MAC, HEADER), MAC, HEADER) == 'hello'
+
+def test_forged_frames_leave_the_session_usable(pair):
+    sender, receiver = pair
+    assert receiver.decrypt(sender.encrypt('before', MAC, HEADER), MAC, HEADER) == 'before'
+    for forged in ('$60.00000000.AAAA', '$1.00000000.AAAA', '$-1.00000000.AAAA', '$0.00000000.AAAA', '$x.y.z'):
+        assert not receiver.authentic(forged, MAC, HEADER)
+        with pytest.raises(ValueError):
+            receiver.decrypt(forged, MAC, HEADER)
+    assert sorted(receiver.chains[MAC]) == [0]
+    assert receiver.decrypt(sender.encrypt('after', MAC, HEADER), MAC, HEADER) == 'after'
+
+def test_replays_are_rejected(pair):
+    sender, receiver = pair
+    frame = sender.encrypt('once', MAC, HEADER)
+    assert receiver.decrypt(frame, MAC, HEADER) == 'once'
+    with pytest.raises(ValueError):
+        receiver.decrypt(frame, MAC, HEADER)
+
+def test_reordered_frames_within_the_window_are_accepted_once(pair):
+    sender, receiver = pair
+    frames = [sender.encrypt(str(i), MAC, HEADER) for i in range(REPLAY_WINDOW + 1)]
+    assert receiver.decrypt(frames[-1], MAC, HEADER) == str(REPLAY_WINDOW)
+    assert receiver.decrypt(frames[1], MAC, HEADER) == '1'
+    with pytest.raises(ValueError):
+        receiver.decrypt(frames[1], MAC, HEADER)
+    with pytest.raises(ValueError):
+        receiver.decrypt(frames[0], MAC, HEADER)  # fell out of the window
+
+def test_tag_covers_the_header(pair):
+    sender, receiver = pair
+    frame = sender.encrypt('body', MAC, HEADER)
+    assert not receiver.authentic(frame, MAC, frame_header(1, 42, 2))
+    with pytest.raises(ValueError):
+        receiver.decrypt(frame, MAC, frame_header(1, 42, 2))
+
+def test_tampered_ciphertext_fails_the_mac_even_with_a_matching_tag(pair):
+    sender, receiver = pair
+    epoch, _, encoded = sender.encrypt('pay alice 10', MAC, HEADER)[1:].split('.', 2)
+    raw = bytearray(base64.b64decode(encoded))
+    raw[8 + len('pay alice ')] ^= ord('1') ^ ord('9')  # CTR is malleable: flip "10" to "90"
+    encoded = base64.b64encode(bytes(raw))
+    # What a prefilter collision would look like: the truncated tag matches, the full MAC can't
+    tag = receiver.tag(MAC, int(epoch), HEADER, encoded)
+    forged = f'${epoch}.{tag}.{encoded.decode("ascii")}'
+    assert receiver.authentic(forged, MAC, HEADER)
+    with pytest.raises(ValueError, match='bad MAC'):
+        receiver.decrypt(forged, MAC, HEADER)
+    assert len(raw) == 8 + len('pay alice 10') + SESSION_MAC_BYTES
+
+def test_ratchet_moves_on_only_for_verified_frames(pair):
+    sender, receiver = pair
+    frames = [sender.encrypt(str(i), MAC, HEADER) for i in range(SESSION_REKEY_FRAMES + 1)]
+    assert frames[-1].startswith('$1.')
+    assert receiver.decrypt(frames[0], MAC, HEADER) == '0'
+    assert sorted(receiver.chains[MAC]) == [0]
+    assert receiver.decrypt(frames[-1], MAC, HEADER) == str(SESSION_REKEY_FRAMES)
+    assert sorted(receiver.chains[MAC]) == [0, 1]
+    # A late frame from the epoch before is still read
+    assert receiver.decrypt(frames[-2], MAC, HEADER) == str(SESSION_REKEY_FRAMES - 1)
+
+def test_epochs_more_than_one_ahead_are_rejected(pair):
+    sender, receiver = pair
+    for i in range(2 * SESSION_REKEY_FRAMES + 1):
+        frame = sender.encrypt(str(i), MAC, HEADER)
+    assert frame.startswith('$2.')
+    with pytest.raises(ValueError, match='too far ahead'):
+        receiver.decrypt(frame, MAC, HEADER)
+    assert MAC not in receiver.chains
@@ -0,0 +1,26 @@
+import threading
+import time
+from checkpoint import decode_ranges
+from transport import SimulatedMedium, SimulatedTransport
+
+def test_a_frame_that_raises_doesnt_end_the_capture():
+    medium = SimulatedMedium(1)
+    sender, receiver = SimulatedTransport(medium, 'a'), SimulatedTransport(medium, 'b')
+    handled = []
+    def callback(frame):
+        if frame == b'bad':
+            int(frame)  # a malformed field, as dispatch would parse it
+        handled.append(frame)
+    threading.Thread(target=receiver.listen, args=(callback,), daemon=True).start()
+    for frame in (b'good', b'bad', b'after'):
+        sender.send(frame)
+    deadline = time.time() + 5
+    while len(handled) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert handled == [b'good', b'after']
+    assert receiver.callback_errors == 1
+
+def test_ranges_are_cut_at_the_limit():
+    assert decode_ranges('0-2,5,8-9', 9) == {0, 1, 2, 5, 8}
+    assert decode_ranges(f'0-{10 ** 12}', 4) == {0, 1, 2, 3}  # doesn't build the whole range
+    assert decode_ranges('', 4) == set()
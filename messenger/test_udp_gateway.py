@@ -0,0 +1,77 @@
+import socket
+import threading
+import time
+import pytest
+from udp_gateway import UdpGateway, encode_msg
+
+class Identity:
+    '''
+    Stands in for a bridged identity's Me, keeping what it's asked to send.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.known_peers = {}
+        self.sent = []
+
+    def register_message_listener(self, callback):
+        pass
+
+    def send_message(self, to, text):
+        self.sent.append((to, text))
+
+    def start(self):
+        pass
+
+LAN_PEER = ('127.0.0.2', 5000)
+OTHER_HOST = ('127.0.0.3', 5000)
+
+@pytest.fixture
+def gateway():
+    gateway = UdpGateway(None, host='127.0.0.1', announce_port=0, identity_factory=Identity)
+    gateway.on_announce({'type': 'announce', 'id': 'lan', 'port': 5000}, LAN_PEER)
+    yield gateway
+    gateway.announce_sock.close()
+    gateway.send_sock.close()
+
+def sent(gateway):
+    return gateway.udp_peers['lan']['me'].sent
+
+def test_messages_from_the_announcing_host_are_bridged(gateway):
+    gateway.on_message({'type': 'msg', 'from': 'lan', 'to': 'radio', 'text': 'hi'}, LAN_PEER)
+    gateway.on_message({'type': 'msg', 'from': 'lan', 'text': 'on its port'}, LAN_PEER, 'radio')
+    assert sent(gateway) == [('radio', 'hi'), ('radio', 'on its port')]
+
+def test_messages_sent_as_a_peer_from_another_host_are_dropped(gateway):
+    gateway.on_message({'type': 'msg', 'from': 'lan', 'to': 'radio', 'text': 'spoofed'}, OTHER_HOST)
+    assert sent(gateway) == []
+    assert gateway.metrics['dropped_spoofed'] == 1
+
+def test_another_host_cant_take_over_a_peer_by_announcing_it(gateway):
+    gateway.on_announce({'type': 'announce', 'id': 'lan', 'port': 6000}, OTHER_HOST)
+    assert gateway.udp_peers['lan']['addr'] == LAN_PEER[0]
+    assert gateway.udp_peers['lan']['port'] == 5000
+    assert gateway.metrics['name_conflicts'] == 1
+
+@pytest.mark.parametrize('msg', [
+    {'type': 'msg', 'from': ['lan'], 'to': 'radio', 'text': 'hi'},
+    {'type': 'msg', 'from': {'lan': 1}, 'to': 'radio', 'text': 'hi'},
+    {'type': 'msg', 'from': 'lan', 'to': ['radio'], 'text': 'hi'},
+    {'type': 'msg', 'from': 'lan', 'to': 'radio', 'text': 5},
+])
+def test_malformed_messages_are_counted_and_dropped(gateway, msg):
+    gateway.on_message(msg, LAN_PEER)
+    assert sent(gateway) == []
+    assert gateway.metrics['dropped_malformed'] == 1
+
+def test_receiver_survives_bad_datagrams(gateway):
+    threading.Thread(target=gateway.receiver, daemon=True).start()
+    port = gateway.send_sock.getsockname()[1]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((LAN_PEER[0], 0))
+        for msg in ({'type': 'msg', 'from': ['lan'], 'text': 'x'}, {'type': []}, [1, 2], 'not json'):
+            sock.sendto(encode_msg(msg) if msg != 'not json' else b'{', ('127.0.0.1', port))
+        sock.sendto(encode_msg({'type': 'msg', 'from': 'lan', 'to': 'radio', 'text': 'still here'}), ('127.0.0.1', port))
+        deadline = time.time() + 5
+        while not sent(gateway) and time.time() < deadline:
+            time.sleep(0.01)
+    assert sent(gateway) == [('radio', 'still here')]
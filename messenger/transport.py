@@ -0,0 +1,251 @@
+import queue
+import random
+import socket
+import threading
+import time
+from packet_ring import RxRing, BatchSender, load_sendmmsg, SOL_PACKET, PACKET_IGNORE_OUTGOING
+
+ETH_P_ALL = 0x0003  # every protocol, so the socket sees raw 802.11 frames
+RECV_BUFFER = 65535  # largest frame read by the one-recv-per-frame path
+
+def guarded(transport, callback):
+    '''
+    Wraps a capture callback so that an exception handling one frame (or
+    ring block) is counted in transport.callback_errors and the frame
+    dropped, instead of ending the capture.
+    '''
+    def handle(frames):
+        try:
+            callback(frames)
+        except Exception as e:
+            transport.callback_errors += 1
+            print(f'[!] Dropped a frame on {transport.name} that raised {e!r}')
+    return handle
+
+class ScapyTransport:
+    '''
+    A monitor-mode interface driven through scapy. scapy is only imported
+    once the interface is first used, so peers on other transports (and
+    tools that never touch the radio) start without it.
+    '''
+    def __init__(self, iface: str):
+        self.name = iface
+        self.iface = iface
+        self.callback_errors = 0
+
+    def send(self, frame: bytes):
+        from scapy.packet import Raw
+        from scapy.sendrecv import sendp
+        sendp(Raw(frame), iface=self.iface, verbose=False)
+
+    def listen(self, callback):
+        '''
+        Blocks, calling callback(frame) with the bytes of every captured frame.
+        '''
+        from scapy.sendrecv import sniff
+        callback = guarded(self, callback)
+        sniff(iface=self.iface, prn=lambda pkt: callback(bytes(pkt)), store=0)
+
+class PacketTransport:
+    '''
+    An interface driven through Linux packet sockets, without scapy.
+    Frames are received from a TPACKET_V3 ring (see packet_ring.py) and
+    handed to the callback as memoryviews into it, valid only for the
+    duration of the call. send_batch() puts a burst of frames on the air
+    with one sendmmsg call per SEND_BATCH frames. Where the kernel or libc
+    offers neither, or with rings=False, it falls back to one recv or send
+    per frame. Any interface works, so lo or a veth pair can stand in for
+    the radio.
+    '''
+    def __init__(self, iface: str, rings: bool = True):
+        self.name = iface
+        self.iface = iface
+        self.rings = rings
+        # Opened on first use, like ScapyTransport's import. Sending has its own
+        # socket bound to no protocol, so it never has frames queued for it.
+        self.sock = None
+        self.send_sock = None
+        self.ring = None
+        self.batch_sender = None
+        self.lock = threading.Lock()
+        # System calls made, to compare the ring and per-frame paths
+        self.frames_sent = 0
+        self.send_calls = 0
+        self.frames_received = 0
+        self.recv_calls = 0
+        self.callback_errors = 0  # frames dropped because handling them raised
+
+    def open(self):
+        '''
+        Opens the receiving socket and its ring.
+        '''
+        with self.lock:
+            if self.sock is not None:
+                return self.sock
+            sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+            sock.bind((self.iface, ETH_P_ALL))
+            try:
+                sock.setsockopt(SOL_PACKET, PACKET_IGNORE_OUTGOING, 1)
+            except OSError:
+                pass  # older kernels also capture our own transmissions, as scapy does
+            if self.rings:
+                try:
+                    self.ring = RxRing(sock)
+                except OSError as e:
+                    print(f'[*] No receive ring on {self.iface} ({e}), using one recv per frame')
+            self.sock = sock
+            return sock
+
+    def open_sender(self):
+        with self.lock:
+            if self.send_sock is not None:
+                return self.send_sock
+            sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+            sock.bind((self.iface, 0))
+            sendmmsg = load_sendmmsg() if self.rings else None
+            if sendmmsg:
+                self.batch_sender = BatchSender(sock, sendmmsg)
+            self.send_sock = sock
+            return sock
+
+    def send(self, frame: bytes):
+        sock = self.send_sock or self.open_sender()
+        sock.send(frame)
+        self.frames_sent += 1
+        self.send_calls += 1
+
+    def send_batch(self, frames: list):
+        sock = self.send_sock or self.open_sender()
+        if self.batch_sender:
+            self.send_calls += self.batch_sender.send(frames)
+        else:
+            for frame in frames:
+                sock.send(frame)
+            self.send_calls += len(frames)
+        self.frames_sent += len(frames)
+
+    def listen_batches(self, callback):
+        '''
+        Blocks, calling callback(frames) with each ring block's worth of
+        captured frames (one at a time without a ring). A block whose
+        callback raises is counted in callback_errors and dropped.
+        '''
+        sock = self.sock or self.open()
+        callback = guarded(self, callback)
+        if self.ring is None:
+            while True:
+                frame = sock.recv(RECV_BUFFER)
+                self.recv_calls += 1
+                self.frames_received += 1
+                callback([frame])
+        while True:
+            frames = self.ring.next_block()
+            if frames is None:
+                self.ring.wait()
+                self.recv_calls += 1
+                continue
+            try:
+                callback(frames)
+            finally:
+                self.frames_received += len(frames)
+                frames.clear()
+                self.ring.release()
+
+    def listen(self, callback):
+        '''
+        Blocks, calling callback(frame) for every captured frame. A frame
+        whose callback raises is counted in callback_errors and dropped.
+        '''
+        callback = guarded(self, callback)
+        def deliver(frames):
+            for frame in frames:
+                callback(frame)
+        self.listen_batches(deliver)
+
+def open_transport(iface: str):
+    '''
+    The transport for a monitor-mode interface: a packet socket on Linux,
+    scapy elsewhere.
+    '''
+    if hasattr(socket, 'AF_PACKET'):
+        return PacketTransport(iface)
+    return ScapyTransport(iface)
+
+class SimulatedMedium:
+    '''
+    An in-memory radio channel. Every frame sent by one attached transport is
+    heard by all the others, like monitor-mode interfaces on one channel.
+    '''
+    def __init__(self, seed: int = None):
+        self.transports = []
+        self.out_of_range = set()  # (sender, receiver) pairs that can't hear each other
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def attach(self, transport):
+        with self.lock:
+            self.transports.append(transport)
+
+    def disconnect(self, a, b):
+        '''
+        Puts two transports out of radio range of each other.
+        '''
+        with self.lock:
+            self.out_of_range.update({(a, b), (b, a)})
+
+    def broadcast(self, sender, frame: bytes):
+        with self.lock:
+            receivers = [t for t in self.transports
+                         if t is not sender and (sender, t) not in self.out_of_range]
+            drops = [self.random.random() < max(sender.loss, t.loss) for t in receivers]
+        for transport, dropped in zip(receivers, drops):
+            if not dropped:
+                transport.deliver(frame)
+
+class SimulatedTransport:
+    '''
+    A transport on a SimulatedMedium with configurable frame loss and link
+    rate (frames per second; sending blocks for the frame's airtime).
+    byte_rate adds airtime per byte, and frames longer than max_frame are
+    dropped without a word, like some adapters do.
+
+    process_rate and inbox_limit model a receiver that can't keep up: it
+    takes frames off its capture buffer at process_rate frames per second,
+    and frames arriving while inbox_limit frames are waiting are dropped.
+    '''
+    def __init__(self, medium: SimulatedMedium, name: str, loss: float = 0.0, rate: float = None,
+                 process_rate: float = None, inbox_limit: int = 0, byte_rate: float = None,
+                 max_frame: int = None):
+        self.name = name
+        self.medium = medium
+        self.loss = loss
+        self.rate = rate
+        self.byte_rate = byte_rate
+        self.max_frame = max_frame
+        self.process_rate = process_rate
+        self.inbox = queue.Queue(inbox_limit)
+        self.overflows = 0
+        self.callback_errors = 0
+        medium.attach(self)
+
+    def deliver(self, frame: bytes):
+        try:
+            self.inbox.put_nowait(frame)
+        except queue.Full:
+            self.overflows += 1
+
+    def send(self, frame: bytes):
+        airtime = (1 / self.rate if self.rate else 0) + (len(frame) / self.byte_rate if self.byte_rate else 0)
+        if airtime:
+            time.sleep(airtime)
+        if self.max_frame and len(frame) > self.max_frame:
+            return
+        self.medium.broadcast(self, frame)
+
+    def listen(self, callback):
+        callback = guarded(self, callback)
+        while True:
+            frame = self.inbox.get()
+            if self.process_rate:
+                time.sleep(1 / self.process_rate)
+            callback(frame)
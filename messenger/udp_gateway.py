@@ -0,0 +1,361 @@
+import argparse
+import json
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict
+from identities import SharedRadio, IDENTITIES_DIR
+from peer import Me, IFACE
+from scheduler import TokenBucket
+from transport import open_transport
+
+# Bridges GhostFrames and the older UDP peer network (frontend/apinew.py)
+# on a wired LAN segment. UDP peers announce themselves as JSON on
+# UDP_ANNOUNCE_PORT and take direct messages on a chat port of their own.
+#
+# Each UDP peer gets an identity of its own name on a SharedRadio, so radio
+# peers see it as one more GhostFrames peer; what they send it goes to the
+# UDP peer. Each radio peer is announced on the LAN with a UDP port of its
+# own on the gateway, so a UDP peer messages it like any other UDP peer,
+# and what arrives on that port is sent to it from the UDP peer's identity.
+# A message may also name its recipient in a "to" field, on any port.
+#
+# Messages to one UDP peer that announced "batch" are sent as one JSON list
+# per datagram, up to UDP_BATCH_BYTES, after waiting at most
+# UDP_FLUSH_DELAY for more. Every datagram received may be a list too.
+# Each UDP peer's traffic is rate limited both ways. A UDP peer's id
+# belongs to the host it first announced from until it times out, and
+# messages from it are only taken from that host.
+
+UDP_ANNOUNCE_PORT = 65432  # where UDP peers announce themselves (BROADCAST_PORT in apinew.py)
+UDP_ANNOUNCE_INTERVAL = 2.0  # seconds between announcements of the radio peers, as apinew.py does
+UDP_PEER_TIMEOUT = 10.0  # seconds without an announcement before a UDP peer's identity is dropped
+UDP_BATCH_BYTES = 1400  # largest batched datagram, under the Ethernet MTU
+UDP_FLUSH_DELAY = 0.01  # seconds a message waits for others to the same UDP peer
+UDP_READ_SIZE = 65535
+MAX_UDP_PEERS = 256  # UDP peers bridged at once; the longest silent is dropped for a new one
+MAX_RADIO_PORTS = 256  # radio peers with a UDP port open; the least recently used is closed
+BRIDGE_RATE = 50  # messages/s each UDP peer may send to, or be sent from, the radio side
+BRIDGE_BURST = 200
+
+def encode_msg(msg) -> bytes:
+    return json.dumps(msg, separators=(',', ':')).encode()
+
+def decode_msgs(data: bytes) -> list:
+    '''
+    The messages in a datagram: a JSON object, or a list of them.
+    '''
+    msgs = json.loads(data.decode())
+    msgs = msgs if isinstance(msgs, list) else [msgs]
+    return [msg for msg in msgs if isinstance(msg, dict)]
+
+class UdpGateway:
+    '''
+    Bridges radio peers and UDP peers. name: the gateway's own identity
+    on the radio, through which it learns the radio peers before any UDP
+    peer shows up. host: the address to bind and announce from;
+    broadcast: where announcements go. identity_factory(name) makes the
+    Me for a UDP peer (by default a plain one on radio, which keeps its
+    tickets and outbox in radio.state_dir(name), so a UDP peer that comes
+    back gets its queued messages again).
+    '''
+    def __init__(self, radio: SharedRadio, name: str = 'gateway', host: str = '',
+                 broadcast: str = '<broadcast>', announce_port: int = UDP_ANNOUNCE_PORT,
+                 identity_factory=None, rate: float = BRIDGE_RATE, burst: float = BRIDGE_BURST):
+        self.radio = radio
+        self.host = host
+        self.broadcast = broadcast
+        self.announce_port = announce_port
+        self.identity_factory = identity_factory or (lambda peer_name: Me(peer_name, radio=radio))
+        self.rate = rate
+        self.burst = burst
+        self.me = self.identity_factory(name)
+        self.lock = threading.RLock()
+        # Peer mapping cache: UDP peer id -> {addr, port, batch, last_seen, me, to_radio, to_udp},
+        # least recently announced first
+        self.udp_peers = OrderedDict()
+        # Connection cache: radio peer name -> its UDP socket on the gateway, least recently used first
+        self.radio_ports = OrderedDict()
+        self.port_peers = {}  # socket -> radio peer name
+        self.pending = {}  # (addr, port) -> {items, bytes, deadline} of batched messages to send
+        self.flush_cond = threading.Condition(self.lock)
+        self.selector = selectors.DefaultSelector()
+        self.metrics = {
+            'udp_peers': 0, 'radio_ports': 0,
+            'to_radio': 0, 'to_udp': 0, 'datagrams_in': 0, 'datagrams_out': 0,
+            'dropped_rate': 0, 'dropped_unroutable': 0, 'dropped_malformed': 0, 'dropped_spoofed': 0,
+            'name_conflicts': 0,
+        }
+
+        self.announce_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.announce_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.announce_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.announce_sock.bind((host, announce_port))
+        # Sends every announcement and message; takes messages that name their recipient
+        self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.send_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.send_sock.bind((host, 0))
+        self.selector.register(self.announce_sock, selectors.EVENT_READ)
+        self.selector.register(self.send_sock, selectors.EVENT_READ)
+
+    def radio_names(self) -> set:
+        '''
+        Names of the radio peers any identity on the gateway knows, other
+        than the UDP peers' own identities.
+        '''
+        names = set()
+        with self.lock:
+            identities = [self.me] + [peer['me'] for peer in self.udp_peers.values()]
+        for me in identities:
+            names.update(pid for pid, info in list(me.known_peers.items()) if 'mac' in info)
+        return names - set(self.udp_peers) - {self.me.name}
+
+    def radio_port(self, name: str):
+        '''
+        The UDP socket that stands for a radio peer, opened if needed.
+        '''
+        with self.lock:
+            sock = self.radio_ports.get(name)
+            if sock is not None:
+                self.radio_ports.move_to_end(name)
+                return sock
+            if len(self.radio_ports) >= MAX_RADIO_PORTS:
+                self.close_radio_port(next(iter(self.radio_ports)))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((self.host, 0))
+            self.radio_ports[name] = sock
+            self.port_peers[sock] = name
+            self.selector.register(sock, selectors.EVENT_READ)
+            self.metrics['radio_ports'] = len(self.radio_ports)
+            return sock
+
+    def close_radio_port(self, name: str):
+        with self.lock:
+            sock = self.radio_ports.pop(name, None)
+            if sock is None:
+                return
+            del self.port_peers[sock]
+            self.selector.unregister(sock)
+            sock.close()
+            self.metrics['radio_ports'] = len(self.radio_ports)
+
+    def announcer(self):
+        '''
+        Announces every radio peer on the LAN, each with its own port, and
+        drops UDP peers that stopped announcing and radio peers gone from
+        the radio.
+        '''
+        while True:
+            names = self.radio_names()
+            for name in names:
+                port = self.radio_port(name).getsockname()[1]
+                msg = encode_msg({'id': name, 'type': 'announce', 'name': name, 'port': port, 'batch': True})
+                try:
+                    self.send_sock.sendto(msg, (self.broadcast, self.announce_port))
+                    self.metrics['datagrams_out'] += 1
+                except OSError as e:
+                    print(f'[!] Could not announce {name} on the LAN: {e}')
+            for name in [name for name in list(self.radio_ports) if name not in names]:
+                self.close_radio_port(name)
+            self.expire_udp_peers()
+            time.sleep(UDP_ANNOUNCE_INTERVAL)
+
+    def expire_udp_peers(self):
+        cutoff = time.monotonic() - UDP_PEER_TIMEOUT
+        with self.lock:
+            expired = [peer_id for peer_id, peer in self.udp_peers.items() if peer['last_seen'] < cutoff]
+        for peer_id in expired:
+            self.drop_udp_peer(peer_id)
+
+    def drop_udp_peer(self, peer_id):
+        with self.lock:
+            peer = self.udp_peers.pop(peer_id, None)
+            self.metrics['udp_peers'] = len(self.udp_peers)
+        if peer:
+            print(f'{peer_id} left the LAN side')
+            peer['me'].send_terminate()
+            peer['me'].stop()
+
+    def on_announce(self, msg, addr):
+        '''
+        Records (or refreshes) a UDP peer, starting its identity on the radio.
+        '''
+        peer_id, port = msg.get('id'), msg.get('port')
+        if not isinstance(peer_id, str) or not peer_id or not isinstance(port, int):
+            self.metrics['dropped_malformed'] += 1
+            return
+        with self.lock:
+            if addr[1] == self.send_sock.getsockname()[1]:
+                return  # our own announcement of a radio peer
+            peer = self.udp_peers.get(peer_id)
+            if peer is not None and peer['addr'] != addr[0]:
+                self.metrics['name_conflicts'] += 1  # taken by another host until it times out
+                return
+            if peer is not None:
+                peer.update(port=port, batch=bool(msg.get('batch')), last_seen=time.monotonic())
+                self.udp_peers.move_to_end(peer_id)
+                return
+            if peer_id in self.radio_ports or peer_id == self.me.name:
+                self.metrics['name_conflicts'] += 1
+                return
+        if len(self.udp_peers) >= MAX_UDP_PEERS:
+            self.drop_udp_peer(next(iter(self.udp_peers)))
+        me = self.identity_factory(peer_id)
+        me.register_message_listener(lambda sender_id, text: self.to_udp(peer_id, sender_id, text))
+        with self.lock:
+            self.udp_peers[peer_id] = {
+                'addr': addr[0], 'port': port, 'batch': bool(msg.get('batch')), 'last_seen': time.monotonic(),
+                'me': me,
+                'to_radio': TokenBucket(self.rate, self.burst),
+                'to_udp': TokenBucket(self.rate, self.burst),
+            }
+            self.metrics['udp_peers'] = len(self.udp_peers)
+        me.start()
+        print(f'{peer_id} joined from the LAN side')
+
+    def on_message(self, msg, addr, radio_name=None):
+        '''
+        Sends a UDP peer's message to the radio peer it is for: the one
+        named in "to", or else the one whose port it arrived on. Only the
+        host a UDP peer announced from may send as it.
+        '''
+        sender, to, text = msg.get('from'), msg.get('to') or radio_name, msg.get('text')
+        if not isinstance(sender, str) or not isinstance(to, (str, type(None))) or not isinstance(text, str):
+            self.metrics['dropped_malformed'] += 1
+            return
+        with self.lock:
+            peer = self.udp_peers.get(sender)
+        if peer is None or not to:
+            self.metrics['dropped_unroutable'] += 1
+            return
+        if peer['addr'] != addr[0]:
+            self.metrics['dropped_spoofed'] += 1
+            return
+        if not peer['to_radio'].take(time.monotonic()):
+            self.metrics['dropped_rate'] += 1
+            return
+        self.metrics['to_radio'] += 1
+        peer['me'].send_message(to, text)
+
+    def to_udp(self, peer_id, sender_id, text):
+        '''
+        Queues a message a radio peer sent to a UDP peer's identity.
+        '''
+        with self.lock:
+            peer = self.udp_peers.get(peer_id)
+            if peer is None:
+                self.metrics['dropped_unroutable'] += 1
+                return
+            if not peer['to_udp'].take(time.monotonic()):
+                self.metrics['dropped_rate'] += 1
+                return
+            self.metrics['to_udp'] += 1
+            self.queue_datagram((peer['addr'], peer['port']), peer['batch'],
+                                encode_msg({'type': 'msg', 'from': sender_id, 'to': peer_id, 'text': text}))
+
+    def queue_datagram(self, dest, batch: bool, item: bytes):
+        '''
+        Sends an encoded message to dest, batched with others for it when
+        it takes batches. Called with the lock held.
+        '''
+        if not batch:
+            self.send_datagram(dest, item)
+            return
+        pending = self.pending.get(dest)
+        if pending and pending['bytes'] + len(item) + 1 > UDP_BATCH_BYTES:
+            self.flush(dest)
+            pending = None
+        if pending is None:
+            pending = self.pending[dest] = {'items': [], 'bytes': 1, 'deadline': time.monotonic() + UDP_FLUSH_DELAY}
+            self.flush_cond.notify()
+        pending['items'].append(item)
+        pending['bytes'] += len(item) + 1
+
+    def flush(self, dest):
+        pending = self.pending.pop(dest)
+        self.send_datagram(dest, b'[' + b','.join(pending['items']) + b']')
+
+    def send_datagram(self, dest, data: bytes):
+        try:
+            self.send_sock.sendto(data, dest)
+            self.metrics['datagrams_out'] += 1
+        except OSError as e:
+            print(f'[!] Could not send to {dest[0]}:{dest[1]}: {e}')
+
+    def flusher(self):
+        '''
+        Sends each batch once its UDP_FLUSH_DELAY is up.
+        '''
+        with self.flush_cond:
+            while True:
+                now = time.monotonic()
+                for dest in [dest for dest, pending in self.pending.items() if pending['deadline'] <= now]:
+                    self.flush(dest)
+                deadlines = [pending['deadline'] for pending in self.pending.values()]
+                self.flush_cond.wait(min(deadlines) - now if deadlines else None)
+
+    def receiver(self):
+        '''
+        Reads announcements and messages from every gateway socket.
+        '''
+        while True:
+            for key, _ in self.selector.select():
+                sock = key.fileobj
+                try:
+                    data, addr = sock.recvfrom(UDP_READ_SIZE)
+                    msgs = decode_msgs(data)
+                except (OSError, ValueError):
+                    self.metrics['dropped_malformed'] += 1
+                    continue
+                self.metrics['datagrams_in'] += 1
+                radio_name = self.port_peers.get(sock)
+                for msg in msgs:
+                    # A datagram is from anyone on the LAN: nothing in it may stop this thread
+                    try:
+                        if msg.get('type') == 'announce':
+                            self.on_announce(msg, addr)
+                        elif msg.get('type') == 'msg':
+                            self.on_message(msg, addr, radio_name)
+                    except Exception as e:
+                        self.metrics['dropped_malformed'] += 1
+                        print(f'[!] Could not handle a datagram from {addr[0]}: {e}')
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.metrics)
+
+    def start(self):
+        self.radio.start()
+        self.me.start()
+        for target in (self.receiver, self.flusher, self.announcer):
+            threading.Thread(target=target, daemon=True).start()
+
+def main():
+    parser = argparse.ArgumentParser(description='Bridge GhostFrames peers and UDP peers on a LAN.')
+    parser.add_argument('--name', default='gateway', help="the gateway's own identity on the radio")
+    parser.add_argument('--ifaces', default=IFACE, help='monitor interfaces, comma separated')
+    parser.add_argument('--host', default='', help='address to bind on the LAN side')
+    parser.add_argument('--broadcast', default='<broadcast>', help='where to announce radio peers')
+    parser.add_argument('--port', type=int, default=UDP_ANNOUNCE_PORT, help='UDP announcement port')
+    parser.add_argument('--state', default=IDENTITIES_DIR, help="where the bridged identities keep their state")
+    parser.add_argument('--stats-interval', type=float, default=30, help='seconds between printed metrics (0: never)')
+    args = parser.parse_args()
+
+    radio = SharedRadio([open_transport(iface.strip()) for iface in args.ifaces.split(',')], directory=args.state)
+    gateway = UdpGateway(radio, args.name, args.host, args.broadcast, args.port)
+    gateway.start()
+    try:
+        while True:
+            time.sleep(args.stats_interval or 3600)
+            if args.stats_interval:
+                print(', '.join(f'{key} {value}' for key, value in gateway.stats().items()))
+    except KeyboardInterrupt:
+        for peer_id in list(gateway.udp_peers):
+            gateway.drop_udp_peer(peer_id)
+        gateway.me.send_terminate()
+        gateway.me.stop()
+
+if __name__ == '__main__':
+    main()